@@ -0,0 +1,197 @@
+"""
+🚦 Control de admisión del pipeline
+Un usuario que envía preguntas sin parar, o un pico de tráfico, puede agotar la cuota de Gemini
+y las conexiones de la base para todos. Antes de entrar al pipeline cada mensaje pasa por:
+
+1. Tasa por rol (usuarios.rol): token bucket por teléfono; sin fichas se rechaza de inmediato.
+2. Concurrencia: como máximo ADMISION_POR_USUARIO ejecuciones por usuario y ADMISION_GLOBAL
+   en total. Sin cupo, el mensaje espera en cola hasta ADMISION_ESPERA_S; si la cola ya tiene
+   ADMISION_COLA_MAX mensajes o se vence la espera, se rechaza.
+
+Los rechazos reciben de inmediato un "ocupado, intenta de nuevo" en vez de un timeout.
+
+La admisión corre en el event loop, antes de pedir un hilo del threadpool: un mensaje en cola
+es una corrutina esperando un futuro, no un hilo bloqueado. Así los hilos ocupados por el
+pipeline son como mucho ADMISION_GLOBAL (más las consultas cortas de autorización), por debajo
+de los 40 del threadpool de anyio, sin importar cuántos mensajes esperen cupo.
+
+Formato de ADMISION_TASAS: "rol:mensajes_por_minuto:rafaga" separados por comas; "*" es el valor
+por defecto para los roles no listados. Ejemplo: "admin:60:20,user:6:3,*:6:3".
+"""
+
+import asyncio
+import os
+import time
+
+from log_config import get_logger
+from metricas import ADMISION_RECHAZOS, ADMISION_ESPERA
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+ADMISION_GLOBAL = int(os.getenv("ADMISION_GLOBAL", 16))  # Pipelines simultáneos (0 = sin límite)
+ADMISION_POR_USUARIO = int(os.getenv("ADMISION_POR_USUARIO", 2))
+ADMISION_ESPERA_S = float(os.getenv("ADMISION_ESPERA_S", 8))  # Tiempo máximo en cola
+ADMISION_COLA_MAX = int(os.getenv("ADMISION_COLA_MAX", 32))
+ADMISION_TASAS = os.getenv("ADMISION_TASAS", "admin:60:20,*:6:3")
+ADMISION_MAX_CUBETAS = int(os.getenv("ADMISION_MAX_CUBETAS", 10000))
+
+# Motivos de rechazo
+LIMITE_TASA = "tasa"
+LIMITE_COLA = "cola"
+LIMITE_ESPERA = "espera"
+
+
+def parsear_tasas(texto):
+    """'admin:60:20,*:6:3' -> {'admin': (60, 20), '*': (6, 3)} (mensajes por minuto, ráfaga)."""
+    tasas = {}
+    for parte in (texto or "").split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        try:
+            rol, por_minuto, rafaga = parte.rsplit(":", 2)
+            tasas[rol.strip().lower()] = (float(por_minuto), max(float(rafaga), 1.0))
+        except ValueError:
+            logger.warning(f"⚠️ ADMISION_TASAS: entrada inválida '{parte}' (se esperaba rol:por_minuto:rafaga)")
+    tasas.setdefault("*", (6.0, 3.0))
+    return tasas
+
+
+class Rechazo:
+    """Motivo de rechazo y segundos sugeridos antes de reintentar."""
+
+    __slots__ = ("motivo", "reintentar_en")
+
+    def __init__(self, motivo, reintentar_en):
+        self.motivo = motivo
+        self.reintentar_en = reintentar_en
+
+
+def _resolver(futuro, admitido):
+    if not futuro.done():
+        futuro.set_result(admitido)
+
+
+class ControlAdmision:
+    """
+    Cubetas de fichas por teléfono y cupos de concurrencia por usuario y global.
+    Se usa solo desde el event loop (entrar y salir), por eso no necesita locks.
+    """
+
+    def __init__(self, global_max=ADMISION_GLOBAL, por_usuario=ADMISION_POR_USUARIO,
+                 espera=ADMISION_ESPERA_S, cola_max=ADMISION_COLA_MAX, tasas=ADMISION_TASAS):
+        self.global_max = global_max
+        self.por_usuario = por_usuario
+        self.espera = espera
+        self.cola_max = cola_max
+        self.tasas = parsear_tasas(tasas) if isinstance(tasas, str) else dict(tasas)
+        self.en_curso = 0
+        self.en_cola = 0
+        self._por_usuario = {}  # telefono -> ejecuciones en curso
+        self._cubetas = {}  # telefono -> [fichas, última recarga]
+        self._cola = []  # [(telefono, futuro)] en orden de llegada
+
+    async def entrar(self, telefono, rol=None):
+        """
+        Pide un cupo para procesar un mensaje.
+
+        Returns:
+            None si fue admitido (llamar salir() al terminar) o un Rechazo.
+        """
+        rechazo = self._tomar_ficha(telefono, rol)
+        if rechazo:
+            return self._rechazar(telefono, rechazo)
+        if self._hay_cupo(telefono):
+            self._ocupar(telefono)
+            return None
+        if self.en_cola >= self.cola_max:
+            return self._rechazar(telefono, Rechazo(LIMITE_COLA, 30))
+
+        inicio = time.monotonic()
+        bucle = asyncio.get_running_loop()
+        # salir() resuelve el futuro con True tras ocupar el cupo en nombre del mensaje
+        espera = (telefono, bucle.create_future())
+        temporizador = bucle.call_later(self.espera, _resolver, espera[1], False)
+        self._cola.append(espera)
+        self.en_cola += 1
+        try:
+            admitido = await espera[1]
+        except asyncio.CancelledError:
+            if espera[1].done() and not espera[1].cancelled() and espera[1].result():
+                self.salir(telefono)  # El cupo llegó a una petición que ya no lo usará
+            raise
+        finally:
+            temporizador.cancel()
+            self.en_cola -= 1
+            if espera in self._cola:
+                self._cola.remove(espera)
+        if not admitido:
+            return self._rechazar(telefono, Rechazo(LIMITE_ESPERA, 30))
+        ADMISION_ESPERA.observar(time.monotonic() - inicio)
+        return None
+
+    def salir(self, telefono):
+        self.en_curso -= 1
+        restantes = self._por_usuario.get(telefono, 1) - 1
+        if restantes > 0:
+            self._por_usuario[telefono] = restantes
+        else:
+            self._por_usuario.pop(telefono, None)
+        self._ceder()
+
+    def _ceder(self):
+        """Pasa los cupos libres a los mensajes en cola que pueden usarlos, en orden de llegada."""
+        for espera in list(self._cola):
+            telefono, futuro = espera
+            if futuro.done():
+                continue
+            if self._hay_cupo(telefono):
+                self._cola.remove(espera)
+                self._ocupar(telefono)
+                futuro.set_result(True)
+
+    def _hay_cupo(self, telefono):
+        if self.global_max > 0 and self.en_curso >= self.global_max:
+            return False
+        return self._por_usuario.get(telefono, 0) < self.por_usuario
+
+    def _ocupar(self, telefono):
+        self.en_curso += 1
+        self._por_usuario[telefono] = self._por_usuario.get(telefono, 0) + 1
+
+    def _tomar_ficha(self, telefono, rol):
+        por_minuto, rafaga = self.tasas.get((rol or "").lower(), self.tasas["*"])
+        if por_minuto <= 0:
+            return None  # Rol sin límite de tasa
+        ahora = time.monotonic()
+        cubeta = self._cubetas.pop(telefono, None) or [rafaga, ahora]
+        # Reinsertar al final: el dict queda en orden de uso para desalojar los inactivos
+        self._cubetas[telefono] = cubeta
+        if len(self._cubetas) > ADMISION_MAX_CUBETAS:
+            self._cubetas.pop(next(iter(self._cubetas)))
+        por_segundo = por_minuto / 60
+        cubeta[0] = min(rafaga, cubeta[0] + (ahora - cubeta[1]) * por_segundo)
+        cubeta[1] = ahora
+        if cubeta[0] >= 1:
+            cubeta[0] -= 1
+            return None
+        return Rechazo(LIMITE_TASA, (1 - cubeta[0]) / por_segundo)
+
+    def _rechazar(self, telefono, rechazo):
+        ADMISION_RECHAZOS.inc(motivo=rechazo.motivo)
+        logger.warning(f"🚦 Mensaje de {telefono} rechazado por {rechazo.motivo} "
+                       f"(en curso {self.en_curso}, en cola {self.en_cola})")
+        return rechazo
+
+
+def mensaje_rechazo(rechazo):
+    """Respuesta de WhatsApp para un mensaje rechazado."""
+    if rechazo.motivo == LIMITE_TASA:
+        segundos = max(int(rechazo.reintentar_en + 0.999), 1)
+        return f"⏳ Has enviado muchas preguntas seguidas. Intenta de nuevo en {segundos} segundos."
+    return "⏳ Estoy atendiendo muchas consultas en este momento. Intenta de nuevo en un minuto."
+
+
+# Instancia global usada por main.py
+admision = ControlAdmision()
@@ -0,0 +1,210 @@
+"""
+⏱️ Benchmark del cargador de APUs (load_apus_csv.py)
+Genera CSVs sintéticos (generar_csv_apus.py) y los carga de punta a punta, midiendo por fase
+(detección de encoding, lectura/limpieza, inserción) el tiempo, las filas/s y la memoria pico.
+Para medir el costo del camino de error compara la carga del CSV sucio con la de un gemelo
+limpio (misma semilla, sin suciedad).
+
+La inserción se hace en un esquema aparte (bench_carga) con una tabla apus propia y una
+restricción CHECK (precio_unitario >= 0), así las filas con precio negativo fuerzan el
+reintento fila por fila del cargador sin tocar la tabla apus real.
+
+Uso:
+    python bench_carga_apus.py --filas 100000 --sucios 0.02 --negativos 0.001
+    python bench_carga_apus.py --csv APUS_V8.csv --solo-lectura
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+import load_apus_csv
+from create_apus_table import SQL_CREAR_APUS
+from generar_csv_apus import escribir_csv_apus
+
+ESQUEMA = "bench_carga"
+
+
+def medir(funcion, *args, memoria=False):
+    """Ejecuta funcion(*args) y devuelve (resultado, segundos, pico de memoria en bytes o None)."""
+    if memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    try:
+        resultado = funcion(*args)
+    finally:
+        duracion = time.perf_counter() - inicio
+        pico = None
+        if memoria:
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return resultado, duracion, pico
+
+
+def preparar_esquema(conn):
+    """Crea (o vacía) bench_carga.apus con la restricción que rechaza precios negativos."""
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ESQUEMA}")
+    cursor.execute(f"SET search_path TO {ESQUEMA}")
+    cursor.execute(SQL_CREAR_APUS)
+    cursor.execute("TRUNCATE apus")
+    cursor.execute("""
+        DO $$ BEGIN
+            ALTER TABLE apus ADD CONSTRAINT apus_precio_no_negativo CHECK (precio_unitario >= 0);
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$
+    """)
+    conn.commit()
+    cursor.close()
+
+
+def cargar(csv_path, batch_size, solo_lectura=False, memoria=True):
+    """Ejecuta las fases del cargador sobre un CSV y devuelve las mediciones."""
+    tamano = os.path.getsize(csv_path)
+    encoding, t_encoding, _ = medir(load_apus_csv.detectar_encoding, csv_path)
+    (datos, errores, _), t_lectura, _ = medir(load_apus_csv.leer_csv, csv_path, encoding)
+    m_encoding = m_lectura = None
+    if memoria:
+        # Pasada aparte: tracemalloc hace la lectura ~15x más lenta y falsearía los tiempos
+        _, _, m_encoding = medir(load_apus_csv.detectar_encoding, csv_path, memoria=True)
+        _, _, m_lectura = medir(load_apus_csv.leer_csv, csv_path, encoding, memoria=True)
+    filas = len(datos) + len(errores)
+
+    resultado = {
+        "archivo": csv_path,
+        "mb": tamano / 1e6,
+        "encoding": encoding,
+        "filas": filas,
+        "errores_formato": len(errores),
+        "encoding_s": t_encoding,
+        "encoding_pico_mb": m_encoding and m_encoding / 1e6,
+        "lectura_s": t_lectura,
+        "lectura_filas_s": filas / t_lectura if t_lectura else 0,
+        "lectura_pico_mb": m_lectura and m_lectura / 1e6,
+    }
+    if solo_lectura:
+        return resultado
+
+    from db_config import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        preparar_esquema(conn)
+        (exitos, errores_db, lotes), t_insercion, _ = medir(
+            load_apus_csv.insertar_lotes, conn, datos, batch_size
+        )
+    finally:
+        conn.close()
+
+    resultado.update({
+        "insertadas": exitos,
+        "errores_db": len(errores_db),
+        "lotes": lotes,
+        "lotes_fallidos": sum(1 for e in errores_db if e.startswith("Lote ")),
+        "insercion_s": t_insercion,
+        "insercion_filas_s": exitos / t_insercion if t_insercion else 0,
+        "total_s": t_encoding + t_lectura + t_insercion,
+    })
+    return resultado
+
+
+def costo_errores(sucio, limpio):
+    """Tiempo extra atribuible a las filas con error (sucio - limpio, normalizado)."""
+    costo = {}
+    extra_lectura = sucio["lectura_s"] - limpio["lectura_s"]
+    if sucio["errores_formato"]:
+        costo["lectura_extra_s"] = extra_lectura
+        costo["ms_por_error_formato"] = extra_lectura / sucio["errores_formato"] * 1000
+    if "insercion_s" in sucio and "insercion_s" in limpio:
+        extra = sucio["insercion_s"] - limpio["insercion_s"]
+        costo["insercion_extra_s"] = extra
+        if sucio["lotes_fallidos"]:
+            costo["s_por_lote_fallido"] = extra / sucio["lotes_fallidos"]
+        rechazadas = sucio["errores_db"] - sucio["lotes_fallidos"]
+        if rechazadas:
+            costo["ms_por_fila_rechazada"] = extra / rechazadas * 1000
+    return costo
+
+
+def imprimir(nombre, r):
+    print(f"\n📄 {nombre}: {r['archivo']} ({r['mb']:.1f} MB, {r['encoding']}, {r['filas']} filas)")
+    memoria = lambda v: f", pico {v:.0f} MB" if v is not None else ""
+    print(f"   Encoding:  {r['encoding_s']:.2f}s{memoria(r['encoding_pico_mb'])}")
+    print(f"   Lectura:   {r['lectura_s']:.2f}s  {r['lectura_filas_s']:,.0f} filas/s"
+          f"{memoria(r['lectura_pico_mb'])}  errores de formato: {r['errores_formato']}")
+    if "insercion_s" in r:
+        print(f"   Inserción: {r['insercion_s']:.2f}s  {r['insercion_filas_s']:,.0f} filas/s  "
+              f"lotes: {r['lotes']} (fallidos: {r['lotes_fallidos']})  errores BD: {r['errores_db']}")
+        print(f"   Total:     {r['total_s']:.2f}s  ({r['filas'] / r['total_s']:,.0f} filas/s de punta a punta)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del cargador de APUs")
+    parser.add_argument("--csv", help="Medir un CSV existente en vez de generar uno")
+    parser.add_argument("--filas", type=int, default=50000)
+    parser.add_argument("--proyectos", type=int, default=100)
+    parser.add_argument("--sucios", type=float, default=0.02)
+    parser.add_argument("--negativos", type=float, default=0.001)
+    parser.add_argument("--encoding", default="cp1252")
+    parser.add_argument("--batch", type=int, default=load_apus_csv.BATCH_SIZE)
+    parser.add_argument("--solo-lectura", action="store_true", help="No insertar en la base")
+    parser.add_argument("--sin-memoria", action="store_true", help="Omitir la pasada extra que mide memoria")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar los logs del cargador")
+    parser.add_argument("--conservar", action="store_true", help="No borrar el esquema bench_carga")
+    parser.add_argument("--salida", help="Guardar resultados en JSON")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger(load_apus_csv.__name__).setLevel(logging.ERROR)
+    memoria = not args.sin_memoria
+
+    resultados = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        if args.csv:
+            resultados["csv"] = cargar(args.csv, args.batch, args.solo_lectura, memoria)
+            imprimir("CSV", resultados["csv"])
+        else:
+            sucio = os.path.join(directorio, "apus_sucio.csv")
+            limpio = os.path.join(directorio, "apus_limpio.csv")
+            inicio = time.perf_counter()
+            conteo = escribir_csv_apus(sucio, args.filas, args.proyectos, sucios=args.sucios,
+                                       negativos=args.negativos, encoding=args.encoding)
+            escribir_csv_apus(limpio, args.filas, args.proyectos, encoding=args.encoding)
+            print(f"🧪 CSVs generados en {time.perf_counter() - inicio:.1f}s: {conteo}")
+
+            resultados["limpio"] = cargar(limpio, args.batch, args.solo_lectura, memoria)
+            imprimir("Limpio", resultados["limpio"])
+            resultados["sucio"] = cargar(sucio, args.batch, args.solo_lectura, memoria)
+            imprimir("Sucio", resultados["sucio"])
+            resultados["suciedad"] = conteo
+            resultados["costo_errores"] = costo_errores(resultados["sucio"], resultados["limpio"])
+            print(f"\n💸 Costo del camino de error: {json.dumps(resultados['costo_errores'], indent=None)}")
+
+    # ru_maxrss está en KB en Linux
+    resultados["rss_max_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"\n🧠 RSS máximo del proceso: {resultados['rss_max_mb']:.0f} MB")
+
+    if not args.solo_lectura and not args.conservar:
+        from db_config import get_db_connection
+
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+            conn.commit()
+        finally:
+            conn.close()
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+        print(f"💾 Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+🏁 Benchmark de extremo a extremo (sin red externa)
+Levanta el bot (uvicorn main:app) contra un Postgres local con APUs sintéticos y dobles
+locales de Gemini y Twilio (bench_stubs.py), envía tráfico concurrente al webhook y reporta:
+  - throughput y latencia p50/p95/p99 del webhook (medida por el cliente)
+  - p50/p95/p99 por etapa (a partir de los histogramas de /metrics)
+  - conexiones a la base de datos (pg_stat_activity) durante la prueba
+  - llamadas recibidas por los dobles de Gemini y Twilio
+
+Requisitos: Postgres local configurado con DB_HOST/DB_NAME/DB_USER/DB_PASSWORD (usar una base
+desechable: se crean tablas y se insertan datos de prueba).
+
+Uso:
+    python bench_e2e.py --mensajes 200 --concurrencia 10 --filas 20000
+    python bench_e2e.py --latencia-sql 0.3 --latencia-resumen 0.6 --salida resultados.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extras import execute_values
+
+from bench_stubs import CONSULTAS, ConfigStubs, iniciar_stubs
+from bench_utils import (
+    diferencia_metricas, enviar_mensaje, leer_metricas, resumen_etapas, resumen_latencias,
+)
+from create_apus_table import COLUMNAS_APUS, SQL_CREAR_APUS
+from create_historial_table import create_historial_table
+from datos_sinteticos import filas_apus_sinteticas
+from db_config import db_config, get_db_connection
+
+HOSTS_LOCALES = ("localhost", "127.0.0.1", "::1", "")
+PREFIJO_TELEFONO = "whatsapp:+57300999"
+
+SQL_CREAR_USUARIOS = """
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id SERIAL PRIMARY KEY,
+        nombre TEXT,
+        telefono TEXT UNIQUE,
+        rol TEXT,
+        activo BOOLEAN DEFAULT TRUE,
+        fecha_registro TIMESTAMP DEFAULT NOW()
+    )
+"""
+
+
+def preparar_base(filas, usuarios, recargar=False):
+    """Crea tablas, carga APUs sintéticos (si faltan) y usuarios de prueba."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(SQL_CREAR_APUS)
+        cursor.execute(SQL_CREAR_USUARIOS)
+        cursor.execute("SELECT COUNT(*) FROM apus")
+        existentes = cursor.fetchone()[0]
+        if recargar or existentes < filas:
+            print(f"🧪 Cargando {filas} filas sintéticas en apus...")
+            cursor.execute("TRUNCATE apus")
+            execute_values(
+                cursor,
+                f"INSERT INTO apus ({', '.join(COLUMNAS_APUS)}) VALUES %s",
+                filas_apus_sinteticas(filas),
+                page_size=1000,
+            )
+            cursor.execute("ANALYZE apus")
+        else:
+            print(f"♻️ Reutilizando {existentes} filas existentes en apus")
+
+        telefonos = [f"{PREFIJO_TELEFONO}{n:04d}" for n in range(usuarios)]
+        execute_values(
+            cursor,
+            """INSERT INTO usuarios (nombre, telefono, rol, activo) VALUES %s
+               ON CONFLICT (telefono) DO UPDATE SET activo = true""",
+            [(f"Bench {n}", t, "bench", True) for n, t in enumerate(telefonos)],
+        )
+        conn.commit()
+        cursor.close()
+    finally:
+        if conn:
+            conn.close()
+
+    create_historial_table()
+    return telefonos
+
+
+def limpiar_historial_bench():
+    """Borra el historial generado por los usuarios de prueba."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM historial_conversaciones WHERE telefono LIKE %s", (PREFIJO_TELEFONO + "%",))
+        conn.commit()
+        cursor.close()
+    finally:
+        if conn:
+            conn.close()
+
+
+class MuestreoConexiones:
+    """Muestrea en segundo plano las conexiones de pg_stat_activity a la base del bot."""
+
+    def __init__(self, intervalo=0.25):
+        self.intervalo = intervalo
+        self.muestras = []
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._hilo.join(timeout=5)
+
+    def _bucle(self):
+        conn = None
+        try:
+            conn = get_db_connection()
+            conn.autocommit = True
+            cursor = conn.cursor()
+            while not self._detener.is_set():
+                # Sin contar la conexión propia del muestreo
+                cursor.execute(
+                    """SELECT state, COUNT(*) FROM pg_stat_activity
+                       WHERE datname = current_database() AND pid <> pg_backend_pid()
+                       GROUP BY state"""
+                )
+                self.muestras.append(dict(cursor.fetchall()))
+                self._detener.wait(self.intervalo)
+        except Exception as e:
+            print(f"⚠️ Muestreo de conexiones detenido: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    def resumen(self):
+        if not self.muestras:
+            return {}
+        totales = [sum(m.values()) for m in self.muestras]
+        activas = [m.get("active", 0) for m in self.muestras]
+        return {
+            "muestras": len(self.muestras),
+            "max": max(totales),
+            "media": sum(totales) / len(totales),
+            "max_activas": max(activas),
+        }
+
+
+def iniciar_bot(puerto, puerto_gemini, puerto_twilio, workers):
+    """Lanza uvicorn main:app apuntando a los dobles locales."""
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_BASE_URL": f"http://127.0.0.1:{puerto_gemini}",
+        "GEMINI_API_KEY": "bench",
+        "TWILIO_API_BASE_URL": f"http://127.0.0.1:{puerto_twilio}",
+        "ACCOUNT_SID": "AC" + "0" * 32,
+        "AUTH_TOKEN": "bench",
+        "FROM_WHATSAPP": "whatsapp:+10000000000",
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+        "HISTORIAL_SPILL_PATH": env.get("HISTORIAL_SPILL_PATH", "bench_historial_pendiente.jsonl"),
+    })
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(puerto),
+         "--workers", str(workers), "--no-access-log"],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    limite = time.time() + 30
+    while time.time() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"uvicorn terminó con código {proceso.returncode}")
+        try:
+            urllib.request.urlopen(url + "/", timeout=1).read()
+            return proceso, url
+        except OSError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError("El bot no respondió en 30s")
+
+
+def generar_trafico(url, telefonos, mensajes, concurrencia, timeout):
+    """Reparte `mensajes` preguntas entre los usuarios con `concurrencia` clientes simultáneos."""
+    trabajos = [
+        (telefonos[n % len(telefonos)], CONSULTAS[n % len(CONSULTAS)][0])
+        for n in range(mensajes)
+    ]
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        resultados = list(ejecutor.map(lambda t: enviar_mensaje(url, t[0], t[1], timeout), trabajos))
+    return resultados, time.perf_counter() - inicio
+
+
+def imprimir_reporte(reporte):
+    e2e = reporte["webhook"]
+    print("\n" + "=" * 70)
+    print("🏁 RESULTADOS DEL BENCHMARK")
+    print("=" * 70)
+    print(f"Mensajes: {reporte['mensajes']}  Concurrencia: {reporte['concurrencia']}  Workers: {reporte['workers']}")
+    print(f"Duración: {reporte['duracion_s']:.1f}s  Throughput: {reporte['throughput_rps']:.2f} msg/s")
+    print(f"Respuestas: {reporte['estados']}")
+    if e2e.get("n"):
+        print(f"Webhook (ms): p50={e2e['p50'] * 1000:.0f}  p95={e2e['p95'] * 1000:.0f}  "
+              f"p99={e2e['p99'] * 1000:.0f}  max={e2e['max'] * 1000:.0f}")
+
+    print(f"\n{'Etapa':<16}{'n':>7}{'media':>10}{'p50':>10}{'p95':>10}{'p99':>10}   (ms)")
+    for nombre, e in sorted(reporte["etapas"].items(), key=lambda kv: -kv[1]["media"] * kv[1]["n"]):
+        print(f"{nombre:<16}{e['n']:>7}{e['media'] * 1000:>10.0f}{e['p50'] * 1000:>10.0f}"
+              f"{e['p95'] * 1000:>10.0f}{e['p99'] * 1000:>10.0f}")
+    if reporte["workers"] > 1:
+        print("⚠️ Con varios workers /metrics solo refleja el proceso que atendió la lectura")
+
+    conexiones = reporte["conexiones_bd"]
+    if conexiones:
+        print(f"\nConexiones BD: max={conexiones['max']}  media={conexiones['media']:.1f}  "
+              f"max activas={conexiones['max_activas']}")
+    print(f"Llamadas a los dobles: {reporte['llamadas_stubs']}")
+    print("=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo con dobles locales")
+    parser.add_argument("--mensajes", type=int, default=200)
+    parser.add_argument("--concurrencia", type=int, default=10)
+    parser.add_argument("--usuarios", type=int, default=20, help="Usuarios distintos que envían mensajes")
+    parser.add_argument("--filas", type=int, default=20000, help="Filas sintéticas en apus")
+    parser.add_argument("--recargar", action="store_true", help="Volver a generar apus aunque ya tenga datos")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--puerto", type=int, default=8780)
+    parser.add_argument("--puerto-gemini", type=int, default=8790)
+    parser.add_argument("--puerto-twilio", type=int, default=8791)
+    parser.add_argument("--latencia-sql", type=float, default=0.8)
+    parser.add_argument("--latencia-resumen", type=float, default=1.5)
+    parser.add_argument("--latencia-twilio", type=float, default=0.15)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--salida", help="Guardar el reporte en JSON")
+    parser.add_argument("--forzar", action="store_true", help="Permitir un DB_HOST que no sea local")
+    args = parser.parse_args()
+
+    if (db_config.host or "") not in HOSTS_LOCALES and not args.forzar:
+        sys.exit(f"❌ DB_HOST={db_config.host} no es local. Usa una base desechable o --forzar")
+
+    telefonos = preparar_base(args.filas, args.usuarios, args.recargar)
+    limpiar_historial_bench()
+
+    config = ConfigStubs(args.latencia_sql, args.latencia_resumen, args.latencia_twilio,
+                         args.jitter, tasa_error=args.tasa_error)
+    servidores = iniciar_stubs(config, args.puerto_gemini, args.puerto_twilio)
+    proceso, url = iniciar_bot(args.puerto, args.puerto_gemini, args.puerto_twilio, args.workers)
+    muestreo = MuestreoConexiones()
+    try:
+        # Calentamiento: una pregunta por usuario (llena cachés y conexiones)
+        generar_trafico(url, telefonos, len(telefonos), args.concurrencia, args.timeout)
+        config.llamadas = dict.fromkeys(config.llamadas, 0)
+
+        antes = leer_metricas(url)
+        muestreo.iniciar()
+        print(f"🚀 Enviando {args.mensajes} mensajes con concurrencia {args.concurrencia}...")
+        resultados, duracion = generar_trafico(url, telefonos, args.mensajes, args.concurrencia, args.timeout)
+        muestreo.detener()
+        delta = diferencia_metricas(antes, leer_metricas(url))
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=30)
+        for servidor in servidores:
+            servidor.shutdown()
+
+    estados = {}
+    for _, estado, cuerpo in resultados:
+        clave = f"{estado} {cuerpo}" if estado == 200 else str(estado)
+        estados[clave] = estados.get(clave, 0) + 1
+
+    reporte = {
+        "mensajes": args.mensajes,
+        "concurrencia": args.concurrencia,
+        "workers": args.workers,
+        "filas_apus": args.filas,
+        "latencias_stubs": {"sql": args.latencia_sql, "resumen": args.latencia_resumen, "twilio": args.latencia_twilio},
+        "duracion_s": duracion,
+        "throughput_rps": len(resultados) / duracion if duracion else 0,
+        "estados": estados,
+        "webhook": resumen_latencias([r[0] for r in resultados if r[1] == 200]),
+        "etapas": resumen_etapas(delta),
+        "conexiones_bd": muestreo.resumen(),
+        "llamadas_stubs": dict(config.llamadas),
+    }
+    imprimir_reporte(reporte)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, ensure_ascii=False, indent=2)
+        print(f"💾 Reporte guardado en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+🧊 Benchmark: Postgres vs motor analítico local (snapshot de apus en DuckDB)
+Ejecuta las mismas consultas en Postgres (como lo hace ejecutar_sql: cursor normal + fetchall)
+y en el motor local sobre el snapshot Parquet, y compara latencias y resultados.
+
+Uso:
+    python snapshot_apus.py exportar
+    python bench_motor_local.py [--corpus corpus.jsonl] [--repeticiones 5] [--salida resultado.json]
+
+Sin --corpus se usan las consultas de bench_stubs.CONSULTAS; con --corpus, la salida de
+"python bench_sql.py corpus". Los resultados se comparan por nombres y tipos de columna y como
+conjuntos de filas (con los números redondeados): un LIMIT con empates puede devolver filas
+distintas en cada motor.
+"""
+
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from bench_stubs import CONSULTAS
+from bench_utils import percentil
+from snapshot_apus import MotorLocal, SNAPSHOT_APUS_PATH, soportada
+
+
+def medir(funcion, repeticiones, calentamiento):
+    """(resultado de la última llamada, tiempos en ms)."""
+    for _ in range(calentamiento):
+        funcion()
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return resultado, tiempos
+
+
+def consultar_postgres(conn, sql, timeout_ms):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN READ ONLY")
+        cursor.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+        cursor.execute(sql)
+        columnas = [d[0] for d in cursor.description]
+        return [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+    finally:
+        cursor.execute("ROLLBACK")
+        cursor.close()
+
+
+def _normalizar_valor(valor):
+    if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool):
+        return round(float(valor), 4)
+    return valor
+
+
+def _tipos(filas):
+    """Tipo de cada columna (el primero que no sea NULL); int y Decimal cuentan como número."""
+    tipos = {}
+    for fila in filas:
+        for columna, valor in fila.items():
+            if valor is not None and tipos.get(columna) is None:
+                tipos[columna] = "numero" if isinstance(valor, (int, Decimal)) else type(valor).__name__
+    return tipos
+
+
+def mismas_filas(a, b):
+    """True si ambos resultados tienen las mismas columnas, tipos y filas (sin importar el orden)."""
+    if a and b and (list(a[0]) != list(b[0]) or _tipos(a) != _tipos(b)):
+        return False
+    clave = lambda fila: tuple(str(_normalizar_valor(v)) for v in fila.values())
+    return sorted(map(clave, a)) == sorted(map(clave, b))
+
+
+def comparar_motores(consultas, repeticiones=5, calentamiento=1, timeout_ms=30000, ruta=SNAPSHOT_APUS_PATH):
+    """Mide cada consulta en ambos motores; las no soportadas en el local solo se cuentan."""
+    from db_config import get_db_connection
+
+    motor = MotorLocal(ruta)
+    if not motor.disponible:
+        raise SystemExit(f"❌ No hay snapshot en {ruta} o falta duckdb (python snapshot_apus.py exportar)")
+    resultados = []
+    conn = None
+    try:
+        conn = get_db_connection(lectura=True)
+        conn.autocommit = True  # Transacciones explícitas en consultar_postgres()
+        for n, sql in enumerate(consultas, 1):
+            fila = {"sql": sql}
+            try:
+                pg, fila["postgres_ms"] = medir(lambda: consultar_postgres(conn, sql, timeout_ms),
+                                                repeticiones, calentamiento)
+            except Exception as e:
+                fila["error"] = str(e).strip().splitlines()[0]
+                print(f"  [{n}/{len(consultas)}] ❌ Postgres: {fila['error'][:70]}")
+                resultados.append(fila)
+                continue
+            local, fila["local_ms"] = medir(lambda: motor.consultar(sql), repeticiones, calentamiento)
+            if local is None:
+                fila["local_ms"] = None
+                fila["no_soportada"] = not soportada(sql)
+                fila["fallback"] = True
+                print(f"  [{n}/{len(consultas)}] ↩️ Postgres (fallback)  {sql[:70]}")
+            else:
+                fila["coinciden"] = mismas_filas(pg, local)
+                p_pg, p_local = statistics.median(fila["postgres_ms"]), statistics.median(fila["local_ms"])
+                marca = "✅" if fila["coinciden"] else "⚠️"
+                print(f"  [{n}/{len(consultas)}] {marca} {p_pg:8.1f} → {p_local:7.1f} ms  {sql[:60]}")
+            resultados.append(fila)
+    finally:
+        if conn:
+            conn.close()
+    return resultados
+
+
+def resumen(resultados):
+    locales = [r for r in resultados if r.get("local_ms")]
+    pg = [statistics.median(r["postgres_ms"]) for r in locales]
+    local = [statistics.median(r["local_ms"]) for r in locales]
+    return {
+        "consultas": len(resultados),
+        "en_motor_local": len(locales),
+        "fallback": sum(1 for r in resultados if r.get("fallback")),
+        "errores_postgres": sum(1 for r in resultados if "error" in r),
+        "resultados_distintos": sum(1 for r in locales if not r["coinciden"]),
+        "postgres_p50_ms": percentil(pg, 50),
+        "postgres_p95_ms": percentil(pg, 95),
+        "local_p50_ms": percentil(local, 50),
+        "local_p95_ms": percentil(local, 95),
+        "aceleracion_total": sum(pg) / sum(local) if local and sum(local) else None,
+    }
+
+
+def imprimir_resumen(r):
+    print("=" * 70)
+    print("🧊 Postgres vs motor local")
+    print("=" * 70)
+    print(f"Consultas: {r['consultas']}  (motor local: {r['en_motor_local']}, fallback: {r['fallback']}, "
+          f"errores en Postgres: {r['errores_postgres']})")
+    if r["en_motor_local"]:
+        print(f"Postgres p50/p95: {r['postgres_p50_ms']:.1f} / {r['postgres_p95_ms']:.1f} ms")
+        print(f"Local    p50/p95: {r['local_p50_ms']:.1f} / {r['local_p95_ms']:.1f} ms")
+        print(f"Aceleración (tiempo total): {r['aceleracion_total']:.1f}x")
+    if r["resultados_distintos"]:
+        print(f"⚠️ {r['resultados_distintos']} consultas con resultados distintos "
+              f"(revisar columnas, tipos o empates en LIMIT)")
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Postgres vs motor analítico local")
+    parser.add_argument("--corpus", help="Corpus JSONL de bench_sql.py (por defecto bench_stubs.CONSULTAS)")
+    parser.add_argument("--snapshot", default=SNAPSHOT_APUS_PATH)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--calentamiento", type=int, default=1)
+    parser.add_argument("--timeout-ms", type=int, default=30000)
+    parser.add_argument("--salida", help="Guardar resultados en JSON")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            consultas = [json.loads(linea)["sql"] for linea in f if linea.strip()]
+    else:
+        consultas = [sql for _, sql in CONSULTAS]
+
+    print(f"🔬 {len(consultas)} consultas, {args.repeticiones} repeticiones por motor...")
+    resultados = comparar_motores(consultas, args.repeticiones, args.calentamiento, args.timeout_ms, args.snapshot)
+    r = resumen(resultados)
+    imprimir_resumen(r)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"fecha": datetime.now().isoformat(timespec="seconds"), "resumen": r,
+                       "consultas": resultados}, f, ensure_ascii=False, indent=2, default=str)
+        print(f"💾 Resultados guardados en {args.salida}")
@@ -0,0 +1,333 @@
+"""
+🔬 Benchmark de regresión SQL sobre el corpus de consultas generadas
+Toma el SQL que Gemini generó para usuarios reales (historial_conversaciones.sql_generado),
+lo deduplica, ejecuta cada consulta con EXPLAIN (ANALYZE, BUFFERS) contra una base destino y
+guarda la forma del plan y los tiempos; luego compara dos ejecuciones para demostrar que un
+índice, una vista materializada o un cambio de esquema acelera las preguntas reales, y para
+detectar regresiones de plan.
+
+Uso:
+    python bench_sql.py corpus --salida corpus.jsonl [--desde 2025-01-01] [--archivo archivo_historial]
+    python bench_sql.py ejecutar corpus.jsonl --etiqueta antes --salida antes.json
+    #   ... crear el índice / vista ...
+    python bench_sql.py ejecutar corpus.jsonl --etiqueta despues --salida despues.json
+    python bench_sql.py comparar antes.json despues.json [--fallar-si-regresion]
+
+Seguridad: EXPLAIN ANALYZE ejecuta la consulta. Solo se corren consultas SELECT/WITH de una
+sentencia, dentro de una transacción READ ONLY con statement_timeout, que siempre se revierte.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+from datetime import datetime
+
+from sql_canonico import canonizar, es_consulta_lectura, huella, normalizar
+
+
+# ===============================
+# 📚 CORPUS
+# ===============================
+def _sql_de_bd(desde=None):
+    """(sql_generado, veces, pregunta de ejemplo) agrupado por texto exacto."""
+    from db_config import get_db_connection
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        condicion, parametros = "", []
+        if desde:
+            condicion, parametros = "AND timestamp >= %s", [desde]
+        cursor.execute(f"""
+            SELECT sql_generado, COUNT(*), MIN(mensaje_usuario)
+            FROM historial_conversaciones
+            WHERE sql_generado IS NOT NULL AND sql_generado <> '' {condicion}
+            GROUP BY sql_generado
+        """, parametros)
+        filas = cursor.fetchall()
+        cursor.close()
+        return filas
+    finally:
+        if conn:
+            conn.close()
+
+
+def _sql_de_archivo(directorio, desde=None):
+    from particiones_historial import leer_archivo
+
+    grupos = {}
+    for conv in leer_archivo(directorio, desde and desde.date()):
+        sql = conv.get("sql_generado")
+        if not sql or (desde and conv["timestamp"] < desde):
+            continue
+        veces, pregunta = grupos.get(sql, (0, conv["mensaje_usuario"]))
+        grupos[sql] = (veces + 1, pregunta)
+    return [(sql, veces, pregunta) for sql, (veces, pregunta) in grupos.items()]
+
+
+def construir_corpus(filas):
+    """
+    Deduplica por consulta normalizada y descarta lo que no sea un SELECT de una sentencia.
+
+    Returns:
+        list: [{"id", "sql", "forma", "id_forma", "frecuencia", "pregunta"}] por frecuencia desc.
+    """
+    corpus = {}
+    descartadas = 0
+    for sql, veces, pregunta in filas:
+        if not es_consulta_lectura(sql):
+            descartadas += 1
+            continue
+        normal = normalizar(sql)
+        id_ = huella(normal)
+        if id_ in corpus:
+            corpus[id_]["frecuencia"] += veces
+            continue
+        forma = canonizar(normal)
+        corpus[id_] = {
+            "id": id_,
+            "sql": normal,
+            "forma": forma,
+            "id_forma": huella(forma),
+            "frecuencia": veces,
+            "pregunta": pregunta,
+        }
+    if descartadas:
+        print(f"⚠️ {descartadas} consultas descartadas (no son un SELECT de una sentencia)")
+    return sorted(corpus.values(), key=lambda c: -c["frecuencia"])
+
+
+# ===============================
+# ▶️ EJECUCIÓN
+# ===============================
+def forma_plan(nodo):
+    """Forma del plan sin costos ni filas: tipo de nodo, relación/índice y subplanes."""
+    detalle = [nodo["Node Type"]]
+    for clave in ("Join Type", "Strategy", "Relation Name", "Index Name"):
+        if clave in nodo:
+            detalle.append(str(nodo[clave]))
+    hijos = [forma_plan(h) for h in nodo.get("Plans", [])]
+    return " ".join(detalle) + (f"({', '.join(hijos)})" if hijos else "")
+
+
+def explicar(cursor, sql, timeout_ms):
+    """Ejecuta EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) en una transacción de solo lectura."""
+    try:
+        cursor.execute("BEGIN READ ONLY")
+        cursor.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")
+        resultado = cursor.fetchone()[0]
+    finally:
+        cursor.execute("ROLLBACK")
+    if isinstance(resultado, str):
+        resultado = json.loads(resultado)
+    return resultado[0]
+
+
+def medir_consulta(cursor, sql, repeticiones, calentamiento, timeout_ms):
+    """Mediana de tiempos y detalles del plan de la última ejecución."""
+    for _ in range(calentamiento):
+        explicar(cursor, sql, timeout_ms)
+    ejecuciones, planificaciones = [], []
+    explicacion = None
+    for _ in range(repeticiones):
+        explicacion = explicar(cursor, sql, timeout_ms)
+        ejecuciones.append(explicacion["Execution Time"])
+        planificaciones.append(explicacion["Planning Time"])
+    plan = explicacion["Plan"]
+    return {
+        "ejecucion_ms": statistics.median(ejecuciones),
+        "ejecuciones_ms": ejecuciones,
+        "planificacion_ms": statistics.median(planificaciones),
+        "filas": plan.get("Actual Rows"),
+        "filas_estimadas": plan.get("Plan Rows"),
+        "costo": plan.get("Total Cost"),
+        "buffers_hit": plan.get("Shared Hit Blocks"),
+        "buffers_read": plan.get("Shared Read Blocks"),
+        "plan": forma_plan(plan),
+    }
+
+
+def ejecutar_corpus(corpus, repeticiones=3, calentamiento=1, timeout_ms=30000):
+    """Corre todo el corpus; los errores (timeout, columna inexistente...) quedan registrados."""
+    from db_config import get_db_connection
+
+    resultados = {}
+    conn = None
+    try:
+        conn = get_db_connection()
+        conn.autocommit = True  # Transacciones explícitas en explicar()
+        cursor = conn.cursor()
+        for n, consulta in enumerate(corpus, 1):
+            try:
+                medicion = medir_consulta(cursor, consulta["sql"], repeticiones, calentamiento, timeout_ms)
+                print(f"  [{n}/{len(corpus)}] {medicion['ejecucion_ms']:9.1f} ms  {consulta['sql'][:80]}")
+            except Exception as e:
+                medicion = {"error": str(e).strip().splitlines()[0]}
+                print(f"  [{n}/{len(corpus)}] ❌ {medicion['error'][:80]}")
+            resultados[consulta["id"]] = {**consulta, **medicion}
+        cursor.close()
+    finally:
+        if conn:
+            conn.close()
+    return resultados
+
+
+def destino_bd():
+    from db_config import db_config
+    return f"{db_config.host}:{db_config.port}/{db_config.name}"
+
+
+# ===============================
+# ⚖️ COMPARACIÓN
+# ===============================
+def comparar(a, b, umbral=1.5, minimo_ms=5.0, top=10):
+    """
+    Compara dos ejecuciones. Una consulta regresa si es `umbral` veces más lenta y al menos
+    `minimo_ms` más lenta (evita ruido en consultas de 1 ms).
+
+    Returns:
+        dict: regresiones, mejoras, cambios de plan, errores nuevos y totales ponderados
+    """
+    comunes = [i for i in a["consultas"] if i in b["consultas"]]
+    regresiones, mejoras, cambios_plan, errores_nuevos, corregidas = [], [], [], [], []
+    total_a = total_b = 0.0
+    for id_ in comunes:
+        ca, cb = a["consultas"][id_], b["consultas"][id_]
+        if "error" in cb and "error" not in ca:
+            errores_nuevos.append((id_, cb["error"]))
+            continue
+        if "error" in ca:
+            if "error" not in cb:
+                corregidas.append(id_)
+            continue
+        ta, tb = ca["ejecucion_ms"], cb["ejecucion_ms"]
+        total_a += ta * ca["frecuencia"]
+        total_b += tb * cb["frecuencia"]
+        razon = tb / ta if ta > 0 else float("inf")
+        if razon >= umbral and tb - ta >= minimo_ms:
+            regresiones.append((razon, id_))
+        elif razon <= 1 / umbral and ta - tb >= minimo_ms:
+            mejoras.append((razon, id_))
+        if ca["plan"] != cb["plan"]:
+            cambios_plan.append((razon, id_))
+
+    return {
+        "comunes": len(comunes),
+        "solo_a": len(a["consultas"]) - len(comunes),
+        "solo_b": len(b["consultas"]) - len(comunes),
+        "total_ponderado_a_ms": total_a,
+        "total_ponderado_b_ms": total_b,
+        "regresiones": sorted(regresiones, reverse=True)[:top],
+        "n_regresiones": len(regresiones),
+        "mejoras": sorted(mejoras)[:top],
+        "n_mejoras": len(mejoras),
+        "cambios_plan": sorted(cambios_plan, reverse=True)[:top],
+        "n_cambios_plan": len(cambios_plan),
+        "errores_nuevos": errores_nuevos,
+        "corregidas": corregidas,
+    }
+
+
+def imprimir_comparacion(a, b, diff):
+    print("=" * 70)
+    print(f"⚖️ {a['etiqueta']} (A) vs {b['etiqueta']} (B)   [{a['bd']} → {b['bd']}]")
+    print("=" * 70)
+    print(f"Consultas comunes: {diff['comunes']}  (solo A: {diff['solo_a']}, solo B: {diff['solo_b']})")
+    ta, tb = diff["total_ponderado_a_ms"], diff["total_ponderado_b_ms"]
+    if ta:
+        print(f"Tiempo total ponderado por frecuencia: {ta:,.0f} ms → {tb:,.0f} ms ({(tb - ta) / ta * 100:+.1f}%)")
+
+    def linea(razon, id_):
+        ca, cb = a["consultas"][id_], b["consultas"][id_]
+        return (f"  {razon:5.2f}x  {ca['ejecucion_ms']:8.1f} → {cb['ejecucion_ms']:8.1f} ms  "
+                f"×{ca['frecuencia']:<4} {ca['sql'][:60]}")
+
+    print(f"\n🔴 Regresiones: {diff['n_regresiones']}")
+    for razon, id_ in diff["regresiones"]:
+        print(linea(razon, id_))
+    print(f"\n🟢 Mejoras: {diff['n_mejoras']}")
+    for razon, id_ in diff["mejoras"]:
+        print(linea(razon, id_))
+    print(f"\n🔀 Cambios de plan: {diff['n_cambios_plan']}")
+    for razon, id_ in diff["cambios_plan"]:
+        print(linea(razon, id_))
+        print(f"        A: {a['consultas'][id_]['plan'][:100]}")
+        print(f"        B: {b['consultas'][id_]['plan'][:100]}")
+    if diff["errores_nuevos"]:
+        print(f"\n❌ Errores nuevos en B: {len(diff['errores_nuevos'])}")
+        for id_, error in diff["errores_nuevos"][:10]:
+            print(f"  {error[:70]}  {a['consultas'][id_]['sql'][:50]}")
+    if diff["corregidas"]:
+        print(f"\n✅ Consultas que fallaban en A y funcionan en B: {len(diff['corregidas'])}")
+    print("=" * 70)
+
+
+def _leer_json(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de regresión del SQL generado")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_cor = sub.add_parser("corpus", help="Extrae y deduplica el SQL del historial")
+    p_cor.add_argument("--salida", required=True)
+    p_cor.add_argument("--desde", type=datetime.fromisoformat)
+    p_cor.add_argument("--archivo", help="Leer del archivo histórico (directorio) en vez de la tabla")
+    p_cor.add_argument("--limite", type=int, help="Solo las N consultas más frecuentes")
+
+    p_eje = sub.add_parser("ejecutar", help="Corre el corpus con EXPLAIN ANALYZE")
+    p_eje.add_argument("corpus")
+    p_eje.add_argument("--etiqueta", default="base")
+    p_eje.add_argument("--repeticiones", type=int, default=3)
+    p_eje.add_argument("--calentamiento", type=int, default=1)
+    p_eje.add_argument("--timeout-ms", type=int, default=30000)
+    p_eje.add_argument("--salida", required=True)
+
+    p_cmp = sub.add_parser("comparar", help="Compara dos ejecuciones")
+    p_cmp.add_argument("a")
+    p_cmp.add_argument("b")
+    p_cmp.add_argument("--umbral", type=float, default=1.5, help="Razón B/A para marcar regresión")
+    p_cmp.add_argument("--minimo-ms", type=float, default=5.0)
+    p_cmp.add_argument("--top", type=int, default=10)
+    p_cmp.add_argument("--fallar-si-regresion", action="store_true", help="Salir con código 1 si hay regresiones")
+    args = parser.parse_args()
+
+    if args.comando == "corpus":
+        filas = _sql_de_archivo(args.archivo, args.desde) if args.archivo else _sql_de_bd(args.desde)
+        corpus = construir_corpus(filas)
+        if args.limite:
+            corpus = corpus[:args.limite]
+        with open(args.salida, "w", encoding="utf-8") as f:
+            for consulta in corpus:
+                f.write(json.dumps(consulta, ensure_ascii=False) + "\n")
+        formas = len({c["id_forma"] for c in corpus})
+        print(f"✅ {len(corpus)} consultas únicas ({formas} formas) guardadas en {args.salida}")
+
+    elif args.comando == "ejecutar":
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = [json.loads(linea) for linea in f if linea.strip()]
+        print(f"🔬 Ejecutando {len(corpus)} consultas en {destino_bd()}...")
+        consultas = ejecutar_corpus(corpus, args.repeticiones, args.calentamiento, args.timeout_ms)
+        errores = sum(1 for c in consultas.values() if "error" in c)
+        ejecucion = {
+            "etiqueta": args.etiqueta,
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "bd": destino_bd(),
+            "repeticiones": args.repeticiones,
+            "consultas": consultas,
+        }
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(ejecucion, f, ensure_ascii=False, indent=2)
+        print(f"💾 {len(consultas)} consultas ({errores} con error) guardadas en {args.salida}")
+
+    else:
+        a, b = _leer_json(args.a), _leer_json(args.b)
+        diff = comparar(a, b, args.umbral, args.minimo_ms, args.top)
+        imprimir_comparacion(a, b, diff)
+        if args.fallar_si_regresion and (diff["n_regresiones"] or diff["errores_nuevos"]):
+            sys.exit(1)
@@ -0,0 +1,212 @@
+"""
+🎭 Dobles locales de Gemini y Twilio para benchmarks
+Servidores HTTP mínimos que imitan las respuestas de la API de Gemini (generateContent y
+streamGenerateContent?alt=sse) y de Twilio (Messages.json) con latencia configurable, para medir el bot sin red externa.
+
+Uso independiente:
+    python bench_stubs.py --puerto-gemini 8790 --puerto-twilio 8791 --latencia-sql 0.8 --latencia-resumen 1.5
+Y en el bot:
+    GEMINI_BASE_URL=http://127.0.0.1:8790 TWILIO_API_BASE_URL=http://127.0.0.1:8791
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Preguntas de prueba y el SQL que "generaría" Gemini (válido sobre datos_sinteticos.py)
+CONSULTAS = [
+    ("cuántos items tiene el proyecto la macarena",
+     "SELECT COUNT(DISTINCT items_descripcion) AS total_items FROM apus WHERE nombre_proyecto ILIKE '%macarena%'"),
+    ("cuál es el item más costoso de la macarena",
+     "SELECT items_descripcion, precio_unitario FROM apus WHERE nombre_proyecto ILIKE '%macarena%' ORDER BY precio_unitario DESC LIMIT 1"),
+    ("dame los items de excavación",
+     "SELECT DISTINCT items_descripcion, precio_unitario FROM apus WHERE items_descripcion ILIKE '%excavación%' ORDER BY precio_unitario DESC LIMIT 20"),
+    ("proyectos en Bogotá",
+     "SELECT DISTINCT nombre_proyecto, ciudad FROM apus WHERE ciudad ILIKE '%bogotá%' LIMIT 20"),
+    ("precio promedio del concreto de 3000 psi por ciudad",
+     "SELECT ciudad, AVG(precio_unitario) AS promedio FROM apus WHERE items_descripcion ILIKE '%concreto de 3000%' GROUP BY ciudad ORDER BY promedio DESC LIMIT 20"),
+    ("dame los insumos de cemento",
+     "SELECT DISTINCT insumo_descripcion, precio_unitario_apu FROM apus WHERE insumo_descripcion ILIKE '%cemento%' ORDER BY precio_unitario_apu DESC LIMIT 20"),
+    ("compara el precio de la mampostería en Medellín y Cali",
+     "SELECT ciudad, AVG(precio_unitario) AS promedio, COUNT(*) AS registros FROM apus WHERE items_descripcion ILIKE '%mampostería%' AND (ciudad ILIKE '%medellín%' OR ciudad ILIKE '%cali%') GROUP BY ciudad"),
+    ("cuántos proyectos hay en total",
+     "SELECT COUNT(DISTINCT nombre_proyecto) AS total_proyectos FROM apus"),
+    ("items más caros del 2023",
+     "SELECT DISTINCT items_descripcion, precio_unitario, nombre_proyecto FROM apus WHERE EXTRACT(YEAR FROM fecha_aprobacion_apu) = 2023 ORDER BY precio_unitario DESC LIMIT 20"),
+    ("precio de la mano de obra por proyecto",
+     "SELECT nombre_proyecto, AVG(precio_unitario_apu) AS promedio_hc FROM apus WHERE tipo_insumo ILIKE '%mano de obra%' GROUP BY nombre_proyecto ORDER BY promedio_hc DESC LIMIT 20"),
+]
+
+SQL_POR_PREGUNTA = {p.lower(): sql for p, sql in CONSULTAS}
+RE_PREGUNTA = re.compile(r'Usuario pregunta: "(.*?)"', re.DOTALL)
+
+
+class ConfigStubs:
+    """Latencias (segundos) y tamaño de las respuestas simuladas."""
+
+    def __init__(self, latencia_sql=0.8, latencia_resumen=1.5, latencia_twilio=0.15, jitter=0.2,
+                 largo_resumen=900, tasa_error=0.0):
+        self.latencia_sql = latencia_sql
+        self.latencia_resumen = latencia_resumen
+        self.latencia_twilio = latencia_twilio
+        self.jitter = jitter
+        self.largo_resumen = largo_resumen
+        self.tasa_error = tasa_error
+        self.llamadas = {"gemini_sql": 0, "gemini_resumen": 0, "twilio": 0}
+        self._lock = threading.Lock()
+
+    def contar(self, clave):
+        with self._lock:
+            self.llamadas[clave] += 1
+
+    def dormir(self, base):
+        if base > 0:
+            time.sleep(max(0.0, random.gauss(base, base * self.jitter)))
+
+
+def sql_para(prompt):
+    """SQL enlatado para la pregunta del prompt (o uno por defecto)."""
+    m = RE_PREGUNTA.search(prompt)
+    pregunta = (m.group(1) if m else "").strip().lower()
+    if pregunta in SQL_POR_PREGUNTA:
+        return SQL_POR_PREGUNTA[pregunta]
+    for clave, sql in SQL_POR_PREGUNTA.items():
+        if any(palabra in pregunta for palabra in clave.split() if len(palabra) > 5):
+            return sql
+    return CONSULTAS[0][1]
+
+
+def resumen_para(prompt, largo):
+    """Texto de resumen con líneas cortas, como las que pide el prompt."""
+    lineas = ["📊 RESULTADOS DE TU CONSULTA", ""]
+    n = 1
+    while sum(len(l) + 1 for l in lineas) < largo:
+        lineas.append(f"{n}. Ítem de ejemplo {n} - ${random.randint(10, 999) * 1000:,} (Bogotá)")
+        n += 1
+    lineas.append("")
+    lineas.append(f"✅ Total de registros: {n - 1}")
+    return "\n".join(lineas)
+
+
+def _handler_gemini(config):
+    class HandlerGemini(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            cuerpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            prompt = cuerpo["contents"][0]["parts"][0]["text"]
+            es_sql = "Genera SOLO la consulta SQL" in prompt
+            streaming = ":streamGenerateContent" in self.path
+            config.contar("gemini_sql" if es_sql else "gemini_resumen")
+            latencia = config.latencia_sql if es_sql else config.latencia_resumen
+            # En streaming el primer fragmento sale al 30% de la latencia y el resto se reparte
+            config.dormir(latencia * 0.3 if streaming else latencia)
+            if random.random() < config.tasa_error:
+                self._responder(503, {"error": {"code": 503, "message": "The model is overloaded."}})
+                return
+            texto = sql_para(prompt) if es_sql else resumen_para(prompt, config.largo_resumen)
+            uso = {
+                "promptTokenCount": len(prompt) // 4,
+                "candidatesTokenCount": len(texto) // 4,
+                "totalTokenCount": (len(prompt) + len(texto)) // 4,
+            }
+            if streaming:
+                self._responder_sse(texto, uso, latencia * 0.7)
+                return
+            self._responder(200, {
+                "candidates": [{"content": {"parts": [{"text": texto}], "role": "model"}, "finishReason": "STOP"}],
+                "usageMetadata": uso,
+            })
+
+        def _responder_sse(self, texto, uso, duracion, fragmentos=10):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            paso = max(len(texto) // fragmentos, 1)
+            trozos = [texto[i:i + paso] for i in range(0, len(texto), paso)]
+            for n, trozo in enumerate(trozos, 1):
+                evento = {"candidates": [{"content": {"parts": [{"text": trozo}], "role": "model"}}]}
+                if n == len(trozos):
+                    evento["candidates"][0]["finishReason"] = "STOP"
+                    evento["usageMetadata"] = uso
+                self.wfile.write(f"data: {json.dumps(evento, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+                self.wfile.flush()
+                if n < len(trozos):
+                    config.dormir(duracion / len(trozos))
+
+        def _responder(self, estado, datos):
+            cuerpo = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+            self.send_response(estado)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+    return HandlerGemini
+
+
+def _handler_twilio(config):
+    class HandlerTwilio(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            config.contar("twilio")
+            config.dormir(config.latencia_twilio)
+            cuenta = self.path.split("/Accounts/")[-1].split("/")[0]
+            cuerpo = json.dumps({
+                "sid": "SM" + uuid.uuid4().hex,
+                "account_sid": cuenta,
+                "status": "queued",
+                "direction": "outbound-api",
+                "num_segments": "1",
+            }).encode("utf-8")
+            self.send_response(201)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+    return HandlerTwilio
+
+
+def iniciar_stubs(config, puerto_gemini=8790, puerto_twilio=8791, host="127.0.0.1"):
+    """Arranca ambos servidores en hilos y los devuelve (llamar .shutdown() para detenerlos)."""
+    servidores = [
+        ThreadingHTTPServer((host, puerto_gemini), _handler_gemini(config)),
+        ThreadingHTTPServer((host, puerto_twilio), _handler_twilio(config)),
+    ]
+    for servidor in servidores:
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dobles locales de Gemini y Twilio")
+    parser.add_argument("--puerto-gemini", type=int, default=8790)
+    parser.add_argument("--puerto-twilio", type=int, default=8791)
+    parser.add_argument("--latencia-sql", type=float, default=0.8)
+    parser.add_argument("--latencia-resumen", type=float, default=1.5)
+    parser.add_argument("--latencia-twilio", type=float, default=0.15)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--largo-resumen", type=int, default=900)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = ConfigStubs(args.latencia_sql, args.latencia_resumen, args.latencia_twilio,
+                         args.jitter, args.largo_resumen, args.tasa_error)
+    iniciar_stubs(config, args.puerto_gemini, args.puerto_twilio)
+    print(f"🎭 Gemini en http://127.0.0.1:{args.puerto_gemini}  Twilio en http://127.0.0.1:{args.puerto_twilio}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print(f"\n📊 Llamadas: {config.llamadas}")
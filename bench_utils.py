@@ -0,0 +1,151 @@
+"""
+📐 Utilidades comunes de los benchmarks
+Percentiles, lectura del texto de /metrics (Prometheus), cuantiles de histogramas
+y el envío de mensajes al webhook con el formato de Twilio.
+"""
+
+import math
+import re
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+RE_MUESTRA = re.compile(r'^([a-zA-Z_:][\w:]*)(?:\{(.*)\})?\s+(\S+)$')
+RE_ETIQUETA = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) con interpolación lineal; None si no hay valores."""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    piso, techo = math.floor(k), math.ceil(k)
+    if piso == techo:
+        return ordenados[int(k)]
+    return ordenados[piso] + (ordenados[techo] - ordenados[piso]) * (k - piso)
+
+
+def resumen_latencias(valores):
+    """{n, media, p50, p95, p99, max} en las mismas unidades de entrada."""
+    if not valores:
+        return {"n": 0}
+    return {
+        "n": len(valores),
+        "media": sum(valores) / len(valores),
+        "p50": percentil(valores, 50),
+        "p95": percentil(valores, 95),
+        "p99": percentil(valores, 99),
+        "max": max(valores),
+    }
+
+
+def parsear_metricas(texto):
+    """Convierte el texto de Prometheus en {(nombre, (("etiqueta", "valor"), ...)): valor}."""
+    muestras = {}
+    for linea in texto.splitlines():
+        if not linea or linea.startswith("#"):
+            continue
+        m = RE_MUESTRA.match(linea.strip())
+        if not m:
+            continue
+        nombre, etiquetas, valor = m.groups()
+        pares = tuple(sorted(RE_ETIQUETA.findall(etiquetas or "")))
+        muestras[(nombre, pares)] = float(valor.replace("+Inf", "inf"))
+    return muestras
+
+
+def diferencia_metricas(antes, despues):
+    """Restar dos lecturas de contadores/histogramas (lo ocurrido entre ambas)."""
+    return {k: v - antes.get(k, 0.0) for k, v in despues.items()}
+
+
+def buckets_histograma(muestras, nombre, **filtro):
+    """{le: conteo acumulado} del histograma `nombre` para las etiquetas de `filtro`."""
+    buckets = {}
+    for (metrica, pares), valor in muestras.items():
+        if metrica != f"{nombre}_bucket":
+            continue
+        etiquetas = dict(pares)
+        if any(etiquetas.get(k) != v for k, v in filtro.items()):
+            continue
+        buckets[float(etiquetas["le"].replace("+Inf", "inf"))] = valor
+    return dict(sorted(buckets.items()))
+
+
+def cuantil_histograma(buckets, q):
+    """Estimación de cuantil (0-1) por interpolación lineal entre buckets, como histogram_quantile()."""
+    if not buckets:
+        return None
+    limites = list(buckets.keys())
+    total = buckets[limites[-1]]
+    if total <= 0:
+        return None
+    objetivo = q * total
+    anterior_limite, anterior_conteo = 0.0, 0.0
+    for limite in limites:
+        conteo = buckets[limite]
+        if conteo >= objetivo:
+            if math.isinf(limite):
+                return anterior_limite
+            if conteo == anterior_conteo:
+                return limite
+            return anterior_limite + (limite - anterior_limite) * (objetivo - anterior_conteo) / (conteo - anterior_conteo)
+        anterior_limite, anterior_conteo = limite, conteo
+    return anterior_limite
+
+
+def valores_etiqueta(muestras, nombre, etiqueta):
+    """Valores distintos de `etiqueta` presentes en la métrica `nombre` (o su _bucket)."""
+    valores = set()
+    for (metrica, pares), _ in muestras.items():
+        if metrica in (nombre, f"{nombre}_bucket", f"{nombre}_count"):
+            etiquetas = dict(pares)
+            if etiqueta in etiquetas:
+                valores.add(etiquetas[etiqueta])
+    return sorted(valores)
+
+
+def leer_metricas(url):
+    """Lee y parsea /metrics de una instancia del bot."""
+    with urllib.request.urlopen(url + "/metrics", timeout=10) as r:
+        return parsear_metricas(r.read().decode("utf-8"))
+
+
+def enviar_mensaje(url, telefono, pregunta, timeout):
+    """POST al webhook con el formato de Twilio; devuelve (segundos, estado HTTP, cuerpo)."""
+    datos = urllib.parse.urlencode({
+        "From": telefono,
+        "Body": pregunta,
+        "MessageSid": "SM" + uuid.uuid4().hex,
+    }).encode("utf-8")
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url + "/whatsapp_webhook", data=datos, timeout=timeout) as r:
+            cuerpo = r.read().decode("utf-8", "replace")
+            return time.perf_counter() - inicio, r.status, cuerpo
+    except urllib.error.HTTPError as e:
+        return time.perf_counter() - inicio, e.code, ""
+    except OSError as e:
+        return time.perf_counter() - inicio, 0, str(e)
+
+
+def resumen_etapas(delta):
+    """p50/p95/p99 por etapa estimados de los buckets de mapus_etapa_segundos."""
+    etapas = {}
+    for nombre in valores_etiqueta(delta, "mapus_etapa_segundos", "etapa"):
+        buckets = buckets_histograma(delta, "mapus_etapa_segundos", etapa=nombre)
+        conteo = max(buckets.values()) if buckets else 0
+        if conteo <= 0:
+            continue
+        suma = delta.get(("mapus_etapa_segundos_sum", (("etapa", nombre),)), 0.0)
+        etapas[nombre] = {
+            "n": int(conteo),
+            "media": suma / conteo,
+            "p50": cuantil_histograma(buckets, 0.50),
+            "p95": cuantil_histograma(buckets, 0.95),
+            "p99": cuantil_histograma(buckets, 0.99),
+        }
+    return etapas
@@ -0,0 +1,137 @@
+"""
+🧠 Caché en memoria del historial de conversaciones
+Mantiene por teléfono una ventana circular con las últimas interacciones (LRU sobre usuarios,
+con límite de usuarios y de memoria) para que obtener_historial no consulte la base de datos
+en cada mensaje. Se llena desde la BD la primera vez y se actualiza en cada escritura.
+"""
+
+import os
+import threading
+from collections import OrderedDict, deque
+
+# ============ CONFIGURACIÓN ============
+HISTORIAL_VENTANA = int(os.getenv("HISTORIAL_VENTANA", 5))  # Interacciones por usuario
+HISTORIAL_CACHE_MAX_USUARIOS = int(os.getenv("HISTORIAL_CACHE_MAX_USUARIOS", 2000))
+HISTORIAL_CACHE_MAX_BYTES = int(os.getenv("HISTORIAL_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+CAMPOS = ("mensaje_usuario", "sql_generado", "respuesta_bot", "timestamp")
+
+
+def _tamano(conv):
+    """Tamaño aproximado en bytes de una interacción."""
+    return 64 + sum(len(conv[c]) for c in CAMPOS[:3] if conv.get(c))
+
+
+class _Ventana:
+    __slots__ = ("convs", "completa", "bytes")
+
+    def __init__(self, tamano):
+        self.convs = deque(maxlen=tamano)
+        self.completa = False  # True cuando ya se cargó desde la BD
+        self.bytes = 0
+
+
+class CacheHistorial:
+    """Ventanas circulares por usuario con desalojo LRU."""
+
+    def __init__(self, ventana=HISTORIAL_VENTANA, max_usuarios=HISTORIAL_CACHE_MAX_USUARIOS,
+                 max_bytes=HISTORIAL_CACHE_MAX_BYTES):
+        self.ventana = ventana
+        self.max_usuarios = max_usuarios
+        self.max_bytes = max_bytes
+        self._usuarios = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, telefono, limite):
+        """Devuelve las últimas `limite` interacciones (orden cronológico) o None si hay que ir a la BD."""
+        if limite > self.ventana:
+            return None
+        with self._lock:
+            v = self._usuarios.get(telefono)
+            if v is None or not v.completa:
+                self.fallos += 1
+                return None
+            self._usuarios.move_to_end(telefono)
+            self.aciertos += 1
+            convs = list(v.convs)
+        return convs[-limite:] if limite > 0 else []
+
+    def cargar(self, telefono, desde_bd):
+        """Llena la ventana con lo leído de la BD, conservando escrituras aún no persistidas."""
+        with self._lock:
+            v = self._usuarios.get(telefono)
+            pendientes = list(v.convs) if v else []
+            conocidas = {(c["timestamp"], c["mensaje_usuario"]) for c in desde_bd}
+            combinadas = [dict(c) for c in desde_bd]
+            combinadas += [c for c in pendientes if (c["timestamp"], c["mensaje_usuario"]) not in conocidas]
+            combinadas.sort(key=lambda c: c["timestamp"])
+            nueva = _Ventana(self.ventana)
+            for conv in combinadas:
+                self._agregar(nueva, conv)
+            nueva.completa = True
+            self._reemplazar(telefono, nueva)
+            return list(nueva.convs)
+
+    def agregar(self, telefono, conv):
+        """Registra una interacción recién guardada."""
+        with self._lock:
+            v = self._usuarios.get(telefono)
+            if v is None:
+                # Sin ventana previa: queda incompleta hasta que la BD la complete
+                v = _Ventana(self.ventana)
+                self._agregar(v, conv)
+                self._reemplazar(telefono, v)
+            else:
+                self._bytes -= v.bytes
+                self._agregar(v, conv)
+                self._bytes += v.bytes
+                self._usuarios.move_to_end(telefono)
+                self._desalojar()
+
+    def invalidar(self, telefono=None):
+        """Elimina la ventana de un usuario (o todas)."""
+        with self._lock:
+            if telefono is None:
+                self._usuarios.clear()
+                self._bytes = 0
+            else:
+                v = self._usuarios.pop(telefono, None)
+                if v:
+                    self._bytes -= v.bytes
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "usuarios": len(self._usuarios),
+                "bytes": self._bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+    # ---------- Internos (con lock tomado) ----------
+
+    def _agregar(self, v, conv):
+        if len(v.convs) == v.convs.maxlen:
+            v.bytes -= _tamano(v.convs[0])
+        v.convs.append(conv)
+        v.bytes += _tamano(conv)
+
+    def _reemplazar(self, telefono, v):
+        anterior = self._usuarios.pop(telefono, None)
+        if anterior:
+            self._bytes -= anterior.bytes
+        self._usuarios[telefono] = v
+        self._bytes += v.bytes
+        self._desalojar()
+
+    def _desalojar(self):
+        while self._usuarios and (len(self._usuarios) > self.max_usuarios or self._bytes > self.max_bytes):
+            _, v = self._usuarios.popitem(last=False)
+            self._bytes -= v.bytes
+
+
+# Instancia global usada por main.py
+cache_historial = CacheHistorial()
@@ -0,0 +1,201 @@
+"""
+🐢 Registro de consultas lentas del SQL generado
+ejecutar_sql reporta aquí cada consulta; las que superan SQL_LENTA_MS (o fallan) se guardan
+con su forma canónica, duración, filas y la pregunta que las originó, en un archivo JSONL o
+en la tabla consultas_lentas. La escritura ocurre en un hilo aparte para no frenar el webhook.
+Ver reporte_consultas_lentas.py para el ranking por forma de consulta.
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+
+from log_config import get_logger
+from sql_canonico import canonizar, huella, normalizar
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+SQL_LENTA_MS = float(os.getenv("SQL_LENTA_MS", 500))  # Umbral (0 = registrar todas)
+SQL_LENTAS_DESTINO = os.getenv("SQL_LENTAS_DESTINO", "archivo")  # "archivo" o "tabla"
+SQL_LENTAS_PATH = os.getenv("SQL_LENTAS_PATH", "consultas_lentas.jsonl")
+SQL_LENTAS_COLA_MAX = int(os.getenv("SQL_LENTAS_COLA_MAX", 1000))
+
+COLUMNAS = ("timestamp", "huella", "sql_canonico", "sql", "duracion_ms", "filas", "pregunta", "error")
+
+SQL_CREAR_TABLA = """
+    CREATE TABLE IF NOT EXISTS consultas_lentas (
+        id SERIAL PRIMARY KEY,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        huella TEXT NOT NULL,
+        sql_canonico TEXT NOT NULL,
+        sql TEXT,
+        duracion_ms REAL NOT NULL,
+        filas INTEGER,
+        pregunta TEXT,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_consultas_lentas_huella ON consultas_lentas (huella, timestamp DESC);
+"""
+
+SQL_INSERT = f"INSERT INTO consultas_lentas ({', '.join(COLUMNAS)}) VALUES %s"
+
+_FIN = object()
+
+
+class RegistroConsultasLentas:
+    """Filtra por umbral y persiste las consultas lentas desde un hilo en segundo plano."""
+
+    def __init__(self, umbral_ms=SQL_LENTA_MS, destino=SQL_LENTAS_DESTINO, ruta=SQL_LENTAS_PATH,
+                 cola_max=SQL_LENTAS_COLA_MAX):
+        self.umbral_ms = umbral_ms
+        self.destino = destino
+        self.ruta = ruta
+        self.descartadas = 0
+        self._cola = queue.Queue(maxsize=cola_max)
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._tabla_lista = False
+
+    def registrar(self, sql, duracion, filas=None, pregunta=None, error=None):
+        """
+        Reporta una ejecución (duración en segundos). Devuelve True si quedó registrada.
+        La forma canónica se calcula solo para las consultas que superan el umbral.
+        """
+        duracion_ms = duracion * 1000
+        if duracion_ms < self.umbral_ms and not error:
+            return False
+        normal = normalizar(sql)
+        canonico = canonizar(normal)
+        registro = (datetime.now(), huella(canonico), canonico, normal, round(duracion_ms, 2),
+                    filas, pregunta, error)
+        self._iniciar()
+        try:
+            self._cola.put_nowait(registro)
+        except queue.Full:
+            self.descartadas += 1
+            return False
+        return True
+
+    def detener(self, timeout=5):
+        if self._hilo and self._hilo.is_alive():
+            self._cola.put(_FIN)
+            self._hilo.join(timeout)
+
+    # ---------- Hilo escritor ----------
+
+    def _iniciar(self):
+        with self._lock:
+            if self._hilo and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="consultas-lentas", daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        fin = False
+        while not fin:
+            lote = [self._cola.get()]
+            # Lo que ya esté en cola sale en el mismo lote
+            while len(lote) < 100:
+                try:
+                    lote.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            if any(r is _FIN for r in lote):
+                fin = True
+                lote = [r for r in lote if r is not _FIN]
+            if lote:
+                self._persistir(lote)
+
+    def _persistir(self, lote):
+        if self.destino == "tabla":
+            try:
+                self._insertar(lote)
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudieron guardar {len(lote)} consultas lentas en la tabla, "
+                               f"se guardan en {self.ruta}: {e}")
+        try:
+            self._escribir_archivo(lote)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron guardar {len(lote)} consultas lentas: {e}")
+
+    def _insertar(self, lote):
+        from psycopg2.extras import execute_values
+        from db_config import get_db_connection
+
+        conn = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            if not self._tabla_lista:
+                cursor.execute(SQL_CREAR_TABLA)
+                self._tabla_lista = True
+            execute_values(cursor, SQL_INSERT, lote, page_size=max(len(lote), 1))
+            conn.commit()
+            cursor.close()
+        except Exception:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                conn.close()
+
+    def _escribir_archivo(self, lote):
+        with open(self.ruta, "a", encoding="utf-8") as f:
+            for fila in lote:
+                registro = dict(zip(COLUMNAS, fila))
+                registro["timestamp"] = fila[0].isoformat()
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+
+def leer_consultas_lentas(destino=SQL_LENTAS_DESTINO, ruta=SQL_LENTAS_PATH, desde=None):
+    """
+    Devuelve los registros (dicts con COLUMNAS) del archivo o de la tabla.
+
+    Args:
+        destino (str): "archivo" o "tabla"
+        ruta (str): Archivo JSONL (si destino es "archivo")
+        desde (datetime): Solo registros posteriores
+    """
+    if destino == "tabla":
+        from db_config import get_db_connection
+        from psycopg2.extras import RealDictCursor
+
+        conn = None
+        try:
+            conn = get_db_connection(lectura=True)
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                f"SELECT {', '.join(COLUMNAS)} FROM consultas_lentas WHERE timestamp >= %s",
+                (desde or datetime.min,),
+            )
+            registros = cursor.fetchall()
+            cursor.close()
+            return registros
+        finally:
+            if conn:
+                conn.close()
+
+    registros = []
+    if not os.path.exists(ruta):
+        return registros
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            registro = json.loads(linea)
+            registro["timestamp"] = datetime.fromisoformat(registro["timestamp"])
+            if desde and registro["timestamp"] < desde:
+                continue
+            registros.append(registro)
+    return registros
+
+
+# Instancia global usada por main.py
+consultas_lentas = RegistroConsultasLentas()
+atexit.register(consultas_lentas.detener)
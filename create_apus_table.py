@@ -0,0 +1,69 @@
+"""
+Script para crear la tabla apus (misma estructura y orden de columnas que el CSV de APUs)
+"""
+
+from db_config import get_db_connection
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+COLUMNAS_APUS = [
+    "fecha_aprobacion_apu", "fecha_analisis_apu",
+    "ciudad", "pais", "entidad", "contratista", "nombre_proyecto",
+    "numero_contrato", "item", "items_descripcion", "item_unidad",
+    "precio_unitario", "precio_unitario_sin_aiu",
+    "codigo_insumo", "tipo_insumo", "insumo_descripcion",
+    "insumo_unidad", "rendimiento_insumo",
+    "precio_unitario_apu", "precio_parcial_apu",
+    "observacion", "link_documento",
+]
+
+SQL_CREAR_APUS = """
+    CREATE TABLE IF NOT EXISTS apus (
+        id SERIAL PRIMARY KEY,
+        fecha_aprobacion_apu DATE,
+        fecha_analisis_apu DATE,
+        ciudad TEXT,
+        pais TEXT,
+        entidad TEXT,
+        contratista TEXT,
+        nombre_proyecto TEXT,
+        numero_contrato TEXT,
+        item TEXT,
+        items_descripcion TEXT,
+        item_unidad TEXT,
+        precio_unitario NUMERIC,
+        precio_unitario_sin_aiu NUMERIC,
+        codigo_insumo TEXT,
+        tipo_insumo TEXT,
+        insumo_descripcion TEXT,
+        insumo_unidad TEXT,
+        rendimiento_insumo NUMERIC,
+        precio_unitario_apu NUMERIC,
+        precio_parcial_apu NUMERIC,
+        observacion TEXT,
+        link_documento TEXT
+    )
+"""
+
+def create_apus_table():
+    """Crea la tabla apus si no existe."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(SQL_CREAR_APUS)
+        conn.commit()
+        cursor.close()
+        logger.info("✅ Tabla apus creada exitosamente")
+
+    except Exception as e:
+        logger.error(f"❌ Error creando tabla: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    create_apus_table()
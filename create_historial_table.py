@@ -1,8 +1,13 @@
 """
 Script para crear la tabla de historial de conversaciones
+(particionada por mes; ver particiones_historial.py para migrar una tabla existente)
 """
 
 from db_config import get_db_connection
+from particiones_historial import crear_tabla_particionada, asegurar_particiones
+from log_config import get_logger
+
+logger = get_logger(__name__)
 
 def create_historial_table():
     """Crea la tabla historial_conversaciones si no existe."""
@@ -11,30 +16,19 @@ def create_historial_table():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Crear tabla de historial
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS historial_conversaciones (
-                id SERIAL PRIMARY KEY,
-                telefono VARCHAR(50) NOT NULL,
-                mensaje_usuario TEXT NOT NULL,
-                sql_generado TEXT,
-                respuesta_bot TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Crear índice para optimizar búsquedas por teléfono y fecha
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_telefono_timestamp 
-            ON historial_conversaciones (telefono, timestamp DESC)
-        """)
+        # Crear tabla de historial particionada por rango de timestamp,
+        # con índice (telefono, timestamp DESC) en cada partición
+        crear_tabla_particionada(cursor)
         
         conn.commit()
         cursor.close()
-        print("✅ Tabla historial_conversaciones creada exitosamente")
+        logger.info("✅ Tabla historial_conversaciones creada exitosamente")
+        
+        # Particiones del mes actual y de los próximos meses (una transacción por mes)
+        asegurar_particiones()
         
     except Exception as e:
-        print(f"❌ Error creando tabla: {e}")
+        logger.error(f"❌ Error creando tabla: {e}")
         if conn:
             conn.rollback()
     finally:
@@ -0,0 +1,67 @@
+"""
+Script para agregar la restricción UNIQUE (telefono) a la tabla usuarios.
+Es requisito del upsert masivo de load_users.py (INSERT ... ON CONFLICT (telefono)).
+"""
+
+from db_config import get_db_connection
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+CONSTRAINT_NAME = "usuarios_telefono_key"
+
+
+def create_usuarios_constraint():
+    """Crea la restricción única sobre usuarios.telefono si no existe."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        # ¿Ya existe una restricción o índice único sobre telefono?
+        cursor.execute("""
+            SELECT 1
+            FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = 'usuarios'::regclass
+              AND i.indisunique
+              AND i.indnatts = 1
+              AND a.attname = 'telefono'
+        """)
+        if cursor.fetchone():
+            logger.info("✅ La tabla usuarios ya tiene una restricción única sobre telefono")
+            cursor.close()
+            return
+
+        # Verificar duplicados antes de crear la restricción
+        cursor.execute("""
+            SELECT telefono, COUNT(*) AS total
+            FROM usuarios
+            GROUP BY telefono
+            HAVING COUNT(*) > 1
+        """)
+        duplicados = cursor.fetchall()
+        if duplicados:
+            logger.error(
+                f"❌ Hay {len(duplicados)} teléfonos duplicados en usuarios. Corrígelos antes de migrar",
+                extra={"campos": {"duplicados": {telefono: total for telefono, total in duplicados}}},
+            )
+            cursor.close()
+            return
+
+        cursor.execute(f"ALTER TABLE usuarios ADD CONSTRAINT {CONSTRAINT_NAME} UNIQUE (telefono)")
+        conn.commit()
+        cursor.close()
+        logger.info(f"✅ Restricción {CONSTRAINT_NAME} creada exitosamente")
+
+    except Exception as e:
+        logger.error(f"❌ Error creando restricción: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    create_usuarios_constraint()
@@ -0,0 +1,138 @@
+"""
+🧪 Datos sintéticos de APUs
+Genera filas realistas de la tabla apus (proyecto -> ítems -> insumos, una fila por insumo)
+de forma determinista a partir de una semilla, para benchmarks sin el CSV privado.
+"""
+
+import random
+import zlib
+from datetime import date, timedelta
+
+CIUDADES = [
+    ("Bogotá", "Colombia"), ("Medellín", "Colombia"), ("Cali", "Colombia"),
+    ("Barranquilla", "Colombia"), ("Cartagena", "Colombia"), ("Bucaramanga", "Colombia"),
+    ("Pereira", "Colombia"), ("Manizales", "Colombia"), ("Villavicencio", "Colombia"),
+    ("Santa Marta", "Colombia"), ("Quito", "Ecuador"), ("Lima", "Perú"),
+]
+
+ENTIDADES = [
+    "Instituto de Desarrollo Urbano", "Empresa de Acueducto", "Gobernación", "Alcaldía Municipal",
+    "Agencia Nacional de Infraestructura", "Secretaría de Educación", "Empresa Metro",
+]
+
+CONTRATISTAS = [
+    "Consorcio Vías del Norte", "Constructora Andina S.A.S.", "Unión Temporal Macarena",
+    "Ingeniería y Obras Ltda.", "Consorcio Puentes 2023", "Obras Civiles del Caribe S.A.",
+]
+
+PROYECTOS = [
+    "La Macarena", "Metro Línea 2", "Vía Norte", "Túnel Sur", "Colegio San José", "Parque Lineal",
+    "Hospital Regional", "Acueducto Veredal", "Puente El Tablazo", "Ciclorruta Calle 80",
+    "Alcantarillado Sector 4", "Plaza de Mercado", "Estación Intermedia", "Malecón del Río",
+]
+
+ITEMS = [
+    ("Excavación manual en material común", "m3", 35000),
+    ("Excavación mecánica", "m3", 18000),
+    ("Relleno compactado con material seleccionado", "m3", 62000),
+    ("Concreto de 3000 psi para zapatas", "m3", 780000),
+    ("Concreto de 4000 psi para columnas", "m3", 920000),
+    ("Concreto de 5000 psi para placas", "m3", 1050000),
+    ("Acero de refuerzo 60000 psi", "kg", 6200),
+    ("Mampostería en bloque de arcilla", "m2", 85000),
+    ("Pañete liso sobre muros", "m2", 32000),
+    ("Pintura en vinilo tipo 1", "m2", 18000),
+    ("Tubería PVC sanitaria 6\"", "ml", 95000),
+    ("Sub-base granular", "m3", 120000),
+    ("Base granular", "m3", 140000),
+    ("Mezcla asfáltica MDC-19", "m3", 680000),
+    ("Demolición de pavimento rígido", "m2", 45000),
+    ("Cerramiento provisional en polisombra", "ml", 28000),
+]
+
+INSUMOS = {
+    "MATERIAL": [
+        ("Cemento gris portland", "kg", 850), ("Arena de río", "m3", 95000), ("Grava triturada", "m3", 110000),
+        ("Agua", "l", 15), ("Bloque de arcilla No. 5", "und", 1800), ("Acero corrugado", "kg", 4800),
+        ("Alambre negro", "kg", 7500), ("Tubo PVC 6\"", "ml", 52000), ("Vinilo tipo 1", "gal", 78000),
+        ("Asfalto AC 60-70", "kg", 3200), ("Material seleccionado", "m3", 48000),
+    ],
+    "MANO DE OBRA": [
+        ("Cuadrilla AA (1 oficial + 2 ayudantes)", "hc", 68000), ("Cuadrilla BA (1 oficial + 1 ayudante)", "hc", 45000),
+        ("Ayudante", "hc", 18000), ("Oficial de obra", "hc", 27000),
+    ],
+    "EQUIPO": [
+        ("Herramienta menor", "%", 5), ("Mezcladora de concreto", "día", 85000), ("Vibrador de concreto", "día", 55000),
+        ("Retroexcavadora", "h", 150000), ("Vibrocompactador", "h", 130000), ("Formaleta metálica", "m2", 12000),
+    ],
+    "TRANSPORTE": [
+        ("Volqueta 7 m3", "viaje", 180000), ("Transporte de materiales", "m3-km", 1800),
+    ],
+}
+
+
+def filas_apus_sinteticas(filas=10000, proyectos=20, semilla=42):
+    """
+    Genera filas de apus en el orden de COLUMNAS_APUS (create_apus_table.py).
+
+    Args:
+        filas (int): Número total de filas (una por insumo)
+        proyectos (int): Número de proyectos distintos
+        semilla (int): Semilla para que los datos sean reproducibles
+
+    Yields:
+        tuple: Fila lista para insertar (fechas como date, precios como float)
+    """
+    rnd = random.Random(semilla)
+    catalogo = []
+    for p in range(proyectos):
+        ciudad, pais = rnd.choice(CIUDADES)
+        nombre = PROYECTOS[p % len(PROYECTOS)] + ("" if p < len(PROYECTOS) else f" Etapa {p // len(PROYECTOS) + 1}")
+        aprobacion = date(2019, 1, 1) + timedelta(days=rnd.randint(0, 6 * 365))
+        catalogo.append({
+            "ciudad": ciudad,
+            "pais": pais,
+            "entidad": rnd.choice(ENTIDADES),
+            "contratista": rnd.choice(CONTRATISTAS),
+            "nombre_proyecto": nombre,
+            "numero_contrato": f"{rnd.randint(100, 999)}-{aprobacion.year}",
+            "fecha_aprobacion_apu": aprobacion,
+            "fecha_analisis_apu": aprobacion - timedelta(days=rnd.randint(5, 90)),
+            "factor": rnd.uniform(0.8, 1.3),  # Nivel de precios del proyecto
+        })
+
+    generadas = 0
+    numero_item = 0
+    while generadas < filas:
+        proyecto = catalogo[numero_item % len(catalogo)]
+        numero_item += 1
+        descripcion, unidad, base = rnd.choice(ITEMS)
+        # Inflación aproximada del 8% anual sobre 2019
+        anios = proyecto["fecha_aprobacion_apu"].year - 2019
+        precio_item = base * proyecto["factor"] * (1.08 ** anios) * rnd.uniform(0.9, 1.1)
+
+        insumos = []
+        for tipo in ("MATERIAL", "MANO DE OBRA", "EQUIPO", "TRANSPORTE"):
+            for _ in range(rnd.randint(1, 3) if tipo == "MATERIAL" else rnd.randint(0, 1) + (tipo == "MANO DE OBRA")):
+                insumos.append((tipo,) + rnd.choice(INSUMOS[tipo]))
+        parciales = [rnd.uniform(0.5, 3) for _ in insumos]
+        escala = precio_item / 1.25 / sum(parciales)
+
+        for (tipo, nombre_insumo, unidad_insumo, precio_insumo), peso in zip(insumos, parciales):
+            if generadas >= filas:
+                break
+            precio_insumo = precio_insumo * proyecto["factor"] * rnd.uniform(0.95, 1.05)
+            parcial = peso * escala
+            rendimiento = parcial / precio_insumo if precio_insumo else 0
+            yield (
+                proyecto["fecha_aprobacion_apu"], proyecto["fecha_analisis_apu"],
+                proyecto["ciudad"], proyecto["pais"], proyecto["entidad"], proyecto["contratista"],
+                proyecto["nombre_proyecto"], proyecto["numero_contrato"],
+                f"{numero_item // 100 + 1}.{numero_item % 100:02d}", descripcion, unidad,
+                round(precio_item, 2), round(precio_item / 1.25, 2),
+                f"{tipo[:3]}-{zlib.crc32(nombre_insumo.encode()) % 10000:04d}", tipo, nombre_insumo,
+                unidad_insumo, round(rendimiento, 4),
+                round(precio_insumo, 2), round(parcial, 2),
+                None, f"https://documentos.example.com/apu/{numero_item}.pdf",
+            )
+            generadas += 1
@@ -1,16 +1,63 @@
 """
 🗄️ Database Configuration Module
 Centralizes database connection logic for PostgreSQL (Google Cloud SQL)
+
+Read replicas (optional): DB_READ_HOSTS="host1,host2:5433" lists read endpoints. Connections
+requested with lectura=True go to a healthy replica whose replication lag is below
+DB_REPLICA_LAG_MAX; everything else (writes, LISTEN, DDL) goes to the primary. A key
+marked with registrar_escritura() reads from the primary for DB_RYW_VENTANA seconds
+(read-your-writes for a user's history right after it was written).
+
+Pooling and prepared statements: connections are kept in a per-endpoint pool (DB_POOL_MAX idle
+connections) and conn.close() returns them to it. Fixed queries registered with
+registrar_sentencia() are PREPAREd once per pooled connection and run with EXECUTE; generated
+SQL is split into shape + literals (sql_canonico.parametrizar) so repeated shapes reuse the
+same prepared statement and its cached plan.
 """
 
+import itertools
+import math
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
 import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
+from log_config import get_logger
+from metricas import BD_CONEXIONES, BD_SENTENCIAS
+from resiliencia import interruptores, restante
+from sql_canonico import huella, parametrizar
+
 # Load environment variables
 load_dotenv()
 
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+DB_READ_HOSTS = os.getenv("DB_READ_HOSTS", "")
+DB_REPLICA_LAG_MAX = float(os.getenv("DB_REPLICA_LAG_MAX", 30))  # Seconds of lag tolerated
+DB_REPLICA_CHEQUEO = float(os.getenv("DB_REPLICA_CHEQUEO", 15))  # Health/lag check interval
+DB_RYW_VENTANA = float(os.getenv("DB_RYW_VENTANA", DB_REPLICA_LAG_MAX + 5))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))  # Idle connections kept per endpoint (0 = no pooling)
+DB_POOL_INACTIVA = float(os.getenv("DB_POOL_INACTIVA", 300))  # Idle connections older than this are closed
+DB_POOL_EDAD_MAX = float(os.getenv("DB_POOL_EDAD_MAX", 1800))  # Connections are recycled after this
+DB_PREPARAR_GENERADAS = os.getenv("DB_PREPARAR_GENERADAS", "1") == "1"
+DB_PREPARADAS_MAX = int(os.getenv("DB_PREPARADAS_MAX", 100))  # Generated shapes prepared per connection
+
+# 0 when the replica has replayed everything it received (an idle primary makes
+# now() - pg_last_xact_replay_timestamp() grow even without real lag)
+SQL_LAG_REPLICA = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
 
 class DatabaseConfig:
     """Database configuration singleton"""
@@ -23,6 +70,7 @@ class DatabaseConfig:
         self.password = os.getenv("DB_PASSWORD")
         self.sslmode = os.getenv("DB_SSLMODE", "prefer")
         self.cloud_sql_connection_name = os.getenv("CLOUD_SQL_CONNECTION_NAME")
+        self.connect_timeout = int(os.getenv("DB_CONNECT_TIMEOUT", 5))
     
     def validate(self):
         """Validate that all required configuration is present"""
@@ -41,15 +89,26 @@ class DatabaseConfig:
                 f"Please check your .env file."
             )
     
-    def get_connection_params(self):
-        """Get connection parameters as a dictionary"""
+    def get_connection_params(self, replica=None):
+        """Get connection parameters as a dictionary (for the primary or the given replica)"""
+        if replica is not None:
+            return {
+                "host": replica.host,
+                "port": replica.port,
+                "dbname": self.name,
+                "user": self.user,
+                "password": self.password,
+                "sslmode": self.sslmode,
+                "connect_timeout": self.connect_timeout
+            }
         if self.cloud_sql_connection_name:
             # Use Unix socket for Cloud SQL Auth Proxy
             return {
                 "user": self.user,
                 "password": self.password,
                 "dbname": self.name,
-                "host": f"/cloudsql/{self.cloud_sql_connection_name}"
+                "host": f"/cloudsql/{self.cloud_sql_connection_name}",
+                "connect_timeout": self.connect_timeout
             }
         else:
             # Use TCP/IP connection
@@ -60,33 +119,385 @@ class DatabaseConfig:
                 "user": self.user,
                 "password": self.password,
                 "sslmode": self.sslmode,
-                "connect_timeout": 30
+                "connect_timeout": self.connect_timeout
             }
 
 
+class ConexionReutilizable(psycopg2.extensions.connection):
+    """Connection whose close() hands it back to its pool; remembers what it has PREPAREd."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.creada = time.monotonic()
+        self.preparadas = set()  # Registered statements
+        self.generadas = OrderedDict()  # Generated SQL shapes, in LRU order
+        self._pool = None
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        if pool is None or not pool.devolver(self):
+            super().close()
+
+
+class PoolConexiones:
+    """Idle connections of one endpoint (primary or replica), reused LIFO."""
+
+    def __init__(self, nombre, maximo=DB_POOL_MAX, interruptor=None):
+        self.nombre = nombre
+        self.maximo = maximo
+        self.interruptor = interruptor  # Circuit breaker told how each returned connection fared
+        self._libres = []  # (connection, idle since)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def sacar(self):
+        """An idle connection, or None if a new one has to be opened."""
+        ahora = time.monotonic()
+        with self._lock:
+            self._revisar_fork()
+            while self._libres:
+                conn, desde = self._libres.pop()
+                if ahora - desde < DB_POOL_INACTIVA and not conn.closed:
+                    conn._pool = self
+                    return conn
+                conn._pool = None
+                conn.close()
+        return None
+
+    def adoptar(self, conn):
+        """Marks a freshly opened connection as belonging to this pool."""
+        if self.maximo > 0 and isinstance(conn, ConexionReutilizable):
+            conn._pool = self
+        return conn
+
+    def devolver(self, conn):
+        """Keeps the connection for reuse; False means the caller must really close it."""
+        if conn.closed:
+            # closed == 2: the server went away while the connection was in use
+            self._informar(conn.closed != 2)
+            return False
+        if conn.autocommit or os.getpid() != self._pid or time.monotonic() - conn.creada > DB_POOL_EDAD_MAX:
+            self._informar(True)
+            return False
+        try:
+            # Abandoned transactions must not leak into the next user (SET LOCAL ends here too)
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._informar(False)
+            return False
+        self._informar(True)
+        with self._lock:
+            if len(self._libres) >= self.maximo:
+                return False
+            self._libres.append((conn, time.monotonic()))
+        return True
+
+    def libres(self):
+        return len(self._libres)
+
+    def _informar(self, sana):
+        # Pooled connections skip connect(): their queries are what tells the breaker Postgres is up
+        if self.interruptor is None:
+            return
+        if sana:
+            self.interruptor.exito()
+        else:
+            self.interruptor.fallo()
+
+    def sacar_todas(self):
+        """Closes the idle connections (the endpoint went down)."""
+        with self._lock:
+            libres, self._libres = self._libres, []
+        for conn, _ in libres:
+            conn._pool = None
+            conn.close()
+
+    def _revisar_fork(self):
+        # A forked worker must not share sockets with its parent: drop them without closing
+        if os.getpid() != self._pid:
+            self._libres = []
+            self._pid = os.getpid()
+
+
+# ============ PREPARED STATEMENTS ============
+
+# name -> SQL with %s placeholders (psycopg2 style)
+SENTENCIAS = {}
+# Generated shapes the server refused to prepare (they run as plain SQL)
+_no_preparables = set()
+
+
+def registrar_sentencia(nombre, sql):
+    """Registers a fixed query (with %s placeholders) to be PREPAREd on each pooled connection."""
+    SENTENCIAS[nombre] = sql
+
+
+def _a_parametros_servidor(sql):
+    """'... = %s LIMIT %s' -> '... = $1 LIMIT $2' (%% stays a literal %)."""
+    contador = itertools.count(1)
+    return re.sub(r"%(%|s)", lambda m: "%" if m.group(1) == "%" else f"${next(contador)}", sql)
+
+
+def preparar(cursor, nombre):
+    """
+    SQL to run the registered statement `nombre` on this cursor's connection: "EXECUTE nombre
+    (%s, ...)" on pooled connections (preparing it the first time), the plain query otherwise.
+    """
+    sql = SENTENCIAS[nombre]
+    preparadas = getattr(cursor.connection, "preparadas", None)
+    if preparadas is None:
+        return sql
+    if nombre not in preparadas:
+        cursor.execute(f"PREPARE {nombre} AS {_a_parametros_servidor(sql)}")
+        preparadas.add(nombre)
+        BD_SENTENCIAS.inc(tipo="fija", resultado="preparada")
+    else:
+        BD_SENTENCIAS.inc(tipo="fija", resultado="reutilizada")
+    n = sum(1 for m in re.finditer(r"%(%|s)", sql) if m.group(1) == "s")
+    return f"EXECUTE {nombre} ({', '.join(['%s'] * n)})" if n else f"EXECUTE {nombre}"
+
+
+def ejecutar_preparada(cursor, nombre, params=None):
+    """cursor.execute() of a registered statement (see registrar_sentencia)."""
+    cursor.execute(preparar(cursor, nombre), params)
+
+
+def ejecutar_generada(cursor, sql):
+    """
+    Runs generated read-only SQL. On pooled connections its literals become parameters of a
+    prepared statement named after the query shape, so repeated shapes skip parsing and
+    planning; shapes the server cannot prepare run as plain SQL.
+    """
+    generadas = getattr(cursor.connection, "generadas", None)
+    forma = parametrizar(sql) if generadas is not None and DB_PREPARAR_GENERADAS else None
+    if forma is None:
+        cursor.execute(sql)
+        return
+    texto, valores = forma
+    nombre = f"g_{huella(texto)}"
+    if nombre in _no_preparables:
+        cursor.execute(sql)
+        return
+    if nombre in generadas:
+        generadas.move_to_end(nombre)
+        BD_SENTENCIAS.inc(tipo="generada", resultado="reutilizada")
+    else:
+        # Savepoint: a failed PREPARE must not abort the transaction (statement_timeout is set in it)
+        cursor.execute("SAVEPOINT preparar")
+        try:
+            cursor.execute(f"PREPARE {nombre} AS {texto}")
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT preparar")
+            if len(_no_preparables) < 10000:
+                _no_preparables.add(nombre)
+            BD_SENTENCIAS.inc(tipo="generada", resultado="fallida")
+            logger.info(f"ℹ️ Generated SQL shape {nombre} not preparable, running it as-is: {e}")
+            cursor.execute(sql)
+            return
+        cursor.execute("RELEASE SAVEPOINT preparar")
+        generadas[nombre] = True
+        BD_SENTENCIAS.inc(tipo="generada", resultado="preparada")
+        if len(generadas) > DB_PREPARADAS_MAX:
+            viejo, _ = generadas.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {viejo}")
+    marcas = ", ".join(["%s"] * len(valores))
+    cursor.execute(f"EXECUTE {nombre} ({marcas})" if valores else f"EXECUTE {nombre}", valores)
+
+
+class Replica:
+    """A read endpoint and its last observed state."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sana = True
+        self.lag = 0.0
+        self.ultimo_chequeo = 0.0
+        self.pool = PoolConexiones(f"{host}:{port}")
+
+    @property
+    def nombre(self):
+        return f"{self.host}:{self.port}"
+
+    def disponible(self):
+        return self.sana and self.lag <= DB_REPLICA_LAG_MAX
+
+
+def parsear_replicas(texto, puerto_defecto):
+    """'host1,host2:5433' -> [Replica]. Socket paths (starting with /) keep the default port."""
+    replicas = []
+    for parte in (texto or "").split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        host, _, puerto = parte.rpartition(":") if ":" in parte and not parte.startswith("/") else (parte, "", "")
+        replicas.append(Replica(host, int(puerto) if puerto else puerto_defecto))
+    return replicas
+
+
+class EnrutadorLecturas:
+    """Chooses the endpoint for each connection and keeps replica health up to date."""
+
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self._turno = itertools.count()
+        self._escrituras = {}  # key -> monotonic time of the last write
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    def registrar_escritura(self, clave):
+        with self._lock:
+            self._escrituras[clave] = time.monotonic()
+            if len(self._escrituras) > 10000:
+                limite = time.monotonic() - DB_RYW_VENTANA
+                self._escrituras = {c: t for c, t in self._escrituras.items() if t > limite}
+
+    def escrito_recientemente(self, clave):
+        if clave is None:
+            return False
+        with self._lock:
+            momento = self._escrituras.get(clave)
+        return momento is not None and time.monotonic() - momento < DB_RYW_VENTANA
+
+    def elegir(self, clave=None):
+        """Replica for a read, or None to use the primary."""
+        if not self.replicas or self.escrito_recientemente(clave):
+            return None
+        self._iniciar_chequeos()
+        disponibles = [r for r in self.replicas if r.disponible()]
+        if not disponibles:
+            return None
+        return disponibles[next(self._turno) % len(disponibles)]
+
+    def marcar_caida(self, replica, error):
+        replica.pool.sacar_todas()
+        if replica.sana:
+            logger.warning(f"⚠️ Replica {replica.nombre} unavailable, reads go to the primary: {error}")
+        replica.sana = False
+
+    # ---------- Health / lag checks ----------
+
+    def _iniciar_chequeos(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="replicas-bd", daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            for replica in self.replicas:
+                self.chequear(replica)
+            time.sleep(DB_REPLICA_CHEQUEO)
+
+    def chequear(self, replica):
+        """Connects to the replica and refreshes its health and lag."""
+        params = db_config.get_connection_params(replica)
+        params["connect_timeout"] = max(2, min(params.get("connect_timeout", 5), 5))
+        conn = None
+        try:
+            conn = psycopg2.connect(**params)
+            cursor = conn.cursor()
+            cursor.execute(SQL_LAG_REPLICA)
+            lag = float(cursor.fetchone()[0] or 0)
+            cursor.close()
+            if not replica.sana or (lag > DB_REPLICA_LAG_MAX) != (replica.lag > DB_REPLICA_LAG_MAX):
+                logger.info(f"🔁 Replica {replica.nombre}: up, lag {lag:.1f}s")
+            replica.sana, replica.lag = True, lag
+        except Exception as e:
+            self.marcar_caida(replica, e)
+        finally:
+            replica.ultimo_chequeo = time.monotonic()
+            if conn:
+                conn.close()
+
+    def estado(self):
+        return [{"replica": r.nombre, "sana": r.sana, "lag": round(r.lag, 2)} for r in self.replicas]
+
+
 # Global configuration instance
 db_config = DatabaseConfig()
+pool_primaria = PoolConexiones("primaria", interruptor=interruptores["postgres"])
+lecturas = EnrutadorLecturas(parsear_replicas(DB_READ_HOSTS, db_config.port))
+
+
+def registrar_escritura(clave):
+    """Reads for `clave` (e.g. a phone number) use the primary for the next DB_RYW_VENTANA seconds."""
+    lecturas.registrar_escritura(clave)
 
 
-def get_db_connection():
+def get_db_connection(lectura=False, clave=None):
     """
-    Create and return a new database connection.
-    
+    Return a database connection (reused from the pool when one is idle).
+    conn.close() hands pooled connections back instead of closing them.
+
+    Args:
+        lectura (bool): Read-only work that may be served by a replica (DB_READ_HOSTS)
+        clave (str, optional): Read-your-writes key; recent writes for it force the primary
+
     Returns:
         psycopg2.connection: Active database connection
         
     Raises:
         ValueError: If database configuration is invalid
+        CircuitoAbierto: If recent connection attempts failed (fails fast until the probe succeeds)
         psycopg2.Error: If connection fails
     """
     db_config.validate()
-    params = db_config.get_connection_params()
-    
+    if lectura:
+        replica = lecturas.elegir(clave)
+        if replica is not None:
+            try:
+                return _conectar_replica(replica)
+            except Exception as e:
+                lecturas.marcar_caida(replica, e)
+                BD_CONEXIONES.inc(destino="primaria_respaldo")
+    else:
+        BD_CONEXIONES.inc(destino="primaria")
+    # Checked before the pool too: during an outage idle connections are dead and must fail fast
+    interruptor = pool_primaria.interruptor
+    interruptor.permitir()
+    params = {}
     try:
-        conn = psycopg2.connect(**params)
-        return conn
+        conn = pool_primaria.sacar()
+        if conn is not None:
+            # exito()/fallo() when it comes back through conn.close()
+            return conn
+        params = db_config.get_connection_params()
+        # Never wait longer than what is left of the current message's deadline (libpq minimum is 2s)
+        queda = restante()
+        if queda is not None:
+            params["connect_timeout"] = max(2, min(params["connect_timeout"], math.ceil(queda)))
+        conn = psycopg2.connect(connection_factory=ConexionReutilizable, **params)
+        interruptor.exito()
+        return pool_primaria.adoptar(conn)
     except psycopg2.Error as e:
+        interruptor.fallo()
+        logger.error(f"❌ Failed to connect to database: {e}", extra={"campos": {"host": params.get("host")}})
         raise Exception(f"Failed to connect to database: {e}")
+    except BaseException:
+        # Not Postgres' fault (bad config, interrupted): release a half-open probe without judging
+        interruptor.liberar()
+        raise
+
+
+def _conectar_replica(replica):
+    conn = replica.pool.sacar()
+    if conn is not None:
+        BD_CONEXIONES.inc(destino="replica")
+        return conn
+    params = db_config.get_connection_params(replica)
+    queda = restante()
+    if queda is not None:
+        params["connect_timeout"] = max(2, min(params["connect_timeout"], math.ceil(queda)))
+    conn = psycopg2.connect(connection_factory=ConexionReutilizable, **params)
+    # Replicas reject writes anyway; read-only makes the intent explicit and skips write checks
+    conn.set_session(readonly=True)
+    BD_CONEXIONES.inc(destino="replica")
+    return replica.pool.adoptar(conn)
 
 
 def execute_query(query, params=None, fetch=True, dict_cursor=True):
@@ -127,6 +538,7 @@ def execute_query(query, params=None, fetch=True, dict_cursor=True):
     except Exception as e:
         if conn:
             conn.rollback()
+        logger.warning(f"⚠️ Query execution failed: {e}")
         raise Exception(f"Query execution failed: {e}")
     finally:
         if conn:
@@ -154,6 +566,7 @@ def test_connection():
             "version": version
         }
     except Exception as e:
+        logger.error(f"❌ Connection test failed: {e}")
         return {
             "status": "error",
             "message": str(e)
@@ -0,0 +1,296 @@
+"""
+🔎 Ejemplos pregunta → SQL recuperados por similitud
+En vez de mandar a Gemini el bloque fijo con todas las reglas y ejemplos, el prompt lleva un
+esquema compacto y solo los EJEMPLOS_K pares más parecidos a la pregunta, tomados de las
+interacciones exitosas de historial_conversaciones (SQL ejecutado con resultados).
+
+El índice es TF-IDF en Python puro (palabras + trigramas de caracteres, tolera tildes y errores
+de tipeo), en memoria. Se reconstruye cada EJEMPLOS_REFRESCO_S y suma en caliente cada
+interacción exitosa nueva.
+
+Revisar la recuperación:
+    python ejemplos_sql.py "precio del concreto en medellín"
+    python ejemplos_sql.py --evaluar        # leave-one-out sobre el historial
+"""
+
+import argparse
+import math
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from estado_conversacion import depende_del_contexto
+from log_config import get_logger
+from sql_canonico import canonizar, es_consulta_lectura, limpiar_sql
+from vuelo_unico import normalizar_pregunta
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+EJEMPLOS_K = int(os.getenv("EJEMPLOS_K", 4))
+EJEMPLOS_SIMILITUD_MIN = float(os.getenv("EJEMPLOS_SIMILITUD_MIN", 0.08))
+EJEMPLOS_MAX = int(os.getenv("EJEMPLOS_MAX", 5000))
+EJEMPLOS_DIAS = int(os.getenv("EJEMPLOS_DIAS", 365))
+EJEMPLOS_REFRESCO_S = float(os.getenv("EJEMPLOS_REFRESCO_S", 3600))
+
+# Respuestas del bot que indican que la interacción no sirvió
+RESPUESTAS_FALLIDAS = ("No se encontraron resultados", "Solo se permiten", "Error al conectar",
+                       "No se pudo procesar", "⏱️")
+
+PALABRAS_VACIAS = {
+    "el", "la", "los", "las", "un", "una", "unos", "unas", "de", "del", "al", "en", "y", "o", "a",
+    "que", "por", "para", "con", "me", "mi", "es", "son", "se", "lo", "dame", "cual", "cuales",
+    "hay", "muestrame", "quiero", "saber", "ver", "favor",
+}
+
+# Pares semilla (los del prompt original): el índice nunca queda vacío
+EJEMPLOS_BASE = [
+    ("cuántos items tiene el proyecto la macarena",
+     "SELECT COUNT(DISTINCT items_descripcion) as total_items FROM apus WHERE nombre_proyecto ILIKE '%macarena%'"),
+    ("cuál es el item más costoso de la macarena",
+     "SELECT items_descripcion, precio_unitario FROM apus WHERE nombre_proyecto ILIKE '%macarena%' ORDER BY precio_unitario DESC LIMIT 1"),
+    ("dame los items de excavación",
+     "SELECT items_descripcion, precio_unitario FROM apus WHERE items_descripcion ILIKE '%excavación%' ORDER BY precio_unitario DESC LIMIT 20"),
+    ("proyectos en Bogotá",
+     "SELECT DISTINCT nombre_proyecto, ciudad FROM apus WHERE ciudad ILIKE '%bogotá%' LIMIT 20"),
+    ("precio promedio del concreto por ciudad",
+     "SELECT ciudad, AVG(precio_unitario) AS promedio FROM apus WHERE items_descripcion ILIKE '%concreto%' GROUP BY ciudad ORDER BY promedio DESC LIMIT 20"),
+]
+
+ESQUEMA_COMPACTO = """Tabla apus (una fila por insumo de cada ítem de un APU):
+- Proyecto: nombre_proyecto, numero_contrato, entidad, contratista, ciudad, pais
+- Fechas: fecha_aprobacion_apu, fecha_analisis_apu
+- Ítem: item, items_descripcion, item_unidad, precio_unitario, precio_unitario_sin_aiu
+- Insumo: codigo_insumo, tipo_insumo, insumo_descripcion, insumo_unidad, rendimiento_insumo,
+  precio_unitario_apu, precio_parcial_apu
+- Otros: observacion, link_documento"""
+
+REGLAS_COMPACTAS = """REGLAS:
+- Textos siempre con ILIKE '%valor%', nunca con =
+- obra/proyecto → nombre_proyecto; actividad/ítem → items_descripcion; material/insumo → insumo_descripcion;
+  precio/valor/costo → precio_unitario; empresa → contratista; lugar → ciudad
+- "más caro" → ORDER BY precio_unitario DESC; "cuántos" → COUNT; "promedio" → AVG; comparaciones → GROUP BY
+- LIMIT 20 salvo que pida otra cantidad; DISTINCT para evitar duplicados
+- Solo SELECT, sin Markdown ni ```sql```"""
+
+
+def terminos(texto):
+    """Palabras significativas y trigramas de caracteres de cada palabra."""
+    palabras = [p for p in normalizar_pregunta(texto).split() if p not in PALABRAS_VACIAS]
+    salida = list(palabras)
+    for p in palabras:
+        relleno = f" {p} "
+        salida.extend("#" + relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return salida
+
+
+class IndiceEjemplos:
+    """TF-IDF sobre preguntas; cada documento es un par (pregunta, sql)."""
+
+    def __init__(self, k=EJEMPLOS_K, similitud_min=EJEMPLOS_SIMILITUD_MIN, max_ejemplos=EJEMPLOS_MAX):
+        self.k = k
+        self.similitud_min = similitud_min
+        self.max_ejemplos = max_ejemplos
+        self._lock = threading.Lock()
+        self._hilo = None
+        self.reconstruir([])
+
+    def reconstruir(self, pares):
+        """Reemplaza el índice por EJEMPLOS_BASE + pares (los más recientes al final)."""
+        ejemplos, vistos = [], {}
+        for pregunta, sql in list(EJEMPLOS_BASE) + list(pares):
+            clave = normalizar_pregunta(pregunta)
+            if clave in vistos:
+                ejemplos[vistos[clave]] = (pregunta, sql)  # Gana el SQL más reciente
+                continue
+            vistos[clave] = len(ejemplos)
+            ejemplos.append((pregunta, sql))
+        ejemplos = ejemplos[-self.max_ejemplos:]
+
+        docs = [Counter(terminos(p)) for p, _ in ejemplos]
+        df = Counter(t for d in docs for t in d)
+        indice = defaultdict(list)
+        normas = []
+        n = len(docs)
+        idf = {t: math.log((1 + n) / (1 + f)) + 1 for t, f in df.items()}
+        for i, d in enumerate(docs):
+            norma = 0.0
+            for t, tf in d.items():
+                peso = (1 + math.log(tf)) * idf[t]
+                indice[t].append((i, peso))
+                norma += peso * peso
+            normas.append(math.sqrt(norma) or 1.0)
+        with self._lock:
+            self._ejemplos = ejemplos
+            self._claves = set(vistos)
+            self._indice = indice
+            self._idf = idf
+            self._normas = normas
+
+    def agregar(self, pregunta, sql):
+        """Suma una interacción exitosa sin reconstruir (el idf se recalcula en el próximo refresco)."""
+        clave = normalizar_pregunta(pregunta)
+        with self._lock:
+            if clave in self._claves or len(self._ejemplos) >= self.max_ejemplos:
+                return
+            i = len(self._ejemplos)
+            self._ejemplos.append((pregunta, sql))
+            self._claves.add(clave)
+            norma = 0.0
+            for t, tf in Counter(terminos(pregunta)).items():
+                # Término nuevo: idf de un término que aparece en un solo documento
+                idf = self._idf.setdefault(t, math.log((2 + i) / 2) + 1)
+                peso = (1 + math.log(tf)) * idf
+                self._indice[t].append((i, peso))
+                norma += peso * peso
+            self._normas.append(math.sqrt(norma) or 1.0)
+
+    def buscar(self, pregunta, k=None, excluir=None):
+        """
+        Los k ejemplos más parecidos, sin repetir forma de SQL.
+
+        Returns:
+            list: [(similitud, pregunta, sql)] de mayor a menor similitud
+        """
+        k = k or self.k
+        consulta = Counter(terminos(pregunta))
+        with self._lock:
+            pesos = {t: (1 + math.log(tf)) * self._idf[t] for t, tf in consulta.items() if t in self._idf}
+            norma_q = math.sqrt(sum(p * p for p in pesos.values())) or 1.0
+            puntajes = defaultdict(float)
+            for t, peso_q in pesos.items():
+                for i, peso_d in self._indice.get(t, ()):
+                    puntajes[i] += peso_q * peso_d
+            candidatos = sorted(((s / (norma_q * self._normas[i]), i) for i, s in puntajes.items()), reverse=True)
+            ejemplos = self._ejemplos
+
+        elegidos, formas = [], set()
+        for similitud, i in candidatos:
+            if similitud < self.similitud_min or len(elegidos) >= k:
+                break
+            if excluir is not None and i == excluir:
+                continue
+            pregunta_ej, sql = ejemplos[i]
+            forma = canonizar(sql)
+            if forma in formas:
+                continue
+            formas.add(forma)
+            elegidos.append((similitud, pregunta_ej, sql))
+        return elegidos
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ejemplos)
+
+    # ---------- Carga desde el historial ----------
+
+    def iniciar(self):
+        """Carga el índice en segundo plano y lo refresca cada EJEMPLOS_REFRESCO_S."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=self._bucle, name="ejemplos-sql", daemon=True)
+        self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            try:
+                inicio = time.perf_counter()
+                self.reconstruir(pares_del_historial())
+                logger.info(f"🔎 Índice de ejemplos SQL: {len(self)} pares en "
+                            f"{(time.perf_counter() - inicio) * 1000:.0f}ms")
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo cargar el índice de ejemplos SQL: {e}")
+            time.sleep(EJEMPLOS_REFRESCO_S)
+
+
+def es_ejemplo_valido(pregunta, sql, respuesta=None):
+    """Un par sirve de ejemplo si la pregunta se entiende sola y el SELECT devolvió resultados."""
+    if not pregunta or not sql or depende_del_contexto(pregunta):
+        return False
+    if respuesta and any(marca in respuesta for marca in RESPUESTAS_FALLIDAS):
+        return False
+    return es_consulta_lectura(sql)
+
+
+def pares_del_historial(dias=EJEMPLOS_DIAS, limite=EJEMPLOS_MAX * 4):
+    """(pregunta, sql) exitosos del historial, del más viejo al más reciente."""
+    from db_config import get_db_connection
+
+    conn = None
+    try:
+        conn = get_db_connection(lectura=True)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT mensaje_usuario, sql_generado, respuesta_bot FROM (
+                SELECT mensaje_usuario, sql_generado, respuesta_bot, timestamp
+                FROM historial_conversaciones
+                WHERE sql_generado IS NOT NULL AND sql_generado <> ''
+                  AND timestamp >= NOW() - make_interval(days => %s)
+                ORDER BY timestamp DESC
+                LIMIT %s
+            ) recientes
+            ORDER BY timestamp
+        """, (dias, limite))
+        filas = cursor.fetchall()
+        cursor.close()
+    finally:
+        if conn:
+            conn.close()
+    return [(p.strip(), limpiar_sql(s)) for p, s, r in filas if es_ejemplo_valido(p, s, r)]
+
+
+def prompt_sql_compacto(pregunta, contexto_historial="", ejemplos=()):
+    """Prompt de generación de SQL con esquema compacto y los ejemplos recuperados."""
+    bloque = "\n".join(f'Usuario: "{p}"\nSQL: {s}' for _, p, s in ejemplos)
+    return f"""Eres experto en PostgreSQL y en análisis de precios unitarios (APU) de obras civiles.
+Convierte la pregunta en una consulta SQL; el usuario no conoce los nombres de las columnas.
+
+{ESQUEMA_COMPACTO}
+
+{REGLAS_COMPACTAS}
+
+EJEMPLOS SIMILARES:
+{bloque or "(sin ejemplos parecidos)"}
+{contexto_historial}
+Usuario pregunta: "{pregunta}"
+
+Genera SOLO la consulta SQL, sin explicaciones."""
+
+
+# Instancia global usada por main.py
+indice_ejemplos = IndiceEjemplos()
+
+
+def evaluar(indice):
+    """Leave-one-out: ¿el ejemplo más parecido (sin contarse a sí mismo) tiene la misma forma de SQL?"""
+    aciertos = total = con_ejemplo = 0
+    for i, (pregunta, sql) in enumerate(list(indice._ejemplos)):
+        encontrados = indice.buscar(pregunta, k=1, excluir=i)
+        total += 1
+        if encontrados:
+            con_ejemplo += 1
+            aciertos += canonizar(encontrados[0][2]) == canonizar(sql)
+    return {"ejemplos": total, "con_ejemplo": con_ejemplo, "misma_forma": aciertos}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recuperación de ejemplos pregunta → SQL")
+    parser.add_argument("pregunta", nargs="?")
+    parser.add_argument("--evaluar", action="store_true", help="Leave-one-out sobre el historial")
+    parser.add_argument("-k", type=int, default=EJEMPLOS_K)
+    args = parser.parse_args()
+
+    indice_ejemplos.reconstruir(pares_del_historial())
+    print(f"📚 {len(indice_ejemplos)} ejemplos en el índice")
+    if args.evaluar:
+        r = evaluar(indice_ejemplos)
+        print(f"Con algún ejemplo parecido: {r['con_ejemplo']}/{r['ejemplos']}")
+        print(f"Top-1 con la misma forma de SQL: {r['misma_forma']}/{r['ejemplos']} "
+              f"({r['misma_forma'] / max(r['ejemplos'], 1):.0%})")
+    if args.pregunta:
+        encontrados = indice_ejemplos.buscar(args.pregunta, k=args.k)
+        for similitud, pregunta, sql in encontrados:
+            print(f"\n{similitud:.2f}  💬 {pregunta}\n      🧬 {sql}")
+        prompt = prompt_sql_compacto(args.pregunta, "", encontrados)
+        print(f"\n📏 Prompt: {len(prompt)} caracteres (~{len(prompt) // 4} tokens)")
@@ -0,0 +1,215 @@
+"""
+🤖 Enrutador de modelos de Gemini por etapa
+- Cada etapa tiene su lista de modelos (GEMINI_MODELOS_SQL, GEMINI_MODELOS_RESUMEN); por defecto
+  ambas usan GEMINI_MODEL.
+- Por (etapa, modelo) se guarda una ventana de latencias y errores recientes. El primario es el de
+  menor latencia mediana entre los sanos; un modelo con pocas muestras va primero hasta reunir
+  ROUTER_MIN_MUESTRAS, para poder compararlo.
+- Si la llamada falla se pasa al siguiente modelo (failover). Si tarda más que el p95 observado del
+  primario se lanza una segunda llamada (cobertura) y gana la primera respuesta.
+- Cada modelo tiene su interruptor de circuito (gemini:<modelo>).
+"""
+
+import os
+import threading
+import time
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from bench_utils import percentil
+from log_config import get_logger
+from metricas import registrar_modelo, LLM_RESPUESTAS
+from resiliencia import interruptores, Interruptor, CircuitoAbierto, PlazoVencido
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+MODELOS_POR_ETAPA = {
+    "gemini_sql": os.getenv("GEMINI_MODELOS_SQL", GEMINI_MODEL),
+    "gemini_resumen": os.getenv("GEMINI_MODELOS_RESUMEN", GEMINI_MODEL),
+}
+ROUTER_VENTANA = int(os.getenv("ROUTER_VENTANA", 100))  # Llamadas recientes por (etapa, modelo)
+ROUTER_MIN_MUESTRAS = int(os.getenv("ROUTER_MIN_MUESTRAS", 20))
+ROUTER_ERROR_MAX = float(os.getenv("ROUTER_ERROR_MAX", 0.3))  # Tasa de error que saca a un modelo del primer puesto
+ROUTER_COBERTURA = os.getenv("ROUTER_COBERTURA", "1") == "1"
+ROUTER_COBERTURA_MIN_S = float(os.getenv("ROUTER_COBERTURA_MIN_S", 1.0))
+ROUTER_HILOS = int(os.getenv("ROUTER_HILOS", 32))
+
+
+class ErrorModelo(Exception):
+    """Respuesta no utilizable; reintentable=False si otro modelo tampoco la resolvería (prompt bloqueado)."""
+
+    def __init__(self, mensaje, reintentable=True):
+        super().__init__(mensaje)
+        self.reintentable = reintentable
+
+
+class EstadisticasModelo:
+    """Ventana deslizante de (latencia, ok) de un modelo en una etapa."""
+
+    def __init__(self, ventana=ROUTER_VENTANA):
+        self._llamadas = deque(maxlen=ventana)
+        self._lock = threading.Lock()
+
+    def registrar(self, latencia, ok):
+        with self._lock:
+            self._llamadas.append((latencia, ok))
+
+    def resumen(self):
+        with self._lock:
+            llamadas = list(self._llamadas)
+        latencias = [l for l, ok in llamadas if ok]
+        return {
+            "muestras": len(llamadas),
+            "tasa_error": (len(llamadas) - len(latencias)) / len(llamadas) if llamadas else 0.0,
+            "p50": percentil(latencias, 50) if latencias else None,
+            "p95": percentil(latencias, 95) if latencias else None,
+        }
+
+
+def _parsear_modelos(texto):
+    return [m.strip() for m in texto.split(",") if m.strip()]
+
+
+class EnrutadorModelos:
+    """Elige el modelo por etapa y coordina failover y cobertura."""
+
+    def __init__(self, modelos_por_etapa=MODELOS_POR_ETAPA, cobertura=ROUTER_COBERTURA):
+        self.modelos = {etapa: _parsear_modelos(m) for etapa, m in modelos_por_etapa.items()}
+        self.cobertura = cobertura
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._ejecutor = ThreadPoolExecutor(max_workers=ROUTER_HILOS, thread_name_prefix="gemini")
+
+    def estadisticas(self, etapa, modelo):
+        with self._lock:
+            stats = self._stats.get((etapa, modelo))
+            if stats is None:
+                stats = self._stats[(etapa, modelo)] = EstadisticasModelo()
+            return stats
+
+    def interruptor(self, modelo):
+        return interruptores.setdefault(f"gemini:{modelo}", Interruptor(f"gemini:{modelo}"))
+
+    def candidatos(self, etapa):
+        """Modelos de la etapa en orden de preferencia según lo observado."""
+        modelos = self.modelos.get(etapa) or [GEMINI_MODEL]
+
+        def clave(indice_modelo):
+            indice, modelo = indice_modelo
+            r = self.estadisticas(etapa, modelo).resumen()
+            if r["muestras"] < ROUTER_MIN_MUESTRAS:
+                return (0, 0.0, indice)  # Calentando: se prueba primero
+            return (int(r["tasa_error"] > ROUTER_ERROR_MAX), r["p50"] or float("inf"), indice)
+
+        return [m for _, m in sorted(enumerate(modelos), key=clave)]
+
+    def llamar(self, etapa, llamar_modelo, cobertura=True):
+        """
+        Ejecuta llamar_modelo(modelo) -> texto con failover y cobertura (cobertura=False para
+        llamadas con efectos visibles, como el streaming que ya envía partes al usuario).
+
+        Returns:
+            tuple: (texto, modelo que respondió)
+
+        Raises:
+            CircuitoAbierto: Si todos los modelos de la etapa tienen el circuito abierto
+            Exception: El último error si ningún modelo respondió
+        """
+        restantes = self.candidatos(etapa)
+        pendientes = {}
+        ultimo_error = None
+
+        def lanzar(via):
+            nonlocal ultimo_error
+            while restantes:
+                modelo = restantes.pop(0)
+                try:
+                    self.interruptor(modelo).permitir()
+                except CircuitoAbierto as e:
+                    ultimo_error = ultimo_error or e
+                    continue
+                # El contexto viaja al hilo: etapa, request_id y plazo del mensaje
+                futuro = self._ejecutor.submit(contextvars.copy_context().run,
+                                               self._ejecutar, etapa, modelo, llamar_modelo)
+                pendientes[futuro] = (modelo, via)
+                return modelo
+            return None
+
+        primario = lanzar("primario")
+        if primario is None:
+            raise ultimo_error
+        umbral = self._umbral_cobertura(etapa, primario) if self.cobertura and cobertura else None
+
+        while pendientes:
+            hechos, _ = wait(pendientes, timeout=umbral, return_when=FIRST_COMPLETED)
+            if not hechos:
+                # El primario superó su p95: segunda llamada con otro modelo, gana la primera
+                umbral = None
+                modelo = lanzar("cobertura")
+                if modelo:
+                    logger.info(f"🤖 {primario} lleva más de su p95 en {etapa}, cobertura con {modelo}")
+                continue
+            for futuro in hechos:
+                modelo, via = pendientes.pop(futuro)
+                try:
+                    texto = futuro.result()
+                except ErrorModelo as e:
+                    if not e.reintentable:
+                        raise
+                    ultimo_error = e
+                except Exception as e:
+                    ultimo_error = e
+                else:
+                    LLM_RESPUESTAS.inc(etapa=etapa, modelo=modelo, via=via)
+                    registrar_modelo(etapa, modelo)
+                    return texto, modelo
+                logger.warning(f"⚠️ {modelo} falló en {etapa}: {ultimo_error}")
+                if not pendientes:
+                    siguiente = lanzar("failover")
+                    if siguiente:
+                        logger.info(f"🤖 Failover de {modelo} a {siguiente} en {etapa}")
+        raise ultimo_error
+
+    def _ejecutar(self, etapa, modelo, llamar_modelo):
+        interruptor = self.interruptor(modelo)
+        inicio = time.perf_counter()
+        try:
+            texto = llamar_modelo(modelo)
+        except PlazoVencido:
+            interruptor.liberar()  # No se llegó a llamar al modelo
+            raise
+        except ErrorModelo as e:
+            # Un prompt bloqueado no indica que el modelo esté mal
+            self.estadisticas(etapa, modelo).registrar(time.perf_counter() - inicio, not e.reintentable)
+            if e.reintentable:
+                interruptor.fallo()
+            else:
+                interruptor.exito()
+            raise
+        except Exception:
+            self.estadisticas(etapa, modelo).registrar(time.perf_counter() - inicio, False)
+            interruptor.fallo()
+            raise
+        self.estadisticas(etapa, modelo).registrar(time.perf_counter() - inicio, True)
+        interruptor.exito()
+        return texto
+
+    def _umbral_cobertura(self, etapa, modelo):
+        """p95 observado del modelo en la etapa (None si aún no hay muestras suficientes)."""
+        r = self.estadisticas(etapa, modelo).resumen()
+        if r["muestras"] < ROUTER_MIN_MUESTRAS or r["p95"] is None:
+            return None
+        return max(r["p95"], ROUTER_COBERTURA_MIN_S)
+
+    def resumen(self):
+        """Estadísticas por etapa y modelo (para /health y métricas)."""
+        with self._lock:
+            claves = list(self._stats)
+        return {f"{etapa}/{modelo}": self.estadisticas(etapa, modelo).resumen() for etapa, modelo in claves}
+
+
+# Instancia global usada por main.py
+enrutador = EnrutadorModelos()
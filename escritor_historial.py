@@ -0,0 +1,249 @@
+"""
+💾 Escritor asíncrono del historial de conversaciones (write-behind)
+Acumula las interacciones en memoria y las inserta por lotes en historial_conversaciones,
+fuera del camino de respuesta del webhook. Si la base de datos no está disponible,
+los lotes se guardan en un archivo JSONL local y se reintentan en el siguiente ciclo.
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from psycopg2.extras import execute_batch
+
+from db_config import get_db_connection, registrar_escritura, registrar_sentencia, preparar
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+HISTORIAL_LOTE_MAX = int(os.getenv("HISTORIAL_LOTE_MAX", 50))  # Filas por INSERT
+HISTORIAL_FLUSH_SEGUNDOS = float(os.getenv("HISTORIAL_FLUSH_SEGUNDOS", 2))  # Espera máxima por lote
+HISTORIAL_COLA_MAX = int(os.getenv("HISTORIAL_COLA_MAX", 10000))  # Interacciones en memoria
+HISTORIAL_SPILL_PATH = os.getenv("HISTORIAL_SPILL_PATH", "historial_pendiente.jsonl")
+
+COLUMNAS = ("telefono", "mensaje_usuario", "sql_generado", "respuesta_bot", "timestamp")
+
+SQL_INSERT = f"""
+    INSERT INTO historial_conversaciones ({', '.join(COLUMNAS)})
+    VALUES ({', '.join(['%s'] * len(COLUMNAS))})
+"""
+# Preparada una vez por conexión del pool; el lote viaja como EXECUTEs en un solo envío
+registrar_sentencia("historial_insertar", SQL_INSERT)
+
+_FIN = object()  # Marca de cierre para despertar al hilo
+
+
+class EscritorHistorial:
+    """Cola en memoria + hilo que persiste el historial por lotes."""
+
+    def __init__(self, tamano_lote=HISTORIAL_LOTE_MAX, intervalo=HISTORIAL_FLUSH_SEGUNDOS,
+                 cola_max=HISTORIAL_COLA_MAX, spill_path=HISTORIAL_SPILL_PATH):
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.spill_path = spill_path
+        self._cola = queue.Queue(maxsize=cola_max)
+        self._hilo = None
+        self._arranque_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._detenido = False
+
+    # ---------- API pública ----------
+
+    def iniciar(self):
+        """Arranca el hilo escritor (idempotente)."""
+        with self._arranque_lock:
+            if self._hilo and self._hilo.is_alive():
+                return
+            self._detenido = False
+            self._hilo = threading.Thread(target=self._bucle, name="escritor-historial", daemon=True)
+            self._hilo.start()
+
+    def encolar(self, telefono, mensaje_usuario, sql_generado, respuesta_bot, timestamp=None):
+        """Agrega una interacción a la cola sin bloquear la respuesta al usuario."""
+        fila = (telefono, mensaje_usuario, sql_generado, respuesta_bot, timestamp or datetime.now())
+        if self._detenido:
+            self._spill([fila])
+            return
+        if not self._hilo or not self._hilo.is_alive():
+            self.iniciar()
+        try:
+            self._cola.put_nowait(fila)
+        except queue.Full:
+            # Cola saturada (BD caída por mucho tiempo): directo al archivo
+            self._spill([fila])
+
+    def detener(self, timeout=10):
+        """Vacía la cola en la base de datos (o en el archivo) y detiene el hilo."""
+        if self._detenido:
+            return
+        self._detenido = True
+        if self._hilo and self._hilo.is_alive():
+            self._cola.put(_FIN)
+            self._hilo.join(timeout)
+        # Lo que no alcanzó a salir queda en disco
+        restantes = []
+        while True:
+            try:
+                fila = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if fila is not _FIN:
+                restantes.append(fila)
+        if restantes:
+            self._spill(restantes)
+
+    def pendientes(self):
+        """Número aproximado de interacciones en memoria."""
+        return self._cola.qsize()
+
+    # ---------- Hilo escritor ----------
+
+    def _bucle(self):
+        self._recuperar_procesando()
+        fin = False
+        while not fin:
+            lote, fin = self._recolectar_lote()
+            if lote:
+                self._persistir(lote)
+            elif os.path.exists(self.spill_path):
+                self._reintentar_spill()
+
+    def _recolectar_lote(self):
+        """Espera hasta completar el lote o hasta que venza el intervalo."""
+        lote = []
+        limite = None
+        while len(lote) < self.tamano_lote:
+            if limite is None:
+                espera = self.intervalo
+            else:
+                espera = limite - time.monotonic()
+                if espera <= 0:
+                    break
+            try:
+                fila = self._cola.get(timeout=espera)
+            except queue.Empty:
+                break
+            if fila is _FIN:
+                # Cierre: vaciar lo que quede sin esperar
+                while True:
+                    try:
+                        fila = self._cola.get_nowait()
+                    except queue.Empty:
+                        return lote, True
+                    if fila is not _FIN:
+                        lote.append(fila)
+            lote.append(fila)
+            if limite is None:
+                limite = time.monotonic() + self.intervalo
+        return lote, False
+
+    def _persistir(self, lote):
+        try:
+            self._insertar(lote)
+            logger.info(f"💾 Historial: {len(lote)} conversaciones guardadas")
+        except Exception as e:
+            logger.warning(f"⚠️ Error guardando historial ({len(lote)} filas), se guardan en {self.spill_path}: {e}")
+            self._spill(lote)
+            return
+        if os.path.exists(self.spill_path):
+            self._reintentar_spill()
+
+    def _insertar(self, filas):
+        conn = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            execute_batch(cursor, preparar(cursor, "historial_insertar"), filas, page_size=max(len(filas), 1))
+            conn.commit()
+            cursor.close()
+            # Las réplicas pueden ir atrasadas: el historial de estos usuarios se lee de la primaria un rato
+            for telefono in {fila[0] for fila in filas}:
+                registrar_escritura(telefono)
+        except Exception:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                conn.close()
+
+    # ---------- Archivo de respaldo ----------
+
+    def _spill(self, filas):
+        """Agrega filas al archivo JSONL de respaldo (con fsync)."""
+        with self._spill_lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for fila in filas:
+                    registro = dict(zip(COLUMNAS, fila))
+                    registro["timestamp"] = fila[4].isoformat()
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _recuperar_procesando(self):
+        """Si el proceso murió a mitad de una recuperación, devuelve esas filas al respaldo."""
+        en_proceso = self.spill_path + ".procesando"
+        with self._spill_lock:
+            if not os.path.exists(en_proceso):
+                return
+            with open(en_proceso, "r", encoding="utf-8") as f:
+                contenido = f.read()
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(contenido)
+                f.flush()
+                os.fsync(f.fileno())
+            os.remove(en_proceso)
+
+    def _reintentar_spill(self):
+        """Reinserta el archivo de respaldo y lo elimina si tuvo éxito."""
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return
+            en_proceso = self.spill_path + ".procesando"
+            os.replace(self.spill_path, en_proceso)
+        filas = []
+        with open(en_proceso, "r", encoding="utf-8") as f:
+            for linea in f:
+                if linea.strip():
+                    registro = json.loads(linea)
+                    filas.append(tuple(registro[c] for c in COLUMNAS))
+        paso = self.tamano_lote * 10
+        i = 0
+        try:
+            # Cada tramo se confirma por separado: i avanza solo tras el commit
+            while i < len(filas):
+                self._insertar(filas[i:i + paso])
+                i += paso
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo recuperar el archivo de respaldo del historial "
+                           f"({i} de {len(filas)} filas guardadas): {e}")
+            # Devolver al archivo solo lo que no se guardó (antepuesto a lo nuevo)
+            with self._spill_lock:
+                # Primero se reemplaza .procesando por lo pendiente: si el proceso muere aquí,
+                # _recuperar_procesando() no repite las filas ya confirmadas
+                temporal = en_proceso + ".tmp"
+                with open(temporal, "w", encoding="utf-8") as f:
+                    for fila in filas[i:]:
+                        f.write(json.dumps(dict(zip(COLUMNAS, fila)), ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporal, en_proceso)
+                if os.path.exists(self.spill_path):
+                    with open(self.spill_path, "r", encoding="utf-8") as f:
+                        nuevas = f.read()
+                    with open(en_proceso, "a", encoding="utf-8") as f:
+                        f.write(nuevas)
+                os.replace(en_proceso, self.spill_path)
+            return
+        os.remove(en_proceso)
+        logger.info(f"♻️ Historial: {len(filas)} conversaciones recuperadas del archivo de respaldo")
+
+
+# Instancia global usada por main.py
+escritor_historial = EscritorHistorial()
+atexit.register(escritor_historial.detener)
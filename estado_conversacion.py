@@ -0,0 +1,290 @@
+"""
+🧭 Estado estructurado de la conversación
+En lugar de enviar a Gemini los últimos mensajes y fragmentos de SQL en texto libre,
+se mantiene por usuario un estado compacto (proyecto, ciudad, ítem, insumo, año, forma
+del último resultado) extraído de forma determinista de cada consulta ejecutada.
+
+Medir la reducción del prompt sobre el historial real:
+    python estado_conversacion.py [--usuarios 200]
+"""
+
+import argparse
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# ============ CONFIGURACIÓN ============
+ESTADO_MAX_USUARIOS = int(os.getenv("ESTADO_MAX_USUARIOS", 5000))
+ESTADO_PREGUNTA_MAX = 120  # Caracteres de la última pregunta que viajan en el prompt
+
+# Columna de la tabla apus -> dimensión del estado
+DIMENSIONES = {
+    "nombre_proyecto": "proyecto",
+    "numero_contrato": "contrato",
+    "ciudad": "ciudad",
+    "pais": "pais",
+    "entidad": "entidad",
+    "contratista": "contratista",
+    "items_descripcion": "item",
+    "item": "item",
+    "insumo_descripcion": "insumo",
+    "codigo_insumo": "insumo",
+    "tipo_insumo": "tipo_insumo",
+}
+
+_COL = r"(?:\w+\s*\(\s*)*(?:\w+\.)?(\w+)(?:\s*\))*"
+_TEXTO = r"(?:\w+\s*\(\s*)*'((?:[^']|'')*)'(?:\s*\))*"
+RE_LIKE = re.compile(_COL + r"\s+(NOT\s+)?I?LIKE\s+" + _TEXTO, re.IGNORECASE)
+RE_IGUAL = re.compile(_COL + r"\s*=\s*" + _TEXTO, re.IGNORECASE)
+RE_ANIO = re.compile(
+    r"(?:EXTRACT\s*\(\s*YEAR\s+FROM\s+(?:\w+\.)?fecha_\w+\s*\)|DATE_PART\s*\(\s*'year'\s*,\s*(?:\w+\.)?fecha_\w+\s*\))"
+    r"\s*(=|>=|<=|>|<)\s*(\d{4})",
+    re.IGNORECASE,
+)
+RE_AGREGADO = re.compile(r"\b(COUNT|AVG|SUM|MIN|MAX)\s*\(\s*(DISTINCT\s+)?([\w.*]+)", re.IGNORECASE)
+RE_GROUP_BY = re.compile(r"\bGROUP\s+BY\s+(.+?)(?:\bHAVING\b|\bORDER\b|\bLIMIT\b|;|$)", re.IGNORECASE | re.DOTALL)
+RE_ORDER_BY = re.compile(r"\bORDER\s+BY\s+([\w.()]+)(?:\s+(ASC|DESC))?", re.IGNORECASE)
+RE_LIMIT = re.compile(r"\bLIMIT\s+(\d+)", re.IGNORECASE)
+# Preguntas que se apoyan en la anterior: "y en Cali?", "ese mismo", "compara con...", "el otro"
+RE_REFERENCIA = re.compile(
+    r"^\s*[¿¡]?\s*y\b|\b(?:anterior(?:es)?|mism[oa]s?|es[eao]s?|est[eao]s?|aquel\w*|ah[ií]|all[ií]|"
+    r"tambi[eé]n|compar\w*|otr[oa]s?|dich[oa]s?|igual)\b",
+    re.IGNORECASE,
+)
+
+
+def _limpiar_valor(valor):
+    return valor.replace("''", "'").strip("%").replace("%", " ").strip()
+
+
+def depende_del_contexto(pregunta):
+    """True si la pregunta hace referencia a la conversación previa (no se entiende sola)."""
+    return bool(RE_REFERENCIA.search(pregunta or ""))
+
+
+def extraer_filtros(sql):
+    """Devuelve {dimension: [valores]} con los filtros de texto y año de una consulta."""
+    filtros = {}
+    for patron in (RE_LIKE, RE_IGUAL):
+        for m in patron.finditer(sql):
+            columna = m.group(1).lower()
+            negado = patron is RE_LIKE and m.group(2)
+            valor = _limpiar_valor(m.group(m.lastindex))
+            dimension = DIMENSIONES.get(columna)
+            if not dimension or negado or not valor:
+                continue
+            valores = filtros.setdefault(dimension, [])
+            if valor.lower() not in (v.lower() for v in valores):
+                valores.append(valor)
+    for operador, anio in RE_ANIO.findall(sql):
+        filtros.setdefault("anio", []).append(anio if operador == "=" else f"{operador}{anio}")
+    return filtros
+
+
+def extraer_forma(sql, filas=None):
+    """Describe la forma del resultado: tipo, agregados, agrupación, orden, límite y filas."""
+    forma = {}
+    agregados = [f"{f.upper()}({'DISTINCT ' if d else ''}{c})" for f, d, c in RE_AGREGADO.findall(sql)]
+    agrupado = RE_GROUP_BY.search(sql)
+    if agrupado:
+        forma["agrupado_por"] = [c.strip() for c in agrupado.group(1).split(",") if c.strip()]
+    if agregados:
+        forma["agregados"] = agregados
+    if agrupado or (agregados and len(agregados) > 1):
+        forma["tipo"] = "comparacion" if agrupado else "agregado"
+    elif agregados:
+        forma["tipo"] = "conteo" if agregados[0].startswith("COUNT") else "agregado"
+    else:
+        forma["tipo"] = "listado"
+    orden = RE_ORDER_BY.search(sql)
+    if orden:
+        forma["orden"] = f"{orden.group(1)} {(orden.group(2) or 'ASC').upper()}"
+    limite = RE_LIMIT.search(sql)
+    if limite:
+        forma["limite"] = int(limite.group(1))
+    if filas is not None:
+        forma["filas"] = len(filas)
+        if filas and isinstance(filas[0], dict):
+            forma["columnas"] = list(filas[0].keys())
+    return forma
+
+
+class EstadoConversacion:
+    """Contexto compacto de un usuario."""
+
+    __slots__ = ("filtros", "filtros_anteriores", "forma", "ultima_pregunta")
+
+    def __init__(self):
+        self.filtros = {}
+        self.filtros_anteriores = {}
+        self.forma = {}
+        self.ultima_pregunta = ""
+
+    def actualizar(self, pregunta, sql=None, filas=None):
+        """Incorpora una interacción; sql solo si fue una consulta SELECT ejecutada."""
+        self.ultima_pregunta = (pregunta or "")[:ESTADO_PREGUNTA_MAX]
+        if not sql:
+            return
+        self._aplicar(extraer_filtros(sql), extraer_forma(sql, filas))
+
+    def actualizar_sin_sql(self, pregunta, filtros, forma):
+        """Incorpora una interacción respondida sin SQL (vía rápida) con sus filtros y forma ya armados."""
+        self.ultima_pregunta = (pregunta or "")[:ESTADO_PREGUNTA_MAX]
+        self._aplicar(filtros, forma)
+
+    def _aplicar(self, nuevos, forma):
+        # Lo que cambió queda como "anterior" para comparaciones ("y en Cali?", "compara con...")
+        anteriores = {d: v for d, v in self.filtros.items() if nuevos.get(d) != v}
+        if anteriores:
+            self.filtros_anteriores = anteriores
+        self.filtros = nuevos
+        self.forma = forma
+
+    def vacio(self):
+        return not (self.filtros or self.forma or self.ultima_pregunta)
+
+    def a_dict(self):
+        return {
+            "filtros": self.filtros,
+            "filtros_anteriores": self.filtros_anteriores,
+            "forma": self.forma,
+            "ultima_pregunta": self.ultima_pregunta,
+        }
+
+    def a_prompt(self):
+        """Bloque de contexto para el prompt SQL (vacío si no hay estado)."""
+        if self.vacio():
+            return ""
+        lineas = ["\n\nCONTEXTO DE LA CONVERSACIÓN (estado actual):"]
+        if self.filtros:
+            lineas.append(f"- Filtros actuales: {_formatear_filtros(self.filtros)}")
+        if self.filtros_anteriores:
+            lineas.append(f"- Filtros anteriores: {_formatear_filtros(self.filtros_anteriores)}")
+        if self.forma:
+            lineas.append(f"- Última consulta: {_formatear_forma(self.forma)}")
+        if self.ultima_pregunta:
+            lineas.append(f'- Última pregunta: "{self.ultima_pregunta}"')
+        lineas.append("USA ESTE CONTEXTO para entender referencias como 'el anterior', 'ese mismo', "
+                      "'y en Cali?', 'compara con...'. Si la pregunta es nueva, ignóralo.\n")
+        return "\n".join(lineas)
+
+
+def _formatear_filtros(filtros):
+    return "; ".join(f"{d}≈{' | '.join(v)}" for d, v in filtros.items())
+
+
+def _formatear_forma(forma):
+    partes = [forma.get("tipo", "listado")]
+    if forma.get("agregados"):
+        partes.append(", ".join(forma["agregados"]))
+    if forma.get("agrupado_por"):
+        partes.append(f"por {', '.join(forma['agrupado_por'])}")
+    if forma.get("orden"):
+        partes.append(f"orden {forma['orden']}")
+    if forma.get("limite"):
+        partes.append(f"límite {forma['limite']}")
+    if "filas" in forma:
+        partes.append(f"{forma['filas']} filas")
+    if forma.get("columnas"):
+        partes.append(f"columnas {', '.join(forma['columnas'])}")
+    return "; ".join(partes)
+
+
+def contexto_legacy(historial):
+    """Contexto en texto libre que se enviaba antes (se conserva para medir la reducción)."""
+    if not historial:
+        return ""
+    contexto = "\n\nCONTEXTO DE CONVERSACIONES PREVIAS:\n"
+    for conv in historial:
+        contexto += f"Usuario: {conv['mensaje_usuario']}\n"
+        if conv['sql_generado']:
+            contexto += f"SQL generado: {conv['sql_generado'][:100]}...\n"
+    contexto += "\nUSA ESTE CONTEXTO para entender referencias como 'el anterior', 'ese mismo', 'compara con...', etc.\n"
+    return contexto
+
+
+def estado_desde_historial(historial):
+    """Reconstruye el estado reproduciendo el historial en orden cronológico."""
+    estado = EstadoConversacion()
+    for conv in historial:
+        estado.actualizar(conv["mensaje_usuario"], conv.get("sql_generado") or None)
+    return estado
+
+
+class RegistroEstados:
+    """Estados por teléfono con desalojo LRU."""
+
+    def __init__(self, max_usuarios=ESTADO_MAX_USUARIOS):
+        self.max_usuarios = max_usuarios
+        self._estados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, telefono, cargar_historial):
+        """Devuelve el estado del usuario; si no está en memoria lo reconstruye con cargar_historial()."""
+        with self._lock:
+            estado = self._estados.get(telefono)
+            if estado is not None:
+                self._estados.move_to_end(telefono)
+                return estado
+        estado = estado_desde_historial(cargar_historial())
+        with self._lock:
+            estado = self._estados.setdefault(telefono, estado)
+            self._estados.move_to_end(telefono)
+            while len(self._estados) > self.max_usuarios:
+                self._estados.popitem(last=False)
+        return estado
+
+    def invalidar(self, telefono=None):
+        with self._lock:
+            if telefono is None:
+                self._estados.clear()
+            else:
+                self._estados.pop(telefono, None)
+
+
+# Instancia global usada por main.py
+estados_conversacion = RegistroEstados()
+
+
+def medir_reduccion(max_usuarios=200, ventana=5):
+    """Compara el tamaño del contexto legado vs el estado estructurado sobre el historial real."""
+    from db_config import execute_query
+
+    telefonos = execute_query("""
+        SELECT telefono FROM historial_conversaciones
+        GROUP BY telefono ORDER BY MAX(timestamp) DESC LIMIT %s
+    """, params=(max_usuarios,))
+    total_legacy = total_estado = mensajes = 0
+    for fila in telefonos:
+        convs = execute_query("""
+            SELECT mensaje_usuario, sql_generado FROM historial_conversaciones
+            WHERE telefono = %s ORDER BY timestamp
+        """, params=(fila["telefono"],))
+        estado = EstadoConversacion()
+        for i, conv in enumerate(convs):
+            # Contexto que habría recibido el mensaje i con cada estrategia
+            total_legacy += len(contexto_legacy(convs[max(0, i - ventana):i]))
+            total_estado += len(estado.a_prompt())
+            mensajes += 1
+            estado.actualizar(conv["mensaje_usuario"], conv["sql_generado"] or None)
+
+    if not mensajes:
+        print("⚠️ No hay historial para medir")
+        return None
+    reduccion = 100 * (1 - total_estado / total_legacy) if total_legacy else 0.0
+    print("\n" + "=" * 60)
+    print("📏 TAMAÑO DEL CONTEXTO EN EL PROMPT SQL")
+    print("=" * 60)
+    print(f"Usuarios: {len(telefonos)}   Mensajes: {mensajes}")
+    print(f"Contexto legado:      {total_legacy / mensajes:8.0f} caracteres/mensaje (~{total_legacy / mensajes / 4:.0f} tokens)")
+    print(f"Estado estructurado:  {total_estado / mensajes:8.0f} caracteres/mensaje (~{total_estado / mensajes / 4:.0f} tokens)")
+    print(f"📉 Reducción: {reduccion:.1f}%")
+    return {"mensajes": mensajes, "legacy": total_legacy, "estado": total_estado, "reduccion": reduccion}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mide la reducción del contexto del prompt")
+    parser.add_argument("--usuarios", type=int, default=200)
+    args = parser.parse_args()
+    medir_reduccion(args.usuarios)
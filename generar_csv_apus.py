@@ -0,0 +1,135 @@
+"""
+🧪 Generador de CSVs sintéticos de APUs
+Escribe archivos con el mismo formato que el CSV real de APUs (delimitado por ';', números con
+formato latino "$ 1.234.567,89", fechas en varios formatos) a partir de datos_sinteticos.py,
+con valores sucios opcionales y el encoding que se indique.
+
+Uso:
+    python generar_csv_apus.py apus_100k.csv --filas 100000 --proyectos 200
+    python generar_csv_apus.py apus_sucio.csv --filas 50000 --sucios 0.05 --encoding cp1252
+"""
+
+import argparse
+import csv
+import random
+
+from create_apus_table import COLUMNAS_APUS
+from datos_sinteticos import filas_apus_sinteticas
+
+# Índices de columnas según COLUMNAS_APUS (mismos que usa load_apus_csv.py)
+INDICES_FECHA = (0, 1)
+INDICES_MONEDA = (11, 12, 18, 19)
+INDICE_RENDIMIENTO = 17
+INDICES_TEXTO = (2, 3, 4, 5, 6, 7, 8, 9, 10, 13, 14, 15, 16, 20, 21)
+
+MARCAS_NULO = ("–", "", "NULL", "null", "N/A", "n/a")
+FORMATOS_FECHA = ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d", "%d-%m-%Y")
+
+# Tipos de suciedad que aparecen en los CSV reales
+SUCIEDADES = (
+    "nulo",              # Marca de nulo en una columna cualquiera
+    "espacios",          # Espacios sobrantes alrededor del texto
+    "separador",         # Texto con ';' y comillas (requiere quoting)
+    "fecha_invalida",    # Fecha imposible -> NULL al limpiar
+    "numero_invalido",   # Número mal formado -> NULL al limpiar
+    "columnas",          # Fila truncada -> error de formato (no se inserta)
+)
+
+
+def formato_moneda(valor):
+    """1234567.891 -> '$ 1.234.567,89'"""
+    texto = f"{valor:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+    return f"$ {texto}"
+
+
+def formato_decimal(valor, decimales=4):
+    """0.0123 -> '0,0123'"""
+    return f"{valor:.{decimales}f}".replace(".", ",")
+
+
+def formatear_fila(fila, rnd, formato_fechas="mixto"):
+    """Convierte una fila de datos_sinteticos (tipos Python) en textos como los del CSV real."""
+    celdas = ["" if v is None else str(v) for v in fila]
+    for i in INDICES_FECHA:
+        formato = rnd.choice(FORMATOS_FECHA) if formato_fechas == "mixto" else formato_fechas
+        celdas[i] = fila[i].strftime(formato)
+    for i in INDICES_MONEDA:
+        celdas[i] = formato_moneda(fila[i])
+    celdas[INDICE_RENDIMIENTO] = formato_decimal(fila[INDICE_RENDIMIENTO])
+    if fila[20] is None:
+        celdas[20] = rnd.choice(MARCAS_NULO)
+    return celdas
+
+
+def ensuciar(celdas, rnd, tipo):
+    """Aplica un tipo de suciedad a la fila (in situ); devuelve la fila resultante."""
+    if tipo == "nulo":
+        celdas[rnd.randrange(len(celdas))] = rnd.choice(MARCAS_NULO)
+    elif tipo == "espacios":
+        i = rnd.choice(INDICES_TEXTO)
+        celdas[i] = f"  {celdas[i]}   "
+    elif tipo == "separador":
+        celdas[9] = f'{celdas[9]}; incluye "transporte" y retiro'
+    elif tipo == "fecha_invalida":
+        celdas[rnd.choice(INDICES_FECHA)] = rnd.choice(("31/02/2023", "2023-13-01", "ayer", "00/00/0000"))
+    elif tipo == "numero_invalido":
+        celdas[rnd.choice(INDICES_MONEDA)] = rnd.choice(("$ 1.234,5,6", "12 mil", "#¡VALOR!", "$ -"))
+    elif tipo == "columnas":
+        del celdas[rnd.randint(5, len(celdas) - 1):]
+    return celdas
+
+
+def escribir_csv_apus(ruta, filas=10000, proyectos=20, semilla=42, sucios=0.0, negativos=0.0,
+                      encoding="utf-8", formato_fechas="mixto"):
+    """
+    Genera un CSV de APUs sintético.
+
+    Args:
+        ruta (str): Archivo de salida
+        filas (int): Filas de datos (sin contar el encabezado)
+        proyectos (int): Proyectos distintos
+        semilla (int): Semilla (mismo archivo para los mismos parámetros)
+        sucios (float): Fracción de filas con algún valor sucio (ver SUCIEDADES)
+        negativos (float): Fracción de filas con precio unitario negativo; pasan la limpieza
+                           pero una restricción CHECK en la base las rechaza (camino de error BD)
+        encoding (str): utf-8, utf-8-sig, latin-1, cp1252...
+        formato_fechas (str): "mixto" o un formato strftime fijo
+
+    Returns:
+        dict: Conteo de filas escritas por tipo de suciedad
+    """
+    rnd = random.Random(semilla + 1)
+    conteo = {"filas": 0, "negativos": 0, **{tipo: 0 for tipo in SUCIEDADES}}
+    with open(ruta, "w", newline="", encoding=encoding, errors="replace") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow([c.upper() for c in COLUMNAS_APUS])
+        for fila in filas_apus_sinteticas(filas, proyectos, semilla):
+            celdas = formatear_fila(fila, rnd, formato_fechas)
+            if negativos and rnd.random() < negativos:
+                celdas[11] = "-" + celdas[11]
+                conteo["negativos"] += 1
+            elif sucios and rnd.random() < sucios:
+                tipo = rnd.choice(SUCIEDADES)
+                ensuciar(celdas, rnd, tipo)
+                conteo[tipo] += 1
+            writer.writerow(celdas)
+            conteo["filas"] += 1
+    return conteo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera un CSV sintético de APUs")
+    parser.add_argument("salida")
+    parser.add_argument("--filas", type=int, default=10000)
+    parser.add_argument("--proyectos", type=int, default=20)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--sucios", type=float, default=0.0, help="Fracción de filas con valores sucios")
+    parser.add_argument("--negativos", type=float, default=0.0,
+                        help="Fracción de filas con precio negativo (error en la base con bench_carga_apus.py)")
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--formato-fechas", default="mixto")
+    args = parser.parse_args()
+
+    conteo = escribir_csv_apus(args.salida, args.filas, args.proyectos, args.semilla, args.sucios,
+                               args.negativos, args.encoding, args.formato_fechas)
+    print(f"✅ {args.salida}: {conteo}")
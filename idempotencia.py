@@ -0,0 +1,204 @@
+"""
+🔁 Idempotencia del webhook por MessageSid
+Twilio reintenta el webhook cuando la respuesta tarda más que su timeout; sin esta capa cada
+reintento vuelve a llamar a Gemini, ejecutar el SQL y enviar la respuesta. Cada MessageSid se
+registra al empezar; los reintentos reciben el resultado original (o EN_CURSO si aún se está
+procesando) sin repetir el pipeline.
+
+Registro en memoria con TTL y, opcionalmente (IDEMPOTENCIA_BD=1), compartido entre instancias
+vía la tabla mensajes_procesados.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+IDEMPOTENCIA_TTL_S = float(os.getenv("IDEMPOTENCIA_TTL_S", 86400))
+IDEMPOTENCIA_MAX = int(os.getenv("IDEMPOTENCIA_MAX", 50000))  # MessageSid en memoria
+IDEMPOTENCIA_BD = os.getenv("IDEMPOTENCIA_BD", "0") == "1"
+# Un "en curso" más viejo que esto se da por abandonado (proceso caído) y puede retomarse
+IDEMPOTENCIA_EN_CURSO_MAX_S = float(os.getenv("IDEMPOTENCIA_EN_CURSO_MAX_S", 300))
+IDEMPOTENCIA_PURGA_S = float(os.getenv("IDEMPOTENCIA_PURGA_S", 3600))
+
+EN_CURSO = "EN_CURSO"
+
+SQL_CREAR_TABLA = """
+    CREATE TABLE IF NOT EXISTS mensajes_procesados (
+        message_sid TEXT PRIMARY KEY,
+        estado TEXT NOT NULL,
+        resultado TEXT,
+        creado TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        actualizado TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_mensajes_procesados_creado ON mensajes_procesados (creado);
+"""
+
+# Inserta el MessageSid o retoma uno "en curso" abandonado; RETURNING vacío = duplicado
+SQL_RECLAMAR = """
+    INSERT INTO mensajes_procesados (message_sid, estado) VALUES (%s, 'en_curso')
+    ON CONFLICT (message_sid) DO UPDATE
+        SET estado = 'en_curso', resultado = NULL, actualizado = NOW()
+        WHERE mensajes_procesados.estado = 'en_curso'
+          AND mensajes_procesados.actualizado < NOW() - make_interval(secs => %s)
+    RETURNING message_sid
+"""
+
+
+class RegistroIdempotencia:
+    """MessageSid procesados o en curso, con su resultado."""
+
+    def __init__(self, ttl=IDEMPOTENCIA_TTL_S, max_entradas=IDEMPOTENCIA_MAX, usar_bd=IDEMPOTENCIA_BD):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.usar_bd = usar_bd
+        self.duplicados = 0
+        self._entradas = OrderedDict()  # sid -> (resultado o EN_CURSO, expira)
+        self._lock = threading.Lock()
+        self._tabla_lista = False
+        self._ultima_purga = 0.0
+
+    def visto(self, sid):
+        """Resultado original (o EN_CURSO) si el MessageSid está en memoria; no registra ni consulta la base."""
+        if not sid:
+            return None
+        with self._lock:
+            entrada = self._entradas.get(sid)
+            if entrada and entrada[1] > time.monotonic():
+                self.duplicados += 1
+                return entrada[0]
+        return None
+
+    def comenzar(self, sid):
+        """
+        Registra el inicio del procesamiento. Con usar_bd hace I/O bloqueante: desde código
+        async va al threadpool (igual que terminar y abandonar).
+
+        Returns:
+            None si el mensaje es nuevo (hay que procesarlo); si es un reintento, el resultado
+            original o EN_CURSO.
+        """
+        if not sid:
+            return None
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(sid)
+            if entrada and entrada[1] > ahora:
+                self.duplicados += 1
+                return entrada[0]
+            self._entradas[sid] = (EN_CURSO, ahora + self.ttl)
+            self._entradas.move_to_end(sid)
+            self._podar(ahora)
+
+        if self.usar_bd:
+            previo = self._reclamar_bd(sid)
+            if previo is not None:
+                with self._lock:
+                    self.duplicados += 1
+                    if previo != EN_CURSO:
+                        self._entradas[sid] = (previo, ahora + self.ttl)
+                    else:
+                        # Lo procesa otra instancia: no retener el EN_CURSO local
+                        self._entradas.pop(sid, None)
+                return previo
+        return None
+
+    def terminar(self, sid, resultado):
+        """Guarda el resultado para responder a los reintentos."""
+        if not sid:
+            return
+        with self._lock:
+            self._entradas[sid] = (resultado, time.monotonic() + self.ttl)
+            self._entradas.move_to_end(sid)
+        if self.usar_bd:
+            self._ejecutar_bd(
+                "UPDATE mensajes_procesados SET estado = 'terminado', resultado = %s, actualizado = NOW() "
+                "WHERE message_sid = %s",
+                (resultado, sid),
+            )
+
+    def abandonar(self, sid):
+        """El procesamiento falló sin resultado: permitir que un reintento lo vuelva a intentar."""
+        if not sid:
+            return
+        with self._lock:
+            self._entradas.pop(sid, None)
+        if self.usar_bd:
+            self._ejecutar_bd(
+                "DELETE FROM mensajes_procesados WHERE message_sid = %s AND estado = 'en_curso'", (sid,)
+            )
+
+    def _podar(self, ahora):
+        # Las entradas se insertan en orden de llegada: las primeras son las más viejas
+        while self._entradas:
+            sid, (_, expira) = next(iter(self._entradas.items()))
+            if expira > ahora and len(self._entradas) <= self.max_entradas:
+                break
+            self._entradas.popitem(last=False)
+
+    # ---------- Base de datos ----------
+
+    def _reclamar_bd(self, sid):
+        """None si esta instancia se queda con el mensaje; si no, el resultado o EN_CURSO."""
+        from db_config import get_db_connection
+
+        conn = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            if not self._tabla_lista:
+                cursor.execute(SQL_CREAR_TABLA)
+                self._tabla_lista = True
+            cursor.execute(SQL_RECLAMAR, (sid, IDEMPOTENCIA_EN_CURSO_MAX_S))
+            propio = cursor.fetchone() is not None
+            previo = None
+            if not propio:
+                cursor.execute("SELECT estado, resultado FROM mensajes_procesados WHERE message_sid = %s", (sid,))
+                fila = cursor.fetchone()
+                if fila:
+                    previo = EN_CURSO if fila[0] == "en_curso" else (fila[1] or "OK")
+            if time.monotonic() - self._ultima_purga > IDEMPOTENCIA_PURGA_S:
+                cursor.execute(
+                    "DELETE FROM mensajes_procesados WHERE creado < NOW() - make_interval(secs => %s)",
+                    (self.ttl,),
+                )
+                self._ultima_purga = time.monotonic()
+            conn.commit()
+            cursor.close()
+            return previo
+        except Exception as e:
+            # Si la base falla se procesa igual: mejor un posible duplicado que perder el mensaje
+            logger.warning(f"⚠️ Idempotencia en BD no disponible para {sid}: {e}")
+            if conn:
+                conn.rollback()
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    def _ejecutar_bd(self, sql, parametros):
+        from db_config import get_db_connection
+
+        conn = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute(sql, parametros)
+            conn.commit()
+            cursor.close()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo actualizar mensajes_procesados: {e}")
+            if conn:
+                conn.rollback()
+        finally:
+            if conn:
+                conn.close()
+
+
+# Instancia global usada por main.py
+idempotencia = RegistroIdempotencia()
@@ -0,0 +1,255 @@
+"""
+⚡ Vía rápida: preguntas de precios respondidas sin Gemini
+Las preguntas de estadísticas de precios ("precio promedio del concreto de 3000 psi por ciudad",
+"insumos de cemento más baratos en Bogotá", "mediana del acero en 2023") se reconocen con
+reglas y se responden desde almacen_precios en menos de un milisegundo, sin las dos llamadas
+a Gemini ni la consulta a Postgres.
+
+El reconocimiento es conservador: si la pregunta menciona proyectos, contratistas o entidades,
+no pide una estadística de precio o su tema no coincide con ningún ítem/insumo, devuelve None
+y el mensaje sigue por el pipeline normal.
+
+Estas respuestas no tienen una consulta SQL equivalente: el almacén busca sin tildes y cuenta
+cada ítem una vez por proyecto, cosa que un ILIKE sobre apus no reproduce. Por eso al historial
+no llega SQL (tampoco entran al índice de ejemplos) y el estado de la conversación recibe los
+filtros directamente.
+"""
+
+import os
+import re
+
+from log_config import get_logger
+from precios_apus import almacen_precios
+from vuelo_unico import normalizar_pregunta
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+VIA_RAPIDA_PRECIOS = os.getenv("VIA_RAPIDA_PRECIOS", "1") == "1"
+VIA_RAPIDA_TOP = int(os.getenv("VIA_RAPIDA_TOP", 5))
+VIA_RAPIDA_GRUPOS = 10  # Grupos mostrados en una comparación
+
+# Sobre la pregunta normalizada (minúsculas, sin tildes ni puntuación)
+RE_PRECIO = re.compile(r"\b(?:precios?|cuestan?|valen?|valor(?:es)?|costos?|costosos?|car[oa]s?|barat[oa]s?|economic[oa]s?)\b")
+RE_FUERA = re.compile(r"\b(?:proyectos?|obras?|contratistas?|entidad(?:es)?|contratos?|empresas?|cuantos|cuantas|total)\b")
+RE_PERCENTIL = re.compile(r"\bpercentil\s+(\d{1,2})\b")
+RE_ANIO = re.compile(r"\b(?:en|del|de|ano|anio)\s+((?:19|20)\d{2})\b(?!\s*(?:psi|mm|cm|kg|lb|m\b))")
+RE_POR = re.compile(r"\bpor\s+(ciudad(?:es)?|anos?|anios?|items?|insumos?|tipos?)\b")
+RE_INSUMO = re.compile(r"\b(?:insumos?|materiales?)\b")
+
+ESTADISTICAS = (
+    (re.compile(r"\b(?:mas|muy)\s+(?:car[oa]s?|costos[oa]s?)\b|\bmaxim[oa]s?\b|\bmas alt[oa]s?\b"), "mayores"),
+    (re.compile(r"\bmas\s+(?:barat[oa]s?|economic[oa]s?)\b|\bminim[oa]s?\b|\bmas baj[oa]s?\b"), "menores"),
+    (re.compile(r"\bmediana\b"), "mediana"),
+    (re.compile(r"\b(?:promedio|media|medio|rango|estadisticas?)\b"), "resumen"),
+)
+AGRUPACIONES = {"ciudad": "ciudad", "ano": "anio", "anio": "anio", "item": "sujeto", "insumo": "sujeto", "tipo": "tipo"}
+
+# Palabras que no forman parte del tema de la pregunta
+VACIAS = set("""
+    a al cual cuales cuanto cuanta es son el la lo los las de del un una unos unas y o en por para con
+    que me dame dime muestrame quiero saber hay tiene tienen se
+    precio precios cuesta cuestan vale valen valor valores costo costos unitario unitarios apu apus
+    promedio media medio mediana rango estadistica estadisticas percentil minimo minima maximo maxima
+    mas muy caro cara caros caras costoso costosa costosos costosas barato barata baratos baratas
+    economico economica economicos economicas alto alta altos altas bajo baja bajos bajas
+    item items insumo insumos material materiales ciudad ciudades ano anos anio anios tipo tipos
+""".split())
+
+
+class RespuestaRapida:
+    """Texto para WhatsApp, filas y filtros/forma para el estado de la conversación."""
+
+    __slots__ = ("texto", "filas", "filtros", "forma")
+
+    def __init__(self, texto, filas, filtros, forma):
+        self.texto = texto
+        self.filas = filas
+        self.filtros = filtros
+        self.forma = forma
+
+
+def _pesos(valor):
+    return f"${valor:,.0f}".replace(",", ".")
+
+
+def _corto(texto, largo=38):
+    return texto if len(texto) <= largo else texto[:largo - 1] + "…"
+
+
+def detectar_intencion_precio(pregunta, version=None):
+    """
+    Reconoce una pregunta de estadísticas de precio.
+
+    Args:
+        version (VersionPrecios): Versión del almacén a consultar (por defecto la vigente); la
+            misma que se usará para responder, así los códigos no cambian entre una y otra
+
+    Returns:
+        dict {"tabla", "sujeto", "estadistica", "percentil", "por", "ciudad", "anio"} o None
+    """
+    version = version or almacen_precios.vigente()
+    if version is None:
+        return None
+    texto = normalizar_pregunta(pregunta)
+    if not RE_PRECIO.search(texto) or RE_FUERA.search(texto):
+        return None
+    estadistica = next((nombre for patron, nombre in ESTADISTICAS if patron.search(texto)), None)
+    percentil = RE_PERCENTIL.search(texto)
+    if percentil:
+        estadistica = "percentil"
+    if estadistica is None:
+        return None
+
+    anio = RE_ANIO.search(texto)
+    por = RE_POR.search(texto)
+    restante = texto
+    if anio:
+        restante = restante.replace(anio.group(0), " ")
+    if por:
+        restante = restante.replace(por.group(0), " ")
+    if percentil:
+        restante = restante.replace(percentil.group(0), " ")
+    # Ciudades del vocabulario mencionadas con todas sus palabras
+    ciudad = None
+    for codigo, valor in enumerate(version.normalizado("ciudad")):
+        if valor and re.search(rf"\b{re.escape(valor)}\b", restante):
+            ciudad = version.etiqueta("ciudad", codigo)
+            restante = re.sub(rf"\b{re.escape(valor)}\b", " ", restante)
+            break
+    sujeto = " ".join(p for p in restante.split() if p not in VACIAS)
+    if not sujeto:
+        return None
+
+    if RE_INSUMO.search(texto):
+        tablas = ("insumos",)
+    else:
+        tablas = ("items", "insumos")
+    tabla = next((t for t in tablas if len(version.buscar(t[:-1], sujeto))), None)
+    if tabla is None:
+        return None
+    agrupacion = AGRUPACIONES.get(por.group(1).rstrip("s").replace("ciudade", "ciudad")) if por else None
+    if agrupacion == "tipo" and tabla != "insumos":
+        return None
+    return {
+        "tabla": tabla,
+        "sujeto": sujeto,
+        "estadistica": estadistica,
+        "percentil": int(percentil.group(1)) if percentil else None,
+        "por": agrupacion,
+        "ciudad": ciudad,
+        "anio": int(anio.group(1)) if anio else None,
+    }
+
+
+def _con_tildes(texto, pregunta):
+    """Palabras de texto (normalizadas) como las escribió el usuario: "excavacion" -> "excavación"."""
+    originales = {normalizar_pregunta(p): p for p in re.findall(r"\w+", pregunta.lower())}
+    return " ".join(originales.get(p, p) for p in texto.split())
+
+
+def filtros_estado(intencion, pregunta):
+    """Filtros de la respuesta con las dimensiones de estado_conversacion ({dimension: [valores]})."""
+    filtros = {"item" if intencion["tabla"] == "items" else "insumo": [_con_tildes(intencion["sujeto"], pregunta)]}
+    if intencion["ciudad"]:
+        filtros["ciudad"] = [intencion["ciudad"]]
+    if intencion["anio"]:
+        filtros["anio"] = [str(intencion["anio"])]
+    return filtros
+
+
+def forma_estado(intencion, filas):
+    """Forma de la respuesta con las claves de estado_conversacion.extraer_forma."""
+    precio = "precio_unitario" if intencion["tabla"] == "items" else "precio_unitario_apu"
+    if intencion["estadistica"] in ("mayores", "menores") and not intencion["por"]:
+        orden = "DESC" if intencion["estadistica"] == "mayores" else "ASC"
+        forma = {"tipo": "listado", "orden": f"{precio} {orden}", "limite": VIA_RAPIDA_TOP}
+    else:
+        forma = {"tipo": "comparacion" if intencion["por"] else "agregado",
+                 "agregados": ["COUNT(*)", f"AVG({precio})", f"MIN({precio})", f"MAX({precio})"]}
+        if intencion["por"]:
+            columna = {"ciudad": "ciudad", "anio": "EXTRACT(YEAR FROM fecha_aprobacion_apu)",
+                       "sujeto": "items_descripcion" if intencion["tabla"] == "items" else "insumo_descripcion",
+                       "tipo": "tipo_insumo"}[intencion["por"]]
+            forma["agrupado_por"] = [columna]
+    forma["filas"] = len(filas)
+    if filas:
+        forma["columnas"] = list(filas[0].keys())
+    return forma
+
+
+def _encabezado(titulo, intencion):
+    lineas = [f"📊 {titulo}", f"🏗️ {intencion['sujeto'].upper()}"]
+    filtros = [f for f in (intencion["ciudad"], intencion["anio"]) if f]
+    if filtros:
+        lineas.append("📍 " + " · ".join(str(f) for f in filtros))
+    return lineas
+
+
+def _formatear(intencion, filas):
+    unidad = "APUs" if intencion["tabla"] == "items" else "registros"
+    estadistica = intencion["estadistica"]
+    if estadistica in ("mayores", "menores") and not intencion["por"]:
+        titulo = "MÁS CAROS" if estadistica == "mayores" else "MÁS ECONÓMICOS"
+        lineas = _encabezado(titulo, intencion) + [""]
+        for n, f in enumerate(filas, 1):
+            lugar = ", ".join(str(v) for v in (f["ciudad"], f["anio"]) if v)
+            lineas.append(f"{n}. {_corto(f['descripcion'])} - {_pesos(f['precio'])}")
+            lineas.append(f"   {_corto(f['proyecto'], 34)} ({lugar})")
+        return "\n".join(lineas)
+
+    clave, nombre = {
+        "mayores": ("maximo", "MÁXIMO"),
+        "menores": ("minimo", "MÍNIMO"),
+        "mediana": ("p50", "MEDIANA"),
+        "percentil": (f"p{intencion['percentil']}", f"PERCENTIL {intencion['percentil']}"),
+    }.get(estadistica, ("promedio", "PROMEDIO"))
+    if intencion["por"]:
+        por = {"ciudad": "CIUDAD", "anio": "AÑO", "sujeto": "ÍTEM" if intencion["tabla"] == "items" else "INSUMO",
+               "tipo": "TIPO"}[intencion["por"]]
+        lineas = _encabezado(f"PRECIO {nombre} POR {por}", intencion) + [""]
+        if intencion["por"] == "anio":
+            filas = sorted(filas, key=lambda f: f["grupo"] or 0, reverse=True)
+        for n, f in enumerate(filas[:VIA_RAPIDA_GRUPOS], 1):
+            lineas.append(f"{n}. {_corto(str(f['grupo'] or 'Sin dato'), 30)} - {_pesos(f[clave])} ({f['n']})")
+        if len(filas) > VIA_RAPIDA_GRUPOS:
+            lineas.append(f"… y {len(filas) - VIA_RAPIDA_GRUPOS} más")
+        return "\n".join(lineas)
+
+    f = filas[0]
+    lineas = _encabezado("PRECIO UNITARIO", intencion) + [
+        f"Registros: {f['n']} {unidad}",
+        "",
+        f"💰 Promedio: {_pesos(f['promedio'])}",
+        f"Mediana: {_pesos(f['p50'])}",
+        f"Mínimo: {_pesos(f['minimo'])}",
+        f"Máximo: {_pesos(f['maximo'])}",
+    ]
+    if estadistica == "percentil":
+        lineas.insert(-3, f"Percentil {intencion['percentil']}: {_pesos(f[clave])}")
+    return "\n".join(lineas)
+
+
+def responder_via_rapida(pregunta):
+    """RespuestaRapida si la pregunta es de estadísticas de precio y hay almacén; None si no."""
+    if not VIA_RAPIDA_PRECIOS:
+        return None
+    # Una sola versión para detectar y responder aunque se publique otra en medio
+    version = almacen_precios.vigente()
+    if version is None:
+        return None
+    intencion = detectar_intencion_precio(pregunta, version)
+    if intencion is None:
+        return None
+    filtros = {"sujeto": intencion["sujeto"], "ciudad": intencion["ciudad"], "anio": intencion["anio"]}
+    if intencion["estadistica"] in ("mayores", "menores") and not intencion["por"]:
+        filas = version.top(intencion["tabla"], k=VIA_RAPIDA_TOP,
+                            mayores=intencion["estadistica"] == "mayores", **filtros)
+    else:
+        percentiles = (50,) if intencion["percentil"] in (None, 50) else (50, intencion["percentil"])
+        filas = version.estadisticas(intencion["tabla"], por=intencion["por"],
+                                     percentiles=percentiles, **filtros)
+    if not filas:
+        return None  # Sin datos con esos filtros: que responda el pipeline normal
+    return RespuestaRapida(_formatear(intencion, filas), filas, filtros_estado(intencion, pregunta),
+                           forma_estado(intencion, filas))
@@ -5,27 +5,32 @@ Loads APU data from CSV file to PostgreSQL database with data cleaning and valid
 
 import csv
 import os
+import sys
 from datetime import datetime
 import chardet
 
 from db_config import get_db_connection
 from psycopg2 import Error
+from log_config import get_logger
+from snapshot_apus import exportar_snapshot, SNAPSHOT_EXPORTAR
+from precios_apus import construir_almacen, PRECIOS_CONSTRUIR
+
+logger = get_logger(__name__)
 
 # ============ CONFIGURACIÓN ============
-CSV_PATH = r"C:\Users\cgrub\Downloads\apus_csv\APUS_V8.csv"
+CSV_PATH = os.getenv("APUS_CSV_PATH", r"C:\Users\cgrub\Downloads\apus_csv\APUS_V8.csv")
 BATCH_SIZE = 1000  # Tamaño del lote para inserción masiva
+COLUMNAS_CSV = 22
 
 
-# ============ VERIFICAR ARCHIVO CSV ============
-if not os.path.exists(CSV_PATH):
-    print(f"❌ Error: No se encontró el archivo CSV en: {CSV_PATH}")
-    exit()
+# ============ DETECTAR ENCODING ============
 
-# Detectar encoding del archivo
-print(f"📂 Leyendo archivo: {CSV_PATH}")
-with open(CSV_PATH, "rb") as f:
-    detectado = chardet.detect(f.read())
-print(f"🔎 Encoding detectado: {detectado['encoding']} (confianza: {detectado['confidence']:.2%})")
+def detectar_encoding(csv_path):
+    """Detecta el encoding del archivo con chardet."""
+    with open(csv_path, "rb") as f:
+        detectado = chardet.detect(f.read())
+    logger.info(f"🔎 Encoding detectado: {detectado['encoding']} (confianza: {detectado['confidence']:.2%})")
+    return detectado["encoding"]
 
 
 # ============ FUNCIONES DE LIMPIEZA ============
@@ -80,74 +85,71 @@ def clean_text(value):
 
 
 # ============ LEER Y LIMPIAR DATOS DEL CSV ============
-DATA_TO_INSERT = []
-errores = []
-errores_db = []
-header = []
 
-print("\n📖 Leyendo y limpiando datos del CSV...")
+def leer_csv(csv_path, encoding):
+    """
+    Lee y limpia el CSV de APUs.
 
-with open(CSV_PATH, "r", encoding=detectado["encoding"], errors="replace") as file:
-    reader = csv.reader(file, delimiter=';')
-    header = next(reader)  # Guardar encabezado
-    
-    print(f"📋 Columnas encontradas en el CSV: {len(header)}")
-    print(f"   {', '.join(header[:5])}... (mostrando primeras 5)")
-    
-    for linea, row in enumerate(reader, start=2):
-        try:
-            # Asegurarse de que la fila tenga el número correcto de columnas
-            if len(row) < 22:
-                print(f"⚠️  Fila {linea}: Tiene {len(row)} columnas, se esperaban 22. Saltando...")
-                errores.append([linea] + row + ['ERROR: Columnas insuficientes'])
-                continue
-            
-            # Crear una copia de la fila para limpiar
-            cleaned_row = row.copy()
-            
-            # A. Limpieza de Fechas (Índices 0, 1)
-            cleaned_row[0] = clean_date(row[0])  # fecha_aprobacion_apu
-            cleaned_row[1] = clean_date(row[1])  # fecha_analisis_apu
-            
-            # B. Limpieza de Textos (Índices 2-10, 13-16, 20-21)
-            text_indices = [2, 3, 4, 5, 6, 7, 8, 9, 10, 13, 14, 15, 16, 20, 21]
-            for idx in text_indices:
-                if idx < len(cleaned_row):
-                    cleaned_row[idx] = clean_text(row[idx])
-            
-            # C. Limpieza de Números (Índices: 11, 12, 17, 18, 19)
-            numeric_indices = [11, 12, 17, 18, 19]
-            for idx in numeric_indices:
-                if idx < len(cleaned_row):
-                    cleaned_row[idx] = clean_numeric(row[idx])
-            
-            # Añadir la fila limpia como tupla
-            DATA_TO_INSERT.append(tuple(cleaned_row))
-            
-            # Mostrar progreso cada 1000 filas
-            if linea % 1000 == 0:
-                print(f"   Procesadas {linea - 1} filas...")
-                
-        except Exception as e:
-            print(f"❌ Error en fila {linea}: {e}")
-            errores.append([linea] + row + [f'ERROR: {str(e)}'])
-
-print(f"\n✅ Total de filas limpiadas y listas: {len(DATA_TO_INSERT)}")
-print(f"❌ Filas con errores de formato: {len(errores)}")
+    Returns:
+        tuple: (filas limpias como tuplas, filas con error de formato, encabezado)
+    """
+    data_to_insert = []
+    errores = []
 
+    logger.info("📖 Leyendo y limpiando datos del CSV...")
 
-# ============ INSERCIÓN MASIVA EN LOTES ============
-print("\n🔌 Conectando a la base de datos...")
+    with open(csv_path, "r", encoding=encoding, errors="replace") as file:
+        reader = csv.reader(file, delimiter=';')
+        header = next(reader)  # Guardar encabezado
 
-try:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    print("✅ Conexión exitosa")
-except Exception as e:
-    print(f"❌ Error al conectar: {e}")
-    exit()
+        logger.info(f"📋 Columnas encontradas en el CSV: {len(header)}")
+        logger.info(f"   {', '.join(header[:5])}... (mostrando primeras 5)")
+
+        for linea, row in enumerate(reader, start=2):
+            try:
+                # Asegurarse de que la fila tenga el número correcto de columnas
+                if len(row) < COLUMNAS_CSV:
+                    logger.warning(f"⚠️  Fila {linea}: Tiene {len(row)} columnas, se esperaban {COLUMNAS_CSV}. Saltando...")
+                    errores.append([linea] + row + ['ERROR: Columnas insuficientes'])
+                    continue
+
+                # Crear una copia de la fila para limpiar
+                cleaned_row = row.copy()
+
+                # A. Limpieza de Fechas (Índices 0, 1)
+                cleaned_row[0] = clean_date(row[0])  # fecha_aprobacion_apu
+                cleaned_row[1] = clean_date(row[1])  # fecha_analisis_apu
+
+                # B. Limpieza de Textos (Índices 2-10, 13-16, 20-21)
+                text_indices = [2, 3, 4, 5, 6, 7, 8, 9, 10, 13, 14, 15, 16, 20, 21]
+                for idx in text_indices:
+                    if idx < len(cleaned_row):
+                        cleaned_row[idx] = clean_text(row[idx])
+
+                # C. Limpieza de Números (Índices: 11, 12, 17, 18, 19)
+                numeric_indices = [11, 12, 17, 18, 19]
+                for idx in numeric_indices:
+                    if idx < len(cleaned_row):
+                        cleaned_row[idx] = clean_numeric(row[idx])
+
+                # Añadir la fila limpia como tupla
+                data_to_insert.append(tuple(cleaned_row))
+
+                # Mostrar progreso cada 1000 filas
+                if linea % 1000 == 0:
+                    logger.info(f"   Procesadas {linea - 1} filas...")
+
+            except Exception as e:
+                logger.error(f"❌ Error en fila {linea}: {e}")
+                errores.append([linea] + row + [f'ERROR: {str(e)}'])
+
+    logger.info(f"✅ Total de filas limpiadas y listas: {len(data_to_insert)}")
+    logger.warning(f"❌ Filas con errores de formato: {len(errores)}")
+    return data_to_insert, errores, header
 
-sql = """
+
+# ============ INSERCIÓN MASIVA EN LOTES ============
+SQL_INSERT = """
     INSERT INTO apus (
         fecha_aprobacion_apu, fecha_analisis_apu,
         ciudad, pais, entidad, contratista, nombre_proyecto,
@@ -162,84 +164,162 @@ sql = """
             %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
 """
 
-total = len(DATA_TO_INSERT)
-exitos = 0
-lotes_procesados = 0
 
-if total > 0:
-    print(f"\n🚀 Iniciando carga masiva en lotes de {BATCH_SIZE}...")
-    print(f"   Total de lotes a procesar: {(total + BATCH_SIZE - 1) // BATCH_SIZE}")
-    
-    for i in range(0, total, BATCH_SIZE):
-        batch = DATA_TO_INSERT[i:i + BATCH_SIZE]
-        lotes_procesados += 1
-        
-        try:
-            cursor.executemany(sql, batch)
-            conn.commit()  # Commit después de cada lote exitoso
-            exitos += len(batch)
-            print(f"✅ Lote {lotes_procesados} ({len(batch)} registros) - Fila CSV inicial: {i + 2}")
-            
-        except Error as e:
-            conn.rollback()  # Rollback en caso de error
-            error_msg = f"Lote {lotes_procesados} (fila inicial CSV: {i + 2}): {str(e)}"
-            print(f"❌ Error en {error_msg}")
-            errores_db.append(error_msg)
-            
-            # Intentar insertar fila por fila en caso de error de lote
-            print(f"   🔄 Intentando inserción fila por fila para este lote...")
-            for j, row in enumerate(batch):
-                try:
-                    cursor.execute(sql, row)
-                    conn.commit()
-                    exitos += 1
-                except Error as row_error:
-                    conn.rollback()
-                    fila_csv = i + j + 2
-                    print(f"   ❌ Error en fila CSV {fila_csv}: {row_error}")
-                    errores_db.append(f"Fila CSV {fila_csv}: {str(row_error)}")
-else:
-    print("\n⚠️  No hay datos para insertar.")
-
-# ============ CERRAR CONEXIÓN ============
-cursor.close()
-conn.close()
-print("\n🔒 Conexión cerrada.")
-
-# ============ RESUMEN FINAL ============
-print("\n" + "="*60)
-print("📊 RESUMEN DE LA CARGA")
-print("="*60)
-print(f"✅ Total filas procesadas (limpias): {total}")
-print(f"✅ Filas insertadas correctamente: {exitos}")
-print(f"❌ Filas con error de formato: {len(errores)}")
-print(f"❌ Errores de base de datos: {len(errores_db)}")
-print(f"📦 Lotes procesados: {lotes_procesados}")
-
-# Calcular tasa de éxito
-if total > 0:
-    tasa_exito = (exitos / total) * 100
-    print(f"📈 Tasa de éxito: {tasa_exito:.2f}%")
+def insertar_lotes(conn, data_to_insert, batch_size=BATCH_SIZE):
+    """
+    Inserta las filas en lotes; si un lote falla, reintenta fila por fila.
+
+    Returns:
+        tuple: (filas insertadas, errores de base de datos, lotes procesados)
+    """
+    cursor = conn.cursor()
+    total = len(data_to_insert)
+    exitos = 0
+    lotes_procesados = 0
+    errores_db = []
+
+    if total > 0:
+        logger.info(f"🚀 Iniciando carga masiva en lotes de {batch_size}...")
+        logger.info(f"   Total de lotes a procesar: {(total + batch_size - 1) // batch_size}")
+
+        for i in range(0, total, batch_size):
+            batch = data_to_insert[i:i + batch_size]
+            lotes_procesados += 1
+
+            try:
+                cursor.executemany(SQL_INSERT, batch)
+                conn.commit()  # Commit después de cada lote exitoso
+                exitos += len(batch)
+                logger.info(f"✅ Lote {lotes_procesados} ({len(batch)} registros) - Fila CSV inicial: {i + 2}")
+
+            except Error as e:
+                conn.rollback()  # Rollback en caso de error
+                error_msg = f"Lote {lotes_procesados} (fila inicial CSV: {i + 2}): {str(e)}"
+                logger.error(f"❌ Error en {error_msg}")
+                errores_db.append(error_msg)
+
+                # Intentar insertar fila por fila en caso de error de lote
+                logger.info(f"   🔄 Intentando inserción fila por fila para este lote...")
+                for j, row in enumerate(batch):
+                    try:
+                        cursor.execute(SQL_INSERT, row)
+                        conn.commit()
+                        exitos += 1
+                    except Error as row_error:
+                        conn.rollback()
+                        fila_csv = i + j + 2
+                        logger.error(f"   ❌ Error en fila CSV {fila_csv}: {row_error}")
+                        errores_db.append(f"Fila CSV {fila_csv}: {str(row_error)}")
+    else:
+        logger.warning("⚠️  No hay datos para insertar.")
+
+    cursor.close()
+    return exitos, errores_db, lotes_procesados
+
 
 # ============ GUARDAR ARCHIVOS DE ERROR ============
-if errores:
-    error_file = "errores_formato.csv"
-    with open(error_file, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f, delimiter=';')
-        writer.writerow(["fila_original"] + header + ["error"])
-        writer.writerows(errores)
-    print(f"\n📁 Archivo '{error_file}' generado con {len(errores)} filas con errores de formato.")
-
-if errores_db:
-    error_db_file = "errores_database.txt"
-    with open(error_db_file, "w", encoding="utf-8") as f:
-        f.write("ERRORES DE BASE DE DATOS\n")
-        f.write("="*60 + "\n\n")
-        for error in errores_db:
-            f.write(f"{error}\n")
-    print(f"📁 Archivo '{error_db_file}' generado con {len(errores_db)} errores de base de datos.")
-
-if not errores and not errores_db:
-    print("\n🎉 ¡Carga completada sin errores!")
-
-print("\n✨ Proceso finalizado.")
+
+def guardar_errores(errores, errores_db, header):
+    """Escribe errores_formato.csv y errores_database.txt si hubo errores."""
+    if errores:
+        error_file = "errores_formato.csv"
+        with open(error_file, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(["fila_original"] + header + ["error"])
+            writer.writerows(errores)
+        logger.info(f"📁 Archivo '{error_file}' generado con {len(errores)} filas con errores de formato.")
+
+    if errores_db:
+        error_db_file = "errores_database.txt"
+        with open(error_db_file, "w", encoding="utf-8") as f:
+            f.write("ERRORES DE BASE DE DATOS\n")
+            f.write("="*60 + "\n\n")
+            for error in errores_db:
+                f.write(f"{error}\n")
+        logger.info(f"📁 Archivo '{error_db_file}' generado con {len(errores_db)} errores de base de datos.")
+
+
+# ============ CARGA COMPLETA ============
+
+def load_apus_csv(csv_path=CSV_PATH, batch_size=BATCH_SIZE, guardar_archivos_error=True):
+    """
+    Carga el CSV de APUs en la tabla apus (detectar encoding, limpiar, insertar en lotes).
+
+    Returns:
+        dict: Resumen de la carga, o None si no se pudo leer el archivo o conectar
+    """
+    if not os.path.exists(csv_path):
+        logger.error(f"❌ Error: No se encontró el archivo CSV en: {csv_path}")
+        return None
+
+    logger.info(f"📂 Leyendo archivo: {csv_path}")
+    encoding = detectar_encoding(csv_path)
+    data_to_insert, errores, header = leer_csv(csv_path, encoding)
+
+    logger.info("🔌 Conectando a la base de datos...")
+    try:
+        conn = get_db_connection()
+        logger.info("✅ Conexión exitosa")
+    except Exception as e:
+        logger.error(f"❌ Error al conectar: {e}")
+        return None
+
+    try:
+        exitos, errores_db, lotes_procesados = insertar_lotes(conn, data_to_insert, batch_size)
+    finally:
+        conn.close()
+        logger.info("🔒 Conexión cerrada.")
+
+    if guardar_archivos_error:
+        guardar_errores(errores, errores_db, header)
+
+    # Snapshot columnar para el motor analítico local (MOTOR_ANALITICO=local)
+    snapshot = exportar_snapshot() if SNAPSHOT_EXPORTAR and exitos else None
+    # Arreglos de precios para la vía rápida (intenciones.py)
+    precios = construir_almacen() if PRECIOS_CONSTRUIR and exitos else None
+
+    return {
+        "encoding": encoding,
+        "total": len(data_to_insert),
+        "exitos": exitos,
+        "errores_formato": len(errores),
+        "errores_db": len(errores_db),
+        "lotes": lotes_procesados,
+        "snapshot": snapshot,
+        "precios": precios,
+    }
+
+
+def imprimir_resumen(resumen):
+    """Resumen final de la carga en consola."""
+    total = resumen["total"]
+    print("\n" + "="*60)
+    print("📊 RESUMEN DE LA CARGA")
+    print("="*60)
+    print(f"✅ Total filas procesadas (limpias): {total}")
+    print(f"✅ Filas insertadas correctamente: {resumen['exitos']}")
+    print(f"❌ Filas con error de formato: {resumen['errores_formato']}")
+    print(f"❌ Errores de base de datos: {resumen['errores_db']}")
+    print(f"📦 Lotes procesados: {resumen['lotes']}")
+    if resumen.get("snapshot"):
+        print(f"🧊 Snapshot: {resumen['snapshot']['ruta']} ({resumen['snapshot']['filas']} filas)")
+    if resumen.get("precios"):
+        print(f"💹 Almacén de precios: {resumen['precios']['version']} ({resumen['precios']['items']} ítems)")
+
+    # Calcular tasa de éxito
+    if total > 0:
+        tasa_exito = (resumen["exitos"] / total) * 100
+        print(f"📈 Tasa de éxito: {tasa_exito:.2f}%")
+
+    if not resumen["errores_formato"] and not resumen["errores_db"]:
+        print("\n🎉 ¡Carga completada sin errores!")
+
+    print("\n✨ Proceso finalizado.")
+
+
+if __name__ == "__main__":
+    # Ruta del CSV como argumento opcional (por defecto APUS_CSV_PATH / CSV_PATH)
+    resumen = load_apus_csv(sys.argv[1] if len(sys.argv) > 1 else CSV_PATH)
+    if resumen is None:
+        sys.exit(1)
+    imprimir_resumen(resumen)
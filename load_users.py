@@ -1,74 +1,133 @@
 import csv
+import json
 import os
+import sys
 from db_config import get_db_connection
 from psycopg2 import Error
+from log_config import get_logger
+
+logger = get_logger(__name__)
 
 CSV_PATH = r"c:\Users\cgrub\OneDrive\Documents\apus_mab\apus_mab\usuarios2.csv"
 
-def load_users():
-    if not os.path.exists(CSV_PATH):
-        print(f"❌ Error: No se encontró el archivo CSV en: {CSV_PATH}")
-        return
+# Canal que escuchan las instancias del bot para refrescar su caché de autorización
+CANAL_USUARIOS = "usuarios_actualizados"
+
+# Upsert de todo el archivo en una sola sentencia (un único viaje a la BD).
+# Requiere la restricción UNIQUE (telefono): ver create_usuarios_constraint.py
+SQL_UPSERT = """
+    WITH datos AS (
+        SELECT *
+        FROM unnest(%(nombres)s::text[], %(telefonos)s::text[], %(roles)s::text[], %(activos)s::boolean[])
+             AS d(nombre, telefono, rol, activo)
+    ),
+    upsert AS (
+        INSERT INTO usuarios (nombre, telefono, rol, activo)
+        SELECT nombre, telefono, rol, activo FROM datos
+        ON CONFLICT (telefono) DO UPDATE
+        SET nombre = EXCLUDED.nombre, rol = EXCLUDED.rol, activo = EXCLUDED.activo
+        RETURNING (xmax = 0) AS insertado
+    ),
+    desactivados AS (
+        UPDATE usuarios
+        SET activo = false
+        WHERE %(desactivar)s
+          AND activo = true
+          AND telefono <> ALL(%(telefonos)s::text[])
+        RETURNING telefono
+    )
+    SELECT
+        (SELECT COUNT(*) FROM upsert WHERE insertado) AS insertados,
+        (SELECT COUNT(*) FROM upsert WHERE NOT insertado) AS actualizados,
+        (SELECT COUNT(*) FROM desactivados) AS desactivados
+"""
+
+
+def leer_usuarios(csv_path):
+    """Lee el CSV y devuelve los usuarios indexados por teléfono (el último registro gana)."""
+    usuarios = {}
 
-    print(f"📂 Leyendo archivo: {CSV_PATH}")
-    
-    users_to_insert = []
-    
     # Read CSV with semi-colon delimiter
-    with open(CSV_PATH, "r", encoding="utf-8") as file:
+    with open(csv_path, "r", encoding="utf-8") as file:
         reader = csv.DictReader(file, delimiter=';')
         for row in reader:
             # Clean and prepare data
-            telefono = row.get('telefono', '').strip()
-            nombre = row.get('nombre', '').strip()
-            rol = row.get('rol', '').strip()
+            telefono = (row.get('telefono') or '').strip()
+            nombre = (row.get('nombre') or '').strip()
+            rol = (row.get('rol') or '').strip()
             if not rol:
                 rol = 'user'
-            
+
             # Default active to True
             activo = True
-            
+
             # Skip if phone is empty
             if not telefono:
                 continue
-                
-            users_to_insert.append((nombre, telefono, rol, activo))
 
-    print(f"✅ Se encontraron {len(users_to_insert)} usuarios para insertar.")
+            # ON CONFLICT no admite la misma clave dos veces en una sentencia
+            if telefono in usuarios:
+                logger.warning(f"⚠️ Teléfono {telefono} repetido en el archivo. Se usa el último registro.")
+            usuarios[telefono] = (nombre, telefono, rol, activo)
+
+    return usuarios
+
+
+def load_users(csv_path=CSV_PATH, desactivar_faltantes=False):
+    if not os.path.exists(csv_path):
+        logger.error(f"❌ Error: No se encontró el archivo CSV en: {csv_path}")
+        return
+
+    logger.info(f"📂 Leyendo archivo: {csv_path}")
+
+    usuarios = leer_usuarios(csv_path)
+
+    logger.info(f"✅ Se encontraron {len(usuarios)} usuarios para sincronizar.")
 
-    if not users_to_insert:
+    if not usuarios:
         return
 
-    print("\n🔌 Conectando a la base de datos...")
+    filas = list(usuarios.values())
+    params = {
+        "nombres": [f[0] for f in filas],
+        "telefonos": [f[1] for f in filas],
+        "roles": [f[2] for f in filas],
+        "activos": [f[3] for f in filas],
+        "desactivar": desactivar_faltantes,
+    }
+
+    logger.info("🔌 Conectando a la base de datos...")
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        for nombre, telefono, rol, activo in users_to_insert:
-            # Check if user exists
-            cursor.execute("SELECT id FROM usuarios WHERE telefono = %s", (telefono,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                print(f"⚠️ Usuario {nombre} ({telefono}) ya existe. Actualizando...")
-                cursor.execute("""
-                    UPDATE usuarios 
-                    SET nombre = %s, rol = %s, activo = %s 
-                    WHERE telefono = %s
-                """, (nombre, rol, activo, telefono))
-            else:
-                print(f"➕ Insertando usuario {nombre} ({telefono})...")
-                cursor.execute("""
-                    INSERT INTO usuarios (nombre, telefono, rol, activo)
-                    VALUES (%s, %s, %s, %s)
-                """, (nombre, telefono, rol, activo))
-        
+
+        cursor.execute(SQL_UPSERT, params)
+        insertados, actualizados, desactivados = cursor.fetchone()
+
+        # NOTIFY es transaccional: solo se entrega si el commit tiene éxito
+        aviso = json.dumps({
+            "insertados": insertados,
+            "actualizados": actualizados,
+            "desactivados": desactivados,
+        })
+        cursor.execute("SELECT pg_notify(%s, %s)", (CANAL_USUARIOS, aviso))
+
         conn.commit()
-        print("\n🎉 Usuarios procesados correctamente.")
-        
+        cursor.close()
+
+        logger.info(f"➕ Insertados: {insertados}")
+        logger.info(f"🔁 Actualizados: {actualizados}")
+        if desactivar_faltantes:
+            logger.info(f"🚫 Desactivados (no están en el archivo): {desactivados}")
+        logger.info("🎉 Usuarios procesados correctamente.")
+
+    except Error as e:
+        logger.error(f"❌ Error al sincronizar usuarios: {e}")
+        if conn:
+            conn.rollback()
     except Exception as e:
-        print(f"❌ Error al conectar o insertar: {e}")
+        logger.error(f"❌ Error al conectar o insertar: {e}")
         if conn:
             conn.rollback()
     finally:
@@ -76,4 +135,5 @@ def load_users():
             conn.close()
 
 if __name__ == "__main__":
-    load_users()
+    # Uso: python load_users.py [--desactivar-faltantes]
+    load_users(desactivar_faltantes="--desactivar-faltantes" in sys.argv)
@@ -0,0 +1,156 @@
+"""
+📝 Logging Configuration Module
+Structured JSON logging with a background queue handler, levels, sampling of verbose
+payloads and size-truncated fields. Every record carries the current request ID.
+
+Usage:
+    from log_config import get_logger, campos
+    logger = get_logger(__name__)
+    logger.info("✅ Mensaje enviado", extra=campos(destino=to))
+    logger.debug("📊 Resultados SQL", extra=campos(resultados=rows, muestra=0.01))
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+from metricas import request_id_var
+
+# ============ CONFIGURACIÓN ============
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" para producción; "texto" para consola. Por defecto: texto si la salida es una terminal
+LOG_FORMATO = os.getenv("LOG_FORMATO", "texto" if sys.stdout.isatty() else "json")
+LOG_MAX_CAMPO = int(os.getenv("LOG_MAX_CAMPO", 2000))  # Caracteres por campo
+LOG_MUESTREO_VERBOSO = float(os.getenv("LOG_MUESTREO_VERBOSO", 0.01))  # Fracción de payloads grandes
+LOG_COLA_MAX = int(os.getenv("LOG_COLA_MAX", 10000))
+
+_listener = None
+_lock = threading.Lock()
+
+
+def truncar(valor, limite=LOG_MAX_CAMPO):
+    """Convierte a texto (si hace falta) y recorta a `limite` caracteres."""
+    if isinstance(valor, (int, float, bool)) or valor is None:
+        return valor
+    if not isinstance(valor, str):
+        try:
+            valor = json.dumps(valor, ensure_ascii=False, default=str)
+        except Exception:
+            valor = repr(valor)
+    if len(valor) > limite:
+        return f"{valor[:limite]}…(+{len(valor) - limite})"
+    return valor
+
+
+def campos(muestra=None, **valores):
+    """Arma el `extra` de un registro: campos estructurados y, opcionalmente, su tasa de muestreo."""
+    extra = {"campos": valores}
+    if muestra is not None:
+        extra["muestra"] = muestra
+    return extra
+
+
+class FormateadorJSON(logging.Formatter):
+    """Una línea JSON por registro."""
+
+    def format(self, record):
+        registro = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": truncar(record.getMessage()),
+        }
+        for clave, valor in getattr(record, "campos", {}).items():
+            registro[clave] = truncar(valor)
+        if record.exc_text:
+            registro["excepcion"] = truncar(record.exc_text)
+        return json.dumps(registro, ensure_ascii=False, default=str)
+
+
+class FormateadorTexto(logging.Formatter):
+    """Formato legible para consola, con los mismos campos al final."""
+
+    def format(self, record):
+        ts = datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S")
+        linea = f"[{ts}] [{getattr(record, 'request_id', '-')}] {truncar(record.getMessage())}"
+        extra = getattr(record, "campos", {})
+        if extra:
+            linea += " " + " ".join(f"{k}={truncar(v)}" for k, v in extra.items())
+        if record.exc_text:
+            linea += "\n" + record.exc_text
+        return linea
+
+
+class FiltroContexto(logging.Filter):
+    """Agrega el request_id y descarta registros muestreados (extra muestra=<fracción>)."""
+
+    def filter(self, record):
+        muestra = getattr(record, "muestra", None)
+        if muestra is not None and random.random() >= muestra:
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que no bloquea: si la cola está llena, descarta el registro."""
+
+    def prepare(self, record):
+        # Formatear el mensaje aquí (hilo de la petición) y soltar referencias pesadas
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def configurar_logging(nivel=LOG_LEVEL, formato=LOG_FORMATO):
+    """Configura el logger raíz con un QueueHandler y un hilo que escribe en stdout (idempotente)."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        salida = logging.StreamHandler(sys.stdout)
+        salida.setFormatter(FormateadorJSON() if formato == "json" else FormateadorTexto())
+
+        cola = queue.Queue(maxsize=LOG_COLA_MAX)
+        manejador = _QueueHandler(cola)
+        manejador.addFilter(FiltroContexto())
+
+        raiz = logging.getLogger()
+        raiz.handlers = [manejador]
+        raiz.setLevel(nivel)
+
+        _listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=False)
+        _listener.start()
+        atexit.register(detener_logging)
+
+
+def detener_logging():
+    """Vacía la cola de logs (se llama al salir)."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(nombre):
+    """Devuelve el logger del módulo, configurando el logging la primera vez."""
+    configurar_logging()
+    return logging.getLogger(nombre)
@@ -2,24 +2,56 @@
 # 📦 main.py — MAPUS BOT IA SQL + APU + CONTROL DE USUARIOS
 # ===============================
 
-from fastapi import FastAPI, Request
+import asyncio
+import contextvars
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from psycopg2.extras import RealDictCursor
 
 import requests
 import json
 import re
 import os
+import select
+import threading
 import time
 from datetime import datetime
+from functools import partial
 from dotenv import load_dotenv
 
 # Import centralized database configuration
-from db_config import get_db_connection, execute_query
+from db_config import (get_db_connection, execute_query, registrar_escritura, lecturas, pool_primaria,
+                       registrar_sentencia, ejecutar_preparada, ejecutar_generada)
+from escritor_historial import escritor_historial
+from cache_historial import cache_historial
+from estado_conversacion import estados_conversacion, depende_del_contexto
+from consultas_lentas import consultas_lentas
+from idempotencia import idempotencia
+from perfilador import perfilador, vigilante_bucle, listar_volcados, leer_volcado
+from rafagas import rafagas
+from admision import admision, mensaje_rechazo
+from enrutador_modelos import enrutador, ErrorModelo
+from resiliencia import interruptores, iniciar_plazo, presupuesto, CircuitoAbierto, PlazoVencido, ABIERTO, PLAZO_MINIMO_S
+from partes_whatsapp import EnsambladorPartes
+from ejemplos_sql import indice_ejemplos, prompt_sql_compacto, es_ejemplo_valido
+from snapshot_apus import motor_local, MOTOR_ANALITICO
+from intenciones import responder_via_rapida
+from vuelo_unico import vuelos_sql, vuelos_consulta, vuelos_resumen, normalizar_pregunta
+from sql_canonico import huella, normalizar
+from metricas import (
+    registro, etapa, etapa_actual, iniciar_peticion, registrar_error, resumen_tramos, modelos,
+    PETICIONES, DURACION_PETICION, CACHE, LLM_TOKENS, LLM_LLAMADAS, LLM_AHORRADAS, FILAS_SQL
+)
+from log_config import get_logger, campos, LOG_MUESTREO_VERBOSO
+
+logger = get_logger("main")
 
 try:
     from twilio.rest import Client
+    from twilio.http.http_client import TwilioHttpClient
 except Exception as e:
-    print(f"⚠️ Twilio import failed: {e}")
+    logger.warning(f"⚠️ Twilio import failed: {e}")
     Client = None
 
 # ===============================
@@ -30,14 +62,36 @@ app = FastAPI()
 
 # Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# "ejemplos": esquema compacto + ejemplos recuperados (ejemplos_sql.py); "completo": prompt fijo anterior
+PROMPT_SQL_MODO = os.getenv("PROMPT_SQL_MODO", "ejemplos")
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "1") == "1"  # Resumen por streamGenerateContent
+# Modelo por etapa (GEMINI_MODEL, GEMINI_MODELOS_SQL, GEMINI_MODELOS_RESUMEN): ver enrutador_modelos.py
+# Permite apuntar a un doble local (bench_stubs.py) en benchmarks
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+# Respuestas de gemini_generate cuando la IA no respondió completa: no se comparten (vuelo único)
+GEMINI_SIN_TIEMPO = "⏱️ La IA está tardando demasiado en responder. Intenta de nuevo en unos minutos."
+GEMINI_FALLO = "No se pudo procesar tu solicitud con la IA."
+GEMINI_SIN_CONEXION = "Error al conectar con la IA de Gemini."
+GEMINI_INTERRUMPIDA = "\n\n⚠️ La respuesta se interrumpió. Intenta de nuevo."
 
 # Twilio
 if Client:
     ACCOUNT_SID = os.getenv("ACCOUNT_SID")
     AUTH_TOKEN = os.getenv("AUTH_TOKEN")
     FROM_WHATSAPP = os.getenv("FROM_WHATSAPP")
-    client = Client(ACCOUNT_SID, AUTH_TOKEN)
+    TWILIO_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL")
+    TWILIO_TIMEOUT_S = float(os.getenv("TWILIO_TIMEOUT_S", 10))
+
+    class _TwilioHttpClientLocal(TwilioHttpClient):
+        """Redirige las llamadas de la API de Twilio a TWILIO_API_BASE_URL (benchmarks)."""
+
+        def request(self, method, url, *args, **kwargs):
+            url = url.replace("https://api.twilio.com", TWILIO_API_BASE_URL.rstrip("/"), 1)
+            return super().request(method, url, *args, **kwargs)
+
+    # Sin timeout, un Twilio colgado retiene el hilo indefinidamente
+    http_client = (_TwilioHttpClientLocal if TWILIO_API_BASE_URL else TwilioHttpClient)(timeout=TWILIO_TIMEOUT_S)
+    client = Client(ACCOUNT_SID, AUTH_TOKEN, http_client=http_client)
 else:
     ACCOUNT_SID = AUTH_TOKEN = FROM_WHATSAPP = None
     client = None
@@ -45,38 +99,169 @@ else:
 # ===============================
 # 🧠 FUNCIONES AUXILIARES
 # ===============================
-def log(msg):
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
+def _llamar_gemini(modelo: str, prompt: str) -> str:
+    """Una llamada a generateContent con el modelo indicado; ErrorModelo si no devuelve texto."""
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{modelo}:generateContent?key={GEMINI_API_KEY}"
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    # Timeout = lo que queda del plazo del mensaje para esta etapa
+    timeout = presupuesto()
+    r = requests.post(url, headers={"Content-Type": "application/json"}, json=payload,
+                      timeout=(min(5, timeout or 5), timeout or 30))
+    data = r.json()
+    LLM_LLAMADAS.inc(etapa=etapa_actual())
+    uso = data.get("usageMetadata", {})
+    LLM_TOKENS.inc(uso.get("promptTokenCount", 0), etapa=etapa_actual(), tipo="prompt")
+    LLM_TOKENS.inc(uso.get("candidatesTokenCount", 0), etapa=etapa_actual(), tipo="respuesta")
+    if "candidates" not in data:
+        logger.error("❌ Error Gemini: respuesta sin candidatos", extra=campos(modelo=modelo, respuesta=data))
+        # 429/5xx: otro modelo puede responder; un bloqueo por contenido no
+        raise ErrorModelo(f"respuesta sin candidatos (HTTP {r.status_code})",
+                          reintentable=r.status_code == 429 or r.status_code >= 500)
+    return data["candidates"][0]["content"]["parts"][0]["text"].strip()
+
+
+def _llamar_gemini_stream(modelo: str, prompt: str, al_recibir) -> str:
+    """Como _llamar_gemini pero por streamGenerateContent (SSE): cada fragmento va a al_recibir."""
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{modelo}:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}"
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    timeout = presupuesto()
+    textos = []
+    uso = {}
+    try:
+        with requests.post(url, headers={"Content-Type": "application/json"}, json=payload, stream=True,
+                           timeout=(min(5, timeout or 5), timeout or 30)) as r:
+            LLM_LLAMADAS.inc(etapa=etapa_actual())
+            if r.status_code != 200:
+                logger.error("❌ Error Gemini (streaming)", extra=campos(modelo=modelo, respuesta=r.text[:500]))
+                raise ErrorModelo(f"HTTP {r.status_code}", reintentable=r.status_code == 429 or r.status_code >= 500)
+            r.encoding = "utf-8"  # text/event-stream sin charset: requests asumiría latin-1
+            for linea in r.iter_lines(decode_unicode=True):
+                if not linea or not linea.startswith("data:"):
+                    continue
+                evento = json.loads(linea[5:])
+                uso = evento.get("usageMetadata", uso)
+                for candidato in evento.get("candidates", [])[:1]:
+                    for parte in candidato.get("content", {}).get("parts", []):
+                        if parte.get("text"):
+                            textos.append(parte["text"])
+                            al_recibir(parte["text"])
+    except ErrorModelo:
+        raise
+    except Exception as e:
+        # Con partes ya enviadas al usuario no se puede repetir con otro modelo
+        if textos:
+            raise ErrorModelo(f"streaming interrumpido: {e}", reintentable=False) from e
+        raise
+    finally:
+        LLM_TOKENS.inc(uso.get("promptTokenCount", 0), etapa=etapa_actual(), tipo="prompt")
+        LLM_TOKENS.inc(uso.get("candidatesTokenCount", 0), etapa=etapa_actual(), tipo="respuesta")
+    if not textos:
+        raise ErrorModelo("respuesta sin texto", reintentable=False)
+    return "".join(textos).strip()
 
 
-def gemini_generate(prompt: str) -> str:
-    """Llama a la API de Gemini para generar texto."""
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
-    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+def gemini_generate(prompt: str, al_recibir=None) -> str:
+    """
+    Llama a la API de Gemini para generar texto con el modelo que el enrutador elija para la etapa.
+    Con al_recibir (y GEMINI_STREAMING) el texto se recibe por streaming y cada fragmento se
+    entrega a al_recibir a medida que llega.
+    """
+    streaming = GEMINI_STREAMING and al_recibir is not None
+    recibido = []
+
+    def entregar(fragmento):
+        recibido.append(fragmento)
+        al_recibir(fragmento)
+
+    if streaming:
+        llamar = partial(_llamar_gemini_stream, prompt=prompt, al_recibir=entregar)
+    else:
+        llamar = partial(_llamar_gemini, prompt=prompt)
     try:
-        r = requests.post(url, headers={"Content-Type": "application/json"}, json=payload, timeout=30)
-        data = r.json()
-        if "candidates" not in data:
-            log(f"❌ Error Gemini: {json.dumps(data, indent=2)}")
-            return "No se pudo procesar tu solicitud con la IA."
-        return data["candidates"][0]["content"]["parts"][0]["text"].strip()
+        presupuesto()  # Sin plazo no vale la pena ni encolar la llamada
+        texto, modelo = enrutador.llamar(etapa_actual(), llamar, cobertura=not streaming)
+        return texto
+    except (CircuitoAbierto, PlazoVencido) as e:
+        registrar_error()
+        logger.warning(f"⏱️ Gemini omitido: {e}")
+        return GEMINI_SIN_TIEMPO
+    except ErrorModelo:
+        registrar_error()
+        if recibido:
+            al_recibir(GEMINI_INTERRUMPIDA)
+            return "".join(recibido) + GEMINI_INTERRUMPIDA
+        return GEMINI_FALLO
     except Exception as e:
-        log(f"❌ Error conectando con Gemini: {e}")
-        return "Error al conectar con la IA de Gemini."
+        registrar_error()
+        logger.error(f"❌ Error conectando con Gemini: {e}")
+        return GEMINI_SIN_CONEXION
+
+
+def gemini_completa(texto: str) -> bool:
+    """False si gemini_generate devolvió un aviso de fallo o un texto cortado a mitad del streaming."""
+    if texto in (GEMINI_SIN_TIEMPO, GEMINI_FALLO, GEMINI_SIN_CONEXION):
+        return False
+    return not texto.endswith(GEMINI_INTERRUMPIDA)
+
+
+def sql_sin_error(resultados) -> bool:
+    """False si ejecutar_sql devolvió una fila de error (plazo vencido, timeout, fallo de la base)."""
+    return not resultados or "error" not in resultados[0]
 
 
-def ejecutar_sql(query: str):
+def ejecutar_sql(query: str, pregunta: str = None):
     """Ejecuta una consulta SQL y devuelve los resultados."""
+    try:
+        timeout = presupuesto("sql")
+    except PlazoVencido as e:
+        logger.warning(f"⏱️ SQL omitido: {e}")
+        return [{"error": str(e)}]
+
+    inicio = time.perf_counter()
+    if MOTOR_ANALITICO == "local":
+        # Snapshot de apus en el proceso; None = no soportada o sin snapshot, sigue en Postgres
+        try:
+            rows = motor_local.consultar(query, timeout)
+        except TimeoutError as e:
+            # Ya se gastó el presupuesto de la etapa: repetirla en Postgres se comería el del resumen
+            registrar_error()
+            logger.warning(f"⏱️ {e}")
+            consultas_lentas.registrar(query, time.perf_counter() - inicio, None, pregunta, error=str(e))
+            return [{"error": str(e)}]
+        if rows is not None:
+            FILAS_SQL.observar(len(rows))
+            consultas_lentas.registrar(query, time.perf_counter() - inicio, len(rows), pregunta)
+            return rows
+        # Postgres recibe solo lo que queda de la etapa, no el presupuesto completo otra vez
+        try:
+            usado = time.perf_counter() - inicio
+            timeout = presupuesto("sql", tope=timeout - usado if timeout else None)
+            if timeout is not None and timeout < PLAZO_MINIMO_S:
+                raise PlazoVencido(f"sin tiempo para sql ({max(timeout, 0):.1f}s disponibles)")
+        except PlazoVencido as e:
+            logger.warning(f"⏱️ SQL omitido: {e}")
+            return [{"error": str(e)}]
+
     conn = None
     try:
-        conn = get_db_connection()
+        # Solo lectura: puede ir a una réplica (DB_READ_HOSTS)
+        conn = get_db_connection(lectura=True)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute(query)
+        if timeout:
+            # Solo para esta transacción: la consulta se cancela si se come el plazo del mensaje
+            cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout * 1000),))
+        # Las consultas que solo cambian en sus literales reutilizan el plan preparado
+        ejecutar_generada(cursor, query)
         rows = cursor.fetchall()
         cursor.close()
+        FILAS_SQL.observar(len(rows))
+        # Solo las que superan SQL_LENTA_MS quedan en el registro de consultas lentas
+        consultas_lentas.registrar(query, time.perf_counter() - inicio, len(rows), pregunta)
         return rows
     except Exception as e:
-        log(f"❌ Error SQL: {e}")
+        registrar_error()
+        logger.error(f"❌ Error SQL: {e}")
+        consultas_lentas.registrar(query, time.perf_counter() - inicio, None, pregunta, error=str(e))
         return [{"error": str(e)}]
     finally:
         if conn:
@@ -86,56 +271,69 @@ def ejecutar_sql(query: str):
 def send_whatsapp_message(to, text):
     """Envía un mensaje de WhatsApp por Twilio."""
     try:
-        client.messages.create(from_=FROM_WHATSAPP, to=to, body=text)
-        log(f"✅ Mensaje enviado a {to}")
+        with interruptores["twilio"].proteger():
+            client.messages.create(from_=FROM_WHATSAPP, to=to, body=text)
+        logger.info(f"✅ Mensaje enviado a {to}")
     except Exception as e:
-        log(f"❌ Error enviando mensaje WhatsApp: {e}")
+        registrar_error()
+        logger.error(f"❌ Error enviando mensaje WhatsApp: {e}")
 
 
 # ===============================
 # � GESTIÓN DE MEMORIA CONVERSACIONAL
 # ===============================
 def guardar_conversacion(telefono: str, mensaje_usuario: str, sql_generado: str, respuesta_bot: str):
-    """Guarda una interacción en el historial de conversaciones."""
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO historial_conversaciones (telefono, mensaje_usuario, sql_generado, respuesta_bot)
-            VALUES (%s, %s, %s, %s)
-        """, (telefono, mensaje_usuario, sql_generado, respuesta_bot))
-        conn.commit()
-        cursor.close()
-        log(f"💾 Conversación guardada para {telefono}")
-    except Exception as e:
-        log(f"⚠️ Error guardando conversación: {e}")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+    """Encola una interacción; escritor_historial la inserta por lotes en segundo plano."""
+    ahora = datetime.now()
+    escritor_historial.encolar(telefono, mensaje_usuario, sql_generado, respuesta_bot, timestamp=ahora)
+    cache_historial.agregar(telefono, {
+        "mensaje_usuario": mensaje_usuario,
+        "sql_generado": sql_generado,
+        "respuesta_bot": respuesta_bot,
+        "timestamp": ahora,
+    })
+    logger.info(f"💾 Conversación encolada para {telefono}")
+
+
+@app.on_event("shutdown")
+def detener_escritor_historial():
+    """Vacía el historial pendiente antes de apagar el servidor."""
+    escritor_historial.detener()
+
+
+registrar_sentencia("historial_usuario", """
+    SELECT mensaje_usuario, sql_generado, respuesta_bot, timestamp
+    FROM historial_conversaciones
+    WHERE telefono = %s
+    ORDER BY timestamp DESC
+    LIMIT %s
+""")
 
 
 def obtener_historial(telefono: str, limite: int = 5):
-    """Recupera las últimas conversaciones del usuario."""
+    """Recupera las últimas conversaciones del usuario (primero desde cache_historial)."""
+    cacheado = cache_historial.obtener(telefono, limite)
+    CACHE.inc(cache="historial", resultado="acierto" if cacheado is not None else "fallo")
+    if cacheado is not None:
+        return cacheado
+
     conn = None
     try:
-        conn = get_db_connection()
+        # Si el usuario acaba de escribir historial, se lee de la primaria (read-your-writes)
+        conn = get_db_connection(lectura=True, clave=telefono)
         cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("""
-            SELECT mensaje_usuario, sql_generado, respuesta_bot, timestamp
-            FROM historial_conversaciones
-            WHERE telefono = %s
-            ORDER BY timestamp DESC
-            LIMIT %s
-        """, (telefono, limite))
+        ejecutar_preparada(cursor, "historial_usuario", (telefono, max(limite, cache_historial.ventana)))
         historial = cursor.fetchall()
         cursor.close()
         # Invertir para tener orden cronológico (más antiguo primero)
-        return list(reversed(historial))
+        historial = list(reversed(historial))
+        ventana = cache_historial.cargar(telefono, historial[-cache_historial.ventana:])
+        if limite <= cache_historial.ventana:
+            return ventana[-limite:]
+        return historial[-limite:]
     except Exception as e:
-        log(f"⚠️ Error recuperando historial: {e}")
+        registrar_error()
+        logger.warning(f"⚠️ Error recuperando historial: {e}")
         return []
     finally:
         if conn:
@@ -145,24 +343,98 @@ def obtener_historial(telefono: str, limite: int = 5):
 # ===============================
 # �👥 CONTROL DE USUARIOS
 # ===============================
+# Caché de autorización: telefono -> (usuario o None, expira_en).
+# load_users.py emite NOTIFY en CANAL_USUARIOS al sincronizar y el listener la vacía.
+USUARIOS_CACHE_TTL = int(os.getenv("USUARIOS_CACHE_TTL", 300))
+CANAL_USUARIOS = "usuarios_actualizados"
+_cache_usuarios = {}
+_cache_usuarios_lock = threading.Lock()
+
+
+def invalidar_cache_usuarios():
+    """Vacía la caché de autorización de usuarios."""
+    with _cache_usuarios_lock:
+        _cache_usuarios.clear()
+    # El cambio puede no haber llegado a las réplicas: releer usuarios de la primaria un rato
+    registrar_escritura("usuarios")
+
+
+registrar_sentencia("usuario_activo", "SELECT * FROM usuarios WHERE telefono = %s AND activo = true")
+
+
 def usuario_autorizado(telefono: str):
     """Verifica si el usuario está autorizado en la tabla 'usuarios'."""
+    ahora = time.monotonic()
+    with _cache_usuarios_lock:
+        cacheado = _cache_usuarios.get(telefono)
+    if cacheado and cacheado[1] > ahora:
+        CACHE.inc(cache="usuarios", resultado="acierto")
+        return cacheado[0]
+    CACHE.inc(cache="usuarios", resultado="fallo")
+
     conn = None
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(lectura=True, clave="usuarios")
         cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT * FROM usuarios WHERE telefono = %s AND activo = true", (telefono,))
+        ejecutar_preparada(cursor, "usuario_activo", (telefono,))
         user = cursor.fetchone()
         cursor.close()
+        with _cache_usuarios_lock:
+            _cache_usuarios[telefono] = (user, ahora + USUARIOS_CACHE_TTL)
         return user
     except Exception as e:
-        log(f"❌ Error verificando usuario: {e}")
+        registrar_error()
+        logger.error(f"❌ Error verificando usuario: {e}")
         return None
     finally:
         if conn:
             conn.close()
 
 
+def escuchar_cambios_usuarios():
+    """Escucha NOTIFY de load_users.py y vacía la caché de autorización (hilo en segundo plano)."""
+    espera = 1
+    while True:
+        conn = None
+        try:
+            conn = get_db_connection()
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {CANAL_USUARIOS}")
+            cursor.close()
+            # Al (re)conectar pudimos perder avisos: mejor empezar con la caché vacía
+            invalidar_cache_usuarios()
+            logger.info(f"👂 Escuchando cambios de usuarios en '{CANAL_USUARIOS}'")
+            espera = 1
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    avisos = len(conn.notifies)
+                    conn.notifies.clear()
+                    invalidar_cache_usuarios()
+                    logger.info(f"🔄 Caché de usuarios invalidada ({avisos} aviso(s))")
+        except Exception as e:
+            logger.warning(f"⚠️ Listener de usuarios desconectado: {e}. Reintentando en {espera}s")
+            time.sleep(espera)
+            espera = min(espera * 2, 60)
+        finally:
+            if conn:
+                conn.close()
+
+
+@app.on_event("startup")
+def iniciar_listener_usuarios():
+    threading.Thread(target=escuchar_cambios_usuarios, name="listener-usuarios", daemon=True).start()
+
+
+@app.on_event("startup")
+def cargar_ejemplos_sql():
+    if PROMPT_SQL_MODO == "ejemplos":
+        indice_ejemplos.iniciar()
+
+
 # ===============================
 # 🩺 HEALTH CHECK
 # ===============================
@@ -184,13 +456,98 @@ def health_check():
     except Exception as e:
         status["status"] = "error"
         status["database"] = str(e)
-        log(f"❌ Health check falló: {e}")
+        logger.error(f"❌ Health check falló: {e}")
     finally:
         if conn:
             conn.close()
+    if lecturas.replicas:
+        status["replicas"] = lecturas.estado()
+    if MOTOR_ANALITICO == "local":
+        status["motor_local"] = motor_local.estado()
     return status
 
 
+@registro.recolector
+def metricas_memoria():
+    """Estado de la admisión, las cachés y la cola de historial al momento del scrape."""
+    stats = cache_historial.estadisticas()
+    return [
+        ("mapus_admision_en_curso", "Mensajes dentro del pipeline", "gauge", {}, admision.en_curso),
+        ("mapus_admision_en_cola", "Mensajes esperando cupo", "gauge", {}, admision.en_cola),
+        *[("mapus_circuito_abierto", "1 si el circuito de la dependencia está abierto", "gauge",
+           {"dependencia": nombre}, int(i.estado == ABIERTO)) for nombre, i in interruptores.items()],
+        *[("mapus_llm_latencia_p95_segundos", "p95 reciente de Gemini por etapa y modelo", "gauge",
+           dict(zip(("etapa", "modelo"), clave.split("/", 1))), r["p95"])
+          for clave, r in enrutador.resumen().items() if r["p95"] is not None],
+        ("mapus_cache_historial_usuarios", "Usuarios con ventana de historial en memoria", "gauge", {}, stats["usuarios"]),
+        ("mapus_cache_historial_bytes", "Bytes aproximados de la caché de historial", "gauge", {}, stats["bytes"]),
+        ("mapus_historial_pendiente", "Interacciones en cola sin persistir", "gauge", {}, escritor_historial.pendientes()),
+        *[("mapus_replica_lag_segundos", "Retraso de replicación observado por réplica", "gauge",
+           {"replica": r.nombre}, r.lag if r.sana else -1) for r in lecturas.replicas],
+        *[("mapus_bd_pool_libres", "Conexiones inactivas en el pool por destino", "gauge",
+           {"destino": pool.nombre}, pool.libres())
+          for pool in [pool_primaria] + [r.pool for r in lecturas.replicas]],
+    ]
+
+
+@app.get("/metrics")
+def metrics():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(registro.exportar(), media_type="text/plain; version=0.0.4")
+
+
+# ===============================
+# 🔥 PERFILADO BAJO DEMANDA
+# ===============================
+@app.on_event("startup")
+async def iniciar_vigilante_bucle():
+    # Solo si PERFIL_VIGILANTE_MS > 0
+    vigilante_bucle.iniciar(asyncio.get_running_loop())
+
+
+def verificar_admin(request: Request):
+    """Los endpoints de administración requieren X-Admin-Token == PERFIL_TOKEN."""
+    if not perfilador.token:
+        raise HTTPException(status_code=404)
+    if not perfilador.autorizado(request.headers.get("x-admin-token")):
+        raise HTTPException(status_code=403)
+
+
+@app.post("/admin/perfil")
+def activar_perfil(request: Request, solicitudes: int = 0, segundos: float = 0):
+    """Perfila las próximas N peticiones y/o todo el proceso durante N segundos."""
+    verificar_admin(request)
+    respuesta = {}
+    if solicitudes > 0:
+        respuesta["solicitudes_pendientes"] = perfilador.perfilar_siguientes(solicitudes)
+    if segundos > 0:
+        respuesta["volcado"] = perfilador.perfilar_proceso(min(segundos, 300))
+    return respuesta
+
+
+@app.get("/admin/perfil/volcados")
+def volcados_perfil(request: Request):
+    verificar_admin(request)
+    return {"volcados": listar_volcados(), "bloqueos_bucle": vigilante_bucle.bloqueos}
+
+
+@app.get("/admin/perfil/volcados/{nombre}")
+def descargar_volcado(request: Request, nombre: str):
+    """Volcado en formato collapsed stacks (flamegraph.pl, speedscope)."""
+    verificar_admin(request)
+    contenido = leer_volcado(nombre)
+    if contenido is None:
+        raise HTTPException(status_code=404)
+    return PlainTextResponse(contenido)
+
+
+@app.post("/admin/perfil/bloqueos")
+def volcar_bloqueos(request: Request):
+    """Guarda las pilas acumuladas por el vigilante del event loop."""
+    verificar_admin(request)
+    return {"volcado": os.path.basename(vigilante_bucle.volcar()), "bloqueos": vigilante_bucle.bloqueos}
+
+
 # ===============================
 # 💬 ENDPOINT WHATSAPP WEBHOOK
 # ===============================
@@ -198,140 +555,293 @@ def health_check():
 async def whatsapp_webhook(request: Request):
     """Procesa mensajes entrantes desde Twilio WhatsApp."""
     data = await request.form()
-    from_number = data.get("From")
-    message_body = data.get("Body", "").strip()
+    # El MessageSid de Twilio sirve como ID de petición en los logs
+    sid = data.get("MessageSid")
+    request_id = iniciar_peticion(sid)
+    iniciar_plazo()
+    inicio = time.perf_counter()
+    resultado = "ERROR"
+    try:
+        # Reintento de Twilio (la respuesta original tardó más que su timeout): no repetir el pipeline
+        previo = idempotencia.visto(sid)
+        if previo is None:
+            previo = await registrar_idempotencia(idempotencia.comenzar, sid)
+        if previo is not None:
+            resultado = "DUPLICADO"
+            logger.info(f"♻️ Reintento de {sid} ignorado (original: {previo})")
+            return previo
+
+        perfilar = perfilador.debe_perfilar(request.headers)
+        try:
+            resultado = await procesar_mensaje(data.get("From"), data.get("Body", "").strip(),
+                                               perfilar, request_id)
+        except Exception:
+            await registrar_idempotencia(idempotencia.abandonar, sid)
+            raise
+        await registrar_idempotencia(idempotencia.terminar, sid, resultado)
+        return resultado
+    finally:
+        DURACION_PETICION.observar(time.perf_counter() - inicio)
+        PETICIONES.inc(resultado=resultado)
+        logger.info(f"⏱️ {resultado} en {(time.perf_counter() - inicio) * 1000:.0f}ms",
+                    extra=campos(resultado=resultado, tramos=resumen_tramos(), modelos=modelos()))
 
-    log(f"📩 Mensaje recibido de {from_number}: {message_body}")
+
+def en_hilo(funcion, *args):
+    """
+    Corre una función bloqueante en el threadpool: mientras un mensaje espera a Gemini el loop
+    sigue atendiendo otros (y las preguntas iguales pueden compartir trabajo). El contexto lleva
+    el ID de petición, los tramos y el plazo.
+    """
+    return run_in_threadpool(contextvars.copy_context().run, funcion, *args)
+
+
+async def registrar_idempotencia(metodo, *args):
+    """Con IDEMPOTENCIA_BD el registro usa psycopg2 (bloqueante): va al threadpool, no al event loop."""
+    if idempotencia.usar_bd:
+        return await en_hilo(metodo, *args)
+    return metodo(*args)
+
+
+async def procesar_mensaje(from_number: str, message_body: str, perfilar=False, request_id=None) -> str:
+    """
+    Pipeline completo de un mensaje: autorización, SQL con IA, resumen y envío.
+    La ráfaga y la admisión esperan en el event loop, antes de pedir un hilo: un mensaje en
+    espera no ocupa ninguno del threadpool.
+    """
+    user, resultado = await en_hilo(autorizar_mensaje, from_number, message_body)
+    if resultado:
+        return resultado
+
+    # 🧩 Los mensajes seguidos del mismo usuario se responden juntos con el último
+    generacion = rafagas.agregar(from_number, message_body)
+    if generacion is not None:
+        with etapa("rafaga"):
+            message_body = await rafagas.esperar(from_number, generacion)
+        if message_body is None:
+            rafagas.retirar(from_number)
+            return "FUSIONADO"
+
+    # 🚦 Tasa por rol y cupos de concurrencia: si no hay cupo se avisa en vez de dejar esperando
+    with etapa("admision"):
+        rechazo = await admision.entrar(from_number, user.get("rol"))
+    if rechazo:
+        rafagas.confirmar(from_number, generacion)
+        with etapa("twilio"):
+            await en_hilo(send_whatsapp_message, from_number, mensaje_rechazo(rechazo))
+        return "OCUPADO"
+
+    def tarea():
+        with perfilador.perfilar_peticion(perfilar, request_id):
+            return responder_pregunta(user, from_number, message_body, generacion)
+
+    try:
+        return await en_hilo(tarea)
+    finally:
+        admision.salir(from_number)
+
+
+def autorizar_mensaje(from_number: str, message_body: str):
+    """Verifica al usuario; devuelve (user, None) para seguir o (None, resultado) si ya se respondió."""
+    logger.info(f"📩 Mensaje recibido de {from_number}: {message_body}")
 
     # 🛡️ Verificación de usuario
-    user = usuario_autorizado(from_number)
+    with etapa("auth"):
+        user = usuario_autorizado(from_number)
     if not user:
-        send_whatsapp_message(from_number, "🚫 Acceso restringido.\nNo tienes permiso para usar este asistente.\nContacta con el administrador para solicitar acceso.")
-        log(f"❌ Acceso denegado a {from_number}")
-        return "UNAUTHORIZED"
+        with etapa("twilio"):
+            send_whatsapp_message(from_number, "🚫 Acceso restringido.\nNo tienes permiso para usar este asistente.\nContacta con el administrador para solicitar acceso.")
+        logger.warning(f"❌ Acceso denegado a {from_number}")
+        return None, "UNAUTHORIZED"
 
-    log(f"✅ Usuario autorizado: {user['nombre']} ({user['rol']})")
+    logger.info(f"✅ Usuario autorizado: {user['nombre']} ({user['rol']})")
 
     if not message_body:
-        send_whatsapp_message(from_number, f"👋 Hola {user['nombre']}! Envíame una pregunta sobre tus APUs o ítems, y te ayudaré con gusto.")
-        return "OK"
+        with etapa("twilio"):
+            send_whatsapp_message(from_number, f"👋 Hola {user['nombre']}! Envíame una pregunta sobre tus APUs o ítems, y te ayudaré con gusto.")
+        return None, "OK"
+    return user, None
+
 
+def responder_pregunta(user: dict, from_number: str, message_body: str, generacion=None) -> str:
+    """SQL con IA, ejecución, resumen y envío para un mensaje ya admitido."""
     # ===============================
     # 💭 RECUPERAR HISTORIAL
     # ===============================
-    historial = obtener_historial(from_number, limite=5)
-    contexto_historial = ""
-    
-    if historial:
-        contexto_historial = "\n\nCONTEXTO DE CONVERSACIONES PREVIAS:\n"
-        for i, conv in enumerate(historial, 1):
-            contexto_historial += f"Usuario: {conv['mensaje_usuario']}\n"
-            if conv['sql_generado']:
-                contexto_historial += f"SQL generado: {conv['sql_generado'][:100]}...\n"
-        contexto_historial += "\nUSA ESTE CONTEXTO para entender referencias como 'el anterior', 'ese mismo', 'compara con...', etc.\n"
-        log(f"📚 Historial recuperado: {len(historial)} mensajes")
+    # Estado estructurado (proyecto, ciudad, ítem, insumo, forma del último resultado)
+    # en vez de los mensajes previos en texto libre; se reconstruye del historial si hace falta
+    with etapa("historial"):
+        estado = estados_conversacion.obtener(from_number, lambda: obtener_historial(from_number, limite=5))
+    contexto_historial = estado.a_prompt()
+    if contexto_historial:
+        logger.info("📚 Estado de conversación", extra=campos(estado=estado.a_dict(), caracteres=len(contexto_historial)))
+
+    # ===============================
+    # ⚡ VÍA RÁPIDA (estadísticas de precios)
+    # ===============================
+    # Se resuelve desde el almacén de precios, sin Gemini ni Postgres; "y en Cali?" necesita el contexto
+    if estado.vacio() or not depende_del_contexto(message_body):
+        with etapa("via_rapida"):
+            rapida = responder_via_rapida(message_body)
+        if rapida is not None:
+            if not rafagas.confirmar(from_number, generacion):
+                rafagas.retirar(from_number, 0)
+                return "FUSIONADO"
+            LLM_AHORRADAS.inc(2, motivo="via_rapida")
+            logger.info("⚡ Respondida por la vía rápida", extra=campos(filtros=rapida.filtros, filas=len(rapida.filas)))
+            estado.actualizar_sin_sql(message_body, rapida.filtros, rapida.forma)
+            respuesta = f"👋 Hola {user['nombre']}!\n\n{rapida.texto}"
+            # Sin sql_generado: ningún SQL reproduce lo que calcula el almacén (ni entra como ejemplo)
+            with etapa("guardar"):
+                guardar_conversacion(from_number, message_body, None, respuesta)
+            with etapa("twilio"):
+                ensamblador = EnsambladorPartes(lambda parte: send_whatsapp_message(from_number, parte))
+                ensamblador.agregar(respuesta)
+                ensamblador.cerrar()
+            return "OK"
 
     # ===============================
     # 🧠 PROMPT PARA SQL
     # ===============================
-    prompt_sql = f"""
-    Actúa como un asistente experto en bases de datos PostgreSQL y en análisis de precios unitarios (APU) de obras civiles.
-    Convierte la solicitud del usuario en una consulta SQL válida, considerando que el usuario NO conoce los nombres técnicos de las columnas.
-
-    Tabla: apus
-    Columnas disponibles:
-    - fecha_aprobacion_apu, fecha_analisis_apu, ciudad, pais, entidad, contratista,
-      nombre_proyecto, numero_contrato, item, items_descripcion, item_unidad,
-      precio_unitario, precio_unitario_sin_aiu, codigo_insumo, tipo_insumo,
-      insumo_descripcion, insumo_unidad, rendimiento_insumo, precio_unitario_apu,
-      precio_parcial_apu, observacion, link_documento
-
-    REGLAS CRÍTICAS PARA BÚSQUEDAS:
+    if PROMPT_SQL_MODO == "ejemplos":
+        # Esquema compacto + los ejemplos del historial más parecidos a la pregunta
+        with etapa("ejemplos"):
+            ejemplos = indice_ejemplos.buscar(message_body)
+        prompt_sql = prompt_sql_compacto(message_body, contexto_historial, ejemplos)
+    else:
+        prompt_sql = f"""
+        Actúa como un asistente experto en bases de datos PostgreSQL y en análisis de precios unitarios (APU) de obras civiles.
+        Convierte la solicitud del usuario en una consulta SQL válida, considerando que el usuario NO conoce los nombres técnicos de las columnas.
+
+        Tabla: apus
+        Columnas disponibles:
+        - fecha_aprobacion_apu, fecha_analisis_apu, ciudad, pais, entidad, contratista,
+          nombre_proyecto, numero_contrato, item, items_descripcion, item_unidad,
+          precio_unitario, precio_unitario_sin_aiu, codigo_insumo, tipo_insumo,
+          insumo_descripcion, insumo_unidad, rendimiento_insumo, precio_unitario_apu,
+          precio_parcial_apu, observacion, link_documento
+
+        REGLAS CRÍTICAS PARA BÚSQUEDAS:
     
-    1. **BÚSQUEDAS FLEXIBLES** - Siempre usa ILIKE (case-insensitive) con % para búsquedas parciales:
-       - Usuario dice "proyecto X" → WHERE nombre_proyecto ILIKE '%X%'
-       - Usuario dice "item de concreto" → WHERE items_descripcion ILIKE '%concreto%'
-       - Usuario dice "insumo cemento" → WHERE insumo_descripcion ILIKE '%cemento%'
-       - Usuario dice "ciudad Bogotá" → WHERE ciudad ILIKE '%bogotá%'
+        1. **BÚSQUEDAS FLEXIBLES** - Siempre usa ILIKE (case-insensitive) con % para búsquedas parciales:
+           - Usuario dice "proyecto X" → WHERE nombre_proyecto ILIKE '%X%'
+           - Usuario dice "item de concreto" → WHERE items_descripcion ILIKE '%concreto%'
+           - Usuario dice "insumo cemento" → WHERE insumo_descripcion ILIKE '%cemento%'
+           - Usuario dice "ciudad Bogotá" → WHERE ciudad ILIKE '%bogotá%'
     
-    2. **MAPEO DE LENGUAJE NATURAL A COLUMNAS**:
-       - "proyecto" / "obra" → nombre_proyecto
-       - "item" / "actividad" → items_descripcion
-       - "insumo" / "material" → insumo_descripcion
-       - "precio" / "valor" / "costo" → precio_unitario
-       - "ciudad" / "lugar" → ciudad
-       - "contratista" / "empresa" → contratista
-       - "más caro" / "más costoso" → ORDER BY precio_unitario DESC
-       - "más barato" / "más económico" → ORDER BY precio_unitario ASC
-       - "cuántos" / "cantidad" → COUNT(*)
-       - "promedio" → AVG(precio_unitario)
-       - "total" → SUM(precio_unitario)
+        2. **MAPEO DE LENGUAJE NATURAL A COLUMNAS**:
+           - "proyecto" / "obra" → nombre_proyecto
+           - "item" / "actividad" → items_descripcion
+           - "insumo" / "material" → insumo_descripcion
+           - "precio" / "valor" / "costo" → precio_unitario
+           - "ciudad" / "lugar" → ciudad
+           - "contratista" / "empresa" → contratista
+           - "más caro" / "más costoso" → ORDER BY precio_unitario DESC
+           - "más barato" / "más económico" → ORDER BY precio_unitario ASC
+           - "cuántos" / "cantidad" → COUNT(*)
+           - "promedio" → AVG(precio_unitario)
+           - "total" → SUM(precio_unitario)
     
-    3. **EJEMPLOS DE CONSULTAS COMUNES**:
+        3. **EJEMPLOS DE CONSULTAS COMUNES**:
        
-       ❌ INCORRECTO:
-       Usuario: "cuántos items tiene el proyecto la macarena"
-       SQL MAL: SELECT * FROM apus WHERE nombre_proyecto = 'la macarena'
+           ❌ INCORRECTO:
+           Usuario: "cuántos items tiene el proyecto la macarena"
+           SQL MAL: SELECT * FROM apus WHERE nombre_proyecto = 'la macarena'
        
-       ✅ CORRECTO:
-       Usuario: "cuántos items tiene el proyecto la macarena"
-       SQL: SELECT COUNT(DISTINCT items_descripcion) as total_items FROM apus WHERE nombre_proyecto ILIKE '%macarena%'
+           ✅ CORRECTO:
+           Usuario: "cuántos items tiene el proyecto la macarena"
+           SQL: SELECT COUNT(DISTINCT items_descripcion) as total_items FROM apus WHERE nombre_proyecto ILIKE '%macarena%'
        
-       ✅ CORRECTO:
-       Usuario: "cuál es el item más costoso de la macarena"
-       SQL: SELECT items_descripcion, precio_unitario FROM apus WHERE nombre_proyecto ILIKE '%macarena%' ORDER BY precio_unitario DESC LIMIT 1
+           ✅ CORRECTO:
+           Usuario: "cuál es el item más costoso de la macarena"
+           SQL: SELECT items_descripcion, precio_unitario FROM apus WHERE nombre_proyecto ILIKE '%macarena%' ORDER BY precio_unitario DESC LIMIT 1
        
-       ✅ CORRECTO:
-       Usuario: "dame los items de excavación"
-       SQL: SELECT items_descripcion, precio_unitario FROM apus WHERE items_descripcion ILIKE '%excavación%' ORDER BY precio_unitario DESC LIMIT 20
+           ✅ CORRECTO:
+           Usuario: "dame los items de excavación"
+           SQL: SELECT items_descripcion, precio_unitario FROM apus WHERE items_descripcion ILIKE '%excavación%' ORDER BY precio_unitario DESC LIMIT 20
        
-       ✅ CORRECTO:
-       Usuario: "proyectos en Bogotá"
-       SQL: SELECT DISTINCT nombre_proyecto, ciudad FROM apus WHERE ciudad ILIKE '%bogotá%' LIMIT 20
+           ✅ CORRECTO:
+           Usuario: "proyectos en Bogotá"
+           SQL: SELECT DISTINCT nombre_proyecto, ciudad FROM apus WHERE ciudad ILIKE '%bogotá%' LIMIT 20
     
-    4. **OTRAS REGLAS**:
-       - Limita resultados a 20 con LIMIT 20 (a menos que el usuario especifique otra cantidad)
-       - Ordena de manera lógica (por precio, fecha, nombre, etc.)
-       - Usa DISTINCT cuando sea necesario para evitar duplicados
-       - Si pide conteo, usa COUNT(*)
-       - Si pide promedio, usa AVG()
-       - Para comparaciones, usa GROUP BY con la columna apropiada
-       - Si el usuario hace referencia a consultas anteriores, usa el contexto previo
+        4. **OTRAS REGLAS**:
+           - Limita resultados a 20 con LIMIT 20 (a menos que el usuario especifique otra cantidad)
+           - Ordena de manera lógica (por precio, fecha, nombre, etc.)
+           - Usa DISTINCT cuando sea necesario para evitar duplicados
+           - Si pide conteo, usa COUNT(*)
+           - Si pide promedio, usa AVG()
+           - Para comparaciones, usa GROUP BY con la columna apropiada
+           - Si el usuario hace referencia a consultas anteriores, usa el contexto previo
     
-    5. **NUNCA USES**:
-       - Igualdad exacta con = para textos (⚠️ casi siempre usar ILIKE)
-       - Formato Markdown ni ```sql```
-       - Consultas que no sean SELECT
+        5. **NUNCA USES**:
+           - Igualdad exacta con = para textos (⚠️ casi siempre usar ILIKE)
+           - Formato Markdown ni ```sql```
+           - Consultas que no sean SELECT
     
-    {contexto_historial}
+        {contexto_historial}
     
-    Usuario pregunta: "{message_body}"
+        Usuario pregunta: "{message_body}"
     
-    Genera SOLO la consulta SQL, sin explicaciones.
-    """
-
-    sql_query = gemini_generate(prompt_sql)
+        Genera SOLO la consulta SQL, sin explicaciones.
+        """
+
+    # Si la pregunta se entiende sola, las idénticas en curso comparten una sola generación.
+    # El prompt lleva los filtros del estado de cada usuario: solo se comparte con el mismo estado
+    pregunta_normal = normalizar_pregunta(message_body)
+    autocontenida = estado.vacio() or not depende_del_contexto(message_body)
+    clave_sql = (pregunta_normal, huella(contexto_historial)) if autocontenida else None
+    with etapa("gemini_sql"):
+        sql_query, compartido = vuelos_sql.hacer(clave_sql, lambda: gemini_generate(prompt_sql),
+                                                 compartible=gemini_completa)
+    if compartido:
+        logger.info("🛫 SQL reutilizado de una pregunta idéntica en curso")
+    # Puntos de control: si llegó otro mensaje del usuario, la ejecución nueva responde por ambos
+    llamadas_hechas = 1
+    ensamblador = None
+    if not rafagas.vigente(from_number, generacion):
+        rafagas.retirar(from_number, llamadas_hechas)
+        return "FUSIONADO"
     sql_query = re.sub(r"```sql|```", "", sql_query).strip()
-    log(f"🧠 SQL generado: {sql_query}")
+    logger.info(f"🧠 SQL generado: {sql_query}")
 
     # ===============================
     # 🗃️ EJECUTAR CONSULTA SQL
     # ===============================
     if not sql_query.lower().startswith("select"):
+        estado.actualizar(message_body)
         respuesta = "Solo se permiten consultas de lectura."
     else:
-        resultados = ejecutar_sql(sql_query)
-        log(f"📊 Resultados SQL: {resultados}")
+        with etapa("sql"):
+            resultados, _ = vuelos_consulta.hacer(huella(normalizar(sql_query)),
+                                                 lambda: ejecutar_sql(sql_query, message_body),
+                                                 compartible=sql_sin_error)
+        # El conteo va siempre; el resultado completo puede pesar megas: solo se registra una muestra
+        logger.info("📊 Resultados SQL", extra=campos(filas=len(resultados)))
+        logger.info("📊 Resultados SQL (muestra)", extra=campos(resultados=resultados,
+                                                                muestra=LOG_MUESTREO_VERBOSO))
+        if not rafagas.vigente(from_number, generacion):
+            rafagas.retirar(from_number, llamadas_hechas)
+            return "FUSIONADO"
 
         if not resultados or "error" in resultados[0]:
+            estado.actualizar(message_body)
             respuesta = "No se encontraron resultados para tu consulta."
         else:
+            # La respuesta empieza a salir durante el resumen (streaming): desde aquí ya no se reemplaza
+            if not rafagas.confirmar(from_number, generacion):
+                rafagas.retirar(from_number, llamadas_hechas)
+                return "FUSIONADO"
+            generacion = None
+            estado.actualizar(message_body, sql_query, resultados)
+            # Par exitoso: queda disponible como ejemplo para las próximas preguntas
+            if es_ejemplo_valido(message_body, sql_query):
+                indice_ejemplos.agregar(message_body, sql_query)
             prompt_resumen = f"""
             Eres un ingeniero experto en Análisis de Precios Unitarios (APU).
             Presenta los resultados SQL de manera clara, profesional y bien formateada para WhatsApp.
             
             INSTRUCCIONES DE FORMATO:
-            1. Saluda brevemente al usuario por su nombre: {user['nombre']}
+            1. NO saludes ni menciones al usuario: el saludo se agrega aparte.
             2. Analiza el tipo de consulta y formatea la respuesta apropiadamente:
                - **LISTADOS**: Usa numeración (1., 2., 3., etc.) con los datos más relevantes
                - **COMPARACIONES**: Usa formato de tabla simple con alineación, separando columnas con | 
@@ -361,25 +871,40 @@ async def whatsapp_webhook(request: Request):
             Pregunta del usuario: "{message_body}"
             Resultados SQL: {json.dumps(resultados, ensure_ascii=False, default=str)}
             """
-            respuesta = gemini_generate(prompt_resumen)
+            # Cada parte completa (≤1500 caracteres, cortada en un límite de línea) sale apenas se genera
+            ensamblador = EnsambladorPartes(lambda parte: send_whatsapp_message(from_number, parte),
+                                            inicio=f"👋 Hola {user['nombre']}!\n\n")
+            # El resumen no lleva datos del usuario: se comparte entre preguntas iguales sobre el mismo SQL
+            with etapa("gemini_resumen"):
+                resumen, _ = vuelos_resumen.hacer(
+                    (pregunta_normal, huella(normalizar(sql_query))),
+                    lambda: gemini_generate(prompt_resumen, al_recibir=ensamblador.agregar),
+                    compartible=gemini_completa,
+                )
+            # Sin streaming, o con el resumen de otra petición, el texto llega entero
+            if not ensamblador.recibido:
+                ensamblador.agregar(resumen)
+            llamadas_hechas = 2
+            respuesta = ensamblador.texto
+
+    if not rafagas.confirmar(from_number, generacion):
+        rafagas.retirar(from_number, llamadas_hechas)
+        return "FUSIONADO"
 
     # ===============================
     # 💾 GUARDAR EN HISTORIAL
     # ===============================
-    guardar_conversacion(from_number, message_body, sql_query if sql_query.lower().startswith("select") else "", respuesta)
+    with etapa("guardar"):
+        guardar_conversacion(from_number, message_body, sql_query if sql_query.lower().startswith("select") else "", respuesta)
 
     # ===============================
     # 📤 ENVÍO DE RESPUESTA
     # ===============================
-    if len(respuesta) > 1500:
-        partes = [respuesta[i:i+1500] for i in range(0, len(respuesta), 1500)]
-        for i, parte in enumerate(partes):
-            send_whatsapp_message(from_number, parte)
-            log(f"🗣️ Parte {i+1}/{len(partes)} enviada ({len(parte)} caracteres).")
-            time.sleep(2)
-    else:
-        send_whatsapp_message(from_number, respuesta)
-        log(f"🗣️ Respuesta enviada ({len(respuesta)} caracteres).")
+    with etapa("twilio"):
+        if ensamblador is None:
+            ensamblador = EnsambladorPartes(lambda parte: send_whatsapp_message(from_number, parte))
+            ensamblador.agregar(respuesta)
+        ensamblador.cerrar()
 
     return "OK"
 
@@ -390,5 +915,5 @@ async def whatsapp_webhook(request: Request):
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 10000))
-    log(f"🚀 Iniciando servidor en puerto {port}")
+    logger.info(f"🚀 Iniciando servidor en puerto {port}")
     uvicorn.run(app, host="0.0.0.0", port=port)
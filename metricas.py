@@ -0,0 +1,243 @@
+"""
+📈 Métricas e instrumentación por etapa
+Contadores e histogramas en memoria exportados en formato de texto de Prometheus (/metrics),
+tramos de tiempo por etapa del webhook y un ID de petición que acompaña cada línea de log.
+Las métricas son por proceso: con varios workers de uvicorn, Prometheus debe raspar cada uno.
+"""
+
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# ID de la petición en curso y tramos medidos ([(etapa, segundos)])
+request_id_var = ContextVar("request_id", default="-")
+_tramos_var = ContextVar("tramos", default=None)
+_etapa_var = ContextVar("etapa", default="webhook")
+_modelos_var = ContextVar("modelos", default=None)
+_inicio_var = ContextVar("inicio", default=None)
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+BUCKETS_FILAS = (0, 1, 5, 10, 20, 50, 100, 500, 1000, 5000)
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ""
+    pares = ",".join(f'{n}="{_escapar(str(v))}"' for n, v in zip(nombres, valores))
+    return "{" + pares + "}"
+
+
+def _escapar(valor):
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _num(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+class Contador:
+    """Contador monótono con etiquetas."""
+
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, cantidad=1, **etiquetas):
+        clave = tuple(etiquetas.get(e, "") for e in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def valor(self, **etiquetas):
+        clave = tuple(etiquetas.get(e, "") for e in self.etiquetas)
+        with self._lock:
+            return self._valores.get(clave, 0)
+
+    def exportar(self):
+        with self._lock:
+            valores = sorted(self._valores.items())
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, k)} {_num(v)}" for k, v in valores]
+
+
+class Histograma:
+    """Histograma acumulativo con etiquetas (buckets fijos)."""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}  # clave -> [conteos por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(etiquetas.get(e, "") for e in self.etiquetas)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def exportar(self):
+        with self._lock:
+            series = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._series.items())
+        lineas = []
+        for clave, (conteos, suma, total) in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                etiquetas = _etiquetas(self.etiquetas + ("le",), clave + (_num(limite),))
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            base = _etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{base} {_num(suma)}")
+            lineas.append(f"{self.nombre}_count{base} {total}")
+        return lineas
+
+
+class Registro:
+    """Conjunto de métricas exportables."""
+
+    def __init__(self):
+        self._metricas = []
+        self._recolectores = []
+
+    def registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self.registrar(Contador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        return self.registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def recolector(self, funcion):
+        """Registra una función que devuelve [(nombre, ayuda, tipo, {etiquetas}, valor)] al exportar."""
+        self._recolectores.append(funcion)
+        return funcion
+
+    def exportar(self):
+        """Texto en formato de exposición de Prometheus (versión 0.0.4)."""
+        lineas = []
+        for m in self._metricas:
+            lineas.append(f"# HELP {m.nombre} {m.ayuda}")
+            lineas.append(f"# TYPE {m.nombre} {m.tipo}")
+            lineas.extend(m.exportar())
+        for funcion in self._recolectores:
+            vistos = set()
+            for nombre, ayuda, tipo, etiquetas, valor in funcion():
+                if nombre not in vistos:
+                    lineas.append(f"# HELP {nombre} {ayuda}")
+                    lineas.append(f"# TYPE {nombre} {tipo}")
+                    vistos.add(nombre)
+                lineas.append(f"{nombre}{_etiquetas(tuple(etiquetas), tuple(etiquetas.values()))} {_num(valor)}")
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+# ============ MÉTRICAS DEL BOT ============
+PETICIONES = registro.contador("mapus_peticiones_total", "Mensajes recibidos por resultado", ("resultado",))
+DURACION_PETICION = registro.histograma("mapus_peticion_segundos", "Duración total del webhook")
+DURACION_ETAPA = registro.histograma("mapus_etapa_segundos", "Duración por etapa del webhook", ("etapa",))
+ERRORES = registro.contador("mapus_errores_total", "Errores por etapa", ("etapa",))
+CACHE = registro.contador("mapus_cache_total", "Consultas a cachés en memoria", ("cache", "resultado"))
+LLM_TOKENS = registro.contador("mapus_llm_tokens_total", "Tokens de Gemini por etapa", ("etapa", "tipo"))
+LLM_LLAMADAS = registro.contador("mapus_llm_llamadas_total", "Llamadas a Gemini por etapa", ("etapa",))
+FILAS_SQL = registro.histograma("mapus_sql_filas", "Filas devueltas por la consulta generada", buckets=BUCKETS_FILAS)
+COALESCIDAS = registro.contador("mapus_coalescidas_total", "Trabajo reutilizado de otra petición en curso", ("etapa",))
+LLM_AHORRADAS = registro.contador("mapus_llm_ahorradas_total", "Llamadas a Gemini evitadas", ("motivo",))
+ADMISION_RECHAZOS = registro.contador("mapus_admision_rechazos_total", "Mensajes rechazados por el control de admisión", ("motivo",))
+ADMISION_ESPERA = registro.histograma("mapus_admision_espera_segundos", "Tiempo en cola de los mensajes admitidos")
+CIRCUITO_RECHAZOS = registro.contador("mapus_circuito_rechazos_total", "Llamadas cortadas por circuito abierto", ("dependencia",))
+PLAZOS_VENCIDOS = registro.contador("mapus_plazo_vencido_total", "Etapas omitidas por falta de plazo", ("etapa",))
+LLM_RESPUESTAS = registro.contador("mapus_llm_respuestas_total", "Respuestas de Gemini por modelo y vía",
+                                   ("etapa", "modelo", "via"))
+PRIMERA_PARTE = registro.histograma("mapus_primera_parte_segundos", "Desde que llega el mensaje hasta la primera parte enviada")
+BLOQUEO_BUCLE = registro.histograma("mapus_bucle_bloqueo_segundos", "Bloqueos del event loop detectados por el vigilante")
+BD_CONEXIONES = registro.contador("mapus_bd_conexiones_total", "Conexiones entregadas por destino (primaria, réplica)", ("destino",))
+BD_SENTENCIAS = registro.contador("mapus_bd_sentencias_total", "Sentencias preparadas por tipo y resultado", ("tipo", "resultado"))
+MOTOR_LOCAL = registro.contador("mapus_motor_local_total", "Consultas generadas enviadas al motor analítico local", ("resultado",))
+
+
+# ============ TRAMOS POR PETICIÓN ============
+
+def iniciar_peticion(request_id=None):
+    """Asigna el ID de petición y reinicia los tramos del contexto actual."""
+    rid = request_id or uuid.uuid4().hex[:12]
+    request_id_var.set(rid)
+    _tramos_var.set([])
+    _modelos_var.set({})
+    _inicio_var.set(time.perf_counter())
+    return rid
+
+
+def etapa_actual():
+    return _etapa_var.get()
+
+
+@contextmanager
+def etapa(nombre):
+    """Mide un tramo del webhook; si la etapa lanza una excepción, cuenta el error y la propaga."""
+    token = _etapa_var.set(nombre)
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORES.inc(etapa=nombre)
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        _etapa_var.reset(token)
+        DURACION_ETAPA.observar(duracion, etapa=nombre)
+        tramos = _tramos_var.get()
+        if tramos is not None:
+            tramos.append((nombre, duracion))
+
+
+def registrar_error(nombre=None):
+    """Cuenta un error manejado en la etapa indicada (o en la etapa en curso)."""
+    ERRORES.inc(etapa=nombre or etapa_actual())
+
+
+def transcurrido():
+    """Segundos desde iniciar_peticion() (0 fuera de una petición)."""
+    inicio = _inicio_var.get()
+    return time.perf_counter() - inicio if inicio is not None else 0.0
+
+
+def registrar_modelo(nombre_etapa, modelo):
+    """Anota qué modelo respondió cada etapa del mensaje en curso."""
+    modelos_ = _modelos_var.get()
+    if modelos_ is not None:
+        modelos_[nombre_etapa] = modelo
+
+
+def modelos():
+    return dict(_modelos_var.get() or {})
+
+
+def tramos():
+    return list(_tramos_var.get() or [])
+
+
+def resumen_tramos():
+    """Texto corto con la duración de cada etapa en milisegundos."""
+    return " ".join(f"{n}={d * 1000:.0f}ms" for n, d in tramos())
@@ -0,0 +1,86 @@
+"""
+✂️ Partición de respuestas para WhatsApp
+Twilio rechaza cuerpos de más de 1600 caracteres; las respuestas largas se parten en piezas de
+hasta WHATSAPP_MAX_CARACTERES cortando en el mejor límite disponible (párrafo, línea, frase,
+palabra) en vez de a mitad de una línea.
+
+EnsambladorPartes recibe el texto a medida que Gemini lo genera (streaming) y envía cada pieza
+en cuanto está completa, así el usuario ve la primera parte sin esperar el resumen entero.
+"""
+
+import os
+import threading
+import time
+
+from log_config import get_logger
+from metricas import transcurrido, PRIMERA_PARTE
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+WHATSAPP_MAX_CARACTERES = int(os.getenv("WHATSAPP_MAX_CARACTERES", 1500))
+WHATSAPP_INTERVALO_S = float(os.getenv("WHATSAPP_INTERVALO_S", 1.0))  # Entre partes, para que lleguen en orden
+
+# Límites preferidos, del mejor al peor
+LIMITES = ("\n\n", "\n", ". ", " ")
+
+
+def punto_de_corte(texto, maximo=WHATSAPP_MAX_CARACTERES):
+    """Posición donde cortar texto (len > maximo) para que la primera pieza quepa en maximo."""
+    for limite in LIMITES:
+        corte = texto.rfind(limite, 0, maximo)
+        # Un corte demasiado temprano deja piezas diminutas: mejor probar el siguiente límite
+        if corte >= maximo // 3:
+            return corte + len(limite)
+    return maximo
+
+
+class EnsambladorPartes:
+    """Acumula texto y envía cada pieza completa con enviar(pieza)."""
+
+    def __init__(self, enviar, inicio="", maximo=WHATSAPP_MAX_CARACTERES, intervalo=WHATSAPP_INTERVALO_S):
+        self.enviar = enviar
+        self.maximo = maximo
+        self.intervalo = intervalo
+        self.enviadas = 0
+        self.recibido = False  # Llegó texto además del inicio
+        self._texto = [inicio] if inicio else []
+        self._pendiente = inicio
+        self._ultimo_envio = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def texto(self):
+        """Todo lo recibido (inicio incluido), para guardar en el historial."""
+        return "".join(self._texto)
+
+    def agregar(self, fragmento):
+        """Suma un fragmento; envía las piezas que ya no pueden crecer."""
+        if not fragmento:
+            return
+        with self._lock:
+            self.recibido = True
+            self._texto.append(fragmento)
+            self._pendiente += fragmento
+            while len(self._pendiente) > self.maximo:
+                corte = punto_de_corte(self._pendiente, self.maximo)
+                pieza, self._pendiente = self._pendiente[:corte].rstrip(), self._pendiente[corte:].lstrip("\n")
+                self._enviar(pieza)
+
+    def cerrar(self):
+        """Envía lo que quede."""
+        with self._lock:
+            pieza, self._pendiente = self._pendiente.strip(), ""
+            if pieza:
+                self._enviar(pieza)
+
+    def _enviar(self, pieza):
+        espera = self._ultimo_envio + self.intervalo - time.perf_counter()
+        if self.enviadas and espera > 0:
+            time.sleep(espera)
+        self.enviar(pieza)
+        self._ultimo_envio = time.perf_counter()
+        self.enviadas += 1
+        if self.enviadas == 1:
+            PRIMERA_PARTE.observar(transcurrido())
+        logger.info(f"🗣️ Parte {self.enviadas} enviada ({len(pieza)} caracteres).")
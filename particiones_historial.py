@@ -0,0 +1,371 @@
+"""
+🗂️ Particionado mensual de historial_conversaciones
+Convierte la tabla en una tabla particionada por rango de timestamp (una partición por mes),
+crea las particiones futuras y aplica la retención: las particiones más antiguas que
+HISTORIAL_RETENCION_MESES se archivan en archivos JSONL comprimidos y se eliminan.
+
+Uso:
+    python particiones_historial.py migrar                 # una sola vez, tabla existente -> particionada
+    python particiones_historial.py mantener               # cron diario: particiones futuras + retención
+    python particiones_historial.py leer [--desde 2025-01] [--hasta 2025-06] [--telefono whatsapp:+57...]
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import sys
+from datetime import date, datetime
+
+from db_config import get_db_connection
+from log_config import get_logger
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+TABLA = "historial_conversaciones"
+HISTORIAL_RETENCION_MESES = int(os.getenv("HISTORIAL_RETENCION_MESES", 6))
+HISTORIAL_MESES_ADELANTE = int(os.getenv("HISTORIAL_MESES_ADELANTE", 2))
+HISTORIAL_ARCHIVAR = os.getenv("HISTORIAL_ARCHIVAR", "true").lower() == "true"
+HISTORIAL_ARCHIVO_DIR = os.getenv("HISTORIAL_ARCHIVO_DIR", "archivo_historial")
+
+PATRON_PARTICION = re.compile(rf"^{TABLA}_p(\d{{4}})_(\d{{2}})$")
+
+
+# ============ UTILIDADES DE FECHAS ============
+
+def sumar_meses(mes, n):
+    """Primer día del mes desplazado n meses."""
+    total = mes.year * 12 + (mes.month - 1) + n
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def inicio_mes(d):
+    return date(d.year, d.month, 1)
+
+
+def nombre_particion(mes):
+    return f"{TABLA}_p{mes.year}_{mes.month:02d}"
+
+
+# ============ ESQUEMA ============
+
+def crear_tabla_particionada(cursor):
+    """Crea la tabla padre particionada, su partición por defecto y el índice."""
+    cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {TABLA}_id_seq")
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLA} (
+            id INTEGER NOT NULL DEFAULT nextval('{TABLA}_id_seq'),
+            telefono VARCHAR(50) NOT NULL,
+            mensaje_usuario TEXT NOT NULL,
+            sql_generado TEXT,
+            respuesta_bot TEXT,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    cursor.execute(f"ALTER SEQUENCE {TABLA}_id_seq OWNED BY {TABLA}.id")
+    # Red de seguridad: si falta la partición del mes, el INSERT no falla
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {TABLA}_default PARTITION OF {TABLA} DEFAULT")
+    # Índice particionado: cada partición mensual tiene su propio índice pequeño
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_telefono_timestamp
+        ON {TABLA} (telefono, timestamp DESC)
+    """)
+
+
+def crear_particion(cursor, mes):
+    """
+    Crea la partición del mes indicado si no existe. Devuelve True si la creó.
+
+    Si la partición por defecto ya guardó filas de ese mes (el INSERT llegó antes que la
+    partición), Postgres rechaza el CREATE ... PARTITION OF: se separa la default, se crea la
+    partición, se mueven allí esas filas y se vuelve a unir. Mientras tanto la tabla queda
+    bloqueada hasta el commit.
+    """
+    desde = inicio_mes(mes)
+    hasta = sumar_meses(desde, 1)
+    nombre = nombre_particion(desde)
+    cursor.execute("SELECT to_regclass(%s), to_regclass(%s)", (nombre, f"{TABLA}_default"))
+    existente, default = cursor.fetchone()
+    if existente is not None:
+        return False
+
+    crear = f"""
+        CREATE TABLE {nombre}
+        PARTITION OF {TABLA}
+        FOR VALUES FROM ('{desde.isoformat()}') TO ('{hasta.isoformat()}')
+    """
+    en_default = False
+    if default is not None:
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {TABLA}_default WHERE timestamp >= %s AND timestamp < %s)",
+                       (desde, hasta))
+        en_default = cursor.fetchone()[0]
+    if not en_default:
+        cursor.execute(crear)
+        return True
+
+    cursor.execute(f"ALTER TABLE {TABLA} DETACH PARTITION {TABLA}_default")
+    cursor.execute(crear)
+    cursor.execute(f"""
+        WITH movidas AS (
+            DELETE FROM {TABLA}_default WHERE timestamp >= %s AND timestamp < %s
+            RETURNING id, telefono, mensaje_usuario, sql_generado, respuesta_bot, timestamp
+        )
+        INSERT INTO {nombre} (id, telefono, mensaje_usuario, sql_generado, respuesta_bot, timestamp)
+        SELECT * FROM movidas
+    """, (desde, hasta))
+    movidas = cursor.rowcount
+    cursor.execute(f"ALTER TABLE {TABLA} ATTACH PARTITION {TABLA}_default DEFAULT")
+    logger.info(f"📦 {movidas} conversaciones movidas de {TABLA}_default a {nombre}")
+    return True
+
+
+def es_particionada(cursor):
+    cursor.execute("""
+        SELECT c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = %s
+    """, (TABLA,))
+    fila = cursor.fetchone()
+    return bool(fila) and fila[0] == "p"
+
+
+def listar_particiones(cursor):
+    """Devuelve [(nombre, mes)] de las particiones mensuales, de la más antigua a la más nueva."""
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (TABLA,))
+    particiones = []
+    for (nombre,) in cursor.fetchall():
+        m = PATRON_PARTICION.match(nombre)
+        if m:
+            particiones.append((nombre, date(int(m.group(1)), int(m.group(2)), 1)))
+    return sorted(particiones, key=lambda p: p[1])
+
+
+# ============ MIGRACIÓN ============
+
+def migrar_a_particionada():
+    """Convierte la tabla existente en particionada copiando los datos (una sola vez)."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        if es_particionada(cursor):
+            logger.info(f"✅ {TABLA} ya está particionada")
+            return
+
+        legado = f"{TABLA}_legacy"
+        logger.info(f"🔁 Renombrando {TABLA} -> {legado}...")
+        cursor.execute(f"LOCK TABLE {TABLA} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"ALTER TABLE {TABLA} RENAME TO {legado}")
+        cursor.execute(f"ALTER TABLE {legado} RENAME CONSTRAINT {TABLA}_pkey TO {legado}_pkey")
+        cursor.execute("ALTER INDEX IF EXISTS idx_telefono_timestamp RENAME TO idx_telefono_timestamp_legacy")
+
+        crear_tabla_particionada(cursor)
+
+        cursor.execute(f"SELECT MIN(timestamp) FROM {legado}")
+        minimo = cursor.fetchone()[0]
+        mes = inicio_mes(minimo.date()) if minimo else inicio_mes(date.today())
+        ultimo = sumar_meses(inicio_mes(date.today()), HISTORIAL_MESES_ADELANTE)
+        creadas = 0
+        while mes <= ultimo:
+            crear_particion(cursor, mes)
+            mes = sumar_meses(mes, 1)
+            creadas += 1
+        logger.info(f"📅 Particiones mensuales creadas: {creadas}")
+
+        cursor.execute(f"""
+            INSERT INTO {TABLA} (id, telefono, mensaje_usuario, sql_generado, respuesta_bot, timestamp)
+            SELECT id, telefono, mensaje_usuario, sql_generado, respuesta_bot,
+                   COALESCE(timestamp, CURRENT_TIMESTAMP)
+            FROM {legado}
+        """)
+        copiadas = cursor.rowcount
+
+        conn.commit()
+        cursor.close()
+        logger.info(f"✅ Migración completada: {copiadas} conversaciones copiadas")
+        logger.info(f"💡 Verifica los datos y luego elimina la tabla anterior: DROP TABLE {legado};")
+
+    except Exception as e:
+        logger.error(f"❌ Error migrando {TABLA}: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+
+# ============ MANTENIMIENTO ============
+
+def asegurar_particiones(meses_adelante=HISTORIAL_MESES_ADELANTE):
+    """Crea las particiones del mes actual y de los próximos meses."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        actual = inicio_mes(date.today())
+        fallidas = 0
+        # Una transacción por mes: un mes que falla no deshace los demás
+        for n in range(meses_adelante + 1):
+            mes = sumar_meses(actual, n)
+            try:
+                crear_particion(cursor, mes)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                fallidas += 1
+                logger.error(f"❌ Error creando {nombre_particion(mes)}: {e}")
+        cursor.close()
+        if not fallidas:
+            logger.info(f"✅ Particiones aseguradas hasta {nombre_particion(sumar_meses(actual, meses_adelante))}")
+    except Exception as e:
+        logger.error(f"❌ Error creando particiones: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+
+def archivar_particion(conn, nombre, directorio=HISTORIAL_ARCHIVO_DIR):
+    """Exporta una partición a <directorio>/<nombre>.jsonl.gz y devuelve las filas escritas."""
+    os.makedirs(directorio, exist_ok=True)
+    destino = os.path.join(directorio, f"{nombre}.jsonl.gz")
+    temporal = destino + ".tmp"
+    escritas = 0
+    # Cursor con nombre (server-side) para no cargar la partición completa en memoria
+    cursor = conn.cursor(name=f"archivo_{nombre}")
+    cursor.itersize = 5000
+    cursor.execute(f"""
+        SELECT id, telefono, mensaje_usuario, sql_generado, respuesta_bot, timestamp
+        FROM {nombre}
+        ORDER BY timestamp
+    """)
+    with gzip.open(temporal, "wt", encoding="utf-8") as f:
+        for id_, telefono, mensaje, sql, respuesta, ts in cursor:
+            f.write(json.dumps({
+                "id": id_,
+                "telefono": telefono,
+                "mensaje_usuario": mensaje,
+                "sql_generado": sql,
+                "respuesta_bot": respuesta,
+                "timestamp": ts.isoformat(),
+            }, ensure_ascii=False) + "\n")
+            escritas += 1
+    cursor.close()
+    os.replace(temporal, destino)
+    return escritas
+
+
+def aplicar_retencion(meses=HISTORIAL_RETENCION_MESES, archivar=HISTORIAL_ARCHIVAR,
+                      directorio=HISTORIAL_ARCHIVO_DIR):
+    """Archiva (opcional) y elimina las particiones anteriores a la ventana de retención."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        corte = sumar_meses(inicio_mes(date.today()), -meses)
+        vencidas = [(n, m) for n, m in listar_particiones(cursor) if m < corte]
+
+        if not vencidas:
+            logger.info(f"✅ No hay particiones anteriores a {corte.isoformat()}")
+            return
+
+        for nombre, _ in vencidas:
+            cursor.execute(f"SELECT COUNT(*) FROM {nombre}")
+            total = cursor.fetchone()[0]
+            if archivar:
+                escritas = archivar_particion(conn, nombre, directorio)
+                if escritas != total:
+                    raise Exception(f"{nombre}: se archivaron {escritas} de {total} filas, no se elimina")
+                logger.info(f"📦 {nombre}: {escritas} conversaciones archivadas en {directorio}")
+            cursor.execute(f"ALTER TABLE {TABLA} DETACH PARTITION {nombre}")
+            cursor.execute(f"DROP TABLE {nombre}")
+            conn.commit()
+            logger.info(f"🗑️ {nombre} eliminada ({total} filas)")
+
+        cursor.close()
+    except Exception as e:
+        logger.error(f"❌ Error aplicando retención: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+
+def mantener():
+    """Tarea periódica: particiones futuras + retención."""
+    asegurar_particiones()
+    aplicar_retencion()
+
+
+# ============ LECTURA DEL ARCHIVO ============
+
+def leer_archivo(directorio=HISTORIAL_ARCHIVO_DIR, desde=None, hasta=None, telefono=None):
+    """
+    Itera las conversaciones archivadas en orden cronológico.
+
+    Args:
+        directorio (str): Carpeta con los archivos <particion>.jsonl.gz
+        desde (date, optional): Primer mes a incluir
+        hasta (date, optional): Último mes a incluir
+        telefono (str, optional): Filtrar por teléfono
+
+    Yields:
+        dict: Conversación con los campos de historial_conversaciones
+    """
+    archivos = []
+    for ruta in glob.glob(os.path.join(directorio, f"{TABLA}_p*.jsonl.gz")):
+        m = PATRON_PARTICION.match(os.path.basename(ruta)[:-len(".jsonl.gz")])
+        if not m:
+            continue
+        mes = date(int(m.group(1)), int(m.group(2)), 1)
+        if (desde and mes < inicio_mes(desde)) or (hasta and mes > inicio_mes(hasta)):
+            continue
+        archivos.append((mes, ruta))
+
+    for _, ruta in sorted(archivos):
+        with gzip.open(ruta, "rt", encoding="utf-8") as f:
+            for linea in f:
+                conv = json.loads(linea)
+                if telefono and conv["telefono"] != telefono:
+                    continue
+                conv["timestamp"] = datetime.fromisoformat(conv["timestamp"])
+                yield conv
+
+
+def _mes(valor):
+    return datetime.strptime(valor, "%Y-%m").date()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Particionado y retención de historial_conversaciones")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("migrar", help="Convierte la tabla existente en particionada")
+    sub.add_parser("mantener", help="Crea particiones futuras y aplica la retención")
+    p_leer = sub.add_parser("leer", help="Imprime el archivo histórico como JSONL")
+    p_leer.add_argument("--desde", type=_mes, help="Mes inicial (YYYY-MM)")
+    p_leer.add_argument("--hasta", type=_mes, help="Mes final (YYYY-MM)")
+    p_leer.add_argument("--telefono")
+    p_leer.add_argument("--directorio", default=HISTORIAL_ARCHIVO_DIR)
+    args = parser.parse_args()
+
+    if args.comando == "migrar":
+        migrar_a_particionada()
+    elif args.comando == "mantener":
+        mantener()
+    else:
+        for conv in leer_archivo(args.directorio, args.desde, args.hasta, args.telefono):
+            conv["timestamp"] = conv["timestamp"].isoformat()
+            sys.stdout.write(json.dumps(conv, ensure_ascii=False) + "\n")
@@ -0,0 +1,248 @@
+"""
+🔥 Perfilado bajo demanda del webhook
+- Muestreo de pilas por petición (cabecera X-Perfilar) o de todo el proceso durante N segundos
+  (endpoint de administración), sin dependencias: lee sys._current_frames() cada
+  PERFIL_INTERVALO_MS desde un hilo aparte.
+- Vigilante del event loop: un latido periódico en el loop y un hilo que, si el latido se
+  atrasa más de PERFIL_VIGILANTE_MS, muestrea la pila del hilo del loop para señalar la llamada
+  bloqueante (time.sleep, consultas síncronas, requests...).
+Los volcados usan el formato "collapsed stacks" (una pila por línea: marco;marco;marco N),
+compatible con flamegraph.pl, speedscope e inferno.
+"""
+
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from log_config import get_logger
+from metricas import BLOQUEO_BUCLE
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+PERFIL_TOKEN = os.getenv("PERFIL_TOKEN")  # Sin token, el perfilado bajo demanda queda deshabilitado
+PERFIL_INTERVALO_MS = float(os.getenv("PERFIL_INTERVALO_MS", 5))
+PERFIL_DIR = os.getenv("PERFIL_DIR", "perfiles")
+PERFIL_VIGILANTE_MS = float(os.getenv("PERFIL_VIGILANTE_MS", 0))  # 0 = vigilante apagado
+PERFIL_MAX_VOLCADOS = int(os.getenv("PERFIL_MAX_VOLCADOS", 200))
+
+RE_NOMBRE_VOLCADO = re.compile(r"^[\w.-]+\.folded$")
+
+
+def pila_colapsada(frame, limite=64):
+    """'funcion (archivo:linea);...' de la raíz a la hoja."""
+    marcos = []
+    while frame is not None and len(marcos) < limite:
+        codigo = frame.f_code
+        marcos.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(marcos))
+
+
+def escribir_volcado(pilas, nombre, directorio=PERFIL_DIR):
+    """Guarda un Counter de pilas en <directorio>/<nombre>.folded y devuelve la ruta."""
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"{nombre}.folded")
+    with open(ruta, "w", encoding="utf-8") as f:
+        for pila, muestras in pilas.most_common():
+            f.write(f"{pila} {muestras}\n")
+    _podar_volcados(directorio)
+    return ruta
+
+
+def _podar_volcados(directorio):
+    archivos = sorted(
+        (os.path.join(directorio, n) for n in os.listdir(directorio) if n.endswith(".folded")),
+        key=os.path.getmtime,
+    )
+    for ruta in archivos[:-PERFIL_MAX_VOLCADOS]:
+        os.remove(ruta)
+
+
+def listar_volcados(directorio=PERFIL_DIR):
+    if not os.path.isdir(directorio):
+        return []
+    return sorted((n for n in os.listdir(directorio) if n.endswith(".folded")), reverse=True)
+
+
+def leer_volcado(nombre, directorio=PERFIL_DIR):
+    """Contenido de un volcado; None si el nombre no es válido o no existe."""
+    if not RE_NOMBRE_VOLCADO.match(nombre):
+        return None
+    ruta = os.path.join(directorio, nombre)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding="utf-8") as f:
+        return f.read()
+
+
+class Muestreador:
+    """Hilo que muestrea las pilas de los hilos registrados mientras haya alguno."""
+
+    def __init__(self, intervalo_ms=PERFIL_INTERVALO_MS):
+        self.intervalo = intervalo_ms / 1000
+        self._objetivos = {}  # id de hilo (o None = todos) -> Counter
+        self._lock = threading.Lock()
+        self._hay_objetivos = threading.Event()
+        self._hilo = None
+
+    def seguir(self, thread_id, pilas):
+        """Acumula en `pilas` las muestras del hilo (thread_id None = todos los hilos)."""
+        with self._lock:
+            self._objetivos[thread_id] = pilas
+            self._hay_objetivos.set()
+            if not self._hilo or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="perfilador", daemon=True)
+                self._hilo.start()
+
+    def dejar(self, thread_id):
+        with self._lock:
+            self._objetivos.pop(thread_id, None)
+            if not self._objetivos:
+                self._hay_objetivos.clear()
+
+    def _bucle(self):
+        propio = threading.get_ident()
+        while True:
+            self._hay_objetivos.wait()
+            # Con el lock tomado: dejar() no retorna mientras se escribe en su Counter
+            with self._lock:
+                frames = sys._current_frames()
+                for thread_id, pilas in self._objetivos.items():
+                    if thread_id is None:
+                        nombres = {t.ident: t.name for t in threading.enumerate()}
+                        for tid, frame in frames.items():
+                            if tid != propio:
+                                pilas[f"{nombres.get(tid, tid)};{pila_colapsada(frame)}"] += 1
+                    elif thread_id in frames:
+                        pilas[pila_colapsada(frames[thread_id])] += 1
+                del frames
+            time.sleep(self.intervalo)
+
+
+class Perfilador:
+    """Punto de entrada de main.py: decide qué peticiones perfilar y guarda los volcados."""
+
+    def __init__(self, token=PERFIL_TOKEN, directorio=PERFIL_DIR):
+        self.token = token
+        self.directorio = directorio
+        self.muestreador = Muestreador()
+        self._pendientes = 0  # Próximas N peticiones a perfilar (endpoint de administración)
+        self._lock = threading.Lock()
+
+    def autorizado(self, valor):
+        if not self.token or not valor:
+            return False
+        # Comparación en tiempo constante: no revela cuántos caracteres del token coinciden
+        return hmac.compare_digest(valor.encode(), self.token.encode())
+
+    def perfilar_siguientes(self, solicitudes):
+        with self._lock:
+            self._pendientes += solicitudes
+            return self._pendientes
+
+    def debe_perfilar(self, cabeceras):
+        """True si la petición trae X-Perfilar con el token o quedan peticiones encargadas."""
+        if self.autorizado(cabeceras.get("x-perfilar")):
+            return True
+        with self._lock:
+            if self._pendientes > 0:
+                self._pendientes -= 1
+                return True
+        return False
+
+    @contextmanager
+    def perfilar_peticion(self, activo, etiqueta):
+        """Muestrea el hilo actual durante el bloque y guarda req_<etiqueta>.folded."""
+        if not activo:
+            yield
+            return
+        pilas = Counter()
+        thread_id = threading.get_ident()
+        inicio = time.perf_counter()
+        self.muestreador.seguir(thread_id, pilas)
+        try:
+            yield
+        finally:
+            self.muestreador.dejar(thread_id)
+            etiqueta = re.sub(r"[^\w-]", "", str(etiqueta))[:40]
+            ruta = escribir_volcado(pilas, f"req_{datetime.now():%Y%m%d_%H%M%S}_{etiqueta}", self.directorio)
+            logger.info(f"🔥 Perfil de petición: {sum(pilas.values())} muestras en "
+                        f"{(time.perf_counter() - inicio) * 1000:.0f}ms -> {ruta}")
+
+    def perfilar_proceso(self, segundos):
+        """Muestrea todos los hilos durante `segundos` en segundo plano; devuelve el nombre del volcado."""
+        nombre = f"proceso_{datetime.now():%Y%m%d_%H%M%S}"
+
+        def tarea():
+            pilas = Counter()
+            self.muestreador.seguir(None, pilas)
+            time.sleep(segundos)
+            self.muestreador.dejar(None)
+            ruta = escribir_volcado(pilas, nombre, self.directorio)
+            logger.info(f"🔥 Perfil de proceso: {sum(pilas.values())} muestras en {segundos}s -> {ruta}")
+
+        threading.Thread(target=tarea, name="perfil-proceso", daemon=True).start()
+        return f"{nombre}.folded"
+
+
+class VigilanteBucle:
+    """Detecta bloqueos del event loop y acumula las pilas que los causan."""
+
+    def __init__(self, umbral_ms=PERFIL_VIGILANTE_MS):
+        self.umbral = umbral_ms / 1000
+        self.pilas = Counter()
+        self.bloqueos = 0
+        self._latido = time.monotonic()
+        self._loop = None
+        self._thread_id = None
+
+    def iniciar(self, loop):
+        """Llamar desde el hilo del loop (evento startup)."""
+        if self.umbral <= 0 or self._loop is not None:
+            return
+        self._loop = loop
+        self._thread_id = threading.get_ident()
+        self._latir()
+        threading.Thread(target=self._vigilar, name="vigilante-bucle", daemon=True).start()
+        logger.info(f"👀 Vigilante del event loop activo (umbral {self.umbral * 1000:.0f}ms)")
+
+    def _latir(self):
+        self._latido = time.monotonic()
+        self._loop.call_later(self.umbral / 4, self._latir)
+
+    def _vigilar(self):
+        paso = self.umbral / 4
+        while True:
+            time.sleep(paso)
+            atraso = time.monotonic() - self._latido
+            if atraso < self.umbral:
+                continue
+            # Bloqueado: muestrear hasta que el loop vuelva a latir
+            inicio = self._latido
+            pilas = Counter()
+            while self._latido == inicio:
+                frame = sys._current_frames().get(self._thread_id)
+                if frame is not None:
+                    pilas[pila_colapsada(frame)] += 1
+                time.sleep(PERFIL_INTERVALO_MS / 1000)
+            duracion = time.monotonic() - inicio
+            self.bloqueos += 1
+            self.pilas.update(pilas)
+            BLOQUEO_BUCLE.observar(duracion)
+            culpable = pilas.most_common(1)[0][0].split(";")[-3:] if pilas else ["?"]
+            logger.warning(f"🧱 Event loop bloqueado {duracion * 1000:.0f}ms en {' <- '.join(reversed(culpable))}")
+
+    def volcar(self, directorio=PERFIL_DIR):
+        return escribir_volcado(self.pilas, f"bloqueos_{datetime.now():%Y%m%d_%H%M%S}", directorio)
+
+
+# Instancias globales usadas por main.py
+perfilador = Perfilador()
+vigilante_bucle = VigilanteBucle()
@@ -0,0 +1,462 @@
+"""
+💹 Almacén de precios en arreglos NumPy mapeados en memoria
+Las preguntas de precios (promedio, percentiles, mínimo/máximo por ítem, insumo, ciudad o año)
+se responden sin Postgres ni Gemini desde arreglos precalculados:
+
+- items: un registro por ítem de cada proyecto (apus repite el precio del ítem en cada insumo,
+  así que se deduplica por proyecto + ítem) con precio_unitario.
+- insumos: un registro por fila de apus con precio_unitario_apu.
+
+Las dimensiones de texto (ítem, insumo, proyecto, ciudad, tipo de insumo) se codifican como
+enteros con un vocabulario JSON. Cada tabla se ordena por su código de ítem/insumo y guarda los
+desplazamientos de cada código, así una búsqueda lee solo un tramo contiguo del arreglo.
+
+Los .npy se abren con mmap_mode="r": los workers de uvicorn comparten las mismas páginas del
+caché del sistema operativo en vez de cargar una copia cada uno. Cada construcción escribe un
+directorio nuevo y cambia el puntero ACTUAL al final; los lectores lo detectan y se remapean.
+
+Dependencia opcional: numpy. Uso:
+    python precios_apus.py construir [--sinteticos 200000]
+    python precios_apus.py medir "precio promedio del concreto de 3000 psi por ciudad"
+"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from create_apus_table import COLUMNAS_APUS
+from log_config import get_logger
+from vuelo_unico import normalizar_pregunta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+PRECIOS_DIR = os.getenv("PRECIOS_DIR", os.path.join("snapshots", "precios"))
+PRECIOS_CONSTRUIR = os.getenv("PRECIOS_CONSTRUIR", "1") == "1"  # Reconstruir al terminar load_apus_csv
+PRECIOS_REVISION_S = float(os.getenv("PRECIOS_REVISION_S", 30))  # Cada cuánto buscar una versión nueva
+PRECIOS_VERSIONES = 2  # Versiones que se conservan en disco (los workers pueden tener la anterior mapeada)
+PRECIOS_CACHE_BUSQUEDAS = 2048
+
+# Tabla -> dimensión de su sujeto y columnas (nombre, dtype)
+TABLAS = {
+    "items": ("item", (("precio", "f8"), ("sujeto", "i4"), ("proyecto", "i4"), ("ciudad", "i4"), ("anio", "i2"))),
+    "insumos": ("insumo", (("precio", "f8"), ("sujeto", "i4"), ("proyecto", "i4"), ("ciudad", "i4"),
+                           ("anio", "i2"), ("tipo", "i4"))),
+}
+DIMENSIONES = ("item", "insumo", "proyecto", "ciudad", "tipo_insumo")
+# Columna de la tabla -> dimensión del vocabulario
+VOCABULARIO_COLUMNA = {"proyecto": "proyecto", "ciudad": "ciudad", "tipo": "tipo_insumo"}
+
+_I = {c: i for i, c in enumerate(COLUMNAS_APUS)}
+
+
+# ============ CONSTRUCCIÓN ============
+
+class _Codificador:
+    """Texto -> código entero estable (orden de aparición)."""
+
+    def __init__(self):
+        self.codigos = {}
+        self.valores = []
+
+    def __call__(self, texto):
+        texto = (texto or "").strip()
+        codigo = self.codigos.get(texto)
+        if codigo is None:
+            codigo = self.codigos[texto] = len(self.valores)
+            self.valores.append(texto)
+        return codigo
+
+
+def _anio(fila):
+    fecha = fila[_I["fecha_aprobacion_apu"]] or fila[_I["fecha_analisis_apu"]]
+    return fecha.year if fecha else 0
+
+
+def construir_desde_filas(filas, directorio=PRECIOS_DIR):
+    """
+    Construye una versión nueva del almacén a partir de filas de apus (orden de COLUMNAS_APUS).
+
+    Returns:
+        dict: {"version", "items", "insumos", "segundos"}
+    """
+    inicio = time.perf_counter()
+    codificadores = {d: _Codificador() for d in DIMENSIONES}
+    columnas = {tabla: {c: array({"f8": "d", "i4": "i", "i2": "h"}[t]) for c, t in cols}
+                for tabla, (_, cols) in TABLAS.items()}
+    vistos = set()
+
+    for fila in filas:
+        proyecto = codificadores["proyecto"](fila[_I["nombre_proyecto"]])
+        ciudad = codificadores["ciudad"](fila[_I["ciudad"]])
+        anio = _anio(fila)
+        precio_item = fila[_I["precio_unitario"]]
+        descripcion = fila[_I["items_descripcion"]]
+        if precio_item is not None and descripcion:
+            clave = (proyecto, fila[_I["item"]], descripcion)
+            if clave not in vistos:
+                vistos.add(clave)
+                t = columnas["items"]
+                t["precio"].append(float(precio_item))
+                t["sujeto"].append(codificadores["item"](descripcion))
+                t["proyecto"].append(proyecto)
+                t["ciudad"].append(ciudad)
+                t["anio"].append(anio)
+        precio_insumo = fila[_I["precio_unitario_apu"]]
+        insumo = fila[_I["insumo_descripcion"]]
+        if precio_insumo is not None and insumo:
+            t = columnas["insumos"]
+            t["precio"].append(float(precio_insumo))
+            t["sujeto"].append(codificadores["insumo"](insumo))
+            t["proyecto"].append(proyecto)
+            t["ciudad"].append(ciudad)
+            t["anio"].append(anio)
+            t["tipo"].append(codificadores["tipo_insumo"](fila[_I["tipo_insumo"]]))
+
+    version = datetime.now().strftime("v%Y%m%d%H%M%S%f")
+    destino = os.path.join(directorio, version)
+    os.makedirs(destino)
+    totales = {}
+    for tabla, (dimension, cols) in TABLAS.items():
+        datos = {c: np.frombuffer(columnas[tabla][c], dtype=t) if len(columnas[tabla][c]) else np.empty(0, t)
+                 for c, t in cols}
+        # Orden por sujeto: las filas de un ítem/insumo quedan contiguas
+        orden = np.argsort(datos["sujeto"], kind="stable")
+        for c, _ in cols:
+            np.save(os.path.join(destino, f"{tabla}_{c}.npy"), datos[c][orden])
+        n_codigos = len(codificadores[dimension].valores)
+        desplazamientos = np.searchsorted(datos["sujeto"][orden], np.arange(n_codigos + 1)).astype("i8")
+        np.save(os.path.join(destino, f"{tabla}_desplazamientos.npy"), desplazamientos)
+        totales[tabla] = len(orden)
+    with open(os.path.join(destino, "vocabulario.json"), "w", encoding="utf-8") as f:
+        json.dump({d: c.valores for d, c in codificadores.items()}, f, ensure_ascii=False)
+
+    # El puntero se cambia al final: los lectores nunca ven una versión a medias
+    puntero = os.path.join(directorio, "ACTUAL")
+    with open(f"{puntero}.tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(f"{puntero}.tmp", puntero)
+    _limpiar_versiones(directorio, version)
+
+    resultado = {"version": version, **totales, "segundos": round(time.perf_counter() - inicio, 2)}
+    logger.info(f"💹 Almacén de precios {version}: {totales['items']} ítems, "
+                f"{totales['insumos']} insumos en {resultado['segundos']}s")
+    return resultado
+
+
+def _limpiar_versiones(directorio, actual):
+    # Borrar un .npy mapeado no afecta a quien lo tiene abierto (Linux conserva el archivo)
+    versiones = sorted(d for d in os.listdir(directorio) if d.startswith("v") and d != actual)
+    for vieja in versiones[:max(len(versiones) - (PRECIOS_VERSIONES - 1), 0)]:
+        shutil.rmtree(os.path.join(directorio, vieja), ignore_errors=True)
+
+
+def construir_almacen(directorio=PRECIOS_DIR):
+    """Construye el almacén leyendo apus de la primaria. None si falta numpy o falló."""
+    if np is None:
+        logger.warning("⚠️ numpy no está instalado: no se construye el almacén de precios")
+        return None
+    from db_config import get_db_connection
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(name="precios_apus")  # Server-side: apus no se carga entera en memoria
+        cursor.itersize = 50000
+        cursor.execute(f"SELECT {', '.join(COLUMNAS_APUS)} FROM apus ORDER BY id")
+        resultado = construir_desde_filas(cursor, directorio)
+        cursor.close()
+        return resultado
+    except Exception as e:
+        logger.error(f"❌ Error construyendo el almacén de precios: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+# ============ CONSULTA ============
+
+def _percentiles(ordenados, inicios, largos, p):
+    """Percentil p (interpolación lineal) de cada grupo de un arreglo ordenado por grupo y valor."""
+    k = inicios + (largos - 1) * (p / 100)
+    piso = np.floor(k).astype("i8")
+    techo = np.ceil(k).astype("i8")
+    return ordenados[piso] + (ordenados[techo] - ordenados[piso]) * (k - piso)
+
+
+class VersionPrecios:
+    """
+    Una versión mapeada del almacén: tablas, vocabulario, vocabulario normalizado y caché de
+    búsquedas. No cambia después de construida; una recarga publica otra instancia completa, así
+    que varias llamadas sobre la misma versión nunca mezclan códigos de dos construcciones.
+    """
+
+    __slots__ = ("nombre", "tablas", "vocabulario", "_normalizado", "_busquedas")
+
+    def __init__(self, nombre, tablas, vocabulario):
+        self.nombre = nombre
+        self.tablas = tablas
+        self.vocabulario = vocabulario
+        self._normalizado = {d: [normalizar_pregunta(v) for v in valores] for d, valores in vocabulario.items()}
+        self._busquedas = {}  # Códigos por búsqueda; válidos solo para esta versión
+
+    def buscar(self, dimension, texto):
+        """Códigos de la dimensión cuyo texto contiene todas las palabras de texto (sin tildes)."""
+        palabras = normalizar_pregunta(texto).split()
+        clave = (dimension, tuple(palabras))
+        codigos = self._busquedas.get(clave)
+        if codigos is None:
+            codigos = np.array([i for i, valor in enumerate(self._normalizado[dimension])
+                                if all(p in valor for p in palabras)], dtype="i4")
+            if len(self._busquedas) >= PRECIOS_CACHE_BUSQUEDAS:
+                self._busquedas.clear()
+            self._busquedas[clave] = codigos
+        return codigos
+
+    def etiqueta(self, dimension, codigo):
+        return self.vocabulario[dimension][codigo]
+
+    def normalizado(self, dimension):
+        """Vocabulario de la dimensión sin tildes ni mayúsculas (mismo orden que los códigos)."""
+        return self._normalizado.get(dimension, [])
+
+    def seleccionar(self, tabla, sujeto=None, ciudad=None, anio=None):
+        """
+        Índices de las filas de la tabla que cumplen los filtros.
+
+        Args:
+            sujeto (str): Palabras del ítem (tabla items) o insumo (tabla insumos)
+            ciudad (str): Palabras de la ciudad
+            anio (int): Año de aprobación del APU
+        """
+        t = self.tablas[tabla]
+        if sujeto:
+            codigos = self.buscar(TABLAS[tabla][0], sujeto)
+            desp = t["desplazamientos"]
+            # Tramos contiguos [desp[c], desp[c + 1]) de cada código encontrado
+            inicios, fines = desp[codigos], desp[codigos + 1]
+            largos = fines - inicios
+            if not largos.sum():
+                return np.empty(0, dtype="i8")
+            idx = np.repeat(inicios - np.cumsum(largos) + largos, largos) + np.arange(largos.sum())
+        else:
+            idx = np.arange(len(t["precio"]))
+        if ciudad:
+            idx = idx[np.isin(t["ciudad"][idx], self.buscar("ciudad", ciudad))]
+        if anio:
+            idx = idx[t["anio"][idx] == anio]
+        return idx
+
+    def estadisticas(self, tabla, sujeto=None, por=None, ciudad=None, anio=None, percentiles=(50,)):
+        """
+        Estadísticas del precio, agrupadas por "ciudad", "anio", "sujeto", "proyecto" o "tipo".
+
+        Returns:
+            list[dict]: {"grupo", "n", "promedio", "minimo", "maximo", "p50", ...}; sin `por`, un
+            solo elemento con grupo None. Agrupado, ordenado por promedio descendente.
+        """
+        t = self.tablas[tabla]
+        idx = self.seleccionar(tabla, sujeto, ciudad, anio)
+        if not len(idx):
+            return []
+        precios = t["precio"][idx]
+        grupos = t[por][idx] if por else np.zeros(len(idx), dtype="i4")
+        # Orden por (grupo, precio): cada grupo queda contiguo y ordenado para los percentiles
+        orden = np.lexsort((precios, grupos))
+        precios, grupos = precios[orden], grupos[orden]
+        inicios = np.flatnonzero(np.r_[True, grupos[1:] != grupos[:-1]])
+        largos = np.diff(np.r_[inicios, len(grupos)])
+        sumas = np.add.reduceat(precios, inicios)
+        resultado = {
+            "n": largos,
+            "promedio": sumas / largos,
+            "minimo": precios[inicios],
+            "maximo": precios[inicios + largos - 1],
+        }
+        for p in percentiles:
+            resultado[f"p{p:g}"] = _percentiles(precios, inicios, largos, p)
+        filas = []
+        for i, codigo in enumerate(grupos[inicios]):
+            fila = {"grupo": self._etiqueta_grupo(tabla, por, int(codigo)) if por else None}
+            fila.update({clave: valores[i].item() for clave, valores in resultado.items()})
+            filas.append(fila)
+        if por:
+            filas.sort(key=lambda f: -f["promedio"])
+        return filas
+
+    def top(self, tabla, sujeto=None, k=5, mayores=True, ciudad=None, anio=None):
+        """
+        Los k registros de mayor (o menor) precio con su descripción, proyecto, ciudad y año.
+        Un mismo ítem/insumo de un mismo proyecto cuenta una sola vez (un insumo se repite en
+        cada ítem que lo usa).
+        """
+        t = self.tablas[tabla]
+        idx = self.seleccionar(tabla, sujeto, ciudad, anio)
+        if not len(idx):
+            return []
+        precios = t["precio"][idx]
+        claves = -precios if mayores else precios
+        # Primero entre los mejores 64·k (partición parcial); si no alcanzan k pares distintos, todos
+        for m in (min(64 * k, len(idx)), len(idx)):
+            candidatos = np.argpartition(claves, m - 1)[:m] if m < len(idx) else np.arange(len(idx))
+            ordenados = idx[candidatos[np.argsort(claves[candidatos], kind="stable")]]
+            # Primera aparición (la de mejor precio) de cada par (sujeto, proyecto)
+            pares = t["sujeto"][ordenados].astype("i8") << 32 | t["proyecto"][ordenados]
+            _, primeros = np.unique(pares, return_index=True)
+            if len(primeros) >= k:
+                break
+        elegidos = ordenados[np.sort(primeros)[:k]]
+        dimension = TABLAS[tabla][0]
+        return [{
+            "descripcion": self.etiqueta(dimension, int(t["sujeto"][i])),
+            "proyecto": self.etiqueta("proyecto", int(t["proyecto"][i])),
+            "ciudad": self.etiqueta("ciudad", int(t["ciudad"][i])),
+            "anio": int(t["anio"][i]) or None,
+            "precio": float(t["precio"][i]),
+        } for i in elegidos]
+
+    def _etiqueta_grupo(self, tabla, por, codigo):
+        if por == "anio":
+            return codigo or None
+        dimension = TABLAS[tabla][0] if por == "sujeto" else VOCABULARIO_COLUMNA[por]
+        return self.etiqueta(dimension, codigo)
+
+
+class AlmacenPrecios:
+    """
+    Versión vigente del almacén y API de estadísticas.
+    Cada llamada usa la versión que estaba publicada al empezar; quien necesita varias llamadas
+    coherentes entre sí (buscar y luego seleccionar) toma la versión con vigente().
+    """
+
+    def __init__(self, directorio=PRECIOS_DIR):
+        self.directorio = directorio
+        self._actual = None  # VersionPrecios; se reemplaza entera en cada recarga
+        self._revisado = 0.0
+        self._recarga = threading.Lock()
+
+    @property
+    def version(self):
+        actual = self._actual
+        return actual.nombre if actual else None
+
+    @property
+    def disponible(self):
+        return self.vigente() is not None
+
+    def vigente(self):
+        """VersionPrecios publicada (None si no hay almacén); revisa antes si hay una más nueva."""
+        self._revisar()
+        return self._actual
+
+    def buscar(self, dimension, texto):
+        return self._actual.buscar(dimension, texto)
+
+    def etiqueta(self, dimension, codigo):
+        return self._actual.etiqueta(dimension, codigo)
+
+    def normalizado(self, dimension):
+        actual = self._actual
+        return actual.normalizado(dimension) if actual else []
+
+    def seleccionar(self, tabla, sujeto=None, ciudad=None, anio=None):
+        return self._actual.seleccionar(tabla, sujeto, ciudad, anio)
+
+    def estadisticas(self, tabla, sujeto=None, por=None, ciudad=None, anio=None, percentiles=(50,)):
+        return self._actual.estadisticas(tabla, sujeto, por, ciudad, anio, percentiles)
+
+    def top(self, tabla, sujeto=None, k=5, mayores=True, ciudad=None, anio=None):
+        return self._actual.top(tabla, sujeto, k, mayores, ciudad, anio)
+
+    def _revisar(self):
+        """Mapea la versión vigente la primera vez y cuando cambia ACTUAL (como mucho cada PRECIOS_REVISION_S)."""
+        ahora = time.monotonic()
+        if np is None or (self._actual is not None and ahora - self._revisado < PRECIOS_REVISION_S):
+            return
+        if not self._recarga.acquire(blocking=self._actual is None):
+            return
+        try:
+            self._revisado = ahora
+            puntero = os.path.join(self.directorio, "ACTUAL")
+            if not os.path.exists(puntero):
+                return
+            with open(puntero, encoding="utf-8") as f:
+                version = f.read().strip()
+            if version != self.version:
+                self._cargar(version)
+        except Exception as e:
+            logger.error(f"❌ Error abriendo el almacén de precios: {e}")
+        finally:
+            self._recarga.release()
+
+    def _cargar(self, version):
+        origen = os.path.join(self.directorio, version)
+        tablas = {}
+        for tabla, (_, cols) in TABLAS.items():
+            # asarray: vista ndarray del mismo mapeo, sin el costo de la subclase memmap en cada operación
+            tablas[tabla] = {c: np.asarray(np.load(os.path.join(origen, f"{tabla}_{c}.npy"), mmap_mode="r"))
+                             for c in [c for c, _ in cols] + ["desplazamientos"]}
+        with open(os.path.join(origen, "vocabulario.json"), encoding="utf-8") as f:
+            vocabulario = json.load(f)
+        # Una sola asignación publica la versión completa: una consulta en curso sigue con la suya
+        self._actual = VersionPrecios(version, tablas, vocabulario)
+        logger.info(f"💹 Almacén de precios {version} mapeado: {len(tablas['items']['precio'])} ítems, "
+                    f"{len(tablas['insumos']['precio'])} insumos")
+
+
+# Instancia global usada por intenciones.py
+almacen_precios = AlmacenPrecios()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Almacén de precios en NumPy")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p = sub.add_parser("construir", help="Construir una versión nueva desde apus")
+    p.add_argument("--directorio", default=PRECIOS_DIR)
+    p.add_argument("--sinteticos", type=int, help="Usar N filas de datos_sinteticos en vez de la base")
+    p = sub.add_parser("medir", help="Latencia de la vía rápida para preguntas de ejemplo")
+    p.add_argument("preguntas", nargs="+")
+    p.add_argument("--repeticiones", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.comando == "construir":
+        if args.sinteticos:
+            from datos_sinteticos import filas_apus_sinteticas
+            resultado = construir_desde_filas(filas_apus_sinteticas(args.sinteticos), args.directorio)
+        else:
+            resultado = construir_almacen(args.directorio)
+        if resultado is None:
+            raise SystemExit(1)
+        print(json.dumps(resultado, indent=2))
+    else:
+        from bench_utils import resumen_latencias
+        from intenciones import responder_via_rapida
+
+        for pregunta in args.preguntas:
+            respuesta = responder_via_rapida(pregunta)
+            if respuesta is None:
+                print(f"↩️ Sin vía rápida: {pregunta}")
+                continue
+            tiempos = []
+            for _ in range(args.repeticiones):
+                inicio = time.perf_counter()
+                responder_via_rapida(pregunta)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            r = resumen_latencias(tiempos)
+            print(f"⚡ {pregunta}\n   p50 {r['p50']:.3f} ms · p95 {r['p95']:.3f} ms · p99 {r['p99']:.3f} ms")
+            print("   " + respuesta.texto.replace("\n", "\n   "))
+
+
+if __name__ == "__main__":
+    main()
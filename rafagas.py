@@ -0,0 +1,143 @@
+"""
+🧩 Agrupación de ráfagas de mensajes por usuario
+Muchos usuarios parten la pregunta en varios mensajes seguidos ("costo del concreto" /
+"en Medellín" / "2023"). Cada mensaje espera RAFAGA_VENTANA_S; si llega otro del mismo usuario
+en ese lapso, el anterior se retira y el último responde la pregunta completa (los textos unidos).
+
+Si un mensaje llega cuando la ráfaga anterior ya está en el pipeline, esa ejecución queda
+superada: abandona en el siguiente punto de control (antes del SQL, antes del resumen o antes de
+responder) y la nueva ejecución incluye también sus textos. Una vez confirmada la respuesta
+(confirmar), los mensajes siguientes abren una ráfaga nueva.
+
+La espera corre en el event loop con un temporizador por teléfono (agregar y esperar se llaman
+desde el handler async): un mensaje en ráfaga no ocupa un hilo del threadpool. Desactivada por
+defecto porque suma la ventana a la latencia de cada mensaje; con RAFAGA_VENTANA_S=1.5 se agrupan
+los mensajes escritos de corrido.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from log_config import get_logger
+from metricas import LLM_AHORRADAS
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+RAFAGA_VENTANA_S = float(os.getenv("RAFAGA_VENTANA_S", 0))  # 0 = sin agrupación
+RAFAGA_MAX_S = float(os.getenv("RAFAGA_MAX_S", 4))  # Espera máxima desde el primer mensaje
+# Una ráfaga sin confirmar más vieja que esto se da por abandonada (excepción en el pipeline)
+RAFAGA_CADUCIDAD_S = float(os.getenv("RAFAGA_CADUCIDAD_S", 180))
+
+LLAMADAS_POR_MENSAJE = 2  # gemini_sql + gemini_resumen
+
+
+def _despertar(futuro):
+    if not futuro.done():
+        futuro.set_result(None)
+
+
+class _Rafaga:
+    __slots__ = ("textos", "generacion", "inicio", "ultimo", "aviso")
+
+    def __init__(self, ahora):
+        self.textos = []
+        self.generacion = 0
+        self.inicio = ahora
+        self.ultimo = ahora
+        self.aviso = None  # Futuro del mensaje que espera; agregar() lo despierta
+
+
+class AgrupadorRafagas:
+    """Ráfaga abierta por teléfono; la generación identifica al mensaje que debe responderla."""
+
+    def __init__(self, ventana=RAFAGA_VENTANA_S, maximo=RAFAGA_MAX_S, caducidad=RAFAGA_CADUCIDAD_S):
+        self.ventana = ventana
+        self.maximo = maximo
+        self.caducidad = caducidad
+        self.fusionados = 0
+        self.llamadas_ahorradas = 0
+        self._rafagas = {}
+        # vigente/confirmar/retirar se llaman desde los hilos del pipeline
+        self._lock = threading.Lock()
+
+    def agregar(self, telefono, texto):
+        """Suma el mensaje a la ráfaga del usuario; devuelve su generación (None = sin agrupación)."""
+        if self.ventana <= 0:
+            return None
+        ahora = time.monotonic()
+        with self._lock:
+            rafaga = self._rafagas.get(telefono)
+            if rafaga is None or ahora - rafaga.inicio > self.caducidad:
+                rafaga = self._rafagas[telefono] = _Rafaga(ahora)
+            rafaga.textos.append(texto)
+            rafaga.generacion += 1
+            rafaga.ultimo = ahora
+            generacion = rafaga.generacion
+            aviso, rafaga.aviso = rafaga.aviso, None
+        if aviso is not None:
+            _despertar(aviso)  # El mensaje anterior ya no responde: que no siga esperando
+        return generacion
+
+    async def esperar(self, telefono, generacion):
+        """
+        Espera en el event loop a que la ráfaga se calme.
+
+        Returns:
+            str: Los textos de la ráfaga unidos, si este mensaje es el último
+            None: Si llegó otro mensaje después (él responderá)
+        """
+        if generacion is None:
+            return None
+        bucle = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                rafaga = self._rafagas.get(telefono)
+                if rafaga is None or rafaga.generacion != generacion:
+                    return None
+                limite = min(rafaga.ultimo + self.ventana, rafaga.inicio + self.maximo)
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    if len(rafaga.textos) > 1:
+                        logger.info(f"🧩 Ráfaga de {len(rafaga.textos)} mensajes de {telefono} unida")
+                    return " ".join(rafaga.textos)
+                aviso = rafaga.aviso = bucle.create_future()
+            temporizador = bucle.call_later(restante, _despertar, aviso)
+            try:
+                await aviso
+            finally:
+                temporizador.cancel()
+
+    def vigente(self, telefono, generacion):
+        """False si llegó un mensaje nuevo que reemplaza a esta ejecución."""
+        if generacion is None:
+            return True
+        with self._lock:
+            rafaga = self._rafagas.get(telefono)
+            return rafaga is not None and rafaga.generacion == generacion
+
+    def confirmar(self, telefono, generacion):
+        """Punto sin retorno antes de responder: cierra la ráfaga si sigue vigente."""
+        if generacion is None:
+            return True
+        with self._lock:
+            rafaga = self._rafagas.get(telefono)
+            if rafaga is None or rafaga.generacion != generacion:
+                return False
+            del self._rafagas[telefono]
+            return True
+
+    def retirar(self, telefono, llamadas_hechas=0):
+        """Registra una ejecución superada y las llamadas a Gemini que se evitaron."""
+        ahorradas = max(LLAMADAS_POR_MENSAJE - llamadas_hechas, 0)
+        with self._lock:
+            self.fusionados += 1
+            self.llamadas_ahorradas += ahorradas
+        LLM_AHORRADAS.inc(ahorradas, motivo="rafaga")
+        logger.info(f"🧩 Mensaje de {telefono} unido a uno posterior ({ahorradas} llamadas a Gemini evitadas)")
+
+
+# Instancia global usada por main.py
+rafagas = AgrupadorRafagas()
@@ -0,0 +1,410 @@
+"""
+🔁 Reproducción de tráfico real desde historial_conversaciones
+Extrae una carga de trabajo del historial (mensajes, pausas entre ellos y orden por usuario),
+la reproduce contra una instancia en marcha a 1× o N× velocidad y compara las distribuciones
+de latencia de dos builds.
+
+Uso:
+    # 1) Extraer la carga (de la tabla o del archivo histórico comprimido)
+    python replay_historial.py extraer --desde 2025-01-01 --hasta 2025-02-01 --salida carga.jsonl
+    python replay_historial.py extraer --archivo archivo_historial --anonimizar --salida carga.jsonl
+
+    # 2) Reproducir contra cada build (misma carga, misma velocidad)
+    python replay_historial.py reproducir carga.jsonl --url http://127.0.0.1:8000 --velocidad 10 \
+        --etiqueta base --salida base.json
+    python replay_historial.py reproducir carga.jsonl --url http://127.0.0.1:8001 --velocidad 10 \
+        --etiqueta rama --salida rama.json
+
+    # 3) Comparar
+    python replay_historial.py comparar base.json rama.json
+
+Notas:
+  - El timestamp del historial es el momento en que se guardó la respuesta, no el de llegada;
+    las pausas entre mensajes de un mismo usuario incluyen por eso el tiempo de procesamiento.
+  - Los teléfonos deben existir (activos) en la tabla usuarios de la instancia destino. Con
+    --anonimizar se reemplazan por los usuarios de prueba que crea bench_e2e.py.
+  - Los mensajes de cada usuario se envían en orden y, por defecto, cada uno espera la respuesta
+    del anterior (como en WhatsApp); los de usuarios distintos se solapan libremente.
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from bench_utils import (
+    diferencia_metricas, enviar_mensaje, leer_metricas, percentil, resumen_etapas, resumen_latencias,
+)
+
+PREFIJO_ANONIMO = "whatsapp:+57300999"  # Mismo prefijo que los usuarios de bench_e2e.py
+
+
+# ===============================
+# 📥 EXTRAER CARGA
+# ===============================
+def _conversaciones_bd(desde, hasta, telefonos):
+    """Conversaciones de historial_conversaciones en orden cronológico."""
+    from db_config import get_db_connection
+
+    conn = None
+    try:
+        conn = get_db_connection(lectura=True)
+        # Cursor con nombre (server-side) para no cargar meses de historial en memoria
+        cursor = conn.cursor(name="replay_historial")
+        cursor.itersize = 5000
+        condiciones, parametros = ["mensaje_usuario IS NOT NULL", "mensaje_usuario <> ''"], []
+        if desde:
+            condiciones.append("timestamp >= %s")
+            parametros.append(desde)
+        if hasta:
+            condiciones.append("timestamp < %s")
+            parametros.append(hasta)
+        if telefonos:
+            condiciones.append("telefono = ANY(%s)")
+            parametros.append(list(telefonos))
+        cursor.execute(f"""
+            SELECT telefono, mensaje_usuario, sql_generado, timestamp
+            FROM historial_conversaciones
+            WHERE {' AND '.join(condiciones)}
+            ORDER BY timestamp, id
+        """, parametros)
+        for telefono, mensaje, sql, ts in cursor:
+            yield {"telefono": telefono, "mensaje_usuario": mensaje, "sql_generado": sql, "timestamp": ts}
+        cursor.close()
+    finally:
+        if conn:
+            conn.close()
+
+
+def _conversaciones_archivo(directorio, desde, hasta, telefonos):
+    """Conversaciones del archivo histórico (particiones ya archivadas)."""
+    from particiones_historial import leer_archivo
+
+    for conv in leer_archivo(directorio, desde and desde.date(), hasta and hasta.date()):
+        if not conv.get("mensaje_usuario"):
+            continue
+        if (desde and conv["timestamp"] < desde) or (hasta and conv["timestamp"] >= hasta):
+            continue
+        if telefonos and conv["telefono"] not in telefonos:
+            continue
+        yield conv
+
+
+def extraer_carga(conversaciones, anonimizar=False, limite=None):
+    """
+    Convierte conversaciones (en orden cronológico) en la carga a reproducir.
+
+    Returns:
+        list: [{"i", "t", "telefono", "mensaje", "sql_original"}], con `t` en segundos
+              desde el primer mensaje
+    """
+    carga = []
+    alias = {}
+    inicio = None
+    for conv in conversaciones:
+        if limite and len(carga) >= limite:
+            break
+        ts = conv["timestamp"]
+        if inicio is None:
+            inicio = ts
+        telefono = conv["telefono"]
+        if anonimizar:
+            telefono = alias.setdefault(telefono, f"{PREFIJO_ANONIMO}{len(alias):04d}")
+        carga.append({
+            "i": len(carga),
+            "t": (ts - inicio).total_seconds(),
+            "telefono": telefono,
+            "mensaje": conv["mensaje_usuario"],
+            "sql_original": conv.get("sql_generado"),
+        })
+    return carga
+
+
+def guardar_carga(carga, ruta):
+    with open(ruta, "w", encoding="utf-8") as f:
+        for mensaje in carga:
+            f.write(json.dumps(mensaje, ensure_ascii=False) + "\n")
+
+
+def leer_carga(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+# ===============================
+# ▶️ REPRODUCIR
+# ===============================
+def programar(carga, velocidad=1.0, max_pausa=None):
+    """
+    Calcula el instante de envío (segundos desde el inicio) de cada mensaje.
+    Las pausas mayores a `max_pausa` (noches, fines de semana) se recortan antes de acelerar.
+    """
+    programados = []
+    anterior_t = 0.0
+    acumulado = 0.0
+    for mensaje in sorted(carga, key=lambda m: (m["t"], m["i"])):
+        pausa = mensaje["t"] - anterior_t
+        if max_pausa is not None:
+            pausa = min(pausa, max_pausa)
+        acumulado += pausa
+        anterior_t = mensaje["t"]
+        programados.append(dict(mensaje, programado=acumulado / velocidad))
+    return programados
+
+
+def reproducir(carga, url, velocidad=1.0, max_pausa=60.0, esperar_respuesta=True, timeout=120):
+    """Envía la carga respetando el orden por usuario; devuelve un resultado por mensaje."""
+    por_usuario = defaultdict(list)
+    for mensaje in programar(carga, velocidad, max_pausa):
+        por_usuario[mensaje["telefono"]].append(mensaje)
+
+    resultados = []
+    lock = threading.Lock()
+    inicio = time.perf_counter() + 0.5  # Margen para arrancar todos los hilos
+
+    def sesion(mensajes):
+        pendientes = []
+        for mensaje in mensajes:
+            espera = inicio + mensaje["programado"] - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+            enviado = time.perf_counter() - inicio
+
+            def enviar(m=mensaje, enviado=enviado):
+                latencia, estado, cuerpo = enviar_mensaje(url, m["telefono"], m["mensaje"], timeout)
+                with lock:
+                    resultados.append({
+                        "i": m["i"],
+                        "telefono": m["telefono"],
+                        "mensaje": m["mensaje"],
+                        "programado": m["programado"],
+                        "retraso": enviado - m["programado"],  # Atraso del cliente respecto al plan
+                        "latencia": latencia,
+                        "estado": estado,
+                        "cuerpo": cuerpo[:200],
+                    })
+
+            if esperar_respuesta:
+                enviar()
+            else:
+                hilo = threading.Thread(target=enviar, daemon=True)
+                hilo.start()
+                pendientes.append(hilo)
+        for hilo in pendientes:
+            hilo.join()
+
+    hilos = [threading.Thread(target=sesion, args=(m,), daemon=True) for m in por_usuario.values()]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return sorted(resultados, key=lambda r: r["i"]), time.perf_counter() - inicio
+
+
+def _latencias_ok(resultados):
+    return [r["latencia"] for r in resultados if r["estado"] == 200]
+
+
+def ejecutar_reproduccion(args):
+    carga = leer_carga(args.carga)
+    if args.limite:
+        carga = carga[:args.limite]
+    plan = programar(carga, args.velocidad, args.max_pausa)
+    duracion_plan = plan[-1]["programado"] if plan else 0
+    usuarios = len({m["telefono"] for m in carga})
+    print(f"▶️ Reproduciendo {len(carga)} mensajes de {usuarios} usuarios a {args.velocidad}× "
+          f"(~{duracion_plan:.0f}s) contra {args.url}")
+
+    try:
+        antes = leer_metricas(args.url)
+    except OSError:
+        antes = None
+        print("⚠️ /metrics no disponible: no habrá desglose por etapa")
+
+    resultados, duracion = reproducir(carga, args.url, args.velocidad, args.max_pausa,
+                                      not args.sin_esperar, args.timeout)
+
+    etapas = {}
+    if antes is not None:
+        etapas = resumen_etapas(diferencia_metricas(antes, leer_metricas(args.url)))
+
+    estados = defaultdict(int)
+    for r in resultados:
+        estados[f"{r['estado']} {r['cuerpo']}" if r["estado"] == 200 else str(r["estado"])] += 1
+
+    reporte = {
+        "etiqueta": args.etiqueta,
+        "url": args.url,
+        "carga": args.carga,
+        "velocidad": args.velocidad,
+        "max_pausa": args.max_pausa,
+        "esperar_respuesta": not args.sin_esperar,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "duracion_s": duracion,
+        "estados": dict(estados),
+        "latencia": resumen_latencias(_latencias_ok(resultados)),
+        "retraso_cliente_max": max((r["retraso"] for r in resultados), default=0),
+        "etapas": etapas,
+        "resultados": resultados,
+    }
+    imprimir_resumen(reporte)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, ensure_ascii=False, indent=2)
+        print(f"💾 Resultados guardados en {args.salida}")
+
+
+def imprimir_resumen(reporte):
+    lat = reporte["latencia"]
+    print(f"\n🏷️ {reporte['etiqueta']}  duración {reporte['duracion_s']:.1f}s  respuestas {reporte['estados']}")
+    if lat.get("n"):
+        print(f"Latencia (ms): p50={lat['p50'] * 1000:.0f}  p95={lat['p95'] * 1000:.0f}  "
+              f"p99={lat['p99'] * 1000:.0f}  max={lat['max'] * 1000:.0f}")
+    if reporte["retraso_cliente_max"] > 1:
+        print(f"⚠️ El cliente se atrasó hasta {reporte['retraso_cliente_max']:.1f}s respecto al plan "
+              "(respuestas lentas con --velocidad alta); las pausas reales no se respetaron del todo")
+
+
+# ===============================
+# ⚖️ COMPARAR
+# ===============================
+def intervalo_bootstrap(a, b, p, remuestreos=1000, semilla=7):
+    """IC 95% de percentil_p(b) - percentil_p(a) por bootstrap."""
+    rnd = random.Random(semilla)
+    diferencias = []
+    for _ in range(remuestreos):
+        ma = [rnd.choice(a) for _ in a]
+        mb = [rnd.choice(b) for _ in b]
+        diferencias.append(percentil(mb, p) - percentil(ma, p))
+    return percentil(diferencias, 2.5), percentil(diferencias, 97.5)
+
+
+def comparar(ruta_a, ruta_b, remuestreos=1000, top=10):
+    with open(ruta_a, encoding="utf-8") as f:
+        a = json.load(f)
+    with open(ruta_b, encoding="utf-8") as f:
+        b = json.load(f)
+
+    if (a["carga"], a["velocidad"], a["max_pausa"]) != (b["carga"], b["velocidad"], b["max_pausa"]):
+        print("⚠️ Las ejecuciones no usan la misma carga/velocidad; la comparación es orientativa")
+
+    lat_a, lat_b = _latencias_ok(a["resultados"]), _latencias_ok(b["resultados"])
+    ra, rb = resumen_latencias(lat_a), resumen_latencias(lat_b)
+    print("=" * 70)
+    print(f"⚖️ {a['etiqueta']} (A) vs {b['etiqueta']} (B)")
+    print("=" * 70)
+    print(f"Respuestas A: {a['estados']}")
+    print(f"Respuestas B: {b['estados']}")
+    if not ra.get("n") or not rb.get("n"):
+        print("❌ Alguna ejecución no tiene respuestas exitosas")
+        return
+
+    print(f"\n{'':<8}{'A (ms)':>10}{'B (ms)':>10}{'Δ':>9}   IC95% Δ (ms)")
+    for clave, p in (("media", None), ("p50", 50), ("p95", 95), ("p99", 99), ("max", None)):
+        va, vb = ra[clave], rb[clave]
+        linea = f"{clave:<8}{va * 1000:>10.0f}{vb * 1000:>10.0f}{(vb - va) / va * 100:>+8.1f}%"
+        if p and remuestreos:
+            bajo, alto = intervalo_bootstrap(lat_a, lat_b, p, remuestreos)
+            linea += f"   [{bajo * 1000:+.0f}, {alto * 1000:+.0f}]"
+        print(linea)
+
+    # Comparación pareada: el mismo mensaje de la carga en ambas ejecuciones
+    por_i_a = {r["i"]: r for r in a["resultados"] if r["estado"] == 200}
+    pares = [(por_i_a[r["i"]]["latencia"], r["latencia"]) for r in b["resultados"]
+             if r["estado"] == 200 and r["i"] in por_i_a]
+    if pares:
+        razones = [lb / la for la, lb in pares if la > 0]
+        mas_rapidos = sum(1 for la, lb in pares if lb < la)
+        print(f"\nPareado ({len(pares)} mensajes): razón B/A mediana={percentil(razones, 50):.2f}  "
+              f"B más rápido en {mas_rapidos / len(pares) * 100:.0f}%")
+
+    # Preguntas que más cambiaron (mediana por texto de pregunta)
+    def por_pregunta(reporte):
+        grupos = defaultdict(list)
+        for r in reporte["resultados"]:
+            if r["estado"] == 200:
+                grupos[r["mensaje"].strip().lower()].append(r["latencia"])
+        return {k: percentil(v, 50) for k, v in grupos.items()}
+
+    pa, pb = por_pregunta(a), por_pregunta(b)
+    cambios = sorted(((pb[k] - pa[k], k) for k in pa.keys() & pb.keys()), reverse=True)
+    if cambios:
+        print(f"\n📈 Preguntas más lentas en B (mediana, top {top}):")
+        for delta, pregunta in cambios[:top]:
+            if delta <= 0:
+                break
+            print(f"  {delta * 1000:+7.0f}ms  {pregunta[:70]}")
+        print(f"📉 Preguntas más rápidas en B (mediana, top {top}):")
+        for delta, pregunta in reversed(cambios[-top:]):
+            if delta >= 0:
+                break
+            print(f"  {delta * 1000:+7.0f}ms  {pregunta[:70]}")
+
+    if a.get("etapas") and b.get("etapas"):
+        print(f"\n{'Etapa':<16}{'p50 A':>9}{'p50 B':>9}{'p95 A':>9}{'p95 B':>9}   (ms)")
+        for nombre in sorted(a["etapas"].keys() | b["etapas"].keys()):
+            ea, eb = a["etapas"].get(nombre), b["etapas"].get(nombre)
+            celdas = [f"{e[clave] * 1000:>9.0f}" if e else f"{'-':>9}"
+                      for clave in ("p50", "p95") for e in (ea, eb)]
+            print(f"{nombre:<16}{''.join(celdas)}")
+    print("=" * 70)
+
+
+def _fecha(valor):
+    return datetime.fromisoformat(valor)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducción de tráfico desde historial_conversaciones")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_ext = sub.add_parser("extraer", help="Genera un archivo de carga (JSONL) desde el historial")
+    p_ext.add_argument("--desde", type=_fecha, help="Fecha/hora inicial (ISO, incluida)")
+    p_ext.add_argument("--hasta", type=_fecha, help="Fecha/hora final (ISO, excluida)")
+    p_ext.add_argument("--telefono", action="append", help="Limitar a uno o más teléfonos")
+    p_ext.add_argument("--archivo", help="Leer del archivo histórico (directorio) en vez de la tabla")
+    p_ext.add_argument("--anonimizar", action="store_true", help="Reemplazar teléfonos por usuarios de prueba")
+    p_ext.add_argument("--limite", type=int, help="Máximo de mensajes")
+    p_ext.add_argument("--salida", required=True)
+
+    p_rep = sub.add_parser("reproducir", help="Reproduce una carga contra una instancia en marcha")
+    p_rep.add_argument("carga")
+    p_rep.add_argument("--url", default="http://127.0.0.1:8000")
+    p_rep.add_argument("--velocidad", type=float, default=1.0, help="Factor de aceleración (1 = tiempo real)")
+    p_rep.add_argument("--max-pausa", type=float, default=60.0,
+                       help="Recortar pausas mayores a N segundos (antes de acelerar)")
+    p_rep.add_argument("--sin-esperar", action="store_true",
+                       help="No esperar la respuesta previa del mismo usuario")
+    p_rep.add_argument("--limite", type=int)
+    p_rep.add_argument("--timeout", type=float, default=120)
+    p_rep.add_argument("--etiqueta", default="build")
+    p_rep.add_argument("--salida")
+
+    p_cmp = sub.add_parser("comparar", help="Compara las latencias de dos reproducciones")
+    p_cmp.add_argument("a")
+    p_cmp.add_argument("b")
+    p_cmp.add_argument("--bootstrap", type=int, default=1000, help="Remuestreos para el IC (0 = sin IC)")
+    p_cmp.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.comando == "extraer":
+        telefonos = set(args.telefono or [])
+        if args.archivo:
+            conversaciones = _conversaciones_archivo(args.archivo, args.desde, args.hasta, telefonos)
+        else:
+            conversaciones = _conversaciones_bd(args.desde, args.hasta, telefonos)
+        carga = extraer_carga(conversaciones, args.anonimizar, args.limite)
+        if not carga:
+            sys.exit("❌ No hay mensajes en el rango indicado")
+        guardar_carga(carga, args.salida)
+        usuarios = len({m["telefono"] for m in carga})
+        print(f"✅ {len(carga)} mensajes de {usuarios} usuarios ({carga[-1]['t'] / 3600:.1f}h reales) "
+              f"guardados en {args.salida}")
+    elif args.comando == "reproducir":
+        ejecutar_reproduccion(args)
+    else:
+        comparar(args.a, args.b, args.bootstrap, args.top)
@@ -0,0 +1,109 @@
+"""
+🐢 Reporte de consultas lentas
+Agrupa el registro de consultas lentas (consultas_lentas.py) por forma canónica y las ordena
+por tiempo total, frecuencia o percentil, para decidir qué índices o atajos valen la pena.
+
+Uso:
+    python reporte_consultas_lentas.py                      # desde SQL_LENTAS_DESTINO
+    python reporte_consultas_lentas.py --tabla --desde 2025-01-01 --orden p95 --top 20
+    python reporte_consultas_lentas.py --archivo consultas_lentas.jsonl --detalle 3
+"""
+
+import argparse
+from collections import defaultdict
+from datetime import datetime
+
+from bench_utils import percentil
+from consultas_lentas import SQL_LENTAS_DESTINO, SQL_LENTAS_PATH, leer_consultas_lentas
+
+ORDENES = {
+    "total": lambda g: g["total_ms"],
+    "frecuencia": lambda g: g["veces"],
+    "media": lambda g: g["media_ms"],
+    "p95": lambda g: g["p95_ms"],
+}
+
+
+def agrupar(registros):
+    """Resumen por huella: veces, tiempos, filas, errores y ejemplos."""
+    grupos = defaultdict(list)
+    for r in registros:
+        grupos[r["huella"]].append(r)
+
+    resumen = []
+    for huella_, regs in grupos.items():
+        duraciones = [r["duracion_ms"] for r in regs]
+        filas = [r["filas"] for r in regs if r["filas"] is not None]
+        preguntas = defaultdict(int)
+        for r in regs:
+            if r["pregunta"]:
+                preguntas[r["pregunta"].strip()] += 1
+        resumen.append({
+            "huella": huella_,
+            "sql_canonico": regs[0]["sql_canonico"],
+            "ejemplo_sql": max(regs, key=lambda r: r["duracion_ms"])["sql"],
+            "veces": len(regs),
+            "total_ms": sum(duraciones),
+            "media_ms": sum(duraciones) / len(duraciones),
+            "p95_ms": percentil(duraciones, 95),
+            "max_ms": max(duraciones),
+            "filas_media": sum(filas) / len(filas) if filas else None,
+            "errores": sum(1 for r in regs if r["error"]),
+            "preguntas": sorted(preguntas.items(), key=lambda kv: -kv[1]),
+            "ultima": max(r["timestamp"] for r in regs),
+        })
+    return resumen
+
+
+def imprimir_reporte(registros, orden="total", top=15, detalle=1):
+    if not registros:
+        print("⚠️  No hay consultas lentas registradas.")
+        return
+
+    grupos = sorted(agrupar(registros), key=ORDENES[orden], reverse=True)
+    total_ms = sum(g["total_ms"] for g in grupos)
+    desde = min(r["timestamp"] for r in registros)
+    hasta = max(r["timestamp"] for r in registros)
+
+    print("\n" + "="*80)
+    print("🐢 CONSULTAS LENTAS POR FORMA")
+    print("="*80)
+    print(f"Registros: {len(registros)}  Formas distintas: {len(grupos)}  "
+          f"Tiempo total: {total_ms / 1000:,.1f}s")
+    print(f"Periodo: {desde:%Y-%m-%d %H:%M} → {hasta:%Y-%m-%d %H:%M}  Orden: {orden}")
+
+    acumulado = sum(g["total_ms"] for g in grupos[:top])
+    if total_ms:
+        print(f"Las {min(top, len(grupos))} formas mostradas suman el {acumulado / total_ms:.0%} del tiempo")
+
+    print(f"\n{'#':>3} {'veces':>6} {'total s':>9} {'media ms':>9} {'p95 ms':>9} {'max ms':>9} {'filas':>7} {'err':>4}")
+    print("-"*80)
+    for n, g in enumerate(grupos[:top], 1):
+        filas = f"{g['filas_media']:.0f}" if g["filas_media"] is not None else "-"
+        print(f"{n:>3} {g['veces']:>6} {g['total_ms'] / 1000:>9.1f} {g['media_ms']:>9.0f} "
+              f"{g['p95_ms']:>9.0f} {g['max_ms']:>9.0f} {filas:>7} {g['errores']:>4}")
+        print(f"    🧬 {g['sql_canonico'][:150]}")
+        for pregunta, veces in g["preguntas"][:detalle]:
+            print(f"    💬 ({veces}x) {pregunta[:120]}")
+    print("="*80)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ranking de consultas lentas por forma")
+    fuente = parser.add_mutually_exclusive_group()
+    fuente.add_argument("--archivo", help=f"Archivo JSONL (por defecto {SQL_LENTAS_PATH})")
+    fuente.add_argument("--tabla", action="store_true", help="Leer de la tabla consultas_lentas")
+    parser.add_argument("--desde", type=datetime.fromisoformat)
+    parser.add_argument("--orden", choices=sorted(ORDENES), default="total")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--detalle", type=int, default=1, help="Preguntas de ejemplo por forma")
+    args = parser.parse_args()
+
+    if args.tabla:
+        destino = "tabla"
+    elif args.archivo:
+        destino = "archivo"
+    else:
+        destino = SQL_LENTAS_DESTINO
+    registros = leer_consultas_lentas(destino, args.archivo or SQL_LENTAS_PATH, args.desde)
+    imprimir_reporte(registros, args.orden, args.top, args.detalle)
@@ -0,0 +1,158 @@
+"""
+🧯 Interruptores de circuito y plazos por mensaje
+- Plazo: cada mensaje tiene PLAZO_MENSAJE_S desde que llega al webhook. Cada llamada externa
+  recibe como timeout lo que queda, descontando el mínimo reservado para las etapas siguientes
+  y sin pasar el tope de su etapa. Así la latencia de cola queda acotada y un Gemini lento no
+  retiene el hilo 30 s dos veces.
+- Interruptor: tras INTERRUPTOR_FALLOS fallos seguidos de una dependencia (gemini, postgres,
+  twilio) las llamadas fallan de inmediato durante INTERRUPTOR_ENFRIAMIENTO_S; después se deja
+  pasar una sola llamada de prueba y, si sale bien, el circuito se cierra.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from log_config import get_logger
+from metricas import etapa_actual, CIRCUITO_RECHAZOS, PLAZOS_VENCIDOS
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+PLAZO_MENSAJE_S = float(os.getenv("PLAZO_MENSAJE_S", 45))
+INTERRUPTOR_FALLOS = int(os.getenv("INTERRUPTOR_FALLOS", 5))
+INTERRUPTOR_ENFRIAMIENTO_S = float(os.getenv("INTERRUPTOR_ENFRIAMIENTO_S", 30))
+
+# Etapas con plazo, en orden: (tope de la etapa, mínimo reservado para ella)
+ETAPAS_PLAZO = {
+    "gemini_sql": (float(os.getenv("GEMINI_TIMEOUT_S", 20)), 2.0),
+    "sql": (float(os.getenv("SQL_TIMEOUT_S", 10)), 1.0),
+    "gemini_resumen": (float(os.getenv("GEMINI_TIMEOUT_S", 20)), 2.0),
+}
+PLAZO_MINIMO_S = 0.5  # Con menos que esto no vale la pena intentar la llamada
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+_plazo_var = ContextVar("plazo", default=None)
+
+
+class CircuitoAbierto(Exception):
+    """La dependencia está marcada como caída: se falla sin llamarla."""
+
+
+class PlazoVencido(Exception):
+    """No queda tiempo del plazo del mensaje para esta etapa."""
+
+
+# ============ PLAZOS ============
+
+def iniciar_plazo(segundos=PLAZO_MENSAJE_S):
+    """Fija el plazo del mensaje en el contexto actual (lo heredan los hilos del threadpool)."""
+    _plazo_var.set(time.monotonic() + segundos if segundos > 0 else None)
+
+
+def restante():
+    """Segundos que quedan del plazo del mensaje (None = sin plazo)."""
+    limite = _plazo_var.get()
+    return None if limite is None else limite - time.monotonic()
+
+
+def presupuesto(etapa=None, tope=None):
+    """
+    Timeout para una llamada de la etapa: min(tope de la etapa, lo que queda del plazo menos
+    lo reservado para las etapas siguientes).
+
+    Raises:
+        PlazoVencido: Si lo disponible es menor que PLAZO_MINIMO_S
+    """
+    etapa = etapa or etapa_actual()
+    topes = [t for t in (tope, ETAPAS_PLAZO.get(etapa, (None,))[0]) if t is not None]
+    tope = min(topes) if topes else None
+    queda = restante()
+    if queda is None:
+        return tope
+    if etapa in ETAPAS_PLAZO:
+        siguientes = list(ETAPAS_PLAZO)[list(ETAPAS_PLAZO).index(etapa) + 1:]
+        queda -= sum(ETAPAS_PLAZO[n][1] for n in siguientes)
+    disponible = queda if tope is None else min(tope, queda)
+    if disponible < PLAZO_MINIMO_S:
+        PLAZOS_VENCIDOS.inc(etapa=etapa)
+        raise PlazoVencido(f"sin tiempo para {etapa} ({max(queda, 0):.1f}s disponibles)")
+    return disponible
+
+
+# ============ INTERRUPTORES ============
+
+class Interruptor:
+    """Circuito de una dependencia externa."""
+
+    def __init__(self, nombre, fallos=INTERRUPTOR_FALLOS, enfriamiento=INTERRUPTOR_ENFRIAMIENTO_S):
+        self.nombre = nombre
+        self.max_fallos = fallos
+        self.enfriamiento = enfriamiento
+        self.estado = CERRADO
+        self.fallos = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        """Lanza CircuitoAbierto si hay que fallar rápido; si no, la llamada puede seguir."""
+        if self.max_fallos <= 0:
+            return
+        with self._lock:
+            if self.estado == CERRADO:
+                return
+            if self.estado == ABIERTO and time.monotonic() - self._abierto_desde >= self.enfriamiento:
+                self.estado = SEMIABIERTO
+            if self.estado == SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                logger.info(f"🧯 Circuito {self.nombre}: llamada de prueba")
+                return
+        CIRCUITO_RECHAZOS.inc(dependencia=self.nombre)
+        raise CircuitoAbierto(f"{self.nombre} no disponible (circuito abierto)")
+
+    def exito(self):
+        with self._lock:
+            if self.estado != CERRADO:
+                logger.info(f"✅ Circuito {self.nombre} cerrado: la dependencia respondió")
+            self.estado = CERRADO
+            self.fallos = 0
+            self._prueba_en_curso = False
+
+    def fallo(self):
+        with self._lock:
+            self.fallos += 1
+            self._prueba_en_curso = False
+            if self.estado == SEMIABIERTO or (self.estado == CERRADO and self.fallos >= self.max_fallos > 0):
+                self.estado = ABIERTO
+                self._abierto_desde = time.monotonic()
+                logger.warning(f"🧯 Circuito {self.nombre} abierto tras {self.fallos} fallos; "
+                               f"nuevo intento en {self.enfriamiento:.0f}s")
+
+    def liberar(self):
+        """La llamada permitida no llegó a hacerse: libera la prueba sin juzgar a la dependencia."""
+        with self._lock:
+            self._prueba_en_curso = False
+
+    @contextmanager
+    def proteger(self):
+        """permitir() + exito()/fallo() según termine el bloque."""
+        self.permitir()
+        try:
+            yield
+        except Exception:
+            self.fallo()
+            raise
+        self.exito()
+
+
+# Instancias globales: una por dependencia (los de Gemini, uno por modelo, los crea enrutador_modelos)
+interruptores = {
+    "postgres": Interruptor("postgres"),
+    "twilio": Interruptor("twilio"),
+}
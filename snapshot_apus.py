@@ -0,0 +1,492 @@
+"""
+🧊 Snapshot columnar de apus y motor analítico local
+Las agregaciones sobre la tabla desnormalizada apus (promedios por ciudad, conteos por proyecto)
+recorren toda la tabla en una instancia de Cloud SQL compartida. Después de cada carga,
+exportar_snapshot() escribe apus en un archivo Parquet comprimido (zstd) y, con
+MOTOR_ANALITICO=local, ejecutar_sql responde el SQL generado con DuckDB en el propio proceso
+contra ese snapshot; lo que el motor local no soporta o no puede ejecutar va a Postgres.
+
+Dependencias opcionales: pyarrow (exportar) y duckdb (consultar). Sin ellas todo sigue en Postgres.
+
+Diferencias de dialecto que se evitan mandando la consulta a Postgres:
+- "/" (Postgres trunca la división entera, DuckDB no) y los operadores de regex "~".
+- Orden de textos: DuckDB compara bytes y Postgres usa la intercalación de la base ("Árbol"
+  va antes de "Zona" en Postgres y después en DuckDB). ORDER BY, MIN/MAX/GREATEST/LEAST y
+  <, >, <=, >=, BETWEEN sobre columnas de texto van a Postgres.
+- Tablas distintas de apus o funciones propias de Postgres (unaccent...): DuckDB falla y se
+  reintenta en Postgres.
+Los NULL se ordenan como en Postgres (primero en DESC).
+Las filas salen como las devolvería Postgres: columnas sin alias con el nombre que les pone
+Postgres ("count", "avg", "?column?") y números con decimales como Decimal (NUMERIC).
+
+Uso:
+    python snapshot_apus.py exportar [--ruta snapshots/apus.parquet]
+    python snapshot_apus.py consultar "SELECT ciudad, COUNT(*) FROM apus GROUP BY ciudad"
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from create_apus_table import COLUMNAS_APUS
+from log_config import get_logger
+from metricas import MOTOR_LOCAL
+from sql_canonico import RE_TOKEN, es_consulta_lectura, limpiar_sql
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+SNAPSHOT_APUS_PATH = os.getenv("SNAPSHOT_APUS_PATH", os.path.join("snapshots", "apus.parquet"))
+SNAPSHOT_EXPORTAR = os.getenv("SNAPSHOT_EXPORTAR", "1") == "1"  # Exportar al terminar load_apus_csv
+SNAPSHOT_LOTE = int(os.getenv("SNAPSHOT_LOTE", 50000))  # Filas por lote al leer de Postgres
+SNAPSHOT_EN_MEMORIA = os.getenv("SNAPSHOT_EN_MEMORIA", "1") == "1"  # 0 = leer el Parquet en cada consulta
+SNAPSHOT_REVISION_S = float(os.getenv("SNAPSHOT_REVISION_S", 30))  # Cada cuánto buscar un snapshot nuevo
+MOTOR_ANALITICO = os.getenv("MOTOR_ANALITICO", "postgres")  # "postgres" o "local"
+
+COLUMNAS_FECHA = {"fecha_aprobacion_apu", "fecha_analisis_apu"}
+COLUMNAS_NUMERICAS = {
+    "precio_unitario", "precio_unitario_sin_aiu", "rendimiento_insumo",
+    "precio_unitario_apu", "precio_parcial_apu",
+}
+
+COLUMNAS_TEXTO = set(COLUMNAS_APUS) - COLUMNAS_FECHA - COLUMNAS_NUMERICAS
+
+# Operadores con semántica distinta en DuckDB (ver docstring del módulo)
+OPERADORES_POSTGRES = {"/", "~"}
+# Lo que depende de la intercalación cuando recibe texto
+FUNCIONES_ORDEN = {"min", "max", "greatest", "least"}
+# Funciones que devuelven un número aunque reciban texto: su argumento no ordena textos
+FUNCIONES_NUMERICAS = {"count", "length", "char_length", "octet_length", "position", "strpos"}
+# Palabras que separan un operando de una comparación del resto de la consulta
+LIMITES_OPERANDO = {"and", "or", "not", "where", "having", "on", "when", "then", "else", "end",
+                    "select", "from", "group", "order", "by", "limit", "offset", "case", "between"}
+FIN_ORDER_BY = {"limit", "offset", "fetch", "union", "intersect", "except"}
+
+# Nombres de columna de DuckDB para expresiones sin alias -> nombre que les da Postgres
+RE_IDENTIFICADOR = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+RE_FUNCION = re.compile(r'^(main\.)?"?([A-Za-z_][A-Za-z0-9_]*)"?\(')
+RE_CAST = re.compile(r"^CAST\((.*) AS [A-Z][A-Z0-9_ ()]*\)$", re.S)
+FUNCIONES_POSTGRES = {"count_star": "count", "quantile_cont": "percentile_cont", "quantile_disc": "percentile_disc"}
+
+
+def esquema_apus():
+    """Esquema Arrow del snapshot: fechas como date32, NUMERIC como float64, el resto texto."""
+    campos = [pa.field("id", pa.int64())]
+    for columna in COLUMNAS_APUS:
+        if columna in COLUMNAS_FECHA:
+            tipo = pa.date32()
+        elif columna in COLUMNAS_NUMERICAS:
+            tipo = pa.float64()
+        else:
+            tipo = pa.string()
+        campos.append(pa.field(columna, tipo))
+    return pa.schema(campos)
+
+
+# ============ EXPORTACIÓN ============
+
+def exportar_snapshot(ruta=SNAPSHOT_APUS_PATH, lote=SNAPSHOT_LOTE):
+    """
+    Copia apus (desde la primaria) a un Parquet comprimido. Escribe en un archivo temporal y lo
+    renombra al terminar, así los procesos que leen el snapshot nunca ven uno a medias.
+
+    Returns:
+        dict: {"ruta", "filas", "bytes", "segundos"}, o None si falta pyarrow o falló
+    """
+    if pa is None:
+        logger.warning("⚠️ pyarrow no está instalado: no se exporta el snapshot de apus")
+        return None
+    from db_config import get_db_connection
+
+    inicio = time.perf_counter()
+    esquema = esquema_apus().with_metadata({"exportado": datetime.now().isoformat()})
+    columnas = [campo.name for campo in esquema]
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    temporal = f"{ruta}.tmp"
+    conn = None
+    escritor = None
+    filas = 0
+    try:
+        # Primaria: justo después de una carga las réplicas pueden no tenerla completa
+        conn = get_db_connection()
+        cursor = conn.cursor(name="snapshot_apus")  # Server-side: no trae toda la tabla de una vez
+        cursor.itersize = lote
+        cursor.execute(f"SELECT {', '.join(columnas)} FROM apus ORDER BY id")
+        escritor = pq.ParquetWriter(temporal, esquema, compression="zstd")
+        while True:
+            bloque = cursor.fetchmany(lote)
+            if not bloque:
+                break
+            datos = {c: [fila[i] for fila in bloque] for i, c in enumerate(columnas)}
+            for c in COLUMNAS_NUMERICAS:
+                datos[c] = [None if v is None else float(v) for v in datos[c]]
+            escritor.write_table(pa.Table.from_pydict(datos, schema=esquema))
+            filas += len(bloque)
+        cursor.close()
+        escritor.close()
+        escritor = None
+        os.replace(temporal, ruta)
+    except Exception as e:
+        logger.error(f"❌ Error exportando el snapshot de apus: {e}")
+        return None
+    finally:
+        if escritor:
+            escritor.close()
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        if conn:
+            conn.close()
+
+    resultado = {
+        "ruta": ruta,
+        "filas": filas,
+        "bytes": os.path.getsize(ruta),
+        "segundos": round(time.perf_counter() - inicio, 2),
+    }
+    logger.info(f"🧊 Snapshot de apus exportado: {filas} filas, {resultado['bytes'] / 1e6:.1f} MB "
+                f"en {resultado['segundos']}s ({ruta})")
+    return resultado
+
+
+# ============ MOTOR LOCAL ============
+
+def nombre_postgres(nombre, sql):
+    """
+    Nombre que Postgres daría a una columna del resultado de DuckDB.
+
+    Returns:
+        str, o None si no se puede deducir (la consulta va a Postgres)
+    """
+    if f'"{nombre}"' in sql:
+        return nombre  # Alias entre comillas: se respeta tal cual
+    if RE_IDENTIFICADOR.match(nombre):
+        return nombre.lower()  # Postgres pasa a minúsculas los identificadores sin comillas
+    cast = RE_CAST.match(nombre)
+    if cast:
+        # x::tipo se llama como x; si x no tiene nombre, Postgres usa el del tipo (no se replica)
+        interno = nombre_postgres(cast.group(1), sql)
+        return None if interno == "?column?" else interno
+    funcion = RE_FUNCION.match(nombre)
+    if funcion:
+        # EXTRACT(...) llega como main.date_part(...); date_part(...) escrito a mano, sin main.
+        if funcion.group(1) and funcion.group(2) == "date_part":
+            return "extract"
+        nombre_funcion = funcion.group(2).lower()
+        return FUNCIONES_POSTGRES.get(nombre_funcion, nombre_funcion)
+    if nombre.startswith("CASE "):
+        return "case"
+    return "?column?"  # Literales y operadores
+
+
+def _a_postgres(valor):
+    # El snapshot guarda NUMERIC como float64; Postgres lo devuelve como Decimal
+    return Decimal(repr(valor)) if isinstance(valor, float) else valor
+
+
+def _tokens(sql):
+    """[(tipo, valor)] sin espacios; palabras en minúscula e identificadores entre comillas sin ellas."""
+    tokens = []
+    for m in RE_TOKEN.finditer(limpiar_sql(sql)):
+        tipo, valor = m.lastgroup, m.group()
+        if tipo == "espacio":
+            continue
+        if tipo == "palabra":
+            valor = valor.lower()
+        elif tipo == "ident":
+            valor = valor[1:-1].replace('""', '"')
+        tokens.append((tipo, valor))
+    return tokens
+
+
+def _cierre(tokens, i):
+    """Índice del ")" que cierra el "(" de tokens[i]."""
+    profundidad = 0
+    for j in range(i, len(tokens)):
+        if tokens[j] == ("otro", "("):
+            profundidad += 1
+        elif tokens[j] == ("otro", ")"):
+            profundidad -= 1
+            if not profundidad:
+                return j
+    return len(tokens) - 1
+
+
+def _es_texto(tokens):
+    """True si la expresión usa una columna de texto fuera de una función numérica (COUNT, LENGTH...)."""
+    i = 0
+    while i < len(tokens):
+        tipo, valor = tokens[i]
+        siguiente = tokens[i + 1] if i + 1 < len(tokens) else None
+        if tipo == "palabra" and valor in FUNCIONES_NUMERICAS and siguiente == ("otro", "("):
+            i = _cierre(tokens, i + 1) + 1
+            continue
+        if tipo in ("palabra", "ident") and valor in COLUMNAS_TEXTO:
+            return True
+        i += 1
+    return False
+
+
+def _alias(tokens):
+    """{alias: tokens de su expresión} de las listas SELECT (para ORDER BY alias)."""
+    alias = {}
+    inicio = 0
+    externos = []  # Inicio de la expresión que contiene cada "(" abierto
+    for i, (tipo, valor) in enumerate(tokens):
+        if (tipo, valor) == ("otro", "("):
+            externos.append(inicio)
+            inicio = i + 1
+        elif (tipo, valor) == ("otro", ")"):
+            inicio = externos.pop() if externos else 0
+        elif (tipo, valor) in (("palabra", "select"), ("otro", ",")):
+            inicio = i + 1
+        elif (tipo, valor) == ("palabra", "as") and i + 1 < len(tokens) and tokens[i + 1][0] in ("palabra", "ident"):
+            alias[tokens[i + 1][1]] = tokens[inicio:i]
+    return alias
+
+
+def _operando(tokens, i, paso):
+    """Tokens del operando a la izquierda (paso=-1) o derecha (paso=1) de tokens[i]."""
+    abre, cierra = (("otro", ")"), ("otro", "(")) if paso < 0 else (("otro", "("), ("otro", ")"))
+    profundidad = 0
+    j = i + paso
+    while 0 <= j < len(tokens):
+        token = tokens[j]
+        if token == abre:
+            profundidad += 1
+        elif token == cierra:
+            if not profundidad:
+                break
+            profundidad -= 1
+        elif not profundidad and (token == ("otro", ",") or (token[0] == "palabra" and token[1] in LIMITES_OPERANDO)):
+            break
+        j += paso
+    return tokens[j + 1:i] if paso < 0 else tokens[i + 1:j]
+
+
+def _items_order_by(tokens, i):
+    """Expresiones del ORDER BY que empieza en tokens[i] (sin ASC/DESC/NULLS)."""
+    items, actual = [], []
+    profundidad = 0
+    for token in tokens[i + 2:]:
+        if token == ("otro", "("):
+            profundidad += 1
+        elif token == ("otro", ")"):
+            if not profundidad:
+                break
+            profundidad -= 1
+        elif not profundidad and token[0] == "palabra" and token[1] in FIN_ORDER_BY:
+            break
+        if not profundidad and token == ("otro", ","):
+            items.append(actual)
+            actual = []
+        elif not (token[0] == "palabra" and token[1] in ("asc", "desc", "nulls", "first", "last")):
+            actual.append(token)
+    return items + [actual]
+
+
+def ordena_texto(sql):
+    """True si el resultado depende de cómo se ordenan los textos (la intercalación de la base)."""
+    tokens = _tokens(sql)
+    alias = _alias(tokens)
+    for i, (tipo, valor) in enumerate(tokens):
+        siguiente = tokens[i + 1] if i + 1 < len(tokens) else None
+        if (tipo, valor) == ("palabra", "order") and siguiente == ("palabra", "by"):
+            for item in _items_order_by(tokens, i):
+                if len(item) == 1 and item[0][0] == "numero":
+                    return True  # ORDER BY 1: no se sabe qué columna es
+                if _es_texto(item) or (len(item) == 1 and _es_texto(alias.get(item[0][1], []))):
+                    return True
+        elif tipo == "palabra" and valor in FUNCIONES_ORDEN and siguiente == ("otro", "("):
+            if _es_texto(tokens[i + 2:_cierre(tokens, i + 1)]):
+                return True
+        elif tipo == "palabra" and valor == "between":
+            if _es_texto(_operando(tokens, i, -1)):
+                return True
+        elif tipo == "otro" and valor in ("<", ">"):
+            # <> y != son igualdad: no dependen del orden
+            if valor == "<" and siguiente == ("otro", ">"):
+                continue
+            if valor == ">" and i and tokens[i - 1] == ("otro", "<"):
+                continue
+            fin = i + 1 if siguiente == ("otro", "=") else i
+            if _es_texto(_operando(tokens, i, -1)) or _es_texto(_operando(tokens, fin, 1)):
+                return True
+    return False
+
+
+def soportada(sql):
+    """True si la consulta puede intentarse en DuckDB sin cambiar de significado."""
+    if not es_consulta_lectura(sql):
+        return False
+    for m in RE_TOKEN.finditer(limpiar_sql(sql)):
+        if m.lastgroup == "otro" and m.group() in OPERADORES_POSTGRES:
+            return False
+    return not ordena_texto(sql)
+
+
+class MotorLocal:
+    """DuckDB en el proceso sobre el snapshot; se recarga cuando aparece un snapshot nuevo."""
+
+    def __init__(self, ruta=SNAPSHOT_APUS_PATH, en_memoria=SNAPSHOT_EN_MEMORIA):
+        self.ruta = ruta
+        self.en_memoria = en_memoria
+        self.filas = 0
+        self._conexion = None
+        self._version = None  # mtime del snapshot cargado
+        self._generacion = 0
+        self._revisado = 0.0
+        self._local = threading.local()  # Cursor de DuckDB por hilo
+        self._recarga = threading.Lock()
+
+    @property
+    def disponible(self):
+        return duckdb is not None and os.path.exists(self.ruta)
+
+    def consultar(self, sql, timeout=None):
+        """
+        Ejecuta sql contra el snapshot.
+
+        Returns:
+            list[dict] con las filas, o None si hay que usar Postgres (sin snapshot, consulta no
+            soportada o error de DuckDB)
+
+        Raises:
+            TimeoutError: Si la consulta se interrumpió por `timeout` (no conviene repetirla en Postgres)
+        """
+        if not soportada(sql):
+            MOTOR_LOCAL.inc(resultado="no_soportada")
+            return None
+        cursor = self._cursor()
+        if cursor is None:
+            MOTOR_LOCAL.inc(resultado="sin_snapshot")
+            return None
+        # DuckDB no tiene statement_timeout: se interrumpe la consulta desde otro hilo
+        interrumpida = threading.Event()
+
+        def interrumpir():
+            interrumpida.set()
+            cursor.interrupt()
+
+        reloj = threading.Timer(timeout, interrumpir) if timeout else None
+        try:
+            if reloj:
+                reloj.start()
+            cursor.execute(limpiar_sql(sql))
+            columnas = [nombre_postgres(d[0], sql) for d in cursor.description]
+            if None in columnas:
+                MOTOR_LOCAL.inc(resultado="no_soportada")
+                logger.info("ℹ️ Motor local: columnas sin un nombre equivalente en Postgres, se usa Postgres")
+                return None
+            filas = [dict(zip(columnas, map(_a_postgres, fila))) for fila in cursor.fetchall()]
+        except Exception as e:
+            if interrumpida.is_set():
+                MOTOR_LOCAL.inc(resultado="timeout")
+                raise TimeoutError(f"motor local: consulta cancelada tras {timeout:.1f}s") from e
+            MOTOR_LOCAL.inc(resultado="error")
+            logger.info(f"ℹ️ Motor local no pudo ejecutar la consulta, se usa Postgres: {e}")
+            return None
+        finally:
+            if reloj:
+                reloj.cancel()
+        MOTOR_LOCAL.inc(resultado="ok")
+        return filas
+
+    def estado(self):
+        return {
+            "snapshot": self.ruta,
+            "cargado": self._version is not None,
+            "filas": self.filas,
+            "exportado": datetime.fromtimestamp(self._version).isoformat() if self._version else None,
+        }
+
+    def _cursor(self):
+        self._revisar()
+        if self._conexion is None:
+            return None
+        local = self._local
+        if getattr(local, "generacion", None) != self._generacion:
+            local.cursor = self._conexion.cursor()
+            local.generacion = self._generacion
+        return local.cursor
+
+    def _revisar(self):
+        """Carga el snapshot la primera vez y cuando cambia el archivo (como mucho cada SNAPSHOT_REVISION_S)."""
+        ahora = time.monotonic()
+        if self._conexion is not None and ahora - self._revisado < SNAPSHOT_REVISION_S:
+            return
+        # Un solo hilo recarga; los demás siguen con el snapshot anterior
+        if not self._recarga.acquire(blocking=self._conexion is None):
+            return
+        try:
+            self._revisado = ahora
+            if not self.disponible:
+                return
+            version = os.path.getmtime(self.ruta)
+            if version != self._version:
+                self._cargar(version)
+        except Exception as e:
+            logger.error(f"❌ Error cargando el snapshot de apus: {e}")
+        finally:
+            self._recarga.release()
+
+    def _cargar(self, version):
+        inicio = time.perf_counter()
+        conexion = duckdb.connect(":memory:")
+        # Como Postgres: NULL al final en ASC y al principio en DESC
+        conexion.execute("SET default_null_order = 'nulls_last_on_asc_first_on_desc'")
+        origen = f"read_parquet('{self.ruta.replace(chr(39), chr(39) * 2)}')"
+        tipo = "TABLE" if self.en_memoria else "VIEW"
+        conexion.execute(f"CREATE {tipo} apus AS SELECT * FROM {origen}")
+        self.filas = conexion.execute("SELECT COUNT(*) FROM apus").fetchone()[0]
+        self._conexion, self._version = conexion, version
+        self._generacion += 1
+        logger.info(f"🧊 Snapshot de apus cargado en el motor local: {self.filas} filas "
+                    f"en {time.perf_counter() - inicio:.2f}s")
+
+
+# Instancia global usada por main.py
+motor_local = MotorLocal()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot columnar de apus")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p = sub.add_parser("exportar", help="Exportar apus a Parquet")
+    p.add_argument("--ruta", default=SNAPSHOT_APUS_PATH)
+    p = sub.add_parser("consultar", help="Ejecutar una consulta en el motor local")
+    p.add_argument("sql")
+    p.add_argument("--ruta", default=SNAPSHOT_APUS_PATH)
+    args = parser.parse_args()
+
+    if args.comando == "exportar":
+        resultado = exportar_snapshot(args.ruta)
+        if resultado is None:
+            raise SystemExit(1)
+        print(json.dumps(resultado, indent=2))
+    else:
+        filas = MotorLocal(args.ruta).consultar(args.sql)
+        if filas is None:
+            print("❌ El motor local no pudo responder la consulta (ver log)")
+            raise SystemExit(1)
+        for fila in filas:
+            print(json.dumps(fila, ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+🧬 Forma canónica del SQL generado por Gemini
+Normaliza consultas para deduplicarlas y agruparlas por "forma" (literales reemplazados por ?),
+al estilo de pg_stat_statements. Lo usan bench_sql.py y el registro de consultas lentas.
+parametrizar() separa los literales para que db_config prepare cada forma una sola vez.
+"""
+
+import hashlib
+import re
+from decimal import Decimal
+
+# Literales de texto ('...' con '' escapadas), números, identificadores entre comillas,
+# palabras, espacios y cualquier otro símbolo
+RE_TOKEN = re.compile(r"""
+    (?P<texto>(?:[eE])?'(?:[^']|'')*')
+  | (?P<numero>(?<![\w.])\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<ident>"(?:[^"]|"")*")
+  | (?P<palabra>[A-Za-z_][\w$]*)
+  | (?P<espacio>\s+)
+  | (?P<otro>.)
+""", re.VERBOSE | re.DOTALL)
+
+# Listas de literales: IN (?, ?, ?) -> IN (...)
+RE_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def limpiar_sql(sql):
+    """Quita los bloques ``` del modelo, el ';' final y espacios sobrantes."""
+    if not sql:
+        return ""
+    sql = re.sub(r"```sql|```", "", sql).strip()
+    return sql.rstrip(";").strip()
+
+
+def normalizar(sql):
+    """Misma consulta con espacios colapsados (conserva los literales)."""
+    partes = []
+    for m in RE_TOKEN.finditer(limpiar_sql(sql)):
+        if m.lastgroup == "espacio":
+            partes.append(" ")
+        else:
+            partes.append(m.group())
+    return "".join(partes).strip()
+
+
+def canonizar(sql):
+    """Forma de la consulta: literales -> ?, palabras en minúscula, espacios colapsados."""
+    partes = []
+    for m in RE_TOKEN.finditer(limpiar_sql(sql)):
+        tipo = m.lastgroup
+        if tipo in ("texto", "numero"):
+            partes.append("?")
+        elif tipo == "palabra":
+            partes.append(m.group().lower())
+        elif tipo == "espacio":
+            partes.append(" ")
+        else:
+            partes.append(m.group())
+    return RE_LISTA.sub("(...)", "".join(partes).strip())
+
+
+def huella(texto):
+    """Identificador corto y estable de un texto (consulta normalizada o canónica)."""
+    return hashlib.md5(texto.encode("utf-8")).hexdigest()[:12]
+
+
+def es_consulta_lectura(sql):
+    """True si es un único SELECT/WITH (lo que el bot ejecuta); descarta DML y varias sentencias."""
+    limpio = limpiar_sql(sql)
+    if not re.match(r"(?is)^\s*(select|with)\b", limpio):
+        return False
+    # Un ';' fuera de literales indica varias sentencias
+    return not any(m.lastgroup == "otro" and m.group() == ";" for m in RE_TOKEN.finditer(limpio))
+
+
+# Prefijos de literales tipados (INTERVAL '1 day'): el literal no puede ser un parámetro
+TIPOS_LITERAL = {"interval", "date", "time", "timestamp", "timestamptz"}
+# Palabras que cierran un ORDER BY / GROUP BY (ahí un número es una posición de columna)
+FIN_ORDEN = {"limit", "offset", "having", "fetch", "union", "intersect", "except", "window", "for"}
+PARAMETROS_MAX = 64
+
+
+def parametrizar(sql):
+    """
+    Separa los literales de una consulta para prepararla en el servidor:
+    "WHERE ciudad = 'Cali' LIMIT 10" -> ("WHERE ciudad = $1 LIMIT $2::integer", ["Cali", 10]).
+
+    Los literales que no pueden ser parámetros quedan en el texto: posiciones de ORDER BY /
+    GROUP BY, literales tipados (DATE '...'), cadenas E'...' y modificadores de tipo
+    (numeric(10, 2)). Los números llevan cast para conservar el tipo que tendría el literal.
+
+    Returns:
+        tuple (texto, valores), o None si la consulta no se puede parametrizar con seguridad
+    """
+    limpio = limpiar_sql(sql)
+    if not limpio or "$" in limpio:  # Cadenas $$...$$ o parámetros ya presentes
+        return None
+    partes, valores = [], []
+    previa = penultima = ""  # Últimos tokens significativos, en minúscula
+    profundidad = 0
+    orden_en = None  # Profundidad de paréntesis del ORDER BY / GROUP BY en curso
+    parentesis_tipo = []  # Por cada paréntesis abierto: True si es numeric(10, 2) y similares
+
+    for m in RE_TOKEN.finditer(limpio):
+        tipo, valor = m.lastgroup, m.group()
+        if tipo == "espacio":
+            partes.append(" ")
+            continue
+        en_tipo = bool(parentesis_tipo) and parentesis_tipo[-1]
+        if tipo == "texto" and valor[0] not in "eE" and previa not in TIPOS_LITERAL:
+            valores.append(valor[1:-1].replace("''", "'"))
+            valor = f"${len(valores)}"
+        elif tipo == "numero" and orden_en is None and not en_tipo:
+            if re.fullmatch(r"\d+", valor):
+                numero = int(valor)
+                valores.append(numero)
+                valor = f"${len(valores)}::{'integer' if numero < 2 ** 31 else 'bigint'}"
+            else:
+                valores.append(Decimal(valor))
+                valor = f"${len(valores)}::numeric"
+        elif tipo == "palabra":
+            bajo = valor.lower()
+            if bajo == "by" and previa in ("order", "group"):
+                orden_en = profundidad
+            elif bajo in FIN_ORDEN and orden_en is not None and profundidad <= orden_en:
+                orden_en = None
+        elif tipo == "otro":
+            if valor == "(":
+                profundidad += 1
+                parentesis_tipo.append(penultima in ("::", "as") and previa.isidentifier())
+            elif valor == ")":
+                profundidad -= 1
+                if parentesis_tipo:
+                    parentesis_tipo.pop()
+                if orden_en is not None and profundidad < orden_en:
+                    orden_en = None
+        partes.append(valor)
+        actual = m.group().lower()
+        if actual == ":" and previa == ":":
+            previa = "::"
+        else:
+            penultima, previa = previa, actual
+
+    if len(valores) > PARAMETROS_MAX:
+        return None
+    return "".join(partes).strip(), valores
@@ -0,0 +1,140 @@
+"""
+Pruebas del control de admisión (admision.py): token bucket por rol y cupos de concurrencia
+entrar() es una corrutina del event loop; cada prueba corre su propio loop con asyncio.run.
+python test_admision.py o pytest.
+"""
+
+import asyncio
+import time
+
+from admision import (
+    LIMITE_COLA,
+    LIMITE_ESPERA,
+    LIMITE_TASA,
+    ControlAdmision,
+    mensaje_rechazo,
+    parsear_tasas,
+)
+
+
+def test_parsear_tasas():
+    assert parsear_tasas("admin:60:20, user:6:3") == {"admin": (60.0, 20.0), "user": (6.0, 3.0), "*": (6.0, 3.0)}
+    assert parsear_tasas("*:0:1,malo") == {"*": (0.0, 1.0)}
+    # La ráfaga mínima es una ficha
+    assert parsear_tasas("user:6:0")["user"] == (6.0, 1.0)
+
+
+def _entrar(control, telefono, rol=None):
+    return asyncio.run(control.entrar(telefono, rol))
+
+
+def test_cubeta_admite_la_rafaga_y_luego_rechaza():
+    control = ControlAdmision(global_max=0, por_usuario=100, tasas="*:60:3")
+    for _ in range(3):
+        assert _entrar(control, "tel") is None
+    rechazo = _entrar(control, "tel")
+    assert rechazo.motivo == LIMITE_TASA
+    # 60 por minuto: una ficha por segundo
+    assert 0 < rechazo.reintentar_en <= 1
+    assert "Intenta de nuevo en 1 segundos" in mensaje_rechazo(rechazo)
+    # Otro teléfono tiene su propia cubeta
+    assert _entrar(control, "otro") is None
+
+
+def test_cubeta_se_recarga_con_el_tiempo():
+    control = ControlAdmision(global_max=0, por_usuario=100, tasas="*:1200:1")  # 20 fichas por segundo
+    assert _entrar(control, "tel") is None
+    assert _entrar(control, "tel").motivo == LIMITE_TASA
+    time.sleep(0.06)
+    assert _entrar(control, "tel") is None
+
+
+def test_tasa_por_rol():
+    control = ControlAdmision(global_max=0, por_usuario=100, tasas="admin:0:1,*:60:1")
+    for _ in range(5):
+        assert _entrar(control, "admin", rol="ADMIN") is None  # Rol sin límite de tasa
+    assert _entrar(control, "user", rol="user") is None
+    assert _entrar(control, "user", rol="user").motivo == LIMITE_TASA
+
+
+def test_concurrencia_por_usuario_espera_y_vence():
+    control = ControlAdmision(global_max=0, por_usuario=1, espera=0.05, tasas="*:0:1")
+    assert _entrar(control, "tel") is None
+    inicio = time.monotonic()
+    rechazo = _entrar(control, "tel")
+    assert rechazo.motivo == LIMITE_ESPERA
+    assert time.monotonic() - inicio >= 0.05
+    assert control.en_cola == 0
+    control.salir("tel")
+    assert _entrar(control, "tel") is None
+
+
+def test_cupo_liberado_despierta_al_que_espera():
+    control = ControlAdmision(global_max=1, por_usuario=5, espera=2, tasas="*:0:1")
+
+    async def escenario():
+        assert await control.entrar("a") is None
+        en_espera = asyncio.create_task(control.entrar("b"))
+        await asyncio.sleep(0.01)
+        assert control.en_cola == 1 and not en_espera.done()
+        control.salir("a")
+        assert await asyncio.wait_for(en_espera, 1) is None
+
+    asyncio.run(escenario())
+    assert control.en_curso == 1 and control.en_cola == 0
+
+
+def test_cupo_pasa_al_que_puede_usarlo():
+    # "a" ya tiene su máximo: el cupo global libre va a "b" aunque "a" llegó antes a la cola
+    control = ControlAdmision(global_max=2, por_usuario=1, espera=2, tasas="*:0:1")
+
+    async def escenario():
+        assert await control.entrar("a") is None
+        assert await control.entrar("c") is None
+        de_a = asyncio.create_task(control.entrar("a"))
+        de_b = asyncio.create_task(control.entrar("b"))
+        await asyncio.sleep(0.01)
+        control.salir("c")
+        assert await asyncio.wait_for(de_b, 1) is None
+        assert not de_a.done()
+        control.salir("a")
+        assert await asyncio.wait_for(de_a, 1) is None
+
+    asyncio.run(escenario())
+    assert control.en_curso == 2 and control._por_usuario == {"a": 1, "b": 1}
+
+
+def test_cancelar_en_cola_no_pierde_el_cupo():
+    control = ControlAdmision(global_max=1, por_usuario=5, espera=2, tasas="*:0:1")
+
+    async def escenario():
+        assert await control.entrar("a") is None
+        en_espera = asyncio.create_task(control.entrar("b"))
+        await asyncio.sleep(0.01)
+        en_espera.cancel()
+        await asyncio.sleep(0)
+        control.salir("a")
+        assert control.en_curso == 0
+        # El cupo se cede a "c" y su petición se cancela antes de usarlo: debe devolverse
+        assert await control.entrar("a") is None
+        de_c = asyncio.create_task(control.entrar("c"))
+        await asyncio.sleep(0.01)
+        control.salir("a")
+        de_c.cancel()
+        await asyncio.gather(de_c, return_exceptions=True)
+
+    asyncio.run(escenario())
+    assert control.en_curso == 0 and control.en_cola == 0 and not control._por_usuario
+
+
+def test_cola_llena_rechaza_de_inmediato():
+    control = ControlAdmision(global_max=1, por_usuario=5, espera=1, cola_max=0, tasas="*:0:1")
+    assert _entrar(control, "a") is None
+    assert _entrar(control, "b").motivo == LIMITE_COLA
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
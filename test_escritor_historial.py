@@ -0,0 +1,101 @@
+"""
+Pruebas del archivo de respaldo del escritor de historial (escritor_historial.py)
+No necesitan base de datos: _insertar se reemplaza por una lista en memoria.
+python test_escritor_historial.py o pytest.
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from escritor_historial import EscritorHistorial
+
+
+class EscritorDePrueba(EscritorHistorial):
+    """Inserta en `guardadas`; el lote número `falla_en` lanza un error (simula la BD caída)."""
+
+    def __init__(self, spill_path, falla_en=None):
+        super().__init__(tamano_lote=1, spill_path=spill_path)  # Tramos de 10 filas al recuperar
+        self.guardadas = []
+        self.falla_en = falla_en
+        self.llamadas = 0
+
+    def _insertar(self, filas):
+        self.llamadas += 1
+        if self.llamadas == self.falla_en:
+            raise RuntimeError("base de datos no disponible")
+        self.guardadas.extend(filas)
+
+
+def _filas(n, prefijo="m"):
+    return [("whatsapp:+57300", f"{prefijo}{i}", None, "ok", datetime(2024, 1, 1, 12, 0, i % 60))
+            for i in range(n)]
+
+
+def _mensajes(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        return [json.loads(linea)["mensaje_usuario"] for linea in f if linea.strip()]
+
+
+def test_reintento_completo_elimina_el_respaldo():
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "pendiente.jsonl")
+        escritor = EscritorDePrueba(ruta)
+        escritor._spill(_filas(25))
+        escritor._reintentar_spill()
+        assert [f[1] for f in escritor.guardadas] == [f"m{i}" for i in range(25)]
+        assert not os.path.exists(ruta)
+        assert not os.path.exists(ruta + ".procesando")
+
+
+def test_fallo_a_mitad_no_duplica_lo_confirmado():
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "pendiente.jsonl")
+        escritor = EscritorDePrueba(ruta, falla_en=2)
+        escritor._spill(_filas(25))
+        escritor._reintentar_spill()
+        # El primer tramo (10 filas) quedó confirmado; solo vuelven al archivo las otras 15
+        assert len(escritor.guardadas) == 10
+        assert _mensajes(ruta) == [f"m{i}" for i in range(10, 25)]
+        assert not os.path.exists(ruta + ".procesando")
+
+        escritor.falla_en = None
+        escritor._reintentar_spill()
+        assert [f[1] for f in escritor.guardadas] == [f"m{i}" for i in range(25)]
+        assert not os.path.exists(ruta)
+
+
+def test_fallo_antepone_lo_pendiente_a_lo_nuevo():
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "pendiente.jsonl")
+
+        class EscritorConNuevas(EscritorDePrueba):
+            def _insertar(self, filas):
+                # Mientras se recupera, otro lote falla y cae al archivo
+                self._spill(_filas(2, prefijo="nueva"))
+                super()._insertar(filas)
+
+        escritor = EscritorConNuevas(ruta, falla_en=1)
+        escritor._spill(_filas(3))
+        escritor._reintentar_spill()
+        assert _mensajes(ruta) == ["m0", "m1", "m2", "nueva0", "nueva1"]
+
+
+def test_recuperar_procesando_tras_caida():
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "pendiente.jsonl")
+        escritor = EscritorDePrueba(ruta)
+        escritor._spill(_filas(2))
+        os.replace(ruta, ruta + ".procesando")  # El proceso murió a mitad de una recuperación
+        escritor._spill(_filas(1, prefijo="nueva"))
+        escritor._recuperar_procesando()
+        assert sorted(_mensajes(ruta)) == ["m0", "m1", "nueva0"]
+        assert not os.path.exists(ruta + ".procesando")
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
@@ -0,0 +1,102 @@
+"""
+Pruebas del estado estructurado de la conversación (estado_conversacion.py)
+No necesitan base de datos: python test_estado_conversacion.py o pytest.
+"""
+
+from estado_conversacion import (
+    EstadoConversacion,
+    RegistroEstados,
+    depende_del_contexto,
+    estado_desde_historial,
+    extraer_filtros,
+    extraer_forma,
+)
+
+SQL_CALI = """
+    SELECT ciudad, AVG(precio_unitario) FROM apus
+    WHERE items_descripcion ILIKE '%concreto%' AND ciudad ILIKE '%cali%'
+      AND insumo_descripcion NOT ILIKE '%agua%'
+      AND EXTRACT(YEAR FROM fecha_aprobacion_apu) >= 2022
+    GROUP BY ciudad ORDER BY AVG(precio_unitario) DESC LIMIT 10
+"""
+
+
+def test_extraer_filtros():
+    # Los NOT ILIKE no son filtros del tema de la conversación
+    assert extraer_filtros(SQL_CALI) == {"item": ["concreto"], "ciudad": ["cali"], "anio": [">=2022"]}
+
+
+def test_extraer_filtros_igualdad_funciones_y_comillas():
+    sql = ("SELECT * FROM apus WHERE nombre_proyecto = 'Puente O''Higgins' "
+           "AND LOWER(ciudad) LIKE LOWER('%Bogotá%') AND ciudad ILIKE '%BOGOTÁ%'")
+    assert extraer_filtros(sql) == {"ciudad": ["Bogotá"], "proyecto": ["Puente O'Higgins"]}
+
+
+def test_extraer_forma():
+    forma = extraer_forma(SQL_CALI, [{"ciudad": "Cali", "avg": 1}])
+    assert forma["tipo"] == "comparacion"
+    assert forma["agrupado_por"] == ["ciudad"]
+    assert forma["orden"] == "AVG(precio_unitario) DESC"
+    assert forma["limite"] == 10
+    assert forma["filas"] == 1
+    assert forma["columnas"] == ["ciudad", "avg"]
+    assert extraer_forma("SELECT COUNT(*) FROM apus")["tipo"] == "conteo"
+    assert extraer_forma("SELECT * FROM apus LIMIT 5")["tipo"] == "listado"
+
+
+def test_actualizar_guarda_filtros_anteriores():
+    estado = EstadoConversacion()
+    assert estado.vacio() and estado.a_prompt() == ""
+    estado.actualizar("precio del concreto en cali", SQL_CALI)
+    estado.actualizar("y en pasto?", SQL_CALI.replace("cali", "pasto"))
+    assert estado.filtros["ciudad"] == ["pasto"]
+    assert estado.filtros_anteriores == {"ciudad": ["cali"]}
+    assert estado.ultima_pregunta == "y en pasto?"
+    assert "ciudad≈pasto" in estado.a_prompt()
+
+
+def test_actualizar_sin_consulta_conserva_filtros():
+    estado = EstadoConversacion()
+    estado.actualizar("precio del concreto en cali", SQL_CALI)
+    estado.actualizar("gracias")
+    assert estado.filtros["item"] == ["concreto"]
+    assert estado.ultima_pregunta == "gracias"
+
+
+def test_actualizar_sin_sql_via_rapida():
+    estado = EstadoConversacion()
+    estado.actualizar("precio del concreto en cali", SQL_CALI)
+    estado.actualizar_sin_sql("precio promedio de la excavación", {"item": ["excavación"]}, {"tipo": "agregado"})
+    assert estado.filtros == {"item": ["excavación"]}
+    assert estado.filtros_anteriores == {"item": ["concreto"], "ciudad": ["cali"], "anio": [">=2022"]}
+    assert estado.forma == {"tipo": "agregado"}
+    assert "item≈excavación" in estado.a_prompt()
+
+
+def test_depende_del_contexto():
+    assert depende_del_contexto("y en Cali?")
+    assert depende_del_contexto("compara con el anterior")
+    assert not depende_del_contexto("precio del concreto de 3000 psi")
+
+
+def test_estado_desde_historial_y_lru():
+    historial = [{"mensaje_usuario": "concreto en cali", "sql_generado": SQL_CALI},
+                 {"mensaje_usuario": "hola", "sql_generado": None}]
+    estado = estado_desde_historial(historial)
+    assert estado.filtros["ciudad"] == ["cali"]
+    assert estado.ultima_pregunta == "hola"
+
+    registro = RegistroEstados(max_usuarios=2)
+    cargas = []
+    for telefono in ("a", "b", "a", "c"):
+        registro.obtener(telefono, lambda: cargas.append(1) or historial)
+    # "a" se usó después de "b": el desalojado es "b"
+    assert list(registro._estados) == ["a", "c"]
+    assert len(cargas) == 3
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
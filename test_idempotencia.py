@@ -0,0 +1,73 @@
+"""
+Pruebas de la idempotencia del webhook por MessageSid (idempotencia.py)
+Solo el registro en memoria (usar_bd=False): python test_idempotencia.py o pytest.
+"""
+
+import time
+
+from idempotencia import EN_CURSO, RegistroIdempotencia
+
+
+def test_mensaje_nuevo_y_reintento_en_curso():
+    registro = RegistroIdempotencia(usar_bd=False)
+    assert registro.comenzar("SM1") is None
+    assert registro.comenzar("SM1") == EN_CURSO
+    assert registro.duplicados == 1
+
+
+def test_visto_solo_consulta_la_memoria():
+    registro = RegistroIdempotencia(usar_bd=False)
+    assert registro.visto("SM1") is None
+    assert registro.comenzar("SM1") is None  # visto() no lo registró
+    assert registro.visto("SM1") == EN_CURSO
+    registro.terminar("SM1", "OK")
+    assert registro.visto("SM1") == "OK"
+    assert registro.duplicados == 2
+
+
+def test_reintento_recibe_el_resultado_original():
+    registro = RegistroIdempotencia(usar_bd=False)
+    registro.comenzar("SM1")
+    registro.terminar("SM1", "OK")
+    assert registro.comenzar("SM1") == "OK"
+    assert registro.comenzar("SM2") is None
+
+
+def test_abandonar_permite_reintentar():
+    registro = RegistroIdempotencia(usar_bd=False)
+    registro.comenzar("SM1")
+    registro.abandonar("SM1")
+    assert registro.comenzar("SM1") is None
+    assert registro.duplicados == 0
+
+
+def test_sin_sid_no_se_registra():
+    registro = RegistroIdempotencia(usar_bd=False)
+    assert registro.comenzar("") is None
+    assert registro.comenzar(None) is None
+    registro.terminar(None, "OK")
+    assert not registro._entradas
+
+
+def test_ttl_vencido_se_procesa_de_nuevo():
+    registro = RegistroIdempotencia(ttl=0.05, usar_bd=False)
+    registro.comenzar("SM1")
+    registro.terminar("SM1", "OK")
+    time.sleep(0.06)
+    assert registro.comenzar("SM1") is None
+
+
+def test_poda_por_tamano():
+    registro = RegistroIdempotencia(max_entradas=3, usar_bd=False)
+    for n in range(5):
+        registro.comenzar(f"SM{n}")
+    # Se conservan los más recientes
+    assert list(registro._entradas) == ["SM2", "SM3", "SM4"]
+    assert registro.comenzar("SM0") is None
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
@@ -0,0 +1,61 @@
+"""
+Pruebas de la partición de respuestas para WhatsApp (partes_whatsapp.py)
+python test_partes_whatsapp.py o pytest.
+"""
+
+from partes_whatsapp import EnsambladorPartes, punto_de_corte
+
+
+def test_punto_de_corte_prefiere_parrafo_linea_frase_palabra():
+    assert punto_de_corte("a" * 40 + "\n\n" + "b" * 40 + "\n" + "c" * 40, 100) == 42
+    # El tipo de límite manda sobre la posición: una línea antes que una frase más adelante
+    assert punto_de_corte("a" * 40 + ". " + "b" * 40 + "\n" + "c" * 40, 100) == 83
+    assert punto_de_corte("a" * 40 + "\n" + "b" * 40 + ". " + "c" * 40, 100) == 41
+    assert punto_de_corte("a" * 40 + " " + "b" * 40 + ". " + "c" * 40, 100) == 83
+    assert punto_de_corte("a" * 40 + " " + "b" * 80, 100) == 41
+
+
+def test_punto_de_corte_evita_piezas_diminutas():
+    # Un párrafo al principio deja una pieza muy corta: se corta en la última línea
+    texto = "hola\n\n" + "x" * 50 + "\n" + "y" * 80
+    assert punto_de_corte(texto, 100) == texto.index("y")
+    # Sin ningún límite útil se corta en el máximo
+    assert punto_de_corte("z" * 150, 100) == 100
+
+
+def test_ensamblador_envia_piezas_al_completarse():
+    enviadas = []
+    ensamblador = EnsambladorPartes(enviadas.append, inicio="👋 Hola!\n\n", maximo=50, intervalo=0)
+    lineas = [f"{n}. Ítem con precio ${n * 1000}\n" for n in range(1, 9)]
+    for linea in lineas:
+        ensamblador.agregar(linea)
+    assert enviadas  # Salió algo antes de cerrar
+    ensamblador.cerrar()
+    assert all(len(pieza) <= 50 for pieza in enviadas)
+    # Ninguna línea queda partida y no se pierde ni se repite texto
+    lineas_enviadas = [l for pieza in enviadas for l in pieza.split("\n") if l]
+    assert lineas_enviadas == [l for l in ensamblador.texto.split("\n") if l]
+    assert ensamblador.texto == "👋 Hola!\n\n" + "".join(lineas)
+    assert ensamblador.enviadas == len(enviadas)
+
+
+def test_ensamblador_texto_corto_y_vacio():
+    enviadas = []
+    ensamblador = EnsambladorPartes(enviadas.append, inicio="Hola ", maximo=50, intervalo=0)
+    assert not ensamblador.recibido
+    ensamblador.agregar("")
+    ensamblador.agregar("mundo")
+    ensamblador.cerrar()
+    assert enviadas == ["Hola mundo"]
+    assert ensamblador.recibido
+
+    vacio = EnsambladorPartes(enviadas.append, maximo=50, intervalo=0)
+    vacio.cerrar()
+    assert len(enviadas) == 1
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
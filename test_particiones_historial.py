@@ -0,0 +1,74 @@
+"""
+Pruebas del particionado mensual de historial_conversaciones (particiones_historial.py)
+La de Postgres corre solo con DB_HOST configurado, dentro de un esquema temporal y una
+transacción que se deshace al final. python test_particiones_historial.py o pytest.
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import uuid
+from datetime import date
+
+from particiones_historial import (
+    TABLA,
+    crear_particion,
+    crear_tabla_particionada,
+    leer_archivo,
+    nombre_particion,
+    sumar_meses,
+)
+
+
+def test_sumar_meses_y_nombre():
+    assert sumar_meses(date(2024, 11, 1), 2) == date(2025, 1, 1)
+    assert sumar_meses(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert nombre_particion(date(2025, 3, 1)) == f"{TABLA}_p2025_03"
+
+
+def test_leer_archivo_por_rango_y_telefono():
+    with tempfile.TemporaryDirectory() as directorio:
+        for mes, telefono in ((date(2025, 1, 1), "a"), (date(2025, 2, 1), "b"), (date(2025, 3, 1), "a")):
+            with gzip.open(os.path.join(directorio, f"{nombre_particion(mes)}.jsonl.gz"), "wt", encoding="utf-8") as f:
+                f.write(json.dumps({"telefono": telefono, "timestamp": f"{mes.isoformat()}T10:00:00"}) + "\n")
+        meses = [c["timestamp"].month for c in leer_archivo(directorio, desde=date(2025, 2, 1))]
+        assert meses == [2, 3]
+        assert [c["timestamp"].month for c in leer_archivo(directorio, telefono="a")] == [1, 3]
+
+
+def test_crear_particion_con_filas_del_mes_en_default():
+    if not os.getenv("DB_HOST"):
+        return
+    from db_config import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        esquema = f"prueba_{uuid.uuid4().hex[:8]}"
+        cursor.execute(f"CREATE SCHEMA {esquema}")
+        cursor.execute(f"SET LOCAL search_path TO {esquema}")
+        crear_tabla_particionada(cursor)
+        # Sin partición de enero de 2020 el INSERT cae en la default
+        cursor.execute(f"INSERT INTO {TABLA} (telefono, mensaje_usuario, timestamp) VALUES "
+                       "('tel', 'hola', '2020-01-15'), ('tel', 'otro mes', '2020-02-15')")
+        assert crear_particion(cursor, date(2020, 1, 1))
+        assert not crear_particion(cursor, date(2020, 1, 1))  # Ya existe
+        cursor.execute(f"SELECT mensaje_usuario FROM {nombre_particion(date(2020, 1, 1))}")
+        assert cursor.fetchall() == [("hola",)]
+        cursor.execute(f"SELECT mensaje_usuario FROM {TABLA}_default")
+        assert cursor.fetchall() == [("otro mes",)]
+        # La default quedó unida de nuevo: la tabla padre sigue viendo las dos filas
+        cursor.execute(f"SELECT COUNT(*) FROM {TABLA}")
+        assert cursor.fetchone()[0] == 2
+        cursor.close()
+    finally:
+        conn.rollback()  # El esquema de prueba desaparece con la transacción
+        conn.close()
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
@@ -0,0 +1,128 @@
+"""
+Pruebas del almacén de precios (precios_apus.py) y de la vía rápida (intenciones.py)
+Construye un almacén pequeño en un directorio temporal; necesita numpy.
+python test_precios_apus.py o pytest.
+"""
+
+import tempfile
+from datetime import date
+
+import intenciones
+from create_apus_table import COLUMNAS_APUS
+from intenciones import detectar_intencion_precio, responder_via_rapida
+from precios_apus import AlmacenPrecios, construir_desde_filas
+
+
+def _fila(proyecto, ciudad, aprobacion, item, item_desc, precio_item, insumo, tipo, precio_insumo):
+    valores = {
+        "fecha_aprobacion_apu": aprobacion, "ciudad": ciudad, "nombre_proyecto": proyecto,
+        "item": item, "items_descripcion": item_desc, "precio_unitario": precio_item,
+        "tipo_insumo": tipo, "insumo_descripcion": insumo, "precio_unitario_apu": precio_insumo,
+    }
+    return tuple(valores.get(c) for c in COLUMNAS_APUS)
+
+
+# apus repite el precio del ítem en cada insumo: los ítems cuentan una vez por proyecto
+FILAS = [
+    _fila("Vía Norte", "Bogotá", date(2023, 3, 1), "1.1", "Excavación manual", 100, "Cemento gris", "Material", 30),
+    _fila("Vía Norte", "Bogotá", date(2023, 3, 1), "1.1", "Excavación manual", 100, "Arena", "Material", 10),
+    _fila("Puente Sur", "Medellín", date(2022, 5, 1), "1.1", "Excavación mecánica", 200, "Cemento gris", "Material", 50),
+    _fila("Puente Sur", "Medellín", date(2022, 5, 1), "2.1", "Concreto 3000 psi", 400, "Cemento gris", "Material", 60),
+    _fila("Puente Sur", "Medellín", date(2022, 5, 1), "2.1", "Concreto 3000 psi", 400, "Grava", "Material", 20),
+    _fila("Colegio Centro", "Bogotá", date(2022, 8, 1), "1.1", "Excavación manual", 400, "Cemento blanco", "Material", 90),
+]
+
+_directorio = tempfile.TemporaryDirectory()
+construir_desde_filas(FILAS, _directorio.name)
+almacen = AlmacenPrecios(_directorio.name)
+# La vía rápida consulta este almacén en vez del global
+intenciones.almacen_precios = almacen
+
+
+def test_estadisticas_items_deduplicados():
+    assert almacen.disponible
+    [fila] = almacen.estadisticas("items", sujeto="excavacion")
+    assert fila["n"] == 3
+    assert fila["promedio"] == 700 / 3
+    assert (fila["minimo"], fila["maximo"], fila["p50"]) == (100, 400, 200)
+
+
+def test_estadisticas_filtros_y_agrupacion():
+    [bogota] = almacen.estadisticas("items", sujeto="excavación", ciudad="bogota")
+    assert (bogota["n"], bogota["promedio"]) == (2, 250)
+    [en_2022] = almacen.estadisticas("items", sujeto="excavacion", anio=2022)
+    assert (en_2022["n"], en_2022["promedio"]) == (2, 300)
+    por_ciudad = almacen.estadisticas("items", sujeto="excavacion", por="ciudad")
+    assert [(f["grupo"], f["n"], f["promedio"]) for f in por_ciudad] == [("Bogotá", 2, 250), ("Medellín", 1, 200)]
+    [fila] = almacen.estadisticas("items", sujeto="excavacion", percentiles=(50, 90))
+    assert fila["p90"] == 200 + (400 - 200) * 0.8
+    assert almacen.estadisticas("items", sujeto="titanio") == []
+
+
+def test_top_un_registro_por_insumo_y_proyecto():
+    mayores = almacen.top("insumos", sujeto="cemento", k=3)
+    assert [(f["descripcion"], f["proyecto"], f["precio"]) for f in mayores] == [
+        ("Cemento blanco", "Colegio Centro", 90),
+        ("Cemento gris", "Puente Sur", 60),  # El 50 del mismo proyecto no se repite
+        ("Cemento gris", "Vía Norte", 30),
+    ]
+    menores = almacen.top("insumos", sujeto="cemento", k=2, mayores=False)
+    assert [f["precio"] for f in menores] == [30, 50]
+    assert menores[0]["ciudad"] == "Bogotá" and menores[0]["anio"] == 2023
+
+
+def test_recarga_entre_buscar_y_seleccionar():
+    with tempfile.TemporaryDirectory() as directorio:
+        construir_desde_filas(FILAS, directorio)
+        recargable = AlmacenPrecios(directorio)
+        version = recargable.vigente()
+        codigos = version.buscar("item", "excavacion")
+        # Otra construcción con otro orden de aparición: los mismos códigos son otros ítems
+        construir_desde_filas(list(reversed(FILAS)), directorio)
+        recargable._revisado = float("-inf")
+        nueva = recargable.vigente()
+        assert nueva is not version and recargable.version == nueva.nombre
+        assert list(nueva.buscar("item", "excavacion")) != list(codigos)
+        # La versión tomada antes de la recarga sigue respondiendo con sus propios códigos
+        idx = version.seleccionar("items", sujeto="excavacion")
+        assert sorted(version.tablas["items"]["precio"][idx]) == [100, 200, 400]
+        [fila] = version.estadisticas("items", sujeto="excavacion")
+        assert (fila["n"], fila["maximo"]) == (3, 400)
+        assert version.etiqueta("item", int(codigos[1])) == "Excavación mecánica"
+
+
+def test_detectar_intencion_precio():
+    intencion = detectar_intencion_precio("¿Cuál es el precio promedio de la excavación en Bogotá?")
+    assert intencion == {"tabla": "items", "sujeto": "excavacion", "estadistica": "resumen", "percentil": None,
+                         "por": None, "ciudad": "Bogotá", "anio": None}
+    intencion = detectar_intencion_precio("precio promedio del cemento por ciudad en 2022")
+    assert (intencion["tabla"], intencion["por"], intencion["anio"]) == ("insumos", "ciudad", 2022)
+    assert detectar_intencion_precio("insumos de cemento más baratos")["estadistica"] == "menores"
+    intencion = detectar_intencion_precio("percentil 90 del precio de la excavación")
+    assert (intencion["estadistica"], intencion["percentil"]) == ("percentil", 90)
+
+
+def test_detectar_intencion_precio_conservadora():
+    assert detectar_intencion_precio("hola") is None
+    assert detectar_intencion_precio("precio del concreto") is None  # Sin estadística
+    assert detectar_intencion_precio("precio promedio de la excavación por proyecto") is None
+    assert detectar_intencion_precio("cuántos insumos de cemento hay con precio promedio") is None
+    assert detectar_intencion_precio("precio promedio del titanio") is None
+    assert detectar_intencion_precio("precio promedio de la excavación por tipo") is None  # Tipo: solo insumos
+
+
+def test_responder_via_rapida_sin_sql():
+    respuesta = responder_via_rapida("precio promedio de la excavación en Bogotá")
+    assert "Promedio: $250" in respuesta.texto
+    assert not hasattr(respuesta, "sql")
+    # El estado recibe el tema como lo escribió el usuario (con tilde)
+    assert respuesta.filtros == {"item": ["excavación"], "ciudad": ["Bogotá"]}
+    assert respuesta.forma["tipo"] == "agregado"
+    assert responder_via_rapida("precio promedio de la excavación en 2019") is None  # Sin datos
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
@@ -0,0 +1,97 @@
+"""
+Pruebas de la agrupación de ráfagas de mensajes (rafagas.py)
+esperar() es una corrutina del event loop; ventanas de decenas de milisegundos.
+python test_rafagas.py o pytest.
+"""
+
+import asyncio
+import time
+
+from rafagas import AgrupadorRafagas
+
+
+def _esperar(agrupador, telefono, generacion):
+    return asyncio.run(agrupador.esperar(telefono, generacion))
+
+
+def test_mensaje_solo_responde_su_texto():
+    agrupador = AgrupadorRafagas(ventana=0.02, maximo=1)
+    generacion = agrupador.agregar("tel", "precio del concreto")
+    assert _esperar(agrupador, "tel", generacion) == "precio del concreto"
+    assert agrupador.confirmar("tel", generacion)
+
+
+def test_rafaga_la_responde_el_ultimo_mensaje():
+    agrupador = AgrupadorRafagas(ventana=0.1, maximo=2)
+    resultados = {}
+    terminados = {}
+
+    async def atender(texto):
+        generacion = agrupador.agregar("tel", texto)
+        resultados[texto] = await agrupador.esperar("tel", generacion)
+        terminados[texto] = time.monotonic()
+
+    async def escenario():
+        tareas = []
+        for texto in ("costo del concreto", "en Medellín", "2023"):
+            tareas.append(asyncio.create_task(atender(texto)))
+            await asyncio.sleep(0.02)
+        await asyncio.gather(*tareas)
+
+    inicio = time.monotonic()
+    asyncio.run(escenario())
+    assert resultados == {
+        "costo del concreto": None,
+        "en Medellín": None,
+        "2023": "costo del concreto en Medellín 2023",
+    }
+    # Los mensajes superados se despiertan al llegar el siguiente, sin esperar su ventana
+    assert terminados["costo del concreto"] - inicio < 0.08
+
+
+def test_usuarios_distintos_no_se_mezclan():
+    agrupador = AgrupadorRafagas(ventana=0.02, maximo=1)
+    a = agrupador.agregar("tel_a", "hola")
+    b = agrupador.agregar("tel_b", "precio del acero")
+    assert _esperar(agrupador, "tel_a", a) == "hola"
+    assert _esperar(agrupador, "tel_b", b) == "precio del acero"
+
+
+def test_espera_maxima_desde_el_primer_mensaje():
+    agrupador = AgrupadorRafagas(ventana=1, maximo=0.05)
+    generacion = agrupador.agregar("tel", "a")
+    inicio = time.monotonic()
+    assert _esperar(agrupador, "tel", generacion) == "a"
+    assert time.monotonic() - inicio < 0.5
+
+
+def test_ejecucion_superada_y_confirmacion():
+    agrupador = AgrupadorRafagas(ventana=0.01, maximo=1)
+    primera = agrupador.agregar("tel", "costo del concreto")
+    assert _esperar(agrupador, "tel", primera) == "costo del concreto"
+    # Llega otro mensaje mientras la primera está en el pipeline
+    segunda = agrupador.agregar("tel", "en Cali")
+    assert not agrupador.vigente("tel", primera)
+    assert not agrupador.confirmar("tel", primera)
+    agrupador.retirar("tel", llamadas_hechas=1)
+    assert agrupador.fusionados == 1 and agrupador.llamadas_ahorradas == 1
+    assert _esperar(agrupador, "tel", segunda) == "costo del concreto en Cali"
+    assert agrupador.confirmar("tel", segunda)
+    # Confirmada: el mensaje siguiente abre una ráfaga nueva
+    tercera = agrupador.agregar("tel", "gracias")
+    assert _esperar(agrupador, "tel", tercera) == "gracias"
+
+
+def test_sin_agrupacion():
+    agrupador = AgrupadorRafagas(ventana=0)
+    assert agrupador.agregar("tel", "hola") is None
+    assert _esperar(agrupador, "tel", None) is None
+    assert agrupador.vigente("tel", None)
+    assert agrupador.confirmar("tel", None)
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
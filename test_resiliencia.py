@@ -0,0 +1,138 @@
+"""
+Pruebas de los interruptores de circuito y los plazos por mensaje (resiliencia.py)
+Más el reporte al interruptor de Postgres desde el pool (db_config.PoolConexiones).
+python test_resiliencia.py o pytest.
+"""
+
+import time
+
+from resiliencia import (
+    ABIERTO,
+    CERRADO,
+    ETAPAS_PLAZO,
+    PLAZO_MINIMO_S,
+    SEMIABIERTO,
+    CircuitoAbierto,
+    Interruptor,
+    PlazoVencido,
+    iniciar_plazo,
+    presupuesto,
+    restante,
+)
+
+
+def _abrir(interruptor):
+    for _ in range(interruptor.max_fallos):
+        interruptor.permitir()
+        interruptor.fallo()
+    assert interruptor.estado == ABIERTO
+
+
+def _rechaza(interruptor):
+    try:
+        interruptor.permitir()
+    except CircuitoAbierto:
+        return True
+    return False
+
+
+def test_se_abre_tras_fallos_seguidos():
+    interruptor = Interruptor("prueba", fallos=3, enfriamiento=60)
+    interruptor.fallo()
+    interruptor.fallo()
+    interruptor.exito()  # Un éxito reinicia la cuenta
+    interruptor.fallo()
+    interruptor.fallo()
+    assert interruptor.estado == CERRADO
+    interruptor.fallo()
+    assert interruptor.estado == ABIERTO
+    assert _rechaza(interruptor)
+
+
+def test_semiabierto_una_sola_prueba_y_cierre():
+    interruptor = Interruptor("prueba", fallos=2, enfriamiento=0.05)
+    _abrir(interruptor)
+    time.sleep(0.06)
+    interruptor.permitir()  # La prueba
+    assert interruptor.estado == SEMIABIERTO
+    assert _rechaza(interruptor)  # Solo una prueba a la vez
+    interruptor.exito()
+    assert interruptor.estado == CERRADO
+    assert not _rechaza(interruptor)
+
+
+def test_prueba_fallida_reabre():
+    interruptor = Interruptor("prueba", fallos=2, enfriamiento=0.05)
+    _abrir(interruptor)
+    time.sleep(0.06)
+    interruptor.permitir()
+    interruptor.fallo()
+    assert interruptor.estado == ABIERTO
+    assert _rechaza(interruptor)
+
+
+def test_liberar_suelta_la_prueba_sin_juzgar():
+    interruptor = Interruptor("prueba", fallos=2, enfriamiento=0.05)
+    _abrir(interruptor)
+    time.sleep(0.06)
+    interruptor.permitir()
+    interruptor.liberar()
+    assert interruptor.estado == SEMIABIERTO
+    assert not _rechaza(interruptor)  # Otra llamada puede hacer la prueba
+
+
+def test_proteger():
+    interruptor = Interruptor("prueba", fallos=1, enfriamiento=60)
+    try:
+        with interruptor.proteger():
+            raise ValueError("falla")
+    except ValueError:
+        pass
+    assert interruptor.estado == ABIERTO
+
+
+def test_desactivado_con_cero_fallos():
+    interruptor = Interruptor("prueba", fallos=0)
+    for _ in range(10):
+        interruptor.fallo()
+    assert not _rechaza(interruptor)
+
+
+def test_pool_reporta_al_interruptor():
+    from db_config import PoolConexiones
+
+    class ConexionPerdida:
+        closed = 2  # El servidor cerró la conexión durante la consulta
+        autocommit = False
+
+    interruptor = Interruptor("postgres_prueba", fallos=2, enfriamiento=60)
+    pool = PoolConexiones("prueba", interruptor=interruptor)
+    assert not pool.devolver(ConexionPerdida())
+    assert not pool.devolver(ConexionPerdida())
+    assert interruptor.estado == ABIERTO
+
+
+def test_presupuesto_reserva_las_etapas_siguientes():
+    iniciar_plazo(0)
+    assert restante() is None
+    assert presupuesto("sql") == ETAPAS_PLAZO["sql"][0]  # Sin plazo: el tope de la etapa
+    iniciar_plazo(5)
+    # sql reserva lo mínimo de gemini_resumen
+    queda = 5 - ETAPAS_PLAZO["gemini_resumen"][1]
+    assert queda - 0.5 < presupuesto("sql") <= queda
+    assert presupuesto("sql", tope=1) == 1
+    iniciar_plazo(ETAPAS_PLAZO["sql"][1] + ETAPAS_PLAZO["gemini_resumen"][1] + PLAZO_MINIMO_S / 2)
+    try:
+        presupuesto("gemini_sql")  # Lo reservado para sql y el resumen deja menos que PLAZO_MINIMO_S
+        assert False, "debía vencer"
+    except PlazoVencido:
+        pass
+    assert presupuesto("gemini_resumen") >= PLAZO_MINIMO_S
+    iniciar_plazo(0)
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
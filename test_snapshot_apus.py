@@ -0,0 +1,101 @@
+"""
+Pruebas del motor analítico local (snapshot_apus.py): qué consultas se intentan en DuckDB y
+qué nombres de columna devuelve. Las de DuckDB se saltan si no está instalado.
+python test_snapshot_apus.py o pytest.
+"""
+
+import os
+import tempfile
+from decimal import Decimal
+
+import snapshot_apus
+from snapshot_apus import MotorLocal, nombre_postgres, soportada
+
+
+def test_soportada():
+    assert soportada("SELECT ciudad, COUNT(*) FROM apus GROUP BY ciudad")
+    assert not soportada("SELECT precio_unitario / 2 FROM apus")  # División entera en Postgres
+    assert not soportada("SELECT * FROM apus WHERE ciudad ~ '^B'")
+    assert soportada("SELECT * FROM apus WHERE link_documento ILIKE '%/docs/%'")  # '/' dentro de un literal
+    assert not soportada("DELETE FROM apus")
+
+
+def test_soportada_orden_de_textos():
+    # El orden de los textos depende de la intercalación de la base: van a Postgres
+    assert not soportada("SELECT nombre_proyecto FROM apus ORDER BY nombre_proyecto")
+    assert not soportada('SELECT ciudad AS "Ciudad", COUNT(*) FROM apus GROUP BY ciudad ORDER BY "Ciudad"')
+    assert not soportada("SELECT MAX(insumo_descripcion) FROM apus")
+    assert not soportada("SELECT * FROM apus WHERE ciudad >= 'M'")
+    assert not soportada("SELECT * FROM apus WHERE LOWER(ciudad) BETWEEN 'a' AND 'm'")
+    assert not soportada("SELECT ciudad, COUNT(*) FROM apus GROUP BY ciudad ORDER BY 1")
+    # Ordenar por números o fechas y comparar textos por igualdad no depende de la intercalación
+    assert soportada("SELECT ciudad, AVG(precio_unitario) AS promedio FROM apus "
+                     "GROUP BY ciudad ORDER BY promedio DESC LIMIT 10")
+    assert soportada("SELECT ciudad, COUNT(DISTINCT nombre_proyecto) AS n FROM apus GROUP BY ciudad ORDER BY n")
+    assert soportada("SELECT * FROM apus WHERE fecha_aprobacion_apu >= '2023-01-01' AND ciudad <> 'Cali'")
+    assert soportada("SELECT MIN(precio_unitario) FROM apus WHERE LENGTH(ciudad) > 3")
+
+
+def test_nombre_postgres():
+    sql = 'SELECT MIN(precio_unitario) AS "Mínimo", MAX(precio_unitario) AS Maximo FROM apus'
+    casos = {
+        "count_star()": "count",
+        "count(DISTINCT ciudad)": "count",
+        "avg(precio_unitario)": "avg",
+        "round(avg(precio_unitario), 2)": "round",
+        "main.date_part('year', fecha_aprobacion_apu)": "extract",
+        "date_part('year', fecha_aprobacion_apu)": "date_part",
+        'main."substring"(ciudad, 1, 2)': "substring",
+        "quantile_cont(0.5 ORDER BY precio_unitario)": "percentile_cont",
+        "CAST(precio_unitario AS INTEGER)": "precio_unitario",
+        "CAST(avg(precio_unitario) AS INTEGER)": "avg",
+        "CASE  WHEN ((precio_unitario > 1)) THEN (1) ELSE NULL END": "case",
+        "(precio_unitario * 2)": "?column?",
+        "1": "?column?",
+        "Mínimo": "Mínimo",  # Alias entre comillas
+        "Maximo": "maximo",  # Alias sin comillas: Postgres lo pasa a minúsculas
+    }
+    for duckdb, postgres in casos.items():
+        assert nombre_postgres(duckdb, sql) == postgres, duckdb
+    assert nombre_postgres("CAST(1 AS INTEGER)", sql) is None
+
+
+def test_consultar_como_postgres():
+    if snapshot_apus.duckdb is None:
+        return
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "apus.parquet")
+        snapshot_apus.duckdb.sql(
+            "COPY (SELECT range AS id, 'Cali' AS ciudad, range * 1.5 AS precio_unitario FROM range(4)) "
+            f"TO '{ruta}' (FORMAT parquet)"
+        )
+        motor = MotorLocal(ruta)
+        filas = motor.consultar("SELECT ciudad, COUNT(*), AVG(precio_unitario) FROM apus GROUP BY ciudad")
+        assert filas == [{"ciudad": "Cali", "count": 4, "avg": Decimal("2.25")}]
+        assert motor.consultar("SELECT CAST(1 AS INTEGER) FROM apus") is None  # Nombre sin equivalente
+        assert motor.consultar("SELECT * FROM otra_tabla") is None  # Error de DuckDB: va a Postgres
+
+
+def test_orden_con_tildes_va_a_postgres():
+    if snapshot_apus.duckdb is None:
+        return
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "apus.parquet")
+        snapshot_apus.duckdb.sql(
+            "COPY (SELECT * FROM (VALUES ('Zona Franca'), ('Árbol'), ('avenida')) AS t(nombre_proyecto)) "
+            f"TO '{ruta}' (FORMAT parquet)"
+        )
+        sql = "SELECT nombre_proyecto FROM apus ORDER BY nombre_proyecto"
+        # DuckDB compara bytes: 'Z' < 'a' < 'Á'. Postgres (es_CO/en_US.UTF-8) da Árbol, avenida, Zona Franca
+        binario = [fila[0] for fila in snapshot_apus.duckdb.sql(sql.replace("apus", f"'{ruta}'")).fetchall()]
+        assert binario == ["Zona Franca", "avenida", "Árbol"]
+        motor = MotorLocal(ruta)
+        assert motor.consultar(sql) is None  # Se responde en Postgres
+        assert len(motor.consultar("SELECT nombre_proyecto FROM apus WHERE nombre_proyecto = 'Árbol'")) == 1
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
@@ -0,0 +1,97 @@
+"""
+Pruebas de la forma canónica del SQL generado (sql_canonico.py)
+No necesitan base de datos: python test_sql_canonico.py o pytest.
+"""
+
+from decimal import Decimal
+
+from sql_canonico import PARAMETROS_MAX, canonizar, es_consulta_lectura, huella, limpiar_sql, normalizar, parametrizar
+
+
+def test_limpiar_sql():
+    assert limpiar_sql("```sql\nSELECT * FROM apus;\n```") == "SELECT * FROM apus"
+    assert limpiar_sql(None) == ""
+
+
+def test_normalizar_conserva_literales():
+    assert normalizar("SELECT  *\n FROM apus WHERE ciudad = 'Santa  Marta'") == \
+        "SELECT * FROM apus WHERE ciudad = 'Santa  Marta'"
+
+
+def test_canonizar_reemplaza_literales():
+    a = canonizar("SELECT * FROM apus WHERE ciudad ILIKE '%cali%' LIMIT 10")
+    b = canonizar("select *  from APUS where CIUDAD ilike '%Bogotá%' limit 5;")
+    assert a == b == "select * from apus where ciudad ilike ? limit ?"
+
+
+def test_canonizar_literales_escapados_y_listas():
+    assert canonizar("SELECT * FROM apus WHERE item = 'O''Brien'") == "select * from apus where item = ?"
+    assert canonizar("SELECT * FROM apus WHERE ciudad IN ('Cali', 'Pasto', 'Neiva')") == \
+        "select * from apus where ciudad in (...)"
+    # Un número dentro de un identificador no es un literal
+    assert canonizar("SELECT col1 FROM t2") == "select col1 from t2"
+
+
+def test_huella_estable_por_forma():
+    assert huella(canonizar("SELECT 1")) == huella(canonizar("select 2"))
+    assert huella(canonizar("SELECT 1")) != huella(canonizar("SELECT 1 FROM apus"))
+    assert len(huella("x")) == 12
+
+
+def test_es_consulta_lectura():
+    assert es_consulta_lectura("SELECT * FROM apus")
+    assert es_consulta_lectura("WITH t AS (SELECT 1) SELECT * FROM t;")
+    assert es_consulta_lectura("SELECT * FROM apus WHERE observacion = 'a; b'")
+    assert not es_consulta_lectura("SELECT 1; DROP TABLE apus")
+    assert not es_consulta_lectura("DELETE FROM apus")
+
+
+def test_parametrizar_textos_y_numeros():
+    assert parametrizar("SELECT * FROM apus WHERE ciudad = 'Cali' AND precio_unitario > 1.5 LIMIT 10") == (
+        "SELECT * FROM apus WHERE ciudad = $1 AND precio_unitario > $2::numeric LIMIT $3::integer",
+        ["Cali", Decimal("1.5"), 10],
+    )
+    assert parametrizar("SELECT * FROM apus WHERE item = 'O''Brien'") == \
+        ("SELECT * FROM apus WHERE item = $1", ["O'Brien"])
+    assert parametrizar("SELECT 3000000000") == ("SELECT $1::bigint", [3000000000])
+
+
+def test_parametrizar_misma_forma_mismo_texto():
+    a, valores_a = parametrizar("SELECT * FROM apus WHERE ciudad = 'Cali' LIMIT 5")
+    b, valores_b = parametrizar("SELECT * FROM apus WHERE ciudad = 'Pasto' LIMIT 20")
+    assert a == b
+    assert valores_a != valores_b
+
+
+def test_parametrizar_conserva_posiciones_de_orden():
+    texto, valores = parametrizar("SELECT ciudad, COUNT(*) FROM apus WHERE anio = 2023 "
+                                  "GROUP BY 1 ORDER BY 2 DESC LIMIT 5")
+    assert texto == ("SELECT ciudad, COUNT(*) FROM apus WHERE anio = $1::integer "
+                     "GROUP BY 1 ORDER BY 2 DESC LIMIT $2::integer")
+    assert valores == [2023, 5]
+    # El ORDER BY de una subconsulta termina con su paréntesis: lo que sigue vuelve a ser literal
+    texto, _ = parametrizar("SELECT * FROM (SELECT * FROM apus ORDER BY 1) t WHERE x = 3")
+    assert texto == "SELECT * FROM (SELECT * FROM apus ORDER BY 1) t WHERE x = $1::integer"
+
+
+def test_parametrizar_literales_que_no_son_parametros():
+    assert parametrizar("SELECT * FROM apus WHERE fecha_aprobacion_apu > DATE '2023-01-01'") == \
+        ("SELECT * FROM apus WHERE fecha_aprobacion_apu > DATE '2023-01-01'", [])
+    assert parametrizar("SELECT precio_unitario::numeric(12, 2) FROM apus") == \
+        ("SELECT precio_unitario::numeric(12, 2) FROM apus", [])
+    assert parametrizar("SELECT E'a\\nb'") == ("SELECT E'a\\nb'", [])
+
+
+def test_parametrizar_rechaza():
+    assert parametrizar("SELECT $$x$$") is None
+    assert parametrizar("SELECT * FROM apus WHERE item = $1") is None
+    assert parametrizar("") is None
+    muchos = ", ".join(str(n) for n in range(PARAMETROS_MAX + 1))
+    assert parametrizar(f"SELECT * FROM apus WHERE id IN ({muchos})") is None
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
@@ -0,0 +1,81 @@
+"""
+Pruebas del vuelo único (vuelo_unico.py): las seguidoras comparten solo resultados completos
+python test_vuelo_unico.py o pytest.
+"""
+
+import threading
+import time
+
+from vuelo_unico import GrupoVuelos, normalizar_pregunta
+
+
+def _sin_error(filas):
+    return not filas or "error" not in filas[0]
+
+
+def _con_seguidora(grupo, lider, seguidora, compartible=None):
+    """El líder corre lider() hasta que la seguidora se suma; devuelve (del líder, de la seguidora)."""
+    resultados = {}
+    puede_terminar = threading.Event()
+
+    def trabajo_lider():
+        puede_terminar.wait(1)
+        return lider()
+
+    hilo = threading.Thread(
+        target=lambda: resultados.setdefault("lider", grupo.hacer("clave", trabajo_lider, compartible)))
+    hilo.start()
+    while not grupo.en_curso():
+        time.sleep(0.001)
+    hilo_seguidora = threading.Thread(
+        target=lambda: resultados.setdefault("seguidora", grupo.hacer("clave", seguidora, compartible)))
+    hilo_seguidora.start()
+    time.sleep(0.02)  # La seguidora ya espera al líder
+    puede_terminar.set()
+    hilo.join(1)
+    hilo_seguidora.join(1)
+    return resultados["lider"], resultados["seguidora"]
+
+
+def test_seguidora_comparte_el_resultado_del_lider():
+    grupo = GrupoVuelos("prueba", habilitado=True)
+    lider, seguidora = _con_seguidora(grupo, lambda: [{"n": 1}], lambda: [{"n": 2}], _sin_error)
+    assert lider == ([{"n": 1}], False)
+    assert seguidora == ([{"n": 1}], True)
+    assert grupo.compartidas == 1 and grupo.en_curso() == 0
+
+
+def test_lider_sin_plazo_no_se_comparte():
+    grupo = GrupoVuelos("prueba", habilitado=True)
+    vencido = [{"error": "sin tiempo para sql (0.1s disponibles)"}]
+    lider, seguidora = _con_seguidora(grupo, lambda: vencido, lambda: [{"n": 2}], _sin_error)
+    assert lider == (vencido, False)
+    # La seguidora tiene su propio plazo: ejecuta la consulta en vez de heredar el error
+    assert seguidora == ([{"n": 2}], False)
+    assert grupo.compartidas == 0
+
+
+def test_resumen_cortado_no_se_comparte():
+    grupo = GrupoVuelos("prueba", habilitado=True)
+    cortado = "El promedio es\n\n⚠️ La respuesta se interrumpió. Intenta de nuevo."
+    lider, seguidora = _con_seguidora(grupo, lambda: cortado, lambda: "El promedio es $100",
+                                      lambda texto: not texto.endswith("Intenta de nuevo."))
+    assert lider == (cortado, False)
+    assert seguidora == ("El promedio es $100", False)
+
+
+def test_sin_clave_o_deshabilitado_no_comparte():
+    grupo = GrupoVuelos("prueba", habilitado=True)
+    assert grupo.hacer(None, lambda: 1) == (1, False)
+    assert GrupoVuelos("prueba", habilitado=False).hacer("clave", lambda: 2) == (2, False)
+
+
+def test_normalizar_pregunta():
+    assert normalizar_pregunta("¿Cuánto  VALE el concreto?") == "cuanto vale el concreto"
+
+
+if __name__ == "__main__":
+    for nombre, prueba in list(globals().items()):
+        if nombre.startswith("test_"):
+            prueba()
+            print(f"✅ {nombre}")
@@ -0,0 +1,118 @@
+"""
+🛫 Vuelo único: deduplicación del trabajo idéntico en curso
+En las reuniones de obra varios ingenieros mandan la misma pregunta con segundos de diferencia.
+La primera petición (líder) hace el trabajo y las demás (seguidoras) esperan su resultado en vez
+de repetir la llamada a Gemini o el mismo SQL. Solo se comparte lo que está en curso: cuando el
+líder termina la clave se libera, no es una caché. Solo se comparte un resultado completo: si
+el líder falla, se queda sin plazo o su respuesta se cortó, cada seguidora hace el trabajo.
+
+Claves usadas por main.py:
+- gemini_sql: pregunta normalizada, solo si no depende del contexto de la conversación
+- sql: la consulta generada normalizada (mismo SQL = mismas filas)
+- gemini_resumen: pregunta normalizada + SQL (el saludo personalizado se agrega después)
+"""
+
+import os
+import re
+import threading
+import unicodedata
+
+from log_config import get_logger
+from metricas import COALESCIDAS
+
+logger = get_logger(__name__)
+
+# ============ CONFIGURACIÓN ============
+VUELO_UNICO = os.getenv("VUELO_UNICO", "1") == "1"
+VUELO_UNICO_ESPERA_S = float(os.getenv("VUELO_UNICO_ESPERA_S", 90))  # Máximo que una seguidora espera al líder
+
+RE_NO_PALABRA = re.compile(r"[^\w\s]")
+RE_ESPACIOS = re.compile(r"\s+")
+
+
+def normalizar_pregunta(texto):
+    """Minúsculas, sin tildes ni signos y con espacios colapsados: '¿Cuánto vale...?' == 'cuanto vale'."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    return RE_ESPACIOS.sub(" ", RE_NO_PALABRA.sub(" ", texto)).strip()
+
+
+class _Vuelo:
+    __slots__ = ("listo", "resultado", "error", "compartible", "seguidoras")
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+        self.compartible = False
+        self.seguidoras = 0
+
+
+class GrupoVuelos:
+    """Ejecuciones en curso por clave para una etapa del pipeline."""
+
+    def __init__(self, nombre, habilitado=VUELO_UNICO, espera=VUELO_UNICO_ESPERA_S):
+        self.nombre = nombre
+        self.habilitado = habilitado
+        self.espera = espera
+        self.compartidas = 0
+        self._vuelos = {}
+        self._lock = threading.Lock()
+
+    def hacer(self, clave, funcion, compartible=None):
+        """
+        Ejecuta funcion() una sola vez por clave mientras esté en curso.
+
+        Args:
+            clave: Identifica el trabajo; None = no compartir
+            funcion: Callable sin argumentos
+            compartible: Callable(resultado) -> bool; con False (filas de error, texto cortado)
+                las seguidoras no reciben el resultado del líder y ejecutan funcion() aparte
+
+        Returns:
+            tuple: (resultado, compartido) — compartido=True si se reutilizó el de otra petición
+        """
+        if not self.habilitado or clave is None:
+            return funcion(), False
+
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+            else:
+                vuelo.seguidoras += 1
+
+        if lider:
+            try:
+                vuelo.resultado = funcion()
+                vuelo.compartible = compartible is None or compartible(vuelo.resultado)
+                return vuelo.resultado, False
+            except BaseException as e:
+                vuelo.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._vuelos.pop(clave, None)
+                vuelo.listo.set()
+
+        if not vuelo.listo.wait(self.espera):
+            logger.warning(f"⚠️ Vuelo {self.nombre} sin respuesta tras {self.espera:.0f}s, se ejecuta aparte")
+            return funcion(), False
+        if vuelo.error is not None or not vuelo.compartible:
+            # El líder falló o su resultado no sirve a otros: cada seguidora lo intenta por su cuenta
+            return funcion(), False
+        with self._lock:
+            self.compartidas += 1
+        COALESCIDAS.inc(etapa=self.nombre)
+        return vuelo.resultado, True
+
+    def en_curso(self):
+        with self._lock:
+            return len(self._vuelos)
+
+
+# Instancias globales usadas por main.py
+vuelos_sql = GrupoVuelos("gemini_sql")
+vuelos_consulta = GrupoVuelos("sql")
+vuelos_resumen = GrupoVuelos("gemini_resumen")